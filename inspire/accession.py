@@ -1,7 +1,5 @@
 """ Function for dealing with different accession groups.
 """
-from copy import deepcopy
-
 import polars as pl
 
 from inspire.constants import (
@@ -13,7 +11,7 @@ from inspire.constants import (
     SOURCE_KEY,
     SCAN_KEY
 )
-from inspire.utils import fetch_proteome
+from inspire.proteome_index import get_proteome_index
 
 ACCESSION_SPLITTERS = {
     'mascot': ',',	
@@ -21,6 +19,8 @@ ACCESSION_SPLITTERS = {
     'maxquant': ';',	
     'peaks': ':',	
 }
+VALIDATED_ACCESSION_KEY = 'validatedAccession'
+VALIDATED_STRATUM_KEY = 'validatedAccessionGroup'
 
 def get_accession_group(accession, search_engine, accession_hierarchy, accession_groups):
     """ Function to get the accession group from the accession of a peptide.
@@ -87,7 +87,7 @@ def get_invitro_spi_acc_group(accession, search_engine):
 
     return assignment
 
-def validate_accession_stratum(df_row, proteome, rev_proteome, config):
+def validate_accession_stratum(df_row, proteome_index, config):
     """ Function to validate the accession of a non-canonical PSM by checking for the
         sequence in the standard proteome.
 
@@ -95,10 +95,8 @@ def validate_accession_stratum(df_row, proteome, rev_proteome, config):
     ----------
     df_row : pd.Series
         An entry in a DataFrame of search results.
-    proteome : list of tuple
-        The standard proteome.
-    rev_proteome : list of tuple
-        The reversed proteome.
+    proteome_index : inspire.proteome_index.ProteomeIndex
+        The index of the standard proteome, decoys are searched in the reversed proteome.
     config : inspire.config.Config
         The Config object for the experiment.
 
@@ -107,38 +105,65 @@ def validate_accession_stratum(df_row, proteome, rev_proteome, config):
     df_row : pd.Series
         The input row updated with accession and accession group validated.
     """
-    pep_seq = df_row[PEPTIDE_KEY].replace('I', 'L')
     if df_row[ACCESSION_STRATUM_KEY] == 0:
         return {
             ACCESSION_KEY: df_row[ACCESSION_KEY],
             ACCESSION_STRATUM_KEY: df_row[ACCESSION_STRATUM_KEY],
         }
 
-    results ={}
-    if df_row[LABEL_KEY] == 1:
-        for entry in proteome:
-            if pep_seq in entry[1]:
-                if config.accession_format == 'invitroSPI':
-                    position = entry[1].index(pep_seq) + 1
-                    results[ACCESSION_KEY] = f'PCP_{position}_{position+len(pep_seq)}'
-                    results[ACCESSION_STRATUM_KEY] = 0
-                else:
-                    results[ACCESSION_KEY] = entry[0]
-                    results[ACCESSION_STRATUM_KEY] = 0
+    reverse = df_row[LABEL_KEY] != 1
+    matches = proteome_index.find(df_row[PEPTIDE_KEY], reverse=reverse)
+    if not matches:
+        return {
+            ACCESSION_KEY: df_row.get(ACCESSION_KEY),
+            ACCESSION_STRATUM_KEY: df_row[ACCESSION_STRATUM_KEY],
+        }
+
+    # The last protein containing the peptide is reported.
+    protein_idx = matches[-1][0]
+    if config.accession_format == 'invitroSPI':
+        position = min(
+            match_position for match_idx, match_position in matches if match_idx == protein_idx
+        ) + 1
+        accession = f'PCP_{position}_{position+len(df_row[PEPTIDE_KEY])}'
     else:
-        for entry in rev_proteome:
-            if pep_seq in entry[1]:
-                if config.accession_format == 'invitroSPI':
-                    position = entry[1].index(pep_seq) + 1
-                    results[ACCESSION_KEY] = f'PCP_{position}_{position+len(pep_seq)}'
-                    results[ACCESSION_STRATUM_KEY] = 0
-                else:
-                    results[ACCESSION_KEY] = entry[0]
-                    results[ACCESSION_STRATUM_KEY] = 0
+        accession = proteome_index.protein_name(protein_idx)
+        if reverse:
+            accession = 'reversed_' + accession
 
-    return results
+    return {
+        ACCESSION_KEY: accession,
+        ACCESSION_STRATUM_KEY: 0,
+    }
 
 
+def _validate_accession_groups(main_df, config):
+    """ Function to validate the accession groups of non-canonical PSMs, querying the
+        proteome index once per distinct PSM assignment.
+    """
+    validate_keys = [ACCESSION_KEY, ACCESSION_STRATUM_KEY, PEPTIDE_KEY, LABEL_KEY]
+    validate_df = main_df.filter(pl.col(ACCESSION_STRATUM_KEY).ne(0)).select(
+        validate_keys
+    ).unique()
+    if not validate_df.shape[0]:
+        return main_df
+
+    proteome_index = get_proteome_index(config.proteome, config.output_folder)
+    validate_df = validate_df.with_columns(
+        pl.struct(validate_keys).apply(
+            lambda x : validate_accession_stratum(x, proteome_index, config),
+        ).alias('results')
+    ).with_columns(
+        pl.col('results').struct.field(ACCESSION_KEY).alias(VALIDATED_ACCESSION_KEY),
+        pl.col('results').struct.field(ACCESSION_STRATUM_KEY).alias(VALIDATED_STRATUM_KEY),
+    ).drop('results')
+
+    main_df = main_df.join(validate_df, how='left', on=validate_keys).with_columns(
+        pl.coalesce(VALIDATED_ACCESSION_KEY, ACCESSION_KEY).alias(ACCESSION_KEY),
+        pl.coalesce(VALIDATED_STRATUM_KEY, ACCESSION_STRATUM_KEY).alias(ACCESSION_STRATUM_KEY),
+    )
+    return main_df.drop([VALIDATED_ACCESSION_KEY, VALIDATED_STRATUM_KEY])
+
 def process_accession_groups(main_df, config):
     """ Function to process the accession groups of a DataFrame of search results.
 
@@ -172,20 +197,7 @@ def process_accession_groups(main_df, config):
         )
 
     if config.proteome is not None:
-        prot_sequences = fetch_proteome(config.proteome, with_desc=False)
-
-        rev_prot_seqs = []
-        for entry in deepcopy(prot_sequences):
-            new_entry = ('reversed_' + entry[0], entry[1][::-1])
-            rev_prot_seqs.append(new_entry)
-
-        main_df = main_df.with_columns(
-            pl.struct([ACCESSION_KEY, ACCESSION_STRATUM_KEY, PEPTIDE_KEY, LABEL_KEY]).apply(
-                lambda x : validate_accession_stratum(x, prot_sequences, rev_prot_seqs, config),
-            ).alias('results')
-        )
-        main_df = main_df.drop([ACCESSION_KEY, ACCESSION_STRATUM_KEY])
-        main_df = main_df.unnest('results')
+        main_df = _validate_accession_groups(main_df, config)
 
     main_df = main_df.sort(
         by=[LABEL_KEY, ACCESSION_STRATUM_KEY, ENGINE_SCORE_KEY, PEPTIDE_KEY],
@@ -6,12 +6,16 @@ import polars as pl
 from inspire.constants import (
     MASS_DIFF_KEY,
     PEPTIDE_KEY,
+    PTM_C_TERM_KEY,
     PTM_ID_KEY,
     PTM_IS_VAR_KEY,
+    PTM_N_TERM_KEY,
+    PTM_RESIDUES_KEY,
     PTM_SEQ_KEY,
     SEQ_LEN_KEY,
 )
 from inspire.spectral_features import fetch_mod_weight_dict
+from inspire.utils import add_ptm_code
 
 def _check_reps(peptide):
     """ Function to count the number of repeated residues
@@ -87,14 +91,13 @@ def create_basic_features(search_df, mods_df):
         mods_df = mods_df[mods_df[PTM_IS_VAR_KEY]]
 
     if not mods_df.empty:
-        mod_ids = [str(x) for x in mods_df[PTM_ID_KEY].tolist()]
-        search_df = search_df.with_columns(
-            pl.col(PTM_SEQ_KEY).apply(
-                lambda x : len(
-                    [char for char in x if char in mod_ids]
-                ) if isinstance(x, str) else 0,
-                skip_nulls=False,
-            ).alias('nVarMods')
+        mod_ids = [int(x) for x in mods_df[PTM_ID_KEY].tolist()]
+        search_df = add_ptm_code(search_df).with_columns(
+            (
+                pl.col(PTM_N_TERM_KEY).is_in(mod_ids).cast(pl.Int64) +
+                pl.col(PTM_RESIDUES_KEY).list.eval(pl.element().is_in(mod_ids)).list.sum() +
+                pl.col(PTM_C_TERM_KEY).is_in(mod_ids).cast(pl.Int64)
+            ).fill_null(0).alias('nVarMods')
         )
 
         mod_weight_dict = fetch_mod_weight_dict(mods_df)
@@ -12,9 +12,9 @@ from inspire.constants import (
     LABEL_KEY,
     OKBLUE_TEXT,
     OKCYAN_TEXT,
+    PTM_CODE_KEYS,
     PTM_ID_KEY,
     PTM_NAME_KEY,
-    PTM_SEQ_KEY,
     SCAN_KEY,
     SEQ_LEN_KEY,
     SOURCE_KEY,
@@ -37,9 +37,10 @@ from inspire.predict_spectra import predict_spectra
 from inspire.prepare import write_prosit_input_df
 from inspire.spectral_features import calculate_spectral_features
 from inspire.utils import (
-    check_bad_mods,
+    add_ptm_code,
     get_ox_flag,
     get_cam_flag,
+    has_ptm_ids,
     remove_source_suffixes,
 )
 
@@ -59,13 +60,9 @@ def _get_top_hits(config):
         (mods_df[PTM_NAME_KEY] != 'Oxidation (M)') &
         ((mods_df[PTM_NAME_KEY] != 'Carbamidomethyl (C)'))
     ][PTM_ID_KEY].tolist()
-    unknown_mods = {str(x) for x in unknown_mods}
 
-    target_df = target_df.with_columns(
-        pl.col(PTM_SEQ_KEY).apply(
-            lambda x : check_bad_mods(x, unknown_mods),
-            skip_nulls=False,
-        ).alias('unknownModifications')
+    target_df = add_ptm_code(target_df).with_columns(
+        has_ptm_ids(unknown_mods).alias('unknownModifications')
     )
     target_df = target_df.filter(
         ~pl.col('unknownModifications')
@@ -190,7 +187,7 @@ def calibrate(config):
         '\t\tCalculating spectral angles...' +
         ENDC_TEXT
     )
-    combined_df = combined_df.with_columns(
+    combined_df = add_ptm_code(combined_df).with_columns(
          pl.struct([
             CHARGE_KEY,
             'collisionEnergy',
@@ -200,7 +197,7 @@ def calibrate(config):
             PROSIT_INTES_KEY,
             PROSIT_IONS_KEY,
             PROSIT_SEQ_KEY,
-            PTM_SEQ_KEY,
+            *PTM_CODE_KEYS,
         ]).apply(
             lambda x : calculate_spectral_features(
                 x,
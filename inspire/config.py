@@ -14,18 +14,26 @@ ALL_CONFIG_KEYS = [
     'accessionFormat',
     'accessionKeys',
     'alleles',
+    'cacheMassIndex',
     'collisionEnergy',
     'contaminantData',
     'combinedScansFile',
+    'competitorMassTolerance',
+    'competitorMassUnits',
     'controlFlags',
     'deltaMethod',
     'distillerLog',
+    'distributedFolder',
+    'distributedLease',
+    'distributedPollInterval',
+    'distributedWaitTimeout',
     'dropUnknownPTMs',
     'epitopeCandidateCutOff',
     'excludeFeatures',
     'engineScoreCut',
     'experimentTitle',
     'falseDiscoveryRate',
+    'featureSearch',
     'fixedModifications',
     'filterCysteine',
     'forceReload',
@@ -52,13 +60,20 @@ ALL_CONFIG_KEYS = [
     'proteome',
     'quantCutOff',
     'rtFitLoc',
+    'rtFitMethod',
     'reduce',
     'remapToProteome',
     'replaceIL',
     'rescoreCommand',
+    'rescoreEngine',
     'rescoreMethod',
+    'rescoreMode',
+    'rescoreModel',
+    'rescoreModelFolder',
+    'rescoreStrata',
     'resultsExport',
     'reuseInput',
+    'reuseRtFits',
     'panDocker',
     'scansFolder',
     'scansFormat',
@@ -123,6 +138,15 @@ class Config:
         if not os.path.exists(f'{self.output_folder}/epitope'):
             os.makedirs(f'{self.output_folder}/epitope')
 
+        if self.distributed_folder is None:
+            self.distributed_folder = f'{self.output_folder}/distributed'
+        else:
+            self.distributed_folder = self.distributed_folder.replace('~', home).replace(
+                '%USERPROFILE%', home
+            )
+            if self.distributed_folder.endswith('/'):
+                self.distributed_folder = self.distributed_folder[:-1]
+
         if not os.path.exists(f'{self.output_folder}/img'):
             os.makedirs(f'{self.output_folder}/img')
 
@@ -208,6 +232,7 @@ class Config:
         self.fdr = config_dict.get('falseDiscoveryRate', 0.01)
         self.exclude_features = config_dict.get('excludeFeatures', [])
         self.include_features = config_dict.get('includeFeatures', None)
+        self.feature_search = config_dict.get('featureSearch', None)
         self.reduce = config_dict.get('reduce', False)
         self.rescore_method = config_dict.get('rescoreMethod', 'percolator')
         self.rescore_command = config_dict.get('rescoreCommand')
@@ -216,12 +241,18 @@ class Config:
                 self.rescore_command = 'percolator'
             else:
                 self.rescore_command = 'mokapot'
+        self.rescore_engine = config_dict.get('rescoreEngine', 'external')
+        self.rescore_model = config_dict.get('rescoreModel', 'svm')
+        self.rescore_mode = config_dict.get('rescoreMode', 'train')
+        self.rescore_model_folder = config_dict.get('rescoreModelFolder')
 
         self.sa_query_dfs = config_dict.get('spectralAngleDfs', None)
         self.silent_execution = config_dict.get('silentExecution', False)
         self.plot_spectra_source_split = config_dict.get('plotSpectraSourceSplit')
 
         self.rt_fit_loc = config_dict.get('rtFitLoc', None)
+        self.rt_fit_method = config_dict.get('rtFitMethod', 'linear')
+        self.reuse_rt_fits = config_dict.get('reuseRtFits', False)
 
         self.filter_c = config_dict.get('filterCysteine', True)
         if self.spectral_predictor == 'prosit':
@@ -251,6 +282,12 @@ class Config:
             default_ba_pred_limit = 31
         self.ba_pred_limit = config_dict.get('baPredictionLimit', default_ba_pred_limit)
 
+        # Distributed feature creation
+        self.distributed_folder = config_dict.get('distributedFolder')
+        self.distributed_lease = config_dict.get('distributedLease')
+        self.distributed_poll_interval = config_dict.get('distributedPollInterval', 10)
+        self.distributed_wait_timeout = config_dict.get('distributedWaitTimeout', 3600)
+
         # MS2PIP Model
         self.ms2pip_model = config_dict.get('ms2pipModel', None)
 
@@ -263,6 +300,12 @@ class Config:
             self.accession_hierarchy = ['nonspliced', 'spliced']
 
         self.use_accession_stratum = config_dict.get('useAccessionStrata', False)
+        self.rescore_strata = config_dict.get('rescoreStrata', False)
+
+        # Spliced peptide validation
+        self.competitor_mass_tolerance = config_dict.get('competitorMassTolerance', 0.01)
+        self.competitor_mass_units = config_dict.get('competitorMassUnits', 'Da')
+        self.cache_mass_index = config_dict.get('cacheMassIndex', False)
 
         # Epitope validation
         self.host_proteome = config_dict.get('hostProteome')
@@ -399,12 +442,65 @@ class Config:
                 f'Unsupported mz unit: "{self.mz_units}". Supported units are :Da" and "ppm".'
             )
 
+        if self.competitor_mass_units not in ('Da', 'ppm'):
+            raise ValueError(
+                f'Unsupported competitor mass unit: "{self.competitor_mass_units}". ' +
+                'Supported units are "Da" and "ppm".'
+            )
+
         if self.rescore_method not in ('mokapot', 'percolator', 'percolatorSeparate'):
             raise ValueError(
                 f'Unsupported Rescore Method: "{self.rescore_method}". Supported ' +
                 'methods are "mokapot", "percolatorSeparate", and "percolator".'
             )
 
+        if self.rescore_engine not in ('external', 'inProcess'):
+            raise ValueError(
+                f'Unsupported Rescore Engine: "{self.rescore_engine}". Supported ' +
+                'engines are "external" and "inProcess".'
+            )
+
+        if self.rescore_engine == 'inProcess' and self.rescore_method == 'mokapot':
+            raise ValueError(
+                'The inProcess rescore engine writes Percolator output, please use ' +
+                'rescoreMethod "percolator" or "percolatorSeparate".'
+            )
+
+        if self.rt_fit_method not in ('linear', 'robust', 'lowess'):
+            raise ValueError(
+                f'Unsupported RT Fit Method: "{self.rt_fit_method}". Supported ' +
+                'methods are "linear", "robust", and "lowess".'
+            )
+
+        if self.feature_search not in (None, 'exhaustive', 'greedy', 'beam'):
+            raise ValueError(
+                f'Unsupported Feature Search: "{self.feature_search}". Supported ' +
+                'searches are "exhaustive", "greedy", and "beam".'
+            )
+
+        if self.rescore_model not in ('svm', 'lda'):
+            raise ValueError(
+                f'Unsupported Rescore Model: "{self.rescore_model}". Supported ' +
+                'models are "svm" and "lda".'
+            )
+
+        if self.rescore_mode not in ('train', 'applyModel'):
+            raise ValueError(
+                f'Unsupported Rescore Mode: "{self.rescore_mode}". Supported ' +
+                'modes are "train" and "applyModel".'
+            )
+
+        if self.rescore_mode == 'applyModel' and self.rescore_model_folder is None:
+            raise ValueError(
+                'You must specify the rescoreModelFolder of a previous run when using ' +
+                'rescoreMode "applyModel".'
+            )
+
+        if self.rescore_strata and not self.use_accession_stratum:
+            raise ValueError(
+                'rescoreStrata requires useAccessionStrata to be set.'
+            )
+
         if self.spectral_predictor not in ('prosit', 'ms2pip'):
             raise ValueError(
                 f'Unsupported Spectral Predictor: "{self.spectral_predictor}". Supported ' +
@@ -58,6 +58,12 @@ PTM_ID_KEY = 'Identifier'
 PTM_IS_VAR_KEY = 'isVar'
 PTM_WEIGHT_KEY = 'Delta'
 
+# Compact encoding of PTM_SEQ_KEY, parsed once when search results are read.
+PTM_N_TERM_KEY = 'ptmNTerm'
+PTM_RESIDUES_KEY = 'ptmResidues'
+PTM_C_TERM_KEY = 'ptmCTerm'
+PTM_CODE_KEYS = [PTM_N_TERM_KEY, PTM_RESIDUES_KEY, PTM_C_TERM_KEY]
+
 # Spectral Features:
 FRAG_MZ_ERR_MED_KEY = 'medianFragmentMzError'
 FRAG_MZ_ERR_VAR_KEY = 'fragmentMzErrorVariance'
@@ -87,6 +93,8 @@ PSM_ID_KEY = {
     'percolator': 'specID',
     'percolatorSeparate': 'specID',
 }
+# PSM Ids are the source name, scan number and modified sequence joined by underscores.
+PSM_ID_PATTERN = r'^(.*)_([^_]*)_([^_]*)$'
 OUT_PSM_ID_KEY = {
     'mokapot': 'specID',
     'percolator': 'PSMId',
@@ -0,0 +1,504 @@
+""" Functions for running feature creation across several hosts which share a
+    filesystem. A coordinator places one task per scan file on a SQLite queue
+    in the shared folder, workers on any host claim tasks and write the
+    spectral features of their scan file to the shared feature store, and the
+    coordinator calibrates retention time across all scan files and merges the
+    results into the percolator/mokapot input before rescoring.
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+import traceback
+import uuid
+
+import pandas as pd
+import polars as pl
+
+from inspire.constants import (
+    ENDC_TEXT,
+    OKCYAN_TEXT,
+    SCAN_KEY,
+    WARNING_TEXT,
+)
+from inspire.feature_creation import (
+    create_non_spectral_features,
+    create_spectral_file_features,
+    generate_function_arguments,
+    get_scan_files,
+    read_feature_input,
+    write_staged_features,
+)
+from inspire.utils import fetch_collision_energy
+
+TASK_PENDING = 'pending'
+TASK_CLAIMED = 'claimed'
+TASK_COMPLETE = 'complete'
+TASK_FAILED = 'failed'
+
+QUEUE_DB_NAME = 'queue.db'
+QUEUE_TABLES = ['tasks', 'metadata', 'run']
+FEATURE_STORE_NAME = 'features'
+DEFAULT_WAIT_TIMEOUT = 3600.0
+
+class TaskQueue:
+    """ Queue of scan file tasks held in a SQLite database on a shared filesystem.
+        All state changes are made inside immediate transactions so that only one
+        worker can ever claim a given task.
+    """
+    def __init__(self, queue_folder, lease_time=None, timeout=600.0):
+        self.queue_folder = queue_folder
+        self.db_path = f'{queue_folder}/{QUEUE_DB_NAME}'
+        self.lease_time = lease_time
+        self.timeout = timeout
+
+    def _connect(self):
+        """ Function to open a connection to the queue database, rollback journals
+            are used as WAL mode is not safe on network filesystems.
+        """
+        connection = sqlite3.connect(
+            self.db_path, timeout=self.timeout, isolation_level=None,
+        )
+        connection.execute('PRAGMA journal_mode=DELETE')
+        return connection
+
+    def initialise(self, tasks, metadata=None):
+        """ Function to (re)create the queue with a pending task for every scan file.
+
+        Parameters
+        ----------
+        tasks : list of tuple
+            The file index and name of every scan file to be processed.
+        metadata : dict or None
+            Any JSON serialisable values which workers require.
+
+        Returns
+        -------
+        run_id : str
+            The identifier the queue is stamped with, along with its creation time.
+        """
+        if not os.path.exists(self.queue_folder):
+            os.makedirs(self.queue_folder)
+        run_id = uuid.uuid4().hex
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for table in QUEUE_TABLES:
+                connection.execute(f'DROP TABLE IF EXISTS {table}')
+            connection.execute(
+                '''CREATE TABLE tasks (
+                    fileIdx INTEGER PRIMARY KEY,
+                    scanFile TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    claimedAt REAL,
+                    finishedAt REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )'''
+            )
+            connection.execute(
+                'CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+            )
+            connection.execute('CREATE TABLE run (runId TEXT NOT NULL, createdAt REAL NOT NULL)')
+            connection.execute(
+                'INSERT INTO run (runId, createdAt) VALUES (?, ?)', (run_id, time.time()),
+            )
+            connection.executemany(
+                'INSERT INTO tasks (fileIdx, scanFile, status) VALUES (?, ?, ?)',
+                [(file_idx, scan_file, TASK_PENDING) for file_idx, scan_file in tasks],
+            )
+            if metadata is not None:
+                connection.executemany(
+                    'INSERT INTO metadata (key, value) VALUES (?, ?)',
+                    [
+                        # Values read via numpy/pandas are converted to python scalars.
+                        (key, json.dumps(value, default=lambda x : x.item()))
+                        for key, value in metadata.items()
+                    ],
+                )
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return run_id
+
+    def reset(self):
+        """ Function to remove the tasks of any earlier run so that workers wait for
+            the queue to be initialised again.
+        """
+        if not os.path.exists(self.db_path):
+            return
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for table in QUEUE_TABLES:
+                connection.execute(f'DROP TABLE IF EXISTS {table}')
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def is_ready(self, created_after=None):
+        """ Function to check whether the coordinator has initialised the queue.
+
+        Parameters
+        ----------
+        created_after : float or None (default=None)
+            If set, a finished queue created before this time is left from an earlier
+            run and is not ready.
+        """
+        if not os.path.exists(self.db_path):
+            return False
+        connection = self._connect()
+        try:
+            # Read in one transaction so that a concurrent reset is seen consistently.
+            connection.execute('BEGIN')
+            tables = connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            ).fetchall()
+            if not set(QUEUE_TABLES).issubset({table[0] for table in tables}):
+                return False
+            if created_after is None:
+                return True
+            created_at = connection.execute('SELECT createdAt FROM run').fetchone()[0]
+            n_open = connection.execute(
+                'SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)',
+                (TASK_PENDING, TASK_CLAIMED),
+            ).fetchone()[0]
+        finally:
+            connection.close()
+        return created_at >= created_after or n_open > 0
+
+    def get_metadata(self):
+        """ Function to read the metadata written by the coordinator.
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT key, value FROM metadata').fetchall()
+        finally:
+            connection.close()
+        return {key: json.loads(value) for key, value in rows}
+
+    def claim(self, worker_id):
+        """ Function to claim the next pending task. Claimed tasks whose lease has
+            expired (e.g. because the worker's host died) are also reclaimed.
+
+        Parameters
+        ----------
+        worker_id : str
+            Identifier of the worker making the claim.
+
+        Returns
+        -------
+        task : tuple of (int, str) or None
+            The file index and scan file name of the claimed task, or None if no
+            task is available.
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            if self.lease_time is None:
+                row = connection.execute(
+                    'SELECT fileIdx, scanFile FROM tasks WHERE status = ? ' +
+                    'ORDER BY fileIdx LIMIT 1',
+                    (TASK_PENDING,),
+                ).fetchone()
+            else:
+                row = connection.execute(
+                    'SELECT fileIdx, scanFile FROM tasks WHERE status = ? OR ' +
+                    '(status = ? AND claimedAt < ?) ORDER BY fileIdx LIMIT 1',
+                    (TASK_PENDING, TASK_CLAIMED, now - self.lease_time),
+                ).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE tasks SET status = ?, worker = ?, claimedAt = ?, ' +
+                    'attempts = attempts + 1 WHERE fileIdx = ?',
+                    (TASK_CLAIMED, worker_id, now, row[0]),
+                )
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        return row[0], row[1]
+
+    def _finish(self, file_idx, worker_id, status, error=None):
+        """ Function to mark a task claimed by the worker as finished.
+        """
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            cursor = connection.execute(
+                'UPDATE tasks SET status = ?, finishedAt = ?, error = ? ' +
+                'WHERE fileIdx = ? AND worker = ? AND status = ?',
+                (status, time.time(), error, file_idx, worker_id, TASK_CLAIMED),
+            )
+            updated = cursor.rowcount
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+        return updated == 1
+
+    def complete(self, file_idx, worker_id):
+        """ Function to mark a task as complete, returns False if the worker no
+            longer holds the task.
+        """
+        return self._finish(file_idx, worker_id, TASK_COMPLETE)
+
+    def fail(self, file_idx, worker_id, error):
+        """ Function to mark a task as failed, returns False if the worker no
+            longer holds the task.
+        """
+        return self._finish(file_idx, worker_id, TASK_FAILED, error)
+
+    def status_counts(self):
+        """ Function to count the tasks in each state.
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT status, COUNT(*) FROM tasks GROUP BY status'
+            ).fetchall()
+        finally:
+            connection.close()
+        counts = {
+            TASK_PENDING: 0, TASK_CLAIMED: 0, TASK_COMPLETE: 0, TASK_FAILED: 0,
+        }
+        counts.update(dict(rows))
+        return counts
+
+    def get_tasks(self):
+        """ Function to fetch the full state of the queue.
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT fileIdx, scanFile, status, worker, attempts, error ' +
+                'FROM tasks ORDER BY fileIdx'
+            ).fetchall()
+        finally:
+            connection.close()
+        return rows
+
+    def is_finished(self):
+        """ Function to check whether no tasks remain to be processed.
+        """
+        counts = self.status_counts()
+        return counts[TASK_PENDING] == 0 and counts[TASK_CLAIMED] == 0
+
+def get_worker_id():
+    """ Function to create an identifier which is unique to the worker process.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def get_queue(config):
+    """ Function to create the TaskQueue for the experiment.
+    """
+    return TaskQueue(
+        config.distributed_folder,
+        lease_time=config.distributed_lease,
+    )
+
+def _feature_store(config):
+    """ Function to get the location of the shared feature store.
+    """
+    return f'{config.distributed_folder}/{FEATURE_STORE_NAME}'
+
+def process_queue(
+        queue, task_func, worker_id=None, poll_interval=5.0, wait_timeout=DEFAULT_WAIT_TIMEOUT,
+    ):
+    """ Function to claim and process tasks until the queue has been exhausted.
+
+    Parameters
+    ----------
+    queue : inspire.distributed.TaskQueue
+        The shared task queue.
+    task_func : function
+        Function called with the file index and scan file of each claimed task.
+    worker_id : str or None
+        Identifier of the worker, defaults to hostname and process ID.
+    poll_interval : float
+        Seconds to wait between checks while the queue is not yet initialised or
+        while tasks held by other workers may still be reclaimed.
+    wait_timeout : float or None
+        Maximum number of seconds to wait for the queue to be initialised, if None
+        the worker waits indefinitely.
+
+    Returns
+    -------
+    processed : list of int
+        The file indices of all tasks completed by this worker.
+    """
+    if worker_id is None:
+        worker_id = get_worker_id()
+
+    # A finished queue created before the worker started is left from an earlier run.
+    start_time = time.time()
+    while not queue.is_ready(created_after=start_time):
+        if wait_timeout is not None and time.time() - start_time > wait_timeout:
+            raise TimeoutError(f'Task queue at {queue.db_path} was never initialised.')
+        time.sleep(poll_interval)
+
+    processed = []
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            # Claimed tasks may return to the queue if their lease expires.
+            if queue.lease_time is None or queue.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        file_idx, scan_file = task
+        try:
+            task_func(file_idx, scan_file)
+        except Exception: # pylint: disable=broad-except
+            queue.fail(file_idx, worker_id, traceback.format_exc())
+            print(
+                WARNING_TEXT +
+                f'Worker {worker_id} failed on scan file {file_idx}, {scan_file}.' +
+                ENDC_TEXT
+            )
+            continue
+
+        if queue.complete(file_idx, worker_id):
+            processed.append(file_idx)
+
+    return processed
+
+def run_coordinator(config):
+    """ Function to prepare the shared feature store, queue a task for every scan file,
+        wait for all workers to finish and merge their results into the
+        percolator/mokapot input file.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object used throughout the pipeline.
+    """
+    # Workers wait while the features are prepared rather than finding an earlier run.
+    queue = get_queue(config)
+    queue.reset()
+
+    target_df, mods_df = read_feature_input(config)
+    feature_df = create_non_spectral_features(target_df, mods_df, config)
+
+    store_folder = _feature_store(config)
+    if not os.path.exists(store_folder):
+        os.makedirs(store_folder)
+    for file_name in os.listdir(store_folder):
+        os.remove(f'{store_folder}/{file_name}')
+    feature_df.write_parquet(f'{store_folder}/searchFeatures.parquet')
+    mods_df.to_csv(f'{store_folder}/mods.csv', index=False)
+
+    scan_files = get_scan_files(feature_df, config)
+    run_id = queue.initialise(
+        list(enumerate(scan_files)),
+        metadata={'collisionEnergy': config.collision_energy},
+    )
+    print(
+        OKCYAN_TEXT +
+        f'\t{len(scan_files)} scan files queued at {queue.db_path} for run {run_id}, ' +
+        'waiting for workers.' +
+        ENDC_TEXT
+    )
+
+    while not queue.is_finished():
+        time.sleep(config.distributed_poll_interval)
+
+    failed_tasks = [task for task in queue.get_tasks() if task[2] == TASK_FAILED]
+    if failed_tasks:
+        failure_details = '\n'.join(
+            f'{task[1]} (worker {task[3]}):\n{task[5]}' for task in failed_tasks
+        )
+        raise RuntimeError(
+            f'Feature creation failed for {len(failed_tasks)} scan files:\n{failure_details}'
+        )
+
+    merge_feature_store(config, scan_files, int(feature_df[SCAN_KEY].max()))
+
+def merge_feature_store(config, scan_files, max_scan):
+    """ Function to calibrate retention time across the spectral features of every
+        scan file in the shared feature store in one batch and merge them into the
+        percolator/mokapot input file, in file index order.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object used throughout the pipeline.
+    scan_files : list of str
+        The scan files queued, in file index order.
+    max_scan : int
+        The maximum scan value in the dataset.
+    """
+    store_folder = _feature_store(config)
+    staged_files = [
+        (file_idx, scan_file, f'{store_folder}/features_{file_idx}.parquet')
+        for file_idx, scan_file in enumerate(scan_files)
+        if os.path.exists(f'{store_folder}/features_{file_idx}.parquet')
+    ]
+    write_staged_features(staged_files, config, max_scan)
+
+    print(
+        OKCYAN_TEXT +
+        f'\tMerged features from {len(staged_files)} of {len(scan_files)} scan files.' +
+        ENDC_TEXT
+    )
+
+def run_worker(config):
+    """ Function to run a worker which creates features for scan files claimed from
+        the shared queue until no tasks remain.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object used throughout the pipeline.
+    """
+    queue = get_queue(config)
+    worker_id = get_worker_id()
+    store_folder = _feature_store(config)
+    shared_data = {}
+
+    def _process_scan_file(file_idx, scan_file):
+        if not shared_data:
+            metadata = queue.get_metadata()
+            if config.collision_energy is None:
+                config.collision_energy = metadata['collisionEnergy']
+                if config.collision_energy is None:
+                    config.collision_energy = fetch_collision_energy(config.output_folder)
+            shared_data['searchDf'] = pl.read_parquet(f'{store_folder}/searchFeatures.parquet')
+            shared_data['modsDf'] = pd.read_csv(f'{store_folder}/mods.csv')
+
+        print(
+            OKCYAN_TEXT +
+            f'\tWorker {worker_id} claimed scan file {file_idx}, {scan_file}.' +
+            ENDC_TEXT
+        )
+        func_args = generate_function_arguments(
+            shared_data['searchDf'], shared_data['modsDf'], config, file_idx, scan_file,
+        )
+        if func_args is None:
+            return
+
+        # Retention time is calibrated by the coordinator across all scan files.
+        combined_df = create_spectral_file_features(func_args, config)
+        # Write to a temporary name so the coordinator never sees partial output.
+        file_loc = f'{store_folder}/features_{file_idx}.parquet'
+        combined_df.write_parquet(f'{file_loc}.{worker_id.replace(":", "_")}.tmp')
+        os.replace(f'{file_loc}.{worker_id.replace(":", "_")}.tmp', file_loc)
+
+    processed = process_queue(
+        queue,
+        _process_scan_file,
+        worker_id=worker_id,
+        poll_interval=config.distributed_poll_interval,
+        wait_timeout=config.distributed_wait_timeout,
+    )
+
+    print(
+        OKCYAN_TEXT +
+        f'\tWorker {worker_id} processed {len(processed)} scan files.' +
+        ENDC_TEXT
+    )
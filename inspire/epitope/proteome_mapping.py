@@ -1,13 +1,20 @@
 """ Functions from proteome remapping in relation to epitope candidate extraction.
 """
 import multiprocessing as mp
+
+import numpy as np
 import pandas as pd
 
 from inspire.constants import (
     ENDC_TEXT,
     OKCYAN_TEXT,
 )
-from inspire.utils import fetch_proteome
+from inspire.proteome_index import (
+    attach_proteome_index,
+    get_batch_count,
+    get_proteome_index,
+    get_proteome_index_loc,
+)
 
 
 def filter_pathogen_only_peptides(final_df, config):
@@ -30,7 +37,9 @@ def filter_pathogen_only_peptides(final_df, config):
     final_df = add_accession_data(final_df, config)
 
     total_count = final_df.shape[0]
-    final_df, multi_mapped_df = filter_multi_mapped(final_df, config.host_proteome)
+    final_df, multi_mapped_df = filter_multi_mapped(
+        final_df, get_proteome_index(config.host_proteome, config.output_folder),
+    )
     no_host_accession_count = final_df.shape[0]
 
     print(
@@ -58,7 +67,9 @@ def filter_pathogen_only_peptides(final_df, config):
     return final_df, multi_mapped_df
 
 
-def _sub_add_accession(unique_df, host_proteome, pathogen_proteome):
+def _sub_add_accession(unique_df, host_index_loc, pathogen_index_loc):
+    host_proteome = attach_proteome_index(host_index_loc)
+    pathogen_proteome = attach_proteome_index(pathogen_index_loc)
     unique_df['hostAccessions'] = unique_df['peptide'].apply(
         lambda x : fetch_antigen_data(
             x, host_proteome, trace_accession=False,
@@ -89,30 +100,25 @@ def add_accession_data(final_df, config):
     final_df : pd.DataFrame
         The inSPIRE final assignments DataFrame updated with
     """
-    host_proteome = fetch_proteome(config.host_proteome)
-    pathogen_proteome = fetch_proteome(config.pathogen_proteome)
+    # Workers memory-map the cached proteome indices rather than receiving copies.
+    host_index_loc = get_proteome_index_loc(config.host_proteome, config.output_folder)
+    pathogen_index_loc = get_proteome_index_loc(config.pathogen_proteome, config.output_folder)
 
     unique_df = final_df[['peptide']].drop_duplicates(subset=['peptide'])
-
-    batch_size = unique_df.shape[0]//config.n_cores
-
-    batch_values = []
-    for batch_idx in range(config.n_cores):
-        batch_values.extend([batch_idx]*batch_size)
-
-    if (additional_psms := unique_df.shape[0]%config.n_cores):
-        batch_values.extend([config.n_cores-1]*additional_psms)
-
-    unique_df['batch'] = batch_values
-
-    pep_df_list = [unique_df[unique_df['batch'] == b_idx] for b_idx in range(config.n_cores)]
-    func_args = []
-    for sub_pep_df in pep_df_list:
-        func_args.append([sub_pep_df, host_proteome, pathogen_proteome])
-
-    with mp.get_context('spawn').Pool(processes=config.n_cores) as pool:
-        pep_df_list = pool.starmap(_sub_add_accession, func_args)
-    remapped_pep_df = pd.concat(pep_df_list)
+    n_batches = get_batch_count(unique_df.shape[0], config.n_cores)
+
+    if n_batches == 1:
+        remapped_pep_df = _sub_add_accession(unique_df, host_index_loc, pathogen_index_loc)
+    else:
+        # Peptides are dealt out in turn so that batch sizes differ by at most one.
+        batch_values = np.arange(unique_df.shape[0]) % n_batches
+        func_args = [
+            [unique_df[batch_values == b_idx], host_index_loc, pathogen_index_loc]
+            for b_idx in range(n_batches)
+        ]
+        with mp.get_context('spawn').Pool(processes=min(config.n_cores, n_batches)) as pool:
+            pep_df_list = pool.starmap(_sub_add_accession, func_args)
+        remapped_pep_df = pd.concat(pep_df_list)
 
     total_df = pd.merge(final_df, remapped_pep_df, how='inner', on='peptide')
 
@@ -121,38 +127,39 @@ def add_accession_data(final_df, config):
 
 def fetch_antigen_data(
         peptide,
-        proteome,
+        proteome_index,
         trace_accession=True,
     ):
     """ Function to check for the presence of an identified peptide as either canonical
         or spliced in the input proteome.
     """
+    matches = proteome_index.find(peptide)
+    if not trace_accession:
+        return 'PCP' if matches else 'unknown'
+
+    # Matches are ordered by protein, so the first of each protein is its first location.
     accession_stratum = []
-    peptide = peptide.replace('I', 'L')
-    for protein in proteome:
-        if peptide in protein[1]:
-            location = protein[1].index(peptide) + 1
-            if trace_accession:
-                if not accession_stratum:
-                    accession_stratum = [(protein[0], location, protein[2])]
-                else:
-                    accession_stratum.append((protein[0], location, protein[2]))
-            else:
-                return 'PCP'
-    if trace_accession:
-        return accession_stratum
-    return 'unknown'
-
-
-def filter_multi_mapped(final_df, host_proteome_filename):
+    previous_idx = None
+    for protein_idx, position in matches:
+        if protein_idx != previous_idx:
+            accession_stratum.append((
+                proteome_index.protein_name(protein_idx),
+                position + 1,
+                proteome_index.protein_description(protein_idx),
+            ))
+            previous_idx = protein_idx
+    return accession_stratum
+
+
+def filter_multi_mapped(final_df, host_proteome_index):
     """ Function to remove peptides which map to both host and pathogen proteomes.
 
     Parameters
     ----------
     final_df : pd.DataFrame
         A DataFrame of all peptides identified.
-    host_proteome_filename : str
-        The path to the file containing the host proteome.
+    host_proteome_index : inspire.proteome_index.ProteomeIndex
+        The index of the host proteome.
 
     Returns
     -------
@@ -162,14 +169,13 @@ def filter_multi_mapped(final_df, host_proteome_filename):
     multi_mapped_df : pd.DataFrame
         A DataFrame of all peptides which map to both the host and pathogen proteomes.
     """
-    host_proteome = fetch_proteome(host_proteome_filename)
     multi_mapped_df = final_df[
         (final_df['hostAccessions'] != 'unknown') &
         (final_df['pathogenProteins'] != 'unknown')
     ]
     multi_mapped_df['hostAccessions'] = multi_mapped_df['peptide'].apply(
         lambda x : fetch_antigen_data(
-            x, host_proteome, trace_accession=False,
+            x, host_proteome_index, trace_accession=False,
         )
     )
     final_df = final_df[
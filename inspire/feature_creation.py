@@ -27,6 +27,7 @@ from inspire.constants import(
     PSM_ID_KEY,
     PEARSON_KEY,
     PERC_SCAN_ID,
+    PTM_CODE_KEYS,
     PTM_ID_KEY,
     PTM_NAME_KEY,
     PTM_SEQ_KEY,
@@ -43,8 +44,10 @@ from inspire.input.mhcpan import read_mhcpan_output
 from inspire.input.msp import msp_to_df
 from inspire.input.mzml import process_mzml_file
 from inspire.input.search_results import generic_read_df
-from inspire.prepare import create_prosit_mod_seq
+from inspire.prepare import add_prosit_mod_seq
+from inspire.proteome_index import get_proteome_index_loc, parallel_remap
 from inspire.retention_time import add_delta_irt
+from inspire.rt_alignment import calibrate_retention_times, write_rt_calibrations
 from inspire.spectral_features import (
     SPECTRAL_FEATURES,
     DELTA_FEATURES,
@@ -52,11 +55,10 @@ from inspire.spectral_features import (
 )
 from inspire.utils import (
     accession_informed_filter,
-    check_bad_mods,
-    fetch_proteome,
+    add_ptm_code,
     get_ox_flag,
+    has_ptm_ids,
     modify_sequence_for_skyline,
-    parallel_remap,
     remove_source_suffixes,
 )
 
@@ -81,12 +83,7 @@ def combine_spectral_data(search_df, scan_df, prosit_df, ox_flag, spectral_predi
         The DataFrame with all merged Data.
     """
     if spectral_predictor == 'prosit':
-        search_df = search_df.with_columns(
-            pl.struct([PEPTIDE_KEY, PTM_SEQ_KEY]).apply(
-                lambda x : create_prosit_mod_seq(x[PEPTIDE_KEY], x[PTM_SEQ_KEY], ox_flag),
-                skip_nulls=False,
-            ).alias('modified_sequence')
-        )
+        search_df = add_prosit_mod_seq(search_df, ox_flag)
         prosit_df = prosit_df.unique(
             subset=['modified_sequence', CHARGE_KEY, 'collisionEnergy']
         )
@@ -207,11 +204,10 @@ def filter_input_columns(combined_df, config, file_idx):
     use_cols += [PEPTIDE_KEY, IN_ACCESSION_KEY[config.rescore_method]]
 
     if config.remap_to_proteome:
-        proteome = fetch_proteome(config.proteome, with_desc=False)
         combined_df = parallel_remap(
             combined_df,
             config.n_cores,
-            proteome,
+            get_proteome_index_loc(config.proteome, config.output_folder),
             IN_ACCESSION_KEY[config.rescore_method],
         )
         combined_df = combined_df.drop(ACCESSION_KEY)
@@ -225,6 +221,27 @@ def filter_input_columns(combined_df, config, file_idx):
 
     return combined_df
 
+def get_scan_files(search_df, config):
+    """ Function to get the ordered list of scan files to be processed, the index
+        of a scan file in this list is used as its file index.
+
+    Parameters
+    ----------
+    search_df : pl.DataFrame
+        The results from the original search DataFrame.
+    config : inspire.config.Config
+        The Config object.
+
+    Returns
+    -------
+    scan_files : list of str
+        The sorted names of all scan files.
+    """
+    if config.combined_scans_file is not None:
+        return sorted([remove_source_suffixes(config.combined_scans_file)])
+
+    return sorted(search_df[SOURCE_KEY].unique().to_list())
+
 def write_with_spectral_features(
         search_df,
         mods_df,
@@ -241,26 +258,63 @@ def write_with_spectral_features(
     config : inspire.config.Config
         The Config object.
     """
-    if config.combined_scans_file is not None:
-        scan_files = sorted([remove_source_suffixes(config.combined_scans_file)])
-    else:
-        scan_files = sorted(search_df[SOURCE_KEY].unique().to_list())
-
+    scan_files = get_scan_files(search_df, config)
 
     max_scan = search_df[SCAN_KEY].max()
-    for file_idx, scan_file in enumerate(scan_files):
-        func_args = generate_function_arguments(
-            search_df, mods_df, config, file_idx, scan_file
-        )
-        process_single_file(
-            func_args, config, file_idx, scan_file, max_scan
-        )
+    staged_files = []
+    try:
+        for file_idx, scan_file in enumerate(scan_files):
+            func_args = generate_function_arguments(
+                search_df, mods_df, config, file_idx, scan_file
+            )
+            if func_args is None:
+                continue
+            file_loc = f'{config.output_folder}/temp_{file_idx}_features.parquet'
+            staged_files.append((file_idx, scan_file, file_loc))
+            create_spectral_file_features(func_args, config).write_parquet(file_loc)
+
+        write_staged_features(staged_files, config, max_scan)
+    finally:
+        # Staged features are removed even if calibration or finalising fails.
+        for _, _, file_loc in staged_files:
+            if os.path.exists(file_loc):
+                os.remove(file_loc)
 
     print(
         OKCYAN_TEXT + '\t\t\tFull input DataFrame written to csv.' + ENDC_TEXT
     )
 
 
+def write_staged_features(staged_files, config, max_scan):
+    """ Function to calibrate retention time across all scan files in one batch, then
+        add the retention time features to each file and write the percolator/mokapot
+        input.
+
+    Parameters
+    ----------
+    staged_files : list of tuple
+        The file index, scan file name and location of the spectral features of each
+        scan file, in file index order.
+    config : inspire.config.Config
+        The Config object.
+    max_scan : int
+        The maximum scan value in the dataset.
+    """
+    fits_df = calibrate_retention_times(
+        config,
+        {scan_file: pl.scan_parquet(file_loc) for _, scan_file, file_loc in staged_files},
+    )
+    if fits_df is not None and config.rt_fit_loc is None:
+        write_rt_calibrations(fits_df, config.output_folder)
+
+    for n_written, (file_idx, scan_file, file_loc) in enumerate(staged_files):
+        combined_df = finalise_file_features(
+            pl.read_parquet(file_loc), config, file_idx, scan_file, max_scan, fits_df,
+        )
+        # Header is only written for the first file with results.
+        _write_to_tab_file(combined_df, n_written, config.output_folder)
+
+
 def add_perc_scan_id(combined_df, config, file_idx, max_scan):
     """ Function add a Percolator scan ID to the DataFrame that will be unique
         to scans across RAW files.
@@ -415,8 +469,11 @@ def generate_function_arguments(
     combined_df_list = combined_df.partition_by('batch')
     func_args = []
     for idx, comb_df in enumerate(combined_df_list):
-        comb_df.write_parquet(f'{config.output_folder}/temp_{idx}_in.parquet')
-        func_args.append([mods_df, config, idx])
+        # Task IDs include the file index so that workers sharing an output folder
+        # never overwrite one another's temporary files.
+        task_id = f'{file_idx}_{idx}'
+        comb_df.write_parquet(f'{config.output_folder}/temp_{task_id}_in.parquet')
+        func_args.append([mods_df, config, task_id])
 
     return func_args
 
@@ -447,10 +504,9 @@ class CustomManager(BaseManager):
     # nothing
     pass
 
-def process_single_file(
-        func_args, config, file_idx, scan_file, max_scan
-    ):
-    """ Function to process PSMs from a single raw file in parallel.
+def create_spectral_file_features(func_args, config):
+    """ Function to create the spectral features for PSMs from a single raw file in
+        parallel.
 
     Parameters
     ----------
@@ -459,13 +515,11 @@ def process_single_file(
         the create_spectral_features function.
     config : inspire.config.Config
         The Config object for the whole experiment.
-    file_idx : int
-        The index of the file being processed.
-    scan_file : str
-        The name of the file being processed.
-    max_scan : int
-        The maximum scan value in the dataset (needed to ensure uniqueness
-        in Percolator scan ID).
+
+    Returns
+    -------
+    combined_df : pl.DataFrame
+        The PSMs of the scan file with spectral features, in input order.
     """
     CustomManager.register('ChildRegressor', ChildRegressor)
     with CustomManager() as manager:
@@ -484,10 +538,11 @@ def process_single_file(
         with mp.get_context('spawn').Pool(processes=config.n_cores) as pool:
             pool.starmap(create_spectral_features, func_args)
 
+    task_ids = [arg_group[2] for arg_group in func_args]
     results_dfs = [
         pl.read_parquet(
-            f'{config.output_folder}/temp_{idx}_out.parquet'
-        ) for idx in range(len(func_args))
+            f'{config.output_folder}/temp_{task_id}_out.parquet'
+        ) for task_id in task_ids
     ]
     select_columns = results_dfs[0].columns
 
@@ -511,16 +566,43 @@ def process_single_file(
                     .otherwise(pl.col(feat)).alias(feat)
             )
 
-    for idx in range(len(func_args)):
-        os.remove(f'{config.output_folder}/temp_{idx}_in.parquet')
-        os.remove(f'{config.output_folder}/temp_{idx}_out.parquet')
+    for task_id in task_ids:
+        os.remove(f'{config.output_folder}/temp_{task_id}_in.parquet')
+        os.remove(f'{config.output_folder}/temp_{task_id}_out.parquet')
 
     combined_df = combined_df.sort(by='spectralAngle', descending=True)
     if isinstance(config.collision_energy, list):
         combined_df = combined_df.unique(subset=['source', 'scan', 'peptide'])
 
     combined_df = combined_df.sort(by='tempIndex')
-    combined_df = add_delta_irt(combined_df, config, scan_file)
+    return combined_df
+
+def finalise_file_features(combined_df, config, file_idx, scan_file, max_scan, fits_df):
+    """ Function to add retention time features to the PSMs of a single raw file and
+        filter to the required features.
+
+    Parameters
+    ----------
+    combined_df : pl.DataFrame
+        The PSMs of the scan file with spectral features.
+    config : inspire.config.Config
+        The Config object for the whole experiment.
+    file_idx : int
+        The index of the file being processed.
+    scan_file : str
+        The name of the file being processed.
+    max_scan : int
+        The maximum scan value in the dataset (needed to ensure uniqueness
+        in Percolator scan ID).
+    fits_df : pl.DataFrame or None
+        The retention time calibrations of the experiment.
+
+    Returns
+    -------
+    combined_df : pl.DataFrame
+        The features for all PSMs of the scan file, filtered to the required columns.
+    """
+    combined_df = add_delta_irt(combined_df, config, scan_file, fits_df)
 
     print(
         OKCYAN_TEXT + '\t\t\tCreated Spectral and Delta RT Features.' + ENDC_TEXT
@@ -529,9 +611,7 @@ def process_single_file(
 
     combined_df = filter_input_columns(combined_df, config, file_idx)
 
-    file_loc = _write_to_tab_file(combined_df, file_idx, config.output_folder)
-
-    return file_loc
+    return combined_df
 
 def _write_to_tab_file(combined_df, file_idx, output_folder):
     """ Function to write percolator input in tab format.
@@ -576,6 +656,32 @@ def write_rescoring_features(
     config : inspire.config.Config
         The Config object.
     """
+    feature_df = create_non_spectral_features(search_df, mods_df, config)
+
+    write_with_spectral_features(
+        feature_df,
+        mods_df,
+        config,
+    )
+
+def create_non_spectral_features(search_df, mods_df, config):
+    """ Function to add the basic features, binding affinity and PSM ID to the
+        search results.
+
+    Parameters
+    ----------
+    search_df : pl.DataFrame
+        The results from the original search DataFrame.
+    mods_df : pd.DataFrame
+        The DataFrame of ptms.
+    config : inspire.config.Config
+        The Config object.
+
+    Returns
+    -------
+    feature_df : pl.DataFrame
+        The search results with all features which do not require spectral data.
+    """
     feature_df = create_basic_features(search_df, mods_df)
 
     if config.use_binding_affinity == 'asFeature':
@@ -600,8 +706,8 @@ def write_rescoring_features(
     else:
         mod_weights = dict(zip(mods_df[PTM_ID_KEY].tolist(), mods_df[PTM_WEIGHT_KEY].tolist()))
 
-    feature_df = feature_df.with_columns(
-        pl.struct([PEPTIDE_KEY, PTM_SEQ_KEY]).apply(
+    feature_df = add_ptm_code(feature_df).with_columns(
+        pl.struct([PEPTIDE_KEY, *PTM_CODE_KEYS]).apply(
             lambda x : modify_sequence_for_skyline(x, mod_weights),
             skip_nulls=False,
         ).alias('modSeq')
@@ -619,11 +725,7 @@ def write_rescoring_features(
         ENDC_TEXT
     )
 
-    write_with_spectral_features(
-        feature_df,
-        mods_df,
-        config,
-    )
+    return feature_df
 
 def process_unknown_modifications(target_df, mods_df, config):
     """ Function to handle modifications which are unknown to the Prosit spectral predictor
@@ -651,12 +753,8 @@ def process_unknown_modifications(target_df, mods_df, config):
             (mods_df[PTM_NAME_KEY] != 'Carbamidomethylation') &
             (mods_df[PTM_NAME_KEY] != 'Carbamidomethyl (C)')
         ][PTM_ID_KEY].tolist()
-        unknown_mods = {str(x) for x in unknown_mods}
-        target_df = target_df.with_columns(
-            pl.col(PTM_SEQ_KEY).apply(
-                lambda x : check_bad_mods(x, unknown_mods),
-                skip_nulls=False,
-            ).alias('unknownModifications')
+        target_df = add_ptm_code(target_df).with_columns(
+            has_ptm_ids(unknown_mods).alias('unknownModifications')
         )
         count_before_drop = target_df.shape[0]
         if config.use_accession_stratum:
@@ -700,6 +798,28 @@ def create_features(config):
     config : inspire.config.Config
         The Config object used throughout the pipeline.
     """
+    target_df, mods_df = read_feature_input(config)
+    write_rescoring_features(
+        target_df,
+        mods_df,
+        config,
+    )
+
+def read_feature_input(config):
+    """ Function to read and filter the search results ahead of feature creation.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object used throughout the pipeline.
+
+    Returns
+    -------
+    target_df : pl.DataFrame
+        The filtered search results.
+    mods_df : pd.DataFrame
+        The DataFrame of ptms.
+    """
     target_df, mods_df = generic_read_df(config)
     target_df = target_df.with_row_count(name='tempIndex')
 
@@ -716,8 +836,5 @@ def create_features(config):
         '\tMS Search Results ready.' +
         ENDC_TEXT
     )
-    write_rescoring_features(
-        target_df,
-        mods_df,
-        config,
-    )
+
+    return target_df, mods_df
@@ -1,10 +1,10 @@
 """ Functions for running automated feature selection.
 """
-from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+import numpy as np
+import polars as pl
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import auc, precision_recall_curve
 from sklearn.model_selection import train_test_split
 import yaml
 
@@ -25,13 +25,17 @@ from inspire.constants import (
     PEPTIDE_KEY,
     PRECURSOR_INTE_KEY,
     PREFIX_KEYS,
+    PSM_ID_KEY,
+    PSM_ID_PATTERN,
     SPEARMAN_KEY,
     SUFFIX_KEYS,
     SEQ_LEN_KEY,
     SOURCE_INDEX_KEY,
     SOURCE_KEY,
     SPECTRAL_ANGLE_KEY,
+    WARNING_TEXT,
 )
+from inspire.rt_alignment import get_rt_scales, read_rt_calibrations, COEFFICIENT_KEY
 from inspire.spectral_features import DELTA_FEATURES
 
 BASE_FEATURES = [
@@ -187,53 +191,185 @@ OUTSTANDING_CONFOUNDING_VARIABLES = [
 
 THRESHOLD_VALUE = 20
 
+# Feature subset search.
+BEAM_WIDTH = 3
+MAX_EXHAUSTIVE_FEATURES = 12
+TEST_METRIC_DECOY_QUANTILE = 0.99
 
-def get_best_feature_set(fe_df, feature_set):
+IRT_COEFFICIENT_KEY = 'irtCoefficient'
+PIN_BATCH_SIZE = 100_000
+
+
+def calculate_pr_auc(labels, scores):
+    """ Function to calculate the area under the precision-recall curve, as by
+        sklearn.metrics.auc of sklearn.metrics.precision_recall_curve, in a single sort.
+
+    Parameters
+    ----------
+    labels : np.array of int
+        The true label of each example, 1 for positives and 0 for negatives.
+    scores : np.array of float
+        The score of each example.
+
+    Returns
+    -------
+    pr_auc : float
+        The trapezoidal area under the precision-recall curve.
+    """
+    order = np.argsort(-scores, kind='mergesort')
+    sorted_scores = scores[order]
+    true_positives = np.cumsum(labels[order])
+
+    # The curve has a point at each distinct score.
+    threshold_idx = np.append(np.flatnonzero(np.diff(sorted_scores)), scores.shape[0] - 1)
+    true_positives = true_positives[threshold_idx]
+    precision = np.append(1.0, true_positives/(threshold_idx + 1))
+    recall = np.append(0.0, true_positives/true_positives[-1])
+    return float(np.trapz(precision, recall))
+
+def _fit_subset(design, subset, init_weights):
+    """ Function to fit a logistic model on the base features and a subset of candidate
+        features, warm-started from the model of a subset with one feature fewer.
+
+    Returns
+    -------
+    pr_auc : float
+        The area under the precision-recall curve on the test split.
+    weights : tuple of np.array
+        The coefficients and intercept of the model.
+    """
+    columns = design['base'] + list(subset)
+    model = LogisticRegression(
+        max_iter=1000, random_state=42, warm_start=init_weights is not None,
+    )
+    if init_weights is not None:
+        model.coef_ = init_weights[0].reshape(1, -1)
+        model.intercept_ = init_weights[1].copy()
+    model.fit(design['train'][:, columns], design['train_labels'])
+    return (
+        calculate_pr_auc(design['test_labels'], design['test'][:, columns] @ model.coef_[0]),
+        (model.coef_[0], model.intercept_),
+    )
+
+def _extend_subsets(parents, candidate_idx, search_method):
+    """ Function to get every subset with one feature more than a parent subset,
+        along with warm start weights from the parent with a zero for the new feature.
+    """
+    candidates = {}
+    for parent, (coef, intercept) in parents.items():
+        for col_idx in candidate_idx:
+            if col_idx in parent or (
+                search_method == 'exhaustive' and parent and col_idx < parent[-1]
+            ):
+                continue
+            position = sum(x < col_idx for x in parent)
+            subset = parent[:position] + (col_idx,) + parent[position:]
+            if subset not in candidates:
+                candidates[subset] = (
+                    np.insert(coef, len(BASE_FEATURES) + position, 0.0), intercept
+                )
+    return candidates
+
+def get_best_feature_set(
+        fe_df,
+        feature_set,
+        search_method='exhaustive',
+        n_cores=1,
+        beam_width=BEAM_WIDTH,
+    ):
     """ Function to get the best combination of features from a feature set
         for each number of features.
 
     Parameters
     ----------
-    fe_df : pd.DataFrame
-        The DataFrame containg all features.
+    fe_df : pl.DataFrame
+        The DataFrame containg all features and the testMetric (see create_test_metric).
     feature_set : list of str
         A list of the features we wish to select between.
+    search_method : str (default='exhaustive')
+        Either exhaustive to test every combination, greedy to add the best feature at
+        each step, or beam to extend the beam_width best combinations of each size.
+    n_cores : int (default=1)
+        The number of candidate models fitted in parallel.
+    beam_width : int (default=BEAM_WIDTH)
+        The number of combinations of each size kept by beam search.
 
     Returns
     -------
     features_sets_to_test : list of list of str
         A list of the best feature combinations for each number of features.
+    pr_aucs : list of float
+        The area under the precision-recall curve of each combination.
     """
-    fe_train, fe_test = train_test_split(fe_df, test_size=0.33, random_state=42)
-    fe_train = fe_train[fe_train['testMetric'] != -1]
-    fe_test['trueLabel'] = fe_test['testMetric'].apply(lambda x : 1 if x == -1 else x)
-    features_sets_to_test = []
-    for i in range(1, len(feature_set)+1):
-        max_r2 = -1000
-        best_features = []
-        for feature_selection in combinations(feature_set, i):
-            feature_selection = list(feature_selection)
-            reg = LogisticRegression(max_iter=1000, random_state=42).fit(
-                fe_train[feature_selection + BASE_FEATURES],
-                fe_train['testMetric'],
-            )
-
-            preds = reg.predict_proba(
-                fe_test[feature_selection + BASE_FEATURES]
-            )[:, 1]
-
-            precision, recall, _ = precision_recall_curve(fe_test['trueLabel'], preds)
-            feat_set_r2 = auc(recall, precision)
-
-            if feat_set_r2 > max_r2:
-                max_r2 = feat_set_r2
-                best_features = feature_selection
-
-        features_sets_to_test.append(best_features)
-    return features_sets_to_test
-
+    # The design matrix is built and standardised once, candidates select its columns.
+    features = np.ascontiguousarray(
+        fe_df.select(pl.col(BASE_FEATURES + feature_set).cast(pl.Float32)).to_numpy()
+    )
+    stds = np.nanstd(features, axis=0)
+    features = np.nan_to_num(
+        (features - np.nanmean(features, axis=0))/np.where(stds > 0, stds, 1.0)
+    )
+    test_metric = fe_df['testMetric'].to_numpy()
+    train_idx, test_idx = train_test_split(
+        np.arange(features.shape[0]), test_size=0.33, random_state=42
+    )
+    train_idx = train_idx[test_metric[train_idx] != -1]
+    design = {
+        'base': list(range(len(BASE_FEATURES))),
+        'train': features[train_idx],
+        'train_labels': test_metric[train_idx],
+        'test': features[test_idx],
+        'test_labels': np.where(test_metric[test_idx] == -1, 1, test_metric[test_idx]),
+    }
+
+    if search_method == 'exhaustive' and len(feature_set) > MAX_EXHAUSTIVE_FEATURES:
+        print(
+            WARNING_TEXT +
+            f'Exhaustive search over {len(feature_set)} features is infeasible, ' +
+            'using beam search instead.' +
+            ENDC_TEXT
+        )
+        search_method = 'beam'
 
-def remove_excluded_features(feature_list, all_features_df, exclude_features):
+    # Subsets are sorted tuples of column indices, each extends a parent by one feature.
+    candidate_idx = range(len(BASE_FEATURES), len(BASE_FEATURES) + len(feature_set))
+    _, base_weights = _fit_subset(design, (), None)
+    parents = {(): base_weights}
+    features_sets_to_test = []
+    pr_aucs = []
+    with ThreadPoolExecutor(max_workers=max(1, n_cores)) as pool:
+        for _ in feature_set:
+            candidates = _extend_subsets(parents, candidate_idx, search_method)
+            results = list(pool.map(
+                _fit_subset,
+                [design]*len(candidates),
+                candidates.keys(),
+                candidates.values(),
+            ))
+            candidates = list(candidates)
+
+            ranking = [
+                idx for _, _, idx in sorted(
+                    (-result[0], subset, idx)
+                    for idx, (subset, result) in enumerate(zip(candidates, results))
+                )
+            ]
+            if search_method == 'exhaustive':
+                kept = ranking
+            elif search_method == 'greedy':
+                kept = ranking[:1]
+            else:
+                kept = ranking[:beam_width]
+            parents = {candidates[idx]: results[idx][1] for idx in kept}
+
+            features_sets_to_test.append([
+                feature_set[col_idx - len(BASE_FEATURES)] for col_idx in candidates[ranking[0]]
+            ])
+            pr_aucs.append(results[ranking[0]][0])
+
+    return features_sets_to_test, pr_aucs
+
+def remove_excluded_features(feature_list, all_features_lf, exclude_features):
     """ Function to get the maximum possible number of features for Percolator q-value
         calculation when dealing with small datasets.
 
@@ -241,8 +377,8 @@ def remove_excluded_features(feature_list, all_features_df, exclude_features):
     ----------
     feature_list : list of str
         A list of perspective features.
-    all_features_df : pd.DataFrame
-        A DataFrame of perspective Percolator inputs.
+    all_features_lf : pl.LazyFrame
+        A LazyFrame of perspective Percolator inputs.
     exclude_features : list of str
         A list of features to be ignored.
 
@@ -251,64 +387,148 @@ def remove_excluded_features(feature_list, all_features_df, exclude_features):
     feature_list : list of str
         A list of perspective features without excluded features.
     """
+    feature_list = [x for x in feature_list if x not in exclude_features]
+    if not feature_list:
+        return feature_list
+
+    # A feature varies if its non-null values have distinct extremes.
+    extremes = all_features_lf.select(
+        [pl.col(x).min().alias(f'{idx}_min') for idx, x in enumerate(feature_list)] +
+        [pl.col(x).max().alias(f'{idx}_max') for idx, x in enumerate(feature_list)]
+    ).collect(streaming=True).row(0, named=True)
     feature_list = [
-        x for x in feature_list if (
-            x not in exclude_features and all_features_df[x].nunique() > 1
+        x for idx, x in enumerate(feature_list) if (
+            extremes[f'{idx}_min'] is not None and
+            extremes[f'{idx}_min'] != extremes[f'{idx}_max']
         )
     ]
     return feature_list
 
-def create_test_metric(df_row, sa_cut_off, es_cut_off):
+def create_test_metric(all_features_df):
     """ Function to create the metric on which logistic models will be trained to
-        quickly test feature set performance.
+        quickly test feature set performance. Targets scoring above the
+        TEST_METRIC_DECOY_QUANTILE of decoys on both spectral angle and engine score are
+        1, other targets -1, and decoys 0.
 
     Parameters
     ----------
-    df_row : pd.Series
-        The row of a DataFrame in which we wish to create a testMetric.
+    all_features_df : pl.DataFrame
+        The DataFrame in which we wish to create a testMetric.
 
     Returns
     -------
-    df_row : pd.Series
-        The updated DataFrame row with testMetric added.
+    all_features_df : pl.DataFrame
+        The DataFrame with testMetric added.
     """
-    if (
-        df_row[LABEL_KEY] > 0 and
-        df_row[SPECTRAL_ANGLE_KEY] > sa_cut_off and
-        df_row[ENGINE_SCORE_KEY] > es_cut_off
-    ):
-        return 1
-    if df_row[LABEL_KEY] > 0:
-        return -1
-    return 0
+    is_target = pl.col(LABEL_KEY) > 0
+    sa_cut_off, es_cut_off = all_features_df.filter(~is_target).select(
+        pl.col(SPECTRAL_ANGLE_KEY).quantile(TEST_METRIC_DECOY_QUANTILE, 'linear'),
+        pl.col(ENGINE_SCORE_KEY).quantile(TEST_METRIC_DECOY_QUANTILE, 'linear'),
+    ).row(0)
+    confident = (
+        (pl.col(SPECTRAL_ANGLE_KEY) > sa_cut_off) & (pl.col(ENGINE_SCORE_KEY) > es_cut_off)
+    ).fill_null(False)
+    return all_features_df.with_columns(
+        pl.when(is_target).then(pl.when(confident).then(1).otherwise(-1)).otherwise(0)
+            .cast(pl.Int64).alias('testMetric')
+    )
 
+def get_irt_coefficients(all_features_lf, config):
+    """ Function to get the coefficient converting seconds to iRT for each source.
 
-def convert_to_irt(all_features_df, config):
-    """ Function to convert deltaRT in seconds to iRT value.
+    Parameters
+    ----------
+    all_features_lf : pl.LazyFrame
+        The LazyFrame containing all features.
+    config : inspire.config.Config
+        The Config object for the experiment.
+
+    Returns
+    -------
+    irt_coeffs_df : pl.DataFrame
+        DataFrame of the iRT coefficient of each source.
     """
-    all_features_df[SOURCE_KEY] = all_features_df['specID'].apply(
-        lambda x : '_'.join(x.split('_')[:-2])
+    sources = all_features_lf.select(
+        _get_source(config.rescore_method).unique()
+    ).collect(streaming=True)[SOURCE_KEY].to_list()
+    fits_df = read_rt_calibrations(config.output_folder)
+    rt_scales = {} if fits_df is None else dict(
+        get_rt_scales(fits_df).select(SOURCE_KEY, COEFFICIENT_KEY).iter_rows()
     )
-    sources = all_features_df[SOURCE_KEY].unique().tolist()
     irt_coeffs = {}
-    for source in sources:
-        try:
-            irt_df = pd.read_csv(f'{config.output_folder}/rt_fit_{source}.csv')
-            irt_coeffs[source] = irt_df['coefficents'].mean()
-            if irt_coeffs[source] <= 0:
-                irt_coeffs[source] = 1.0
-        except FileNotFoundError:
-            print(f'No file found for {source}')
-            irt_coeffs[source] = 1.0
-
-    all_features_df['deltaRT'] = all_features_df[['deltaRT', 'source']].apply(
-        lambda df_row : abs(
-            df_row['deltaRT']/irt_coeffs.get(df_row['source'], 1.0)
-        ),
-        axis=1,
+    for source in sorted(sources):
+        if source not in rt_scales:
+            print(f'No retention time calibration found for {source}')
+        irt_coeffs[source] = rt_scales.get(source, 1.0)
+
+    return pl.DataFrame(
+        {
+            SOURCE_KEY: list(irt_coeffs.keys()),
+            IRT_COEFFICIENT_KEY: list(irt_coeffs.values()),
+        },
+        schema={SOURCE_KEY: pl.Utf8, IRT_COEFFICIENT_KEY: pl.Float64},
     )
-    return all_features_df
 
+def _get_source(rescore_method):
+    """ Function to get an expression for the source of each PSM from its PSM Id.
+    """
+    return pl.col(PSM_ID_KEY[rescore_method]).str.extract(
+        PSM_ID_PATTERN, 1
+    ).fill_null('').alias(SOURCE_KEY)
+
+def convert_to_irt(all_features_lf, irt_coeffs_df, rescore_method):
+    """ Function to convert deltaRT in seconds to iRT value.
+    """
+    return all_features_lf.with_columns(
+        _get_source(rescore_method)
+    ).join(
+        irt_coeffs_df.lazy(), how='left', on=SOURCE_KEY
+    ).with_columns(
+        (pl.col('deltaRT')/pl.col(IRT_COEFFICIENT_KEY).fill_null(1.0)).abs().alias('deltaRT')
+    ).drop(SOURCE_KEY, IRT_COEFFICIENT_KEY)
+
+def search_feature_set(all_features_lf, feature_set, config):
+    """ Function to reduce the feature set to the base features, accession features,
+        and the subset of the remaining candidates with the best PR-AUC.
+
+    Parameters
+    ----------
+    all_features_lf : pl.LazyFrame
+        The LazyFrame containing all features.
+    feature_set : list of str
+        The features available for rescoring.
+    config : inspire.config.Config
+        The Config object for the experiment.
+
+    Returns
+    -------
+    feature_set : list of str
+        The selected features.
+    """
+    fixed_features = [
+        feature for feature in feature_set
+        if feature in BASE_FEATURES or feature.startswith('accession_')
+    ]
+    candidates = [feature for feature in feature_set if feature not in fixed_features]
+    if not candidates or not all(feature in feature_set for feature in BASE_FEATURES):
+        return feature_set
+
+    print(
+        OKCYAN_TEXT +
+        f'\tRunning {config.feature_search} search over {len(candidates)} features.' +
+        ENDC_TEXT
+    )
+    fe_df = all_features_lf.select(
+        BASE_FEATURES + candidates + [LABEL_KEY]
+    ).collect(streaming=True)
+    feature_sets, pr_aucs = get_best_feature_set(
+        create_test_metric(fe_df),
+        candidates,
+        search_method=config.feature_search,
+        n_cores=config.n_cores,
+    )
+    best_features = feature_sets[int(np.argmax(pr_aucs))]
+    return [feature for feature in feature_set if feature in fixed_features + best_features]
 
 def select_features(config):
     """ Function to select the features used in the final percolator model.
@@ -318,13 +538,18 @@ def select_features(config):
     config : inspire.config.Config
         The Config object for the experiment.
     """
-    all_features_df = pd.read_csv(
-        f'{config.output_folder}/input_all_features.tab',
-        sep='\t'
-    )
+    # Columns are only read when a query selects them.
+    features_loc = f'{config.output_folder}/input_all_features.tab'
+    all_features_lf = pl.scan_csv(features_loc, separator='\t', infer_schema_length=None)
+    schema = all_features_lf.schema
+    all_columns = list(schema)
 
+    irt_coeffs_df = None
     if config.use_irt_diff:
-        all_features_df = convert_to_irt(all_features_df, config)
+        irt_coeffs_df = get_irt_coefficients(all_features_lf, config)
+        all_features_lf = convert_to_irt(
+            all_features_lf, irt_coeffs_df, config.rescore_method
+        )
 
     if config.minimal_features:
         feature_set = MINIMAL_FEATURE_SET
@@ -338,8 +563,7 @@ def select_features(config):
 
     if config.use_accession_stratum:
         feature_set += [
-            col for col in all_features_df.columns # pylint: disable=no-member
-            if col.startswith('accession_')
+            col for col in all_columns if col.startswith('accession_')
         ]
 
     if config.exclude_features is not None and config.exclude_features:
@@ -351,8 +575,7 @@ def select_features(config):
     elif config.include_features is not None:
         feature_set = list(set(feature_set + config.include_features))
         exclude_features = [
-            col for col in all_features_df.columns # pylint: disable=no-member
-            if col not in config.include_features
+            col for col in all_columns if col not in config.include_features
         ]
         if config.use_accession_stratum:
             exclude_features = [x for x in exclude_features if not x.startswith('accession')]
@@ -362,38 +585,61 @@ def select_features(config):
         )
 
     feature_set = remove_excluded_features(
-        feature_set, all_features_df, exclude_features
+        feature_set, all_features_lf, exclude_features
     )
 
-    write_final_feature_set(all_features_df, feature_set, config)
+    if config.feature_search is not None:
+        feature_set = search_feature_set(all_features_lf, feature_set, config)
+
+    write_final_feature_set(features_loc, schema, feature_set, config, irt_coeffs_df)
 
-def write_final_feature_set(all_features_df, feature_set, config):
+def write_final_feature_set(features_loc, schema, feature_set, config, irt_coeffs_df=None):
     """ Function to write the final selected features for Percolator input.
 
     Parameters
     ----------
-    all_features_df : pd.DataFrame
-        DataFrame containing all possible percolator input features.
+    features_loc : str
+        The location of the file containing all possible percolator input features.
+    schema : dict
+        The data type of every column in the features file.
     feature_set : list of str
         A list of the feature names to be used.
     config : inspire.config.Config
         The Config object
+    irt_coeffs_df : pl.DataFrame or None (default=None)
+        The iRT coefficient of each source if deltaRT is converted to iRT.
     """
     with open(f'{config.output_folder}/selectedFeatures.yaml', 'w', encoding='UTF-8') as file:
         yaml.dump(feature_set, file)
 
     prefix_keys = PREFIX_KEYS[config.rescore_method]
 
-    all_features_df[PEPTIDE_KEY] = '-.' +all_features_df[PEPTIDE_KEY].astype(str) + '.-'
-    all_features_df = all_features_df[
-        prefix_keys + feature_set + SUFFIX_KEYS[config.rescore_method]
-    ]
-
-    all_features_df.to_csv(
-        f'{config.output_folder}/final_input.tab',
-        sep='\t',
-        index=False
+    # The input is streamed through in batches rather than loaded in full.
+    final_columns = prefix_keys + feature_set + SUFFIX_KEYS[config.rescore_method]
+    reader = pl.read_csv_batched(
+        features_loc,
+        separator='\t',
+        columns=list(dict.fromkeys(final_columns)),
+        dtypes=schema,
+        batch_size=PIN_BATCH_SIZE,
     )
+    with open(f'{config.output_folder}/final_input.tab', 'w', encoding='UTF-8') as pin_file:
+        include_header = True
+        while (batches := reader.next_batches(1)) is not None:
+            batch_lf = batches[0].lazy()
+            if irt_coeffs_df is not None and 'deltaRT' in feature_set:
+                batch_lf = convert_to_irt(batch_lf, irt_coeffs_df, config.rescore_method)
+            batch_lf.select(final_columns).with_columns(
+                pl.concat_str([pl.lit('-.'), pl.col(PEPTIDE_KEY), pl.lit('.-')]).alias(
+                    PEPTIDE_KEY
+                )
+            ).collect().write_csv(pin_file, separator='\t', include_header=include_header)
+            include_header = False
+        if include_header:
+            pl.DataFrame(schema={col: schema[col] for col in final_columns}).write_csv(
+                pin_file, separator='\t',
+            )
+
     print(
         OKCYAN_TEXT +
         '\tFinal Feature Set Written.' +
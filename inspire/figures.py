@@ -5,6 +5,16 @@ from plotly.colors import n_colors
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+# Curves with more q-value cut offs than this are drawn without markers.
+MAX_MARKER_POINTS = 20
+VIOLIN_COLORS = {'Accepted': '#8FBC8F', 'Rejected': '#a52a2a'}
+VIOLIN_HALF_WIDTH = 0.4
+
+def _get_line_mode(fdrs_df):
+    """ Function to get the plotly mode of a q-value curve.
+    """
+    return 'lines+markers' if fdrs_df.shape[0] <= MAX_MARKER_POINTS else 'lines'
+
 
 def create_binders_fig(fdrs_df, search_engine):
     """ Function to create a plotly figure of percentage binders as predicted
@@ -27,7 +37,7 @@ def create_binders_fig(fdrs_df, search_engine):
         y=fdrs_df['SpirePercentageBinders'],
         name='inSPIRE Percentage Binders',
         line={'color': 'red'},
-        mode='lines+markers',
+        mode=_get_line_mode(fdrs_df),
         connectgaps=True,
     )
     trace2 = go.Scatter(
@@ -35,7 +45,7 @@ def create_binders_fig(fdrs_df, search_engine):
         y=fdrs_df['searchEnginePercentageBinders'],
         name='Original Percentage Binders',
         line={'color': 'black'},
-        mode='lines+markers',
+        mode=_get_line_mode(fdrs_df),
         connectgaps=True,
     )
 
@@ -79,7 +89,7 @@ def create_psms_fig(fdrs_df, output_folder):
         y=fdrs_df['nSpirePsms'],
         name='With inSPIRE',
         line={'color': 'red'},
-        mode='lines+markers',
+        mode=_get_line_mode(fdrs_df),
         connectgaps=True,
     )
     search_engine_trace = go.Scatter(
@@ -87,7 +97,7 @@ def create_psms_fig(fdrs_df, output_folder):
         y=fdrs_df['nSearchEnginePsms'],
         name='Without inSPIRE',
         line={'color': 'black'},
-        mode='lines+markers',
+        mode=_get_line_mode(fdrs_df),
         connectgaps=True,
     )
 
@@ -122,14 +132,55 @@ def create_psms_fig(fdrs_df, output_folder):
     return fig.to_html()
 
 
-def create_violin_fig(combined_df, most_positive_features, most_negative_features):
+def _add_violin(fig, summary, position, fillcolor, row, col):
+    """ Function to draw a violin from a precomputed density, with its mean and a
+        sample of outliers.
+    """
+    half_widths = VIOLIN_HALF_WIDTH*summary['density']/summary['density'].max()
+    fig.add_trace(
+        go.Scatter(
+            x=np.concatenate([position - half_widths, (position + half_widths)[::-1]]),
+            y=np.concatenate([summary['grid'], summary['grid'][::-1]]),
+            fill='toself',
+            fillcolor=fillcolor,
+            line={'color': 'black', 'width': 0.5},
+            mode='lines',
+            hoverinfo='skip',
+        ),
+        row=row,
+        col=col,
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=[position - VIOLIN_HALF_WIDTH, position + VIOLIN_HALF_WIDTH],
+            y=[summary['mean'], summary['mean']],
+            line={'color': 'black', 'width': 1},
+            mode='lines',
+        ),
+        row=row,
+        col=col,
+    )
+    if summary['points'].size:
+        fig.add_trace(
+            go.Scatter(
+                x=np.full(summary['points'].size, position),
+                y=summary['points'],
+                marker={'color': fillcolor, 'size': 2},
+                mode='markers',
+            ),
+            row=row,
+            col=col,
+        )
+
+def create_violin_fig(distributions, most_positive_features, most_negative_features):
     """ Function to create a plotly figure of violin plots of the distributions of
         key features above and below the 1% FDR cut off.
 
     Parameters
     ----------
-    combined_df : pd.DataFrame
-        A DataFrame of inSPIRE output with input features.
+    distributions : dict
+        The summaries of the accepted and rejected distribution of each feature, see
+        inspire.report.summarise_distribution.
     most_positive_features : list of str
         The most positively weighted features by percolator/mokapot.
     most_negative_features : list of str
@@ -150,37 +201,19 @@ def create_violin_fig(combined_df, most_positive_features, most_negative_feature
 
     for row_idx, feature_group in enumerate([most_positive_features, most_negative_features]):
         for idx, feature in enumerate(feature_group):
-            fig.add_trace(
-                go.Violin(
-                    x=combined_df[combined_df['Status'] == 'Accepted']['Status'],
-                    y=combined_df[combined_df['Status'] == 'Accepted'][feature],
-                    # color=combined_df['Status'],
-                    name='Accepted',
-                    fillcolor='#8FBC8F',
-                    line_color='black',
-                    line_width=0.5,
-                    marker_size=0.25,
-                    scalegroup=(row_idx*3) + idx,
-                    # box_visible=True,
-                    meanline_visible=True,
-                ),
-                row=row_idx+1,
-                col=idx+1,
-            )
-            fig.add_trace(
-                go.Violin(
-                    x=combined_df[combined_df['Status'] == 'Rejected']['Status'],
-                    y=combined_df[combined_df['Status'] == 'Rejected'][feature],
-                    fillcolor='#a52a2a',
-                    line_color='black',
-                    line_width=0.5,
-                    marker_size=0.25,
-                    # color=combined_df['Status'],
-                    name='Rejected',
-                    scalegroup=(row_idx*3) +idx,
-                    # box_visible=True,
-                    meanline_visible=True,
-                ),
+            for position, (status, fillcolor) in enumerate(VIOLIN_COLORS.items()):
+                if distributions[feature][status] is not None:
+                    _add_violin(
+                        fig,
+                        distributions[feature][status],
+                        position,
+                        fillcolor,
+                        row_idx+1,
+                        idx+1,
+                    )
+            fig.update_xaxes(
+                tickvals=list(range(len(VIOLIN_COLORS))),
+                ticktext=list(VIOLIN_COLORS),
                 row=row_idx+1,
                 col=idx+1,
             )
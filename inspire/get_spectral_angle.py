@@ -1,6 +1,5 @@
 """ Functions for simple pipeline to get spectral angle on of identified PSMs.
 """
-import pandas as pd
 import polars as pl
 
 from inspire.constants import(
@@ -8,20 +7,23 @@ from inspire.constants import(
     KNOWN_PTM_WEIGHTS,
     SCAN_KEY,
     SOURCE_KEY,
-    INTENSITIES_KEY,
-    MZS_KEY,
-    PEPTIDE_KEY,
-    PROSIT_INTES_KEY,
-    PROSIT_IONS_KEY,
-    PROSIT_SEQ_KEY,
-    PTM_SEQ_KEY,
     RT_KEY,
 )
 from inspire.input.msp import msp_to_df
 from inspire.input.ssl import ssl_file_to_inspire_format
 from inspire.predict_spectra import predict_spectra
-from inspire.spectral_features import calculate_spectral_features
-from inspire.utils import convert_mod_seq_to_ptm_seq, fetch_scan_data, filter_for_prosit
+from inspire.rt_alignment import (
+    get_rt_scales,
+    predict_retention_times,
+    read_rt_calibrations,
+    COEFFICIENT_KEY,
+)
+from inspire.spectral_features import score_spectra
+from inspire.utils import (
+    convert_mod_seq_to_ptm_seq,
+    fetch_scan_data,
+    filter_for_prosit,
+)
 
 def get_spectral_angle(config):
     """ Function to generate pair plots of selected PSMs (experimental vs. Prosit
@@ -87,49 +89,34 @@ def get_spectral_angle(config):
             ).alias('ptm_seq'),
         )
 
-        input_df = input_df.with_columns(
-            pl.struct([
-                CHARGE_KEY,
-                'collisionEnergy',
-                INTENSITIES_KEY,
-                MZS_KEY,
-                PEPTIDE_KEY,
-                PROSIT_INTES_KEY,
-                PROSIT_IONS_KEY,
-                PROSIT_SEQ_KEY,
-                PTM_SEQ_KEY,
-            ]).apply(lambda df_row : calculate_spectral_features(
-                df_row,
-                {
-                    0: 0.0,
-                    1: KNOWN_PTM_WEIGHTS['Oxidation (M)'],
-                    2: KNOWN_PTM_WEIGHTS['Carbamidomethylation'],
-                },
-                config.mz_accuracy,
-                config.mz_units,
-                None,
-                '1',
-                config.delta_method,
-                minimal_features=True,
-            )).alias('spectralResults')
+        input_df = score_spectra(
+            input_df,
+            {
+                0: 0.0,
+                1: KNOWN_PTM_WEIGHTS['Oxidation (M)'],
+                2: KNOWN_PTM_WEIGHTS['Carbamidomethylation'],
+            },
+            config.mz_accuracy,
+            config.mz_units,
+            config.n_cores,
         )
-        input_df = input_df.unnest('spectralResults')
         output_columns = ['spectralAngle', 'spearmanR']
 
         try:
-            sources = input_df['source'].unique().tolist()
-            for source in sources:
-                source_df = input_df[input_df['source'] == source]
-                source_rt_df = pd.read_csv(f'{config.output_folder}/rt_fit_{source}.csv')
-                intercept = source_rt_df['intercepts'].mean()
-                coefficient = source_rt_df['coefficents'].mean()
-                source_df['deltaRT'] = source_df[['source', 'retentionTime', 'iRT']].apply(
-                    lambda df_row, coef=coefficient, interc=intercept : abs(
-                        (df_row['retentionTime'] - (df_row['iRT']*coef)+interc)/coef
-                    ),
-                    axis=1,
-                )
-                output_columns.append('deltaRT')
+            fits_df = read_rt_calibrations(config.output_folder)
+            if fits_df is None:
+                raise ValueError(f'no calibration found in {config.output_folder}')
+            input_df = input_df.with_columns(
+                predict_retention_times(input_df, fits_df, cross_fit=False).alias('predRT')
+            ).join(
+                get_rt_scales(fits_df), how='left', on=SOURCE_KEY,
+            ).with_columns(
+                (
+                    (pl.col(RT_KEY) - pl.col('predRT')).abs() /
+                    pl.col(COEFFICIENT_KEY).fill_null(1.0)
+                ).alias('deltaRT')
+            )
+            output_columns.append('deltaRT')
         except Exception as e:
             print(f'Retention Time Prediction Comparison failed with error {e}')
 
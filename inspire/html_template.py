@@ -6,6 +6,19 @@ import webbrowser
 
 from inspire.constants import ENDC_TEXT, OKCYAN_TEXT
 
+def _get_weights_strata_note(figures):
+    """ Function to note that the weights of each accession stratum are shown when
+        strata are rescored separately.
+    """
+    if 'weights_strata' not in figures:
+        return ''
+    return '''
+            <p>
+                Each accession stratum was rescored with its own model, the weights of
+                every stratum are shown with features labelled by stratum.
+            </p>
+    '''
+
 def create_html_report(config, figures):
     """ Function to create the final html report and open it in the brower.
 
@@ -79,6 +92,7 @@ def create_html_report(config, figures):
                 is so strongly correlated to a more powerful feature like deltaScore which
                 has a strong positive coefficent.
             </p>
+    ''' + _get_weights_strata_note(figures) + '''
             <center>
     ''' + figures['table'] +
     '''
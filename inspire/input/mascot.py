@@ -1,7 +1,11 @@
 """ Functions for reading in Mascot search results.
 """
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import mmap
 import re
 
+import numpy as np
 import pandas as pd
 import polars as pl
 
@@ -28,11 +32,9 @@ from inspire.utils import filter_for_prosit
 MASCOT_HEADER_MARKER = 'Header'
 MASCOT_FILENAME_MARKER = 'Peak list data path'
 MASCOT_HITS_START_MARKER = 'prot_hit_num'
-MASCOT_NO_FIXED_MODS_MARKER = '""'
 MASCOT_QUERIES_START_MARKER = 'Queries'
 MASCOT_VAR_MODS_MARKER = 'Variable modifications'
 MASCOT_FIXED_MODS_MARKER = 'Fixed modifications'
-MASCOT_SEARCH_PARAMS_MARKER = 'Search Parameters'
 MASCOT_SCAN_FILE_NAME_LINE = 'Peak list data path'
 
 MASCOT_CHARGE_KEY = 'pep_exp_z'
@@ -59,103 +61,159 @@ REQUIRED_MASCOT_COLUMNS = [
     MASCOT_PTM_SEQ_KEY,
     MASCOT_SCAN_TITLE_KEY,
 ]
+# String columns are fixed so that inference on the first rows cannot misread them.
+MASCOT_DTYPES = {
+    MASCOT_ACCESSION_KEY: pl.Utf8,
+    MASCOT_DECOY_KEY: pl.Utf8,
+    MASCOT_PEPTIDE_KEY: pl.Utf8,
+    MASCOT_PTM_SEQ_KEY: pl.Utf8,
+    MASCOT_SCAN_TITLE_KEY: pl.Utf8,
+}
 MASCOT_QUERIES_TITLE_KEY = 'StringTitle'
 MASCOT_QUERIES_RT_KEY = 'Retention time range'
 MASCOT_QUERIES_INTENSITY_KEY = 'intensity'
+MASCOT_DECOY_REGEX = 'Reversed|random|Random'
 
-def _get_mascot_file_metadata(csv_file):
-    """ Function to extract metadata from a csv file of Mascot results.
+BLANK_LINE_REGEX = re.compile(rb'\n[ \t\r]*\n')
+
+def _find_table(mapped_file, start):
+    """ Function to find the end of a csv table within a Mascot export, tables are
+        terminated by a blank line or the end of the file.
 
     Parameters
     ----------
-    csv_file : str
-        The input address for a mascot search results file.
+    mapped_file : mmap.mmap
+        The memory mapped Mascot export.
+    start : int
+        The byte offset of the table header.
 
     Returns
     -------
-    header_line : int
-        The line number of the Header line.
-    output_filename : str
-        The name to be used for the output file of processing to ensure
-        it matches with the processed Peaks file.
-    hits_line : int
-        The line number where the data on peptide matches starts.
-    queries_line : int
-        The line number where the query data starts (including Retention
-        Time data).
+    table_range : tuple of int
+        The start and end byte offsets of the table.
     """
-    with open(csv_file, 'r', encoding='UTF-8') as open_file:
-        line_idx = 0
-        header_line = -1
-        hits_line = -1
-        queries_line = None
-        fixed_mods_line = None
-        var_mods_line = -1
-        search_params_line = -1
-        scan_filename = ''
-
-        while (line := open_file.readline()):
-            if header_line==-1 and MASCOT_HEADER_MARKER in line:
-                header_line = line_idx
-            if (
-                fixed_mods_line is None and
-                MASCOT_FIXED_MODS_MARKER in line and
-                MASCOT_NO_FIXED_MODS_MARKER not in line
-            ):
-                fixed_mods_line = line_idx
-            if var_mods_line == -1 and MASCOT_VAR_MODS_MARKER in line:
-                var_mods_line = line_idx
-            if MASCOT_SCAN_FILE_NAME_LINE in line:
-                scan_filename = line.split(',')[-1].strip('\n').strip('"')
-            if search_params_line == -1 and MASCOT_SEARCH_PARAMS_MARKER in line:
-                search_params_line = line_idx
-            if hits_line==-1 and MASCOT_HITS_START_MARKER in line:
-                hits_line = line_idx
-            if queries_line is None and MASCOT_QUERIES_START_MARKER in line:
-                queries_line = line_idx
-                break
-            line_idx += 1
-
-    mod_ranges = {}
-    mod_ranges['variable'] = range(var_mods_line+2, search_params_line-1)
-    if fixed_mods_line is not None:
-        mod_ranges['fixed'] = range(fixed_mods_line+2, var_mods_line-1)
-
-    return header_line, hits_line, queries_line, mod_ranges, scan_filename
-
-def _skip_logic(idx, start_idx=0, end_idx=None):
-    """ Simple function for identifying which lines to skip when reading a csv.
+    blank_line = BLANK_LINE_REGEX.search(mapped_file, start)
+    if blank_line is None:
+        return start, len(mapped_file)
+    return start, blank_line.start() + 1
+
+def _find_line(mapped_file, prefix, end):
+    """ Function to find the first line starting with a prefix before an offset.
 
     Parameters
     ----------
-    idx : int
-        A line number in a file.
-    start_idx : int
-        The line number at which csv data starts.
-    end_idx: int
-        The line number at which csv data ends.
+    mapped_file : mmap.mmap
+        The memory mapped Mascot export.
+    prefix : bytes
+        The start of the line.
+    end : int
+        The offset at which to stop searching.
 
     Returns
-    ------
-    skip_line : bool
-        A flag on whether to skip the line or not.
+    -------
+    offset : int
+        The byte offset of the line, -1 if not found.
     """
-    if end_idx is not None:
-        if start_idx <= idx < end_idx:
-            return False
-    else:
-        if idx >= start_idx:
-            return False
-    return True
+    if mapped_file[:len(prefix)] == prefix:
+        return 0
+    offset = mapped_file.find(b'\n' + prefix, 0, end)
+    return offset if offset == -1 else offset + 1
+
+def _find_section_table(mapped_file, section_name, end):
+    """ Function to find the csv table following a named section header, such as
+        "Variable modifications","------".
+
+    Parameters
+    ----------
+    mapped_file : mmap.mmap
+        The memory mapped Mascot export.
+    section_name : str
+        The name of the section.
+    end : int
+        The offset at which to stop searching.
 
-def separate_scan_and_source(df_row, scan_title_format, source_list=None, source_filename=None):
+    Returns
+    -------
+    table_range : tuple of int or None
+        The start and end byte offsets of the table, None if the section is not present.
+    """
+    section_start = _find_line(mapped_file, f'"{section_name}","-'.encode(), end)
+    if section_start == -1:
+        return None
+
+    start = mapped_file.find(b'\n', section_start)
+    if start == -1:
+        return None
+    while start < len(mapped_file) and mapped_file[start:start+1] in (b'\n', b'\r', b' '):
+        start += 1
+    return _find_table(mapped_file, start)
+
+def _get_mascot_sections(mapped_file):
+    """ Function to locate the sections of a Mascot export by byte offset. The
+        search parameters and modifications all precede the peptide hits.
+
+    Parameters
+    ----------
+    mapped_file : mmap.mmap
+        The memory mapped Mascot export.
+
+    Returns
+    -------
+    sections : dict
+        The byte ranges of the hits table and the variable and fixed modification
+        tables (if present).
+    scan_filename : str
+        The name of the peak list searched.
+    """
+    hits_start = _find_line(
+        mapped_file, f'{MASCOT_HITS_START_MARKER},'.encode(), len(mapped_file)
+    )
+    if hits_start == -1:
+        raise ValueError('No peptide hits found in Mascot search results.')
+
+    if mapped_file.find(MASCOT_HEADER_MARKER.encode(), 0, hits_start) == -1:
+        raise ValueError('No header line found in Mascot search results.')
+
+    sections = {
+        'hits': _find_table(mapped_file, hits_start),
+        'variable': _find_section_table(mapped_file, MASCOT_VAR_MODS_MARKER, hits_start),
+        'fixed': _find_section_table(mapped_file, MASCOT_FIXED_MODS_MARKER, hits_start),
+    }
+
+    scan_filename = ''
+    scan_file_start = _find_line(
+        mapped_file, f'{MASCOT_SCAN_FILE_NAME_LINE},'.encode(), hits_start
+    )
+    if scan_file_start != -1:
+        scan_file_line = mapped_file[
+            scan_file_start:mapped_file.find(b'\n', scan_file_start)
+        ].decode('UTF-8').rstrip('\r')
+        scan_filename = scan_file_line.split(',')[-1].strip('"')
+
+    return sections, scan_filename
+
+def _read_mods_table(mapped_file, table_range):
+    """ Function to read a table of modifications from a Mascot export.
+    """
+    mods_df = pd.read_csv(
+        BytesIO(mapped_file[table_range[0]:table_range[1]]),
+        usecols=range(4),
+    )
+    return mods_df
+
+def _strip_source_suffix(source):
+    """ Function to remove raw and mgf file endings from a source name expression.
+    """
+    return source.str.replace(r'\.(raw|mgf)$', '')
+
+def separate_scan_and_source(hits_df, scan_title_format, source_list=None, source_filename=None):
     """ Function to separate source file and scan number (as well as retention time if
         Distiller format used) from mascots scan_title_format column.
 
     Parameters
     ----------
-    df_row : pd.Series
-        A row of the mascot search results DataFrame.
+    hits_df : pl.DataFrame
+        The mascot search results DataFrame.
     scan_title_format : str or None
         The format of the scan title (see README for options).
     source_list : str or None
@@ -165,60 +223,78 @@ def separate_scan_and_source(df_row, scan_title_format, source_list=None, source
 
     Returns
     -------
-    df_row : pd.Series
-        The input row updated with new columns.
+    hits_df : pl.DataFrame
+        The input DataFrame updated with new columns.
     """
-    results = {}
-    scan_title = df_row[MASCOT_SCAN_TITLE_KEY]
+    scan_title = pl.col(MASCOT_SCAN_TITLE_KEY)
     if scan_title_format is None:
-        df_row[SCAN_KEY] = int(scan_title.split('=')[-1].strip('~'))
         if source_filename is None:
-            source = scan_title.split('File:')[-1]
-            if source.startswith('~'):
-                source = source.split('~')[1]
-            else:
-                source = source.split(', ')[0]
+            source = scan_title.str.split('File:').list.last()
+            source = pl.when(source.str.starts_with('~')).then(
+                source.str.split('~').list.get(1)
+            ).otherwise(
+                source.str.split(', ').list.first()
+            )
         else:
-            source = source_filename
-
-        if source.endswith('.raw') or source.endswith('.mgf'):
-            source = source[:-4]
-        results[SOURCE_KEY] = source
-
-    elif scan_title_format == 'mascotDistiller':
-        scan_rt_details = scan_title.split(' Scan ')[-1].split(' (rt')
-        results[SCAN_KEY] = int(scan_rt_details[0])
-        source_idx = int(scan_title.split(' from file [')[-1].strip(']'))
-        source_idx = int(scan_title.split(' from file [')[-1].strip(']'))
-        results[SOURCE_KEY] = source_list[source_idx]
-        results[RT_KEY] = float(scan_rt_details[-1][1:].split(')')[0])
-    elif scan_title_format == 'distiller':
-        split_name = scan_title.split(' (rt=')
-        results[SCAN_KEY] = int(split_name[0].split(' Scan ')[-1])
-        results[RT_KEY] = float(split_name[-1].split(')')[0])
-    else:
-        raise ValueError('Oops')
-    return results
-
-def _read_mascot_dfs(
-        csv_filename,
-        hits_line,
-        queries_line,
-        mods_range,
-        scan_file,
-    ):
-    hits_df = pd.read_csv(
-        csv_filename,
-        skiprows=lambda idx : _skip_logic(idx, hits_line, queries_line),
-        usecols=REQUIRED_MASCOT_COLUMNS
-    )
-    hits_df = pl.from_pandas(hits_df)
+            source = pl.lit(source_filename)
+        return hits_df.with_columns(
+            scan_title.str.split('=').list.last().str.strip_chars('~').cast(
+                pl.Int64
+            ).alias(SCAN_KEY),
+            _strip_source_suffix(source).alias(SOURCE_KEY),
+        )
 
-    mods_df = pd.read_csv(
-        csv_filename,
-        skiprows=lambda idx : idx not in mods_range['variable'],
-        usecols=range(4),
+    if scan_title_format == 'mascotDistiller':
+        scan_rt_details = scan_title.str.split(' Scan ').list.last().str.split(' (rt')
+        return hits_df.with_columns(
+            scan_rt_details.list.first().cast(pl.Int64).alias(SCAN_KEY),
+            scan_title.str.split(' from file [').list.last().str.strip_chars(']').cast(
+                pl.Int64
+            ).map_dict(dict(enumerate(source_list))).alias(SOURCE_KEY),
+            scan_rt_details.list.last().str.slice(1).str.split(')').list.first().cast(
+                pl.Float64
+            ).alias(RT_KEY),
+        )
+
+    if scan_title_format == 'distiller':
+        split_name = scan_title.str.split(' (rt=')
+        return hits_df.with_columns(
+            split_name.list.first().str.split(' Scan ').list.last().cast(
+                pl.Int64
+            ).alias(SCAN_KEY),
+            split_name.list.last().str.split(')').list.first().cast(pl.Float64).alias(RT_KEY),
+        )
+
+    raise ValueError(f'Unknown scan title format: {scan_title_format}')
+
+def _read_mascot_dfs(mapped_file, sections, scan_file):
+    """ Function to read the peptide hits and modifications of a memory mapped
+        Mascot export.
+
+    Parameters
+    ----------
+    mapped_file : mmap.mmap
+        The memory mapped Mascot export.
+    sections : dict
+        The byte ranges of each table in the file.
+    scan_file : str
+        The name of the peak list searched.
+
+    Returns
+    -------
+    hits_df : pl.DataFrame
+        The formatted peptide hits.
+    mods_df : pd.DataFrame
+        The variable and fixed modifications used in the search.
+    """
+    hits_start, hits_end = sections['hits']
+    hits_df = pl.read_csv(
+        mapped_file[hits_start:hits_end],
+        columns=REQUIRED_MASCOT_COLUMNS,
+        dtypes=MASCOT_DTYPES,
     )
+
+    mods_df = _read_mods_table(mapped_file, sections['variable'])
     mods_df[PTM_IS_VAR_KEY] = True
 
     # Rename to match inSPIRE naming scheme.
@@ -236,89 +312,108 @@ def _read_mascot_dfs(
     hits_df = hits_df.with_columns(
         (pl.col(MASCOT_MASS_KEY) - pl.col(MASCOT_PRED_MASS_KEY)).alias(MASS_DIFF_KEY),
         pl.col(PEPTIDE_KEY).str.lengths().alias(SEQ_LEN_KEY),
-        (pl.col(MASCOT_MASS_KEY)/pl.col(SEQ_LEN_KEY)).alias('avgResidueMass'),
-    )
-
-    hits_df = hits_df.drop([MASCOT_MASS_KEY, MASCOT_PRED_MASS_KEY])
-
-    hits_df = hits_df.with_columns(
-        pl.col(MASCOT_PEP_QUERY_KEY).apply(
-            lambda x : scan_file + str(x)
-        ).alias(MASCOT_PEP_QUERY_KEY),
-        pl.col(MASCOT_DECOY_KEY).apply(
-            lambda x : -1 if 'Reversed' in x or 'random' in x or 'Random' in x else 1
-        ).alias(LABEL_KEY)
+        (pl.col(MASCOT_MASS_KEY)/pl.col(PEPTIDE_KEY).str.lengths()).alias('avgResidueMass'),
+        pl.concat_str([
+            pl.lit(scan_file), pl.col(MASCOT_PEP_QUERY_KEY).cast(pl.Utf8)
+        ]).alias(MASCOT_PEP_QUERY_KEY),
+        pl.when(
+            pl.col(MASCOT_DECOY_KEY).str.contains(MASCOT_DECOY_REGEX)
+        ).then(-1).otherwise(1).cast(pl.Int64).alias(LABEL_KEY),
     )
 
-    hits_df = hits_df.drop([MASCOT_DECOY_KEY])
+    hits_df = hits_df.drop([MASCOT_MASS_KEY, MASCOT_PRED_MASS_KEY, MASCOT_DECOY_KEY])
 
     # Add fixed mods
-    if 'fixed' in mods_range:
-        fixed_mods_df = pd.read_csv(
-            csv_filename,
-            skiprows=lambda idx : idx not in mods_range['fixed'],
-            usecols=range(4)
-        )
-        fixed_mods_df[PTM_ID_KEY] = fixed_mods_df[PTM_ID_KEY] + mods_df.shape[0]
-        fixed_ptm_dict = {}
-        for mod_name, mod_id in zip(
-                fixed_mods_df[PTM_NAME_KEY].tolist(),
-                fixed_mods_df[PTM_ID_KEY].tolist()
-            ):
-            modified_residues = mod_name.split('(')[-1].split(')')[0]
-            fixed_ptm_dict[modified_residues] = mod_id
-
-        hits_df[PTM_SEQ_KEY] = hits_df[[PEPTIDE_KEY, PTM_SEQ_KEY]].apply(
-            lambda x : _add_fixed_mod(x[PEPTIDE_KEY], x[PTM_SEQ_KEY], fixed_ptm_dict),
-            axis=1
-        )
+    if sections['fixed'] is not None:
+        fixed_mods_df = _read_mods_table(mapped_file, sections['fixed'])
+        if fixed_mods_df.shape[0]:
+            fixed_mods_df[PTM_ID_KEY] = fixed_mods_df[PTM_ID_KEY] + mods_df.shape[0]
+            fixed_ptm_dict = {}
+            for mod_name, mod_id in zip(
+                    fixed_mods_df[PTM_NAME_KEY].tolist(),
+                    fixed_mods_df[PTM_ID_KEY].tolist()
+                ):
+                modified_residues = mod_name.split('(')[-1].split(')')[0]
+                fixed_ptm_dict[modified_residues] = mod_id
 
-        fixed_mods_df[PTM_IS_VAR_KEY] = False
+            hits_df = _add_fixed_mods(hits_df, fixed_ptm_dict)
 
-        mods_df = pd.concat([mods_df, fixed_mods_df])
+            fixed_mods_df[PTM_IS_VAR_KEY] = False
 
+            mods_df = pd.concat([mods_df, fixed_mods_df], ignore_index=True)
 
     return hits_df, mods_df
 
-def _add_fixed_mod(peptide, ptm_seq, fixed_ptm_dict):
+def _add_fixed_mods(hits_df, fixed_ptm_dict):
     """ Function to add fixed modifications to Mascot search results in the same style as
-        variable modifications.
+        variable modifications. The modification strings are processed as a single
+        character matrix of PSMs by positions.
 
     Parameters
     ----------
-    peptide : str
-        The peptide sequence.
-    ptm_seq : str
-        The sequence of variable modifications.
+    hits_df : pl.DataFrame
+        The Mascot search results.
     fixed_ptm_dict : dict
         A dictionary mapping fixed ptm residues to their ID.
 
     Returns
     -------
-    ptm_seq : str
-        The input ptm_seq updated with any relevant fixed modifications.
+    hits_df : pl.DataFrame
+        The input hits_df with ptm_seq updated with any relevant fixed modifications.
     """
-    for residues in fixed_ptm_dict:
+    n_psms = hits_df.shape[0]
+    if not n_psms:
+        return hits_df
+
+    seq_lens = hits_df[SEQ_LEN_KEY].to_numpy()
+    max_len = int(seq_lens.max())
+    width = max_len + 2
+    peptide_chars = np.array(
+        hits_df[PEPTIDE_KEY].to_list(), dtype=f'S{max_len}'
+    ).view('S1').reshape(n_psms, max_len)
+
+    # Rows hold the N-terminal mod, one mod per residue and the C-terminal mod.
+    mod_chars = np.full((n_psms, width), b'0', dtype='S1')
+    has_ptm_seq = hits_df[PTM_SEQ_KEY].is_not_null().to_numpy()
+    if has_ptm_seq.any():
+        var_mod_chars = np.array(
+            hits_df.filter(pl.col(PTM_SEQ_KEY).is_not_null()).select(
+                pl.col(PTM_SEQ_KEY).str.replace_all('.', '', literal=True)
+            ).to_series().to_list(),
+            dtype=f'S{width}',
+        ).view('S1').reshape(-1, width)
+        mod_chars[has_ptm_seq] = np.where(var_mod_chars == b'', b'0', var_mod_chars)
+
+    psm_idx = np.arange(n_psms)
+    fixed_mod_added = np.zeros(n_psms, dtype=bool)
+    for residues, mod_id in fixed_ptm_dict.items():
+        mod_id = str(mod_id).encode()
         if residues == 'N-term':
-            if not isinstance(ptm_seq, str):
-                ptm_seq = '0.' + ''.join(['0']*len(peptide)) + '.0'
-            ptm_seq = str(fixed_ptm_dict[residues]) + ptm_seq[1:]
+            mod_chars[:, 0] = mod_id
+            fixed_mod_added[:] = True
         elif residues == 'C-term':
-            if not isinstance(ptm_seq, str):
-                ptm_seq = '0.' + ''.join(['0']*len(peptide)) + '.0'
-            ptm_seq = ptm_seq[:-1] + str(fixed_ptm_dict[residues])
+            mod_chars[psm_idx, seq_lens + 1] = mod_id
+            fixed_mod_added[:] = True
         else:
-            for res in residues:
-                ptm_postns = [m.start() for m in re.finditer(res, peptide)]
-                if ptm_postns and not isinstance(ptm_seq, str):
-                    ptm_seq = '0.' + ''.join(['0']*len(peptide)) + '.0'
-                for pos in ptm_postns:
-                    ptm_seq = ptm_seq[:pos+2] + str(fixed_ptm_dict[residues]) + ptm_seq[pos+3:]
+            residue_mask = np.isin(peptide_chars, [res.encode() for res in residues])
+            mod_chars[:, 1:-1][residue_mask] = mod_id
+            fixed_mod_added |= residue_mask.any(axis=1)
+
+    # Blank positions beyond each peptide so that they are dropped on joining.
+    mod_chars[np.arange(width)[None, :] > (seq_lens + 1)[:, None]] = b''
+    ptm_seqs = pl.Series(
+        mod_chars.view(f'S{width}').ravel().astype(str)
+    ).str.replace(r'^(.)(.*)(.)$', '$1.$2.$3')
+
+    return hits_df.with_columns(
+        pl.when(pl.Series(has_ptm_seq | fixed_mod_added)).then(ptm_seqs).otherwise(
+            None
+        ).alias(PTM_SEQ_KEY)
+    )
 
-    return ptm_seq
-
-def read_single_mascot_data(input_filename, scan_title_format, variable_mods):
-    """ Function to read in mascot search results from a single file.
+def _read_single_mascot_file(input_filename, scan_title_format):
+    """ Function to read the search results and modifications of a Mascot export
+        without reference to other files.
 
     Parameters
     ----------
@@ -326,90 +421,86 @@ def read_single_mascot_data(input_filename, scan_title_format, variable_mods):
         A location of mascot search results.
     scan_title_format : str
         The format of mascot's pep_scan_title column.
-    source_list : list of str or None
-        A list of the source files used in the mascot search.
-    variable_mods : pd.DataFrame
-        The previously discovered variable modifications.
 
     Returns
     -------
-    hits_df : pd.DataFrame
+    hits_df : pl.DataFrame
         A DataFrame of all search results properly formatted for inSPIRE.
-    mods_dfs : pd.DataFrame
+    mods_df : pd.DataFrame
         A small DataFrame detailing the ptms found in the data.
     """
-    # Original File contains both peptide hits and queries, search file to find separators.
-    header_line, hits_line, queries_line, mod_ranges, scan_file = _get_mascot_file_metadata(
-        input_filename
-    )
-
-    if header_line == -1:
-        raise ValueError('No header line found in Mascot search results.')
-
-    # Read separate files as pandas dataframes.
-    hits_df, new_variable_mods = _read_mascot_dfs(
-        input_filename,
-        hits_line,
-        queries_line,
-        mod_ranges,
-        scan_file,
-    )
+    with open(input_filename, 'rb') as open_file:
+        with mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            sections, scan_file = _get_mascot_sections(mapped_file)
+            hits_df, mods_df = _read_mascot_dfs(mapped_file, sections, scan_file)
 
     if scan_title_format == 'distiller':
         hits_df = hits_df.with_columns(
-            pl.lit(scan_file.strip('.raw').strip('.mgf').strip('.temp')).alias(SOURCE_KEY)
+            pl.lit(re.sub(r'(\.raw|\.mgf|\.temp)+$', '', scan_file)).alias(SOURCE_KEY)
         )
 
+    return hits_df, mods_df
+
+def _harmonise_ptm_ids(hits_df, new_variable_mods, variable_mods):
+    """ Function to use the modification IDs of previously read Mascot results.
+
+    Parameters
+    ----------
+    hits_df : pl.DataFrame
+        The search results of the new file.
+    new_variable_mods : pd.DataFrame
+        The modifications of the new file.
+    variable_mods : pd.DataFrame or None
+        The previously discovered variable modifications.
+
+    Returns
+    -------
+    hits_df : pl.DataFrame
+        The search results with modification IDs updated.
+    mods_df : pd.DataFrame
+        The modifications to be used.
+    """
     if variable_mods is None or new_variable_mods.equals(variable_mods):
         return hits_df, new_variable_mods
 
-    new_variable_mods = new_variable_mods.rename(
-        columns={
-            PTM_ID_KEY: 'newId'
-        }
-    )[[PTM_NAME_KEY, 'newId']]
-    combo_df = pd.merge(
-        variable_mods,
-        new_variable_mods,
-        on=[PTM_NAME_KEY],
-        how='outer',
-    )
-    unmatched_df = combo_df[combo_df['newId'] != combo_df[PTM_ID_KEY]]
-    replacements = {str(k): str(v) for k, v in zip(
-        unmatched_df['newId'].tolist(), unmatched_df[PTM_ID_KEY].tolist()
-    )}
-    hits_df = hits_df.with_columns(
-        pl.col(PTM_SEQ_KEY).apply(
-            lambda x : _replace_ptm_id(x, replacements)
+    previous_ids = dict(zip(variable_mods[PTM_NAME_KEY], variable_mods[PTM_ID_KEY]))
+    replacements = {
+        str(new_id): str(previous_ids[mod_name]) for mod_name, new_id in zip(
+            new_variable_mods[PTM_NAME_KEY], new_variable_mods[PTM_ID_KEY]
+        ) if mod_name in previous_ids and previous_ids[mod_name] != new_id
+    }
+    if replacements:
+        replacement_table = str.maketrans(replacements)
+        hits_df = hits_df.with_columns(
+            pl.col(PTM_SEQ_KEY).map_dict({
+                ptm_seq: ptm_seq.translate(replacement_table)
+                for ptm_seq in hits_df[PTM_SEQ_KEY].drop_nulls().unique().to_list()
+            })
         )
-    )
 
     return hits_df, variable_mods
 
-def _replace_ptm_id(ptm_seq, replacements):
-    """ Function to replace certain ptm ids in the ptm seq.
+def read_single_mascot_data(input_filename, scan_title_format, variable_mods):
+    """ Function to read in mascot search results from a single file.
 
     Parameters
     ----------
-    ptm_seq : str or None
-        The PTM sequence for the PSM.
-    replacements : dict
-        The PTM IDs to be updated.
+    input_filename : str
+        A location of mascot search results.
+    scan_title_format : str
+        The format of mascot's pep_scan_title column.
+    variable_mods : pd.DataFrame
+        The previously discovered variable modifications.
 
     Returns
     -------
-    new_ptm_seq : str or None
-        The updated PTM sequence.
+    hits_df : pl.DataFrame
+        A DataFrame of all search results properly formatted for inSPIRE.
+    mods_dfs : pd.DataFrame
+        A small DataFrame detailing the ptms found in the data.
     """
-    if not isinstance(ptm_seq, str):
-        return ptm_seq
-    new_ptm_seq = ''
-    for char in ptm_seq:
-        if char in replacements:
-            new_ptm_seq += replacements[char]
-        else:
-            new_ptm_seq += char
-    return new_ptm_seq
+    hits_df, new_variable_mods = _read_single_mascot_file(input_filename, scan_title_format)
+    return _harmonise_ptm_ids(hits_df, new_variable_mods, variable_mods)
 
 def read_mascot_data(
         mascot_data,
@@ -418,6 +509,7 @@ def read_mascot_data(
         reduce,
         source_filename,
         with_accession=False,
+        n_cores=1,
     ):
     """ Function to read in mascot search results from one or more files.
 
@@ -431,6 +523,8 @@ def read_mascot_data(
         A list of the source files used in the mascot search.
     source_filename : str or None
         The name of the source file used in the search if available.
+    n_cores : int
+        The number of files to read in parallel.
 
     Returns
     -------
@@ -440,20 +534,23 @@ def read_mascot_data(
         A small DataFrame detailing the ptms found in the data.
     """
     if isinstance(mascot_data, list):
+        # File reading is done by polars and numpy, which release the GIL.
+        with ThreadPoolExecutor(max_workers=max(1, min(n_cores, len(mascot_data)))) as pool:
+            file_results = list(pool.map(
+                lambda input_filename : _read_single_mascot_file(
+                    input_filename, scan_title_format
+                ),
+                mascot_data,
+            ))
+
         hits_dfs = []
-        variable_mods_dfs = []
         variable_mods = None
-        for input_filename in mascot_data:
-            hits_df, variable_mods = read_single_mascot_data(
-                input_filename,
-                scan_title_format,
-                variable_mods,
+        for hits_df, new_variable_mods in file_results:
+            hits_df, variable_mods = _harmonise_ptm_ids(
+                hits_df, new_variable_mods, variable_mods
             )
             hits_dfs.append(hits_df)
-            variable_mods_dfs.append(variable_mods)
         hits_df = pl.concat(hits_dfs)
-        for i in range(len(variable_mods_dfs)-1):
-            assert variable_mods_dfs[i].equals(variable_mods_dfs[i+1])
     else:
         hits_df, variable_mods = read_single_mascot_data(
             mascot_data,
@@ -463,23 +560,16 @@ def read_mascot_data(
 
     if with_accession:
         hits_df = hits_df.with_columns(
-            pl.col(ACCESSION_KEY).apply(
-                lambda x : 1 if 'PSP' in x else 0
-            ).alias('PSP')
+            pl.col(ACCESSION_KEY).str.contains('PSP').cast(pl.Int64).alias('PSP')
         )
         hits_df = hits_df.sort(by='PSP')
         hits_df = hits_df.sort(by=LABEL_KEY, descending=True)
 
     hits_df = mascot_reduce_to_max(hits_df, reduce, with_accession)
 
-    hits_df = hits_df.with_columns(
-        pl.struct([MASCOT_SCAN_TITLE_KEY, SCAN_KEY]).apply(
-            lambda x : separate_scan_and_source(x, scan_title_format, source_list, source_filename),
-            skip_nulls=False,
-        ).alias('results')
-    ).unnest('results')
+    hits_df = separate_scan_and_source(hits_df, scan_title_format, source_list, source_filename)
     hits_df = hits_df.unique(
-        subset=[SOURCE_KEY, SCAN_KEY, PEPTIDE_KEY]
+        subset=[SOURCE_KEY, SCAN_KEY, PEPTIDE_KEY], keep='first', maintain_order=True,
     )
 
     hits_df = hits_df.with_columns(
@@ -513,13 +603,9 @@ def mascot_reduce_to_max(main_df, reduce, with_accession):
             by=[LABEL_KEY, ENGINE_SCORE_KEY, PEPTIDE_KEY], descending=True
         )
     if reduce:
-        main_df = main_df.with_columns(
-            pl.col(PEPTIDE_KEY).apply(
-                lambda x : x.replace('I', 'L').alias('ilSub')
-            )
+        main_df = main_df.unique(
+            subset=[MASCOT_PEP_QUERY_KEY], keep='first', maintain_order=True,
         )
-        main_df = main_df.unique(subset=[MASCOT_PEP_QUERY_KEY, 'ilSub'])
-        main_df = main_df.drop('ilSub')
 
     main_df = main_df.with_columns(
         pl.lit(0).alias(DELTA_SCORE_KEY)
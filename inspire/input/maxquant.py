@@ -81,6 +81,11 @@ MQ_RELEVANT_COLS = [
     MQ_RT_KEY,
 ]
 
+MQ_ROW_KEY = 'mqRow'
+
+# Matches a bracketed modification, allowing one level of nested brackets,
+# e.g. (ox) or (Oxidation (M)).
+MQ_MOD_REGEX = r'\((?:[^()]|\([^()]*\))*\)'
 
 def _create_mq_mods_df(mq_df):
     """ Helper function to create a DataFrame of the unique modifications found in
@@ -88,7 +93,7 @@ def _create_mq_mods_df(mq_df):
 
     Parameters
     ----------
-    mq_df : pd.DataFrame
+    mq_df : pl.DataFrame
         A DataFrame of MaxQuant search results.
 
     Returns
@@ -96,95 +101,114 @@ def _create_mq_mods_df(mq_df):
     mods_df : pd.DataFrame
         A small DataFrame containing the unique modifications found.
     """
-    unique_mods = mq_df[MQ_MODS_KEY].apply(
-        lambda x : x.split(',')
-    ).explode().unique().to_list()
+    unique_mods = mq_df.select(
+        pl.col(MQ_MODS_KEY).str.split(',').explode().str.replace(r'^. ', '').unique()
+    ).to_series().drop_nulls().to_list()
 
-    unique_mods = list({x if x[1] != ' ' else x[2:] for x in unique_mods})
     unique_mods.remove('Unmodified')
     mods_df = pd.DataFrame({
-        PTM_NAME_KEY: pd.Series(unique_mods),
-        PTM_WEIGHT_KEY: pd.Series([KNOWN_PTM_WEIGHTS.get(mod, 0.0) for mod in unique_mods]),
+        PTM_NAME_KEY: pd.Series(unique_mods, dtype=str),
+        PTM_WEIGHT_KEY: pd.Series(
+            [KNOWN_PTM_WEIGHTS.get(mod, 0.0) for mod in unique_mods], dtype=float
+        ),
     })
     mods_df = mods_df.sort_values(by=PTM_NAME_KEY)
     mods_df.reset_index(drop=True, inplace=True)
     mods_df[PTM_ID_KEY] = mods_df[PTM_NAME_KEY].apply(
         lambda x : ID_NUMBERS.get(x, 9)
     )
-    mods_df = mods_df.sort_values(by=PTM_ID_KEY).reset_index(drop=True)
+    mods_df = mods_df.sort_values(by=PTM_ID_KEY, kind='stable').reset_index(drop=True)
     mods_df[PTM_IS_VAR_KEY] = True
     return mods_df
 
-def _create_ptm_seq_col(modified_seq, unqiue_mods):
-    """ Helper function to take MaxQuant modified peptide and return
-        the sequence representing the ptms.
+def _get_mq_mod_id(mod_token, unique_mods):
+    """ Helper function to find the ID of a bracketed MaxQuant modification, which may
+        be either the full modification name or its abbreviation.
+
+    Parameters
+    ----------
+    mod_token : str
+        The modification in brackets, e.g. (ox) or (Oxidation (M)).
+    unique_mods : dict
+        A dictionary mapping ptm names to integer ids.
+
+    Returns
+    -------
+    mod_id : str
+        The ID of the modification.
+    """
+    mod = mod_token[1:-1]
+    if not mod[0].isupper():
+        mod = MQ_ABBREVIATIONS.get(mod, 'unknown')
+    return str(unique_mods.get(mod, 9))
+
+def _create_ptm_seq_col(mq_df, unique_mods):
+    """ Helper function to create the column of ptm sequences from MaxQuant modified
+        sequences, e.g. _(ac)AM(ox)L_ becomes 3.020.0
 
     Parameters
     ----------
-    modified_seq : str
-        A modified peptide sequence in MaxQuant format.
-    unqiue_mods : dict
+    mq_df : pl.DataFrame
+        A DataFrame of MaxQuant search results.
+    unique_mods : dict
         A dictionary mapping ptm names to integer ids.
 
     Returns
     -------
-    ptm_seq : str
-        The ptm sequence by ID.
+    mq_df : pl.DataFrame
+        The input DataFrame with the ptm_seq column added.
     """
-    ptm_seq = ''
-    if '(' not in modified_seq:
-        return None
-    split_seq = modified_seq.split('_')
-    if split_seq[0]:
-        ptm_seq += f'{unqiue_mods[split_seq[0]]}.'
-        main_seq = split_seq[1]
-    elif split_seq[1].startswith('('):
-        if split_seq[2].isupper():
-            main_seq = split_seq[1]
-            main_seq = main_seq[1:]
-            end_mod = main_seq.index(')') + 1
-            mod = main_seq[:end_mod]
-            main_seq = main_seq[end_mod + 1:]
-            ptm_seq += f'{str(unqiue_mods.get(mod, 9))}.'
-        else:
-            main_seq = split_seq[1]
-            main_seq = main_seq[1:]
-            end_mod = main_seq.index(')')
-            mod = main_seq[:end_mod]
-            main_seq = main_seq[end_mod + 1:]
-            ptm_seq += f'{str(unqiue_mods.get(MQ_ABBREVIATIONS.get(mod, "unknown"), 9))}.'
-    else:
-        ptm_seq += '0.'
-        main_seq = split_seq[1]
-    while main_seq:
-        assert main_seq[0] != '('
-        if len(main_seq) == 1:
-            ptm_seq += '0'
-            break
-
-        if main_seq[1] != '(':
-            ptm_seq += '0'
-            main_seq = main_seq[1:]
-        else:
-            if main_seq[2].isupper():
-                main_seq = main_seq[2:]
-                end_mod = main_seq.index(')') + 1
-                mod = main_seq[:end_mod]
-                main_seq = main_seq[end_mod + 1:]
-                ptm_seq += str(unqiue_mods.get(mod, 9))
-            else:
-                main_seq = main_seq[2:]
-                end_mod = main_seq.index(')')
-                mod = main_seq[:end_mod]
-                main_seq = main_seq[end_mod + 1:]
-                ptm_seq += str(unqiue_mods.get(MQ_ABBREVIATIONS.get(mod, 'unknown'), 9))
-
-    if split_seq[2]:
-        ptm_seq += f'.{unqiue_mods.get(split_seq[2], 9)}'
-    else:
-        ptm_seq += '.0'
-
-    return ptm_seq
+    mod_seq = pl.col(MQ_MOD_SEQ_KEY)
+    modified_df = mq_df.with_row_count(MQ_ROW_KEY).filter(
+        mod_seq.str.contains('(', literal=True)
+    )
+    mod_ids = {
+        mod_token: _get_mq_mod_id(mod_token, unique_mods)
+        for mod_token in modified_df.select(
+            mod_seq.str.extract_all(MQ_MOD_REGEX).explode().unique()
+        ).to_series().drop_nulls().to_list()
+    }
+
+    # Modified sequences have the form N-termMod_(N-termMod)residue(residueMod)..._C-termMod
+    sequence_parts = mod_seq.str.split('_')
+    n_term_mod = sequence_parts.list.first()
+    c_term_mod = sequence_parts.list.last()
+    residue_mod_ids = sequence_parts.list.get(1)
+    n_term_mod = pl.when(n_term_mod.eq('')).then(
+        residue_mod_ids.str.extract(r'^(' + MQ_MOD_REGEX + ')').map_dict(
+            mod_ids, default=pl.lit('0')
+        )
+    ).otherwise(
+        n_term_mod.map_dict(unique_mods, default=pl.lit(9)).cast(pl.Utf8)
+    )
+
+    # Each modified residue is replaced by the modification ID, e.g. AM(ox)L -> AM#2L -> A2L,
+    # and then each unmodified residue by 0.
+    residue_mod_ids = residue_mod_ids.str.replace(r'^' + MQ_MOD_REGEX, '')
+    for mod_token in sorted(mod_ids, key=len, reverse=True):
+        residue_mod_ids = residue_mod_ids.str.replace_all(
+            mod_token, f'#{mod_ids[mod_token]}', literal=True
+        )
+    residue_mod_ids = residue_mod_ids.str.replace_all(r'[A-Z]#', '').str.replace_all(
+        r'[A-Z]', '0'
+    )
+
+    # Unmodified peptides have no ptm_seq.
+    modified_df = modified_df.select(
+        MQ_ROW_KEY,
+        pl.concat_str([
+            n_term_mod,
+            pl.lit('.'),
+            residue_mod_ids,
+            pl.lit('.'),
+            pl.when(c_term_mod.eq('')).then(pl.lit('0')).otherwise(
+                c_term_mod.map_dict(unique_mods, default=pl.lit(9)).cast(pl.Utf8)
+            ),
+        ]).alias(PTM_SEQ_KEY),
+    )
+    return mq_df.with_row_count(MQ_ROW_KEY).join(
+        modified_df, how='left', on=MQ_ROW_KEY
+    ).drop(MQ_ROW_KEY)
 
 def read_single_mq_data(mq_data):
     """ Function to read in MaxQuant search results from a single file.
@@ -196,7 +220,7 @@ def read_single_mq_data(mq_data):
 
     Returns
     -------
-    hits_df : pd.DataFrame
+    hits_df : pl.DataFrame
         A DataFrame of all search results properly formatted for inSPIRE.
     mods_dfs : pd.DataFrame
         A small DataFrame detailing the ptms found in the data.
@@ -210,11 +234,7 @@ def read_single_mq_data(mq_data):
     # Separate PTMs.
     mods_df = _create_mq_mods_df(mq_df)
     var_mod_dict = dict(zip(mods_df[PTM_NAME_KEY].tolist(), mods_df[PTM_ID_KEY].tolist()))
-    mq_df = mq_df.with_columns(
-        pl.col(MQ_MOD_SEQ_KEY).apply(
-            lambda x : _create_ptm_seq_col(x, var_mod_dict)
-        ).alias(PTM_SEQ_KEY)
-    )
+    mq_df = _create_ptm_seq_col(mq_df, var_mod_dict)
 
     # Rename to match inSPIRE naming scheme.
     mq_df = mq_df.rename({
@@ -233,36 +253,16 @@ def read_single_mq_data(mq_data):
     # Filter for Prosit, clean up accession data, and add label.
     mq_df = filter_for_prosit(mq_df)
 
+    is_decoy = pl.col(MQ_DECOY_KEY).eq('+').fill_null(False)
     mq_df = mq_df.with_columns(
-        pl.struct([MQ_ACCESSION_KEY, MQ_DECOY_KEY]).apply(
-            lambda x : 'reverseSeq' if x[MQ_DECOY_KEY] == '+' else (
-                x[MQ_ACCESSION_KEY] if x[MQ_ACCESSION_KEY] else 'unknown'
-            ),
-            skip_nulls=False,
-        ).alias(ACCESSION_KEY)
-    )
-
-    mq_df = mq_df.with_columns(
-        (pl.col(PEPTIDE_KEY).count()).over([SOURCE_KEY, SCAN_KEY]).alias('scanCounts')
-    )
-    mq_df = mq_df.with_columns(
-        pl.col('scanCounts').gt(1).cast(int).alias('fromChimera'),
-        skip_nulls=False,
-    )
-
-    mq_df = mq_df.with_columns(
-        pl.struct([MQ_MASS_KEY, SEQ_LEN_KEY])
-        .apply(
-            lambda x : x[MQ_MASS_KEY]/x[SEQ_LEN_KEY],
-            skip_nulls=False,
-        ).alias('avgResidueMass')
-    )
-    mq_df = mq_df.with_columns(
-        pl.col(MQ_DECOY_KEY)
-        .apply(
-            lambda x : -1 if x == '+' else 1,
-            skip_nulls=False,
-        ).alias(LABEL_KEY)
+        pl.when(is_decoy).then(pl.lit('reverseSeq')).otherwise(
+            pl.col(MQ_ACCESSION_KEY).fill_null('unknown')
+        ).alias(ACCESSION_KEY),
+        pl.col(PEPTIDE_KEY).count().over([SOURCE_KEY, SCAN_KEY]).gt(1).cast(
+            pl.Int64
+        ).alias('fromChimera'),
+        (pl.col(MQ_MASS_KEY)/pl.col(SEQ_LEN_KEY)).alias('avgResidueMass'),
+        pl.when(is_decoy).then(-1).otherwise(1).cast(pl.Int64).alias(LABEL_KEY),
     )
 
     mq_df = mq_df.drop([
@@ -271,7 +271,6 @@ def read_single_mq_data(mq_data):
         MQ_DECOY_KEY,
         MQ_MASS_KEY,
         MQ_MODS_KEY,
-        'scanCounts',
     ])
 
     return mq_df, mods_df
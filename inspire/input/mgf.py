@@ -14,7 +14,9 @@ from inspire.constants import (
     SCAN_KEY,
     SOURCE_KEY,
 )
+from inspire.profiling import profile_function
 
+@profile_function
 def process_mgf_file(
         mgf_filename,
         scan_ids,
@@ -1,12 +1,11 @@
 """ Functions for reading in MSFragger search results.
 """
 import multiprocessing
-import os
 from pathlib import Path
 
+from lxml import etree
 import polars as pl
 import pandas as pd
-from pyteomics import pepxml
 
 from inspire.constants import (
     ACCESSION_KEY,
@@ -76,50 +75,231 @@ MSF_MAPPING_PEP_XML_REV = {
     item: key for key, item in MSF_MAPPING_PEP_XML.items()
 }
 
-def _extract_psm_id_data(spec_id):
-    """ Function to extract data from the PSM ID column to standard inSPIRE format.
+MSF_SPEC_ID_KEY = 'SpecId'
+MSF_MOD_PEP_KEY = 'modified_peptide'
+MSF_CALC_MASS_KEY = 'calc_neutral_pep_mass'
+MSF_MASS_DIFF_KEY = 'massdiff'
+
+# Columns built while streaming through a pepXML file, one entry per search hit.
+PEPXML_SCHEMA = {
+    MSF_SPEC_ID_KEY: pl.Utf8,
+    CHARGE_KEY: pl.Int64,
+    MSF_RT_KEY: pl.Float64,
+    PEPTIDE_KEY: pl.Utf8,
+    MSF_MOD_PEP_KEY: pl.Utf8,
+    ACCESSION_KEY: pl.Utf8,
+    LABEL_KEY: pl.Int64,
+    MSF_SCORE_KEY: pl.Float64,
+    MSF_DELTA_KEY: pl.Float64,
+    MSF_MASS_DIFF_KEY: pl.Float64,
+    MSF_CALC_MASS_KEY: pl.Float64,
+}
+
+# Number of search hits held as Python objects before conversion to a DataFrame.
+PEPXML_CHUNK_SIZE = 500_000
+
+def _get_source_name(df_loc):
+    """ Function to get the name of the raw file searched from a pepXML file name.
+
+    Parameters
+    ----------
+    df_loc : str
+        Location of the pepXML file.
+
+    Returns
+    -------
+    source_name : str
+        The source name written in the pepXML file.
+    """
+    source_name = Path(df_loc).name
+    if source_name.endswith('_uncalibrated.pepXML'):
+        return source_name[:-20]
+    if source_name.endswith('_calibrated.pepXML'):
+        return source_name[:-18]
+    if source_name.endswith('.pepXML'):
+        return source_name[:-7]
+    return source_name
+
+def _safe_float(value):
+    """ Function to convert a pepXML attribute to float, treating MSFragger's +-0
+        notation as zero.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        if value.startswith('+-0'):
+            return 0.0
+        raise
+
+def _get_modified_peptide(peptide, mod_info, mod_masses):
+    """ Function to get the modified peptide of a search hit and record the rounded
+        masses of all modifications found.
 
     Parameters
     ----------
-    spec_id : str
-        The spectrum ID from MSFragger pepXML output.
+    peptide : str
+        The unmodified peptide sequence.
+    mod_info : lxml.etree.Element or None
+        The modification_info element of the search hit.
+    mod_masses : set of int
+        The rounded masses of all modifications found, updated in place.
 
     Returns
     -------
-    results : dict
-        Dictionary of the scan, source and reported charge of the peptide.
+    modified_peptide : str
+        The peptide with residue modifications written as X[mass].
     """
-    results = {}
-    spec_id_data = spec_id.split('.')
-    results[SOURCE_KEY] = spec_id_data[0]
-    results[SCAN_KEY] = int(spec_id_data[1])
-    results[f'alt_{CHARGE_KEY}'] = int(spec_id_data[-1].split('_')[0])
-    return results
+    if mod_info is None:
+        return peptide
+
+    for term_key in ('mod_nterm_mass', 'mod_cterm_mass'):
+        if (term_mass := mod_info.get(term_key)) is not None:
+            mod_masses.add(round(float(term_mass)))
+
+    residue_mods = []
+    for mod_element in mod_info:
+        if (
+            mod_element.tag.endswith('mod_aminoacid_mass') and
+            (mod_mass := mod_element.get('mass')) is not None
+        ):
+            mod_masses.add(round(float(mod_mass)))
+            residue_mods.append((int(mod_element.get('position')), float(mod_mass)))
+
+    modified_peptide = mod_info.get(MSF_MOD_PEP_KEY)
+    if modified_peptide is not None and modified_peptide != peptide:
+        return modified_peptide
+
+    # Without a modified_peptide the residue modifications are inserted by position.
+    modified_peptide = peptide
+    for position, mod_mass in sorted(residue_mods, reverse=True):
+        if 0 < position <= len(peptide):
+            modified_peptide = (
+                f'{modified_peptide[:position]}[{int(mod_mass)}]{modified_peptide[position:]}'
+            )
+    return modified_peptide
 
-def _extract_mod_weight(code):
-    """ Function to extract the weight of a modification.
+def _add_spectrum_query(spectrum_query, columns, mod_masses):
+    """ Function to add the search hits of a single spectrum_query element to
+        the column lists, keeping the best ranked hit for each distinct peptide.
 
     Parameters
     ----------
-    code : dict
-        Dictionary describing a modification.
+    spectrum_query : lxml.etree.Element
+        The spectrum_query element.
+    columns : dict
+        Dictionary of lists for each column in PEPXML_SCHEMA.
+    mod_masses : set of int
+        The rounded masses of all modifications found, updated in place.
 
     Returns
     -------
-    mass : int or None
+    n_hits : int
+        The number of hits added.
     """
-    if code['mass'] is not None:
-        return round(code['mass'])
-    return None
+    search_hits = sorted(
+        (search_hit for search_result in spectrum_query for search_hit in search_result),
+        key=lambda hit : int(hit.get('hit_rank', 1)),
+    )
+    peps_added = set()
+    hits_to_add = []
+    for search_hit in search_hits:
+        peptide = search_hit.get('peptide')
+        if peptide in peps_added:
+            continue
+        peps_added.add(peptide)
+
+        # Children are visited directly as tag searches are slow on large files.
+        hit_data = {'score': None, 'proteins': [search_hit.get('protein')], 'modInfo': None}
+        for child in search_hit:
+            if child.tag.endswith('search_score'):
+                if child.get('name') == MSF_SCORE_KEY:
+                    hit_data['score'] = float(child.get('value'))
+            elif child.tag.endswith('alternative_protein'):
+                hit_data['proteins'].append(child.get('protein'))
+            elif child.tag.endswith('modification_info'):
+                hit_data['modInfo'] = child
+        hits_to_add.append((peptide, search_hit, hit_data))
+
+    if not hits_to_add:
+        return 0
+
+    rank_2_score = hits_to_add[1][2]['score'] if len(hits_to_add) > 1 else 0
+    spec_id = spectrum_query.get('spectrum')
+    charge = int(spectrum_query.get('assumed_charge'))
+    retention_time = _safe_float(spectrum_query.get('retention_time_sec'))
+    for peptide, search_hit, hit_data in hits_to_add:
+        score = hit_data['score']
+        columns[MSF_SPEC_ID_KEY].append(spec_id)
+        columns[CHARGE_KEY].append(charge)
+        columns[MSF_RT_KEY].append(retention_time)
+        columns[PEPTIDE_KEY].append(peptide)
+        columns[MSF_MOD_PEP_KEY].append(
+            _get_modified_peptide(peptide, hit_data['modInfo'], mod_masses)
+        )
+        columns[ACCESSION_KEY].append(','.join(hit_data['proteins']))
+        columns[LABEL_KEY].append(
+            1 if any(not protein.startswith('rev') for protein in hit_data['proteins'])
+            else -1
+        )
+        columns[MSF_SCORE_KEY].append(score)
+        columns[MSF_DELTA_KEY].append(None if score is None else score - rank_2_score)
+        columns[MSF_MASS_DIFF_KEY].append(_safe_float(search_hit.get(MSF_MASS_DIFF_KEY)))
+        columns[MSF_CALC_MASS_KEY].append(float(search_hit.get(MSF_CALC_MASS_KEY)))
+
+    return len(hits_to_add)
+
+def _stream_pepxml(df_loc, chunk_size=PEPXML_CHUNK_SIZE):
+    """ Function to stream through a pepXML file, building the search hits directly
+        as columns. Parsed elements are cleared so memory does not grow with file size.
 
+    Parameters
+    ----------
+    df_loc : str
+        Location of the pepXML file.
+    chunk_size : int
+        The number of hits collected before conversion to a DataFrame.
 
-def _get_msf_mods_pepxml(msf_df, fixed_modifications):
+    Returns
+    -------
+    msf_df : pl.DataFrame
+        The search hits, with columns as in PEPXML_SCHEMA.
+    mod_masses : set of int
+        The rounded masses of all modifications found.
+    """
+    mod_masses = set()
+    chunk_dfs = []
+    columns = {column: [] for column in PEPXML_SCHEMA}
+    n_hits = 0
+
+    for _, spectrum_query in etree.iterparse(
+        df_loc,
+        events=('end',),
+        tag='{*}spectrum_query',
+        huge_tree=True,
+        remove_comments=True,
+        remove_pis=True,
+    ):
+        n_hits += _add_spectrum_query(spectrum_query, columns, mod_masses)
+
+        spectrum_query.clear()
+        while spectrum_query.getprevious() is not None:
+            del spectrum_query.getparent()[0]
+
+        if n_hits >= chunk_size:
+            chunk_dfs.append(pl.DataFrame(columns, schema=PEPXML_SCHEMA))
+            columns = {column: [] for column in PEPXML_SCHEMA}
+            n_hits = 0
+
+    chunk_dfs.append(pl.DataFrame(columns, schema=PEPXML_SCHEMA))
+    return pl.concat(chunk_dfs, rechunk=True), mod_masses
+
+def _get_msf_mods_pepxml(mod_masses, fixed_modifications):
     """ Function to get the modifications based on the MS fragger pepXML columns.
 
     Parameters
     ----------
-    msf_df : pd.DataFrame
-        MSFragger results read in from pepXML format.
+    mod_masses : set of int
+        The rounded masses of all modifications found in the data.
     fixed_modifications : list of str or None
         A list of the fixed modification used in the exeriment.
 
@@ -130,17 +310,7 @@ def _get_msf_mods_pepxml(msf_df, fixed_modifications):
     msf_name_to_id : dict
         A dictionary mapping names of modifications in MSFragger to inSPIRE IDs.
     """
-    if 'modifications' not in msf_df.columns:
-        return pd.DataFrame(), {}
-
-    msf_mods = sorted(
-        msf_df['modifications'].explode().apply(
-            _extract_mod_weight,
-            skip_nulls=False,
-        ).drop_nulls().unique().to_list()
-    )
-    msf_mods = [str(int(x)) for x in msf_mods if int(x) != -1]
-
+    msf_mods = [str(msf_mod) for msf_mod in sorted(mod_masses) if msf_mod != -1]
     mod_names = [MSF_MAPPING_PEP_XML.get(msf_mod, 'unknown') for msf_mod in msf_mods]
     mod_weights = [KNOWN_PTM_WEIGHTS.get(mod, 100) for mod in mod_names]
 
@@ -162,239 +332,164 @@ def _get_msf_mods_pepxml(msf_df, fixed_modifications):
     ))
     return mod_df, msf_name_to_id
 
-def _separate_msf_ptms(mod_pep, ms_frag_mappings):
-    """ Function to separate MSFragger reported PTMs.
+def _create_msf_ptm_seq_col(msf_df, msf_name_to_id):
+    """ Function to separate MSFragger reported PTMs into the inSPIRE ptm_seq,
+        e.g. n[43]AM[147]L -> 3.020.0.
 
     Parameters
     ----------
-    df_row : pd.Series
-        Row of MSFragger results DataFrame
-    ms_frag_mappings : dict
+    msf_df : pl.DataFrame
+        MSFragger search hits with the modified_peptide column.
+    msf_name_to_id : dict
         Dictionary mapping PTM weights to their inSPIRE ID.
 
     Returns
     -------
-    df_row : pd.Series
-        The input row with peptide sequence and modifications separated.
+    msf_df : pl.DataFrame
+        The input DataFrame with the ptm_seq column added.
     """
-    peptide = mod_pep
-    start_mod = '0'
-    if peptide[0:5] == 'n[43]':
-        start_mod = '3'
-        peptide = peptide[5:]
-    if '[' in peptide:
-        pep_seq = ''
-        ptm_seq = ''
-        while peptide:
-            assert peptide[0] != '['
-            if len(peptide) == 1:
-                pep_seq += peptide[0]
-                ptm_seq += '0'
-                break
-
-            if peptide[1] != '[':
-                pep_seq += peptide[0]
-                ptm_seq += '0'
-                peptide = peptide[1:]
-            else:
-                pep_seq += peptide[0]
-                peptide = peptide[1:]
-
-                end_mod_str = peptide.index(']') + 1
-                ptm_seq += ms_frag_mappings[peptide[1:end_mod_str-1]]
-                peptide = peptide[end_mod_str:]
-
-        return f'{start_mod}.{ptm_seq}.0'
-    if start_mod == '3':
-        return f'{start_mod}.{"0"*len(peptide)}.0'
-    return None
-
-def flatten_protein_data(proteins):
-    """ Function to extract protein accession data from pepXML dictionary.
-
-    Parameters
-    ----------
-    proteins : pd.Series
-        The pepXML protein data for a single hit.
-
-    Returns
-    -------
-    df_row : pd.Series
-        The input data updated to parse protein accession data.
-    """
-    label = -1
-    results = {}
-    new_proteins = []
-    for protein in proteins:
-        if not protein['protein'].startswith('rev'):
-            label = 1
-        new_proteins.append(protein['protein'])
-    results[LABEL_KEY] = label
-    results[ACCESSION_KEY] = ','.join(new_proteins)
-    return results
-
-def get_read_path(df_loc, file_idx):
-    """ Function to remove invalid characters from a source.
-
-    Parameters
-    ----------
-    df_loc : str
-        Location of the file.
-    file_idx : int
-        The index of the input file.
+    mod_pep = pl.col(MSF_MOD_PEP_KEY)
+    unknown_id = str(ID_NUMBERS['unknown'])
+
+    n_term_mod = mod_pep.str.extract(r'^n\[(\d+)\]')
+    n_term_mod = pl.when(n_term_mod.is_null()).then(pl.lit('0')).when(
+        n_term_mod.eq('43')
+    ).then(pl.lit('3')).otherwise(
+        n_term_mod.map_dict(msf_name_to_id, default=pl.lit(unknown_id))
+    )
+    c_term_mod = mod_pep.str.extract(r'c\[(\d+)\]$')
+    c_term_mod = pl.when(c_term_mod.is_null()).then(pl.lit('0')).otherwise(
+        c_term_mod.map_dict(msf_name_to_id, default=pl.lit(unknown_id))
+    )
 
-    Returns
-    -------
-    read_loc : str
-        The final location that should be read from.
-    remove_read_loc : bool
-        Flag indicating if a temporary file was generated which should be removed.
-    """
-    source_name = Path(df_loc).name
-    if source_name.endswith('_uncalibrated.pepXML'):
-        source_name = source_name[:-20]
-    elif source_name.endswith('_calibrated.pepXML'):
-        source_name = source_name[:-18]
-    elif source_name.endswith('.pepXML'):
-        source_name = source_name[:-7]
-    if "'" in source_name:
-        with open(df_loc, 'r', encoding='UTF-8') as file :
-            filedata = file.read()
-        filedata = filedata.replace(source_name, f'temp_{file_idx}')
-        with open(df_loc.replace(source_name, f'temp_{file_idx}'), 'w', encoding='UTF-8') as file:
-            file.write(filedata)
-        return df_loc.replace(source_name, f'temp_{file_idx}'), True
-    return df_loc, False
+    # Each modified residue is replaced by the modification ID, e.g. AM[147]L -> AM#2L
+    # -> A2L, and then each unmodified residue by 0.
+    residue_mod_ids = mod_pep.str.replace(r'^n\[\d+\]', '').str.replace(r'c\[\d+\]$', '')
+    for msf_mod, mod_id in msf_name_to_id.items():
+        residue_mod_ids = residue_mod_ids.str.replace_all(
+            f'[{msf_mod}]', f'#{mod_id}', literal=True
+        )
+    residue_mod_ids = residue_mod_ids.str.replace_all(
+        r'\[\d+\]', f'#{unknown_id}'
+    ).str.replace_all(r'[A-Z]#', '').str.replace_all(r'[A-Z]', '0')
+
+    return msf_df.with_columns(
+        pl.when(mod_pep.str.contains('[', literal=True)).then(
+            pl.concat_str([n_term_mod, pl.lit('.'), residue_mod_ids, pl.lit('.'), c_term_mod])
+        ).otherwise(None).alias(PTM_SEQ_KEY)
+    )
 
 def read_single_ms_fragger_data(df_loc, fixed_modifications, file_idx):
-    """ Function to read in PEAKS DB search results from a single file.
+    """ Function to read in MSFragger search results from a single pepXML file.
 
     Parameters
     ----------
     df_loc : str
-        A location of PEAKS DB search results.
+        A location of MSFragger pepXML search results.
+    fixed_modifications : list of str or None
+        A list of the fixed modification used in the exeriment.
+    file_idx : int
+        The index of the input file, used to replace source names containing quotes.
 
     Returns
     -------
-    hits_df : pd.DataFrame
+    hits_df : pl.DataFrame
         A DataFrame of all search results properly formatted for inSPIRE.
     mods_dfs : pd.DataFrame
         A small DataFrame detailing the ptms found in the data.
     """
-    read_loc, remove_read_loc  = get_read_path(df_loc, file_idx)
-
-    all_psms = []
-    with pepxml.read(read_loc) as psms:
-        for psm in psms:
-            psms_to_add = []
-            peps_added = []
-
-            for pep_psm in psm['search_hit']:
-                if pep_psm['peptide'] not in peps_added:
-                    pep_psm[CHARGE_KEY] = int(psm['assumed_charge'])
-                    pep_psm['SpecId'] = psm['spectrum']
-                    pep_psm[MSF_RT_KEY] = psm['retention_time_sec']
-                    pep_psm['hyperscore'] = pep_psm['search_score']['hyperscore']
-                    del pep_psm['search_score']
-                    peps_added.append(pep_psm['peptide'])
-                    psms_to_add.append(pep_psm)
-
-            if len(psms_to_add) > 1:
-                rank_2_score = psms_to_add[1]['hyperscore']
-            else:
-                rank_2_score = 0
-
-            for pep_psm in psms_to_add:
-                pep_psm[MSF_DELTA_KEY] = pep_psm['hyperscore'] - rank_2_score
-                all_psms.append(pep_psm)
-
-    msf_df = pl.DataFrame(all_psms)
+    msf_df, mod_masses = _stream_pepxml(df_loc)
 
+    # SpecId has the form source.startScan.endScan.charge
+    spec_id = pl.col(MSF_SPEC_ID_KEY)
+    source = spec_id.str.replace(r'\.[^.]*\.[^.]*\.[^.]*$', '')
+    source_name = _get_source_name(df_loc)
+    if "'" in source_name:
+        source = source.str.replace_all(source_name, f'temp_{file_idx}', literal=True)
     msf_df = msf_df.with_columns(
-        pl.col('SpecId').apply(
-            _extract_psm_id_data
-        ).alias('results')
-    ).unnest('results')
-
-    if CHARGE_KEY not in msf_df.columns:
-        msf_df = msf_df.rename({f'alt_{CHARGE_KEY}': CHARGE_KEY})
+        source.alias(SOURCE_KEY),
+        spec_id.str.split('.').list.get(-3).cast(pl.Int64).alias(SCAN_KEY),
+    )
 
     # Separate PTMs.
-    var_mod_df, msf_name_to_id = _get_msf_mods_pepxml(msf_df, fixed_modifications)
+    var_mod_df, msf_name_to_id = _get_msf_mods_pepxml(mod_masses, fixed_modifications)
+    msf_df = _create_msf_ptm_seq_col(msf_df, msf_name_to_id)
 
     msf_df = msf_df.with_columns(
-        pl.col('modified_peptide').apply(
-            lambda mod_pep : _separate_msf_ptms(mod_pep, msf_name_to_id)
-        ).alias(PTM_SEQ_KEY)
+        pl.col(PEPTIDE_KEY).str.n_chars().cast(pl.Int64).alias(SEQ_LEN_KEY),
     )
-
     msf_df = msf_df.with_columns(
-        pl.col('proteins').apply(flatten_protein_data).alias('results')
-    )
-    msf_df = msf_df.drop('proteins')
-    msf_df = msf_df.unnest('results')
-
-    msf_df= msf_df.with_columns(
-        pl.col(PEPTIDE_KEY).apply(len).alias(MSF_PEP_LEN_KEY),
-    )
-    msf_df= msf_df.with_columns(
-        (
-            pl.col('calc_neutral_pep_mass')/pl.col(MSF_PEP_LEN_KEY)
-        ).alias('avgResidueMass'),
+        (pl.col(MSF_CALC_MASS_KEY)/pl.col(SEQ_LEN_KEY)).alias('avgResidueMass'),
+        pl.col(MSF_MASS_DIFF_KEY).abs().alias(MASS_DIFF_KEY),
+        pl.lit(0).alias('fromChimera'),
+        pl.lit(0).alias('missedCleavages'),
     )
 
     # Rename to match inSPIRE naming scheme.
     msf_df = msf_df.rename({
-        MSF_PEP_LEN_KEY: SEQ_LEN_KEY,
-        'massdiff': MASS_DIFF_KEY,
         MSF_RT_KEY: RT_KEY,
         MSF_SCORE_KEY: ENGINE_SCORE_KEY,
         MSF_DELTA_KEY: DELTA_SCORE_KEY,
     })
 
-    msf_df = msf_df.with_columns(
-        pl.lit(0).alias('fromChimera'),
-        pl.lit(0).alias('missedCleavages'),
-        pl.col(MASS_DIFF_KEY).apply(abs).alias(MASS_DIFF_KEY),
-    )
-
     # Filter for Prosit and add feature columns not present.
     msf_df = filter_for_prosit(msf_df)
 
     msf_df = msf_df.select(
-        'source',
-        'scan',
-        'peptide',
-        'Label',
-        'proteins',
-        'ptm_seq',
-        'sequenceLength',
+        SOURCE_KEY,
+        SCAN_KEY,
+        PEPTIDE_KEY,
+        LABEL_KEY,
+        ACCESSION_KEY,
+        PTM_SEQ_KEY,
+        SEQ_LEN_KEY,
         'missedCleavages',
-        'charge',
-        'massDiff',
-        'retentionTime',
-        'engineScore',
-        'deltaScore',
+        CHARGE_KEY,
+        MASS_DIFF_KEY,
+        RT_KEY,
+        ENGINE_SCORE_KEY,
+        DELTA_SCORE_KEY,
         'fromChimera',
         'avgResidueMass',
     )
 
-    if remove_read_loc:
-        os.remove(read_loc)
-
     return msf_df, var_mod_df
 
+def _combine_mods_dfs(mods_dfs):
+    """ Function to combine the modifications found in separate pepXML files.
+
+    Parameters
+    ----------
+    mods_dfs : list of pd.DataFrame
+        The modifications DataFrame of each file.
+
+    Returns
+    -------
+    mods_df : pd.DataFrame
+        DataFrame of all modifications found.
+    """
+    mods_df = pd.concat(mods_dfs).drop_duplicates(subset='msfMod')
+    mods_df = mods_df.sort_values(by=PTM_NAME_KEY)
+    return mods_df.reset_index(drop=True)
+
 def read_ms_fragger_data(ms_fragger_data, fixed_modifications, n_cores, reduce_results):
-    """ Function to read in PEAKS DB search results from one or more files.
+    """ Function to read in MSFragger search results from one or more pepXML files,
+        with one worker process per file.
 
     Parameters
     ----------
-    peaks_data : str or list of str
-        A single location of PEAKS DB search results or a list of locations.
+    ms_fragger_data : str or list of str
+        A single location of MSFragger pepXML results or a list of locations.
+    fixed_modifications : list of str or None
+        A list of the fixed modification used in the exeriment.
+    n_cores : int
+        The number of files to read in parallel.
+    reduce_results : bool
+        Flag indicating whether to keep only the top scoring hit per scan.
 
     Returns
     -------
-    hits_df : pd.DataFrame
+    hits_df : pl.DataFrame
         A DataFrame of all search results properly formatted for inSPIRE.
     mods_dfs : pd.DataFrame
         A small DataFrame detailing the ptms found in the data.
@@ -406,21 +501,19 @@ def read_ms_fragger_data(ms_fragger_data, fixed_modifications, n_cores, reduce_r
             )
         ]
 
-        with multiprocessing.get_context('spawn').Pool(processes=n_cores) as pool:
-            results = pool.starmap(read_single_ms_fragger_data, func_args)
-
-        mods_dfs = [res[1] for res in results]
+        n_processes = max(1, min(n_cores, len(func_args)))
+        if n_processes > 1:
+            with multiprocessing.get_context('spawn').Pool(processes=n_processes) as pool:
+                results = pool.starmap(read_single_ms_fragger_data, func_args)
+        else:
+            results = [read_single_ms_fragger_data(*args) for args in func_args]
 
-        # Combine DataFrames and validate that same PTMs are present.
+        # Combine DataFrames and the PTMs found in each file.
         hits_df = pl.concat([res[0] for res in results])
+        mods_df = _combine_mods_dfs([res[1] for res in results])
+    else:
+        hits_df, mods_df = read_single_ms_fragger_data(ms_fragger_data, fixed_modifications, 0)
 
-        if reduce_results:
-            hits_df = hits_df.sort(by=[ENGINE_SCORE_KEY, LABEL_KEY], descending=True)
-            hits_df = hits_df.unique(subset=[SOURCE_KEY, SCAN_KEY])
-
-        return hits_df, mods_dfs[0]
-
-    hits_df, mods_df = read_single_ms_fragger_data(ms_fragger_data, fixed_modifications, 0)
     if reduce_results:
         hits_df = hits_df.sort(by=[ENGINE_SCORE_KEY, LABEL_KEY], descending=True)
         hits_df = hits_df.unique(subset=[SOURCE_KEY, SCAN_KEY])
@@ -17,6 +17,7 @@ from inspire.constants import (
     PTM_NAME_KEY,
     PTM_SEQ_KEY,
 )
+from inspire.profiling import profile_function
 
 def msp_process_sequence_and_charge(line):
     """ Function to extract the name and charge of a sample from
@@ -216,6 +217,7 @@ def process_prosit_comment(line, sequence):
 
     return sequence, irt, collision_energy
 
+@profile_function
 def msp_to_df(msp_filename, msp_format, mods_df):
     """ Function to process an msp file and extract relevant information
         for training into csv format (tab separated).
@@ -12,8 +12,10 @@ from inspire.constants import (
     SCAN_KEY,
     SOURCE_KEY,
 )
+from inspire.profiling import profile_function
 
 
+@profile_function
 def process_mzml_file(mzml_filename, scan_ids, with_charge=False, with_retention_time=False):
     """ Function to process an MzML file to find matches with scan IDs.
 
@@ -1,7 +1,5 @@
 """ Functions for reading in PEAKS search results.
 """
-from copy import deepcopy
-
 import pandas as pd
 import polars as pl
 
@@ -24,7 +22,7 @@ from inspire.constants import (
     SEQ_LEN_KEY,
     SOURCE_KEY,
 )
-from inspire.utils import filter_for_prosit, remove_source_suffixes
+from inspire.utils import filter_for_prosit
 
 # Define the relevant column names from PEAKS DB search results.
 PEAKS_ACCESSION_KEY = 'Accession'
@@ -72,118 +70,139 @@ ID_NUMBERS = {
     'Carbamidomethylation': 1,
 }
 
-def _extract_terminus_ptms(mod_list, var_mods, terminus):
-    """ Helper function to extract any ptms at the N or C termini.
+PEAKS_ROW_KEY = 'peaksRow'
+PEAKS_MOD_REGEX = r'\([^)]*\)'
 
-    Parameters
-    ----------
-    mod_list : list of str
-        A list of the ptms for the sequence.
-    var_mods : dict
-        A dictionary mapping ptm names to integer IDs.
-    terminus : str
-        A flag for the terminus (either N or C).
+def _ascore_names_expr():
+    """ Function to create an expression listing the ptm names of the AScore column in
+        the order they occur in the peptide.
+    """
+    return pl.col(PEAKS_ASCORE_KEY).str.split(';').list.eval(
+        pl.element().str.strip_chars(' ').str.split(':').list.get(1).str.strip_chars(' ')
+    )
 
-    Returns
-    -------
-    mod_list : list of str
-        The updated list of the ptms for the sequence without the terminus modification.
-    term_flag : str
-        A ID of the terminus ptm.
+def _explode_with_index(list_df, list_col, index_col):
+    """ Function to explode a list column, recording the position within each list.
     """
-    term_mod = -1
-    term_flag = '0'
-    for mod in mod_list:
-        if mod.endswith(f'({terminus}-term)'):
-            term_mod = mod
-            break
-    if term_mod != -1:
-        term_flag = f'{var_mods[term_mod]}'
-        mod_list.remove(term_mod)
-    return mod_list, term_flag
-
-def separate_peaks_ptms(df_row, var_mods):
+    return list_df.explode(list_col).with_columns(
+        pl.col(PEAKS_ROW_KEY).cum_count().over(PEAKS_ROW_KEY).alias(index_col)
+    )
+
+def separate_peaks_ptms(peaks_df, var_mods):
     """ Helper function to remove ptm markers from the Peaks Peptide column and create a
-        separate ptm_seq column containing ptm data.
+        separate ptm_seq column containing ptm data. Each ptm marker in the peptide takes
+        its name from the next entry of the AScore column.
 
     Parameters
     ----------
-    df_row : pd.Series
-        A row of the Peaks search results DataFrame.
+    peaks_df : pl.DataFrame
+        The Peaks search results DataFrame.
     var_mods : dict
         A dictionary mapping ptm names to integer ids.
 
     Returns
     -------
-    df_row : pd.Series
-        The updated row with peptide and ptms separated.
+    peaks_df : pl.DataFrame
+        The updated DataFrame with peptide and ptms separated.
     """
-    results = {}
-    peptide = df_row[PEAKS_PEPTIDE_KEY]
-    ptms = df_row[PEAKS_ASCORE_KEY]
-    ptm_prefix = '0'
-    ptm_suffix = '0'
-
-    if isinstance(ptms, str):
-        ptm_list = [a.strip(' ') for a in ptms.split(';')]
-        ptm_list = [b.split(':')[1].strip(' ') for b in ptm_list]
-    else:
-        results[PEPTIDE_KEY] = peptide
-        results[PTM_SEQ_KEY] = None
-        return results
-    pep_seq = ''
-    ptm_seq = ''
-    idx = 0
-
-    while peptide:
-        assert peptide[0] != '('
-        if len(peptide) == 1:
-            pep_seq += peptide[0]
-            ptm_seq += '0'
-            break
-
-        if peptide[1] != '(':
-            pep_seq += peptide[0]
-            ptm_seq += '0'
-            peptide = peptide[1:]
-        else:
-            pep_seq += peptide[0]
-            peptide = peptide[1:]
-
-            end_mod = peptide.index(')') + 1
-            mod_list = []
-            while peptide[0] == '(':
-                end_mod = peptide.index(')') + 1
-
-                mod_list.append(ptm_list[0])
-                ptm_list = ptm_list[1:]
-
-                peptide = peptide[end_mod:]
-                if not peptide:
-                    break
-
-            if idx == 0:
-                mod_list, ptm_prefix = _extract_terminus_ptms(mod_list, var_mods, 'N')
-
-            if not peptide:
-                mod_list, ptm_suffix = _extract_terminus_ptms(mod_list, var_mods, 'C')
-
-            if mod_list:
-                ptm_seq += str(var_mods[mod_list[0]])
-            else:
-                ptm_seq += '0'
-        idx += 1
-
-    results[PEPTIDE_KEY] = pep_seq
-    results[PTM_SEQ_KEY] = '.'.join([ptm_prefix, ptm_seq, ptm_suffix])
-    return results
+    var_mods = {name: str(mod_id) for name, mod_id in var_mods.items()}
+    peaks_df = peaks_df.with_row_count(PEAKS_ROW_KEY)
+    with_ptms_df = peaks_df.filter(pl.col(PEAKS_ASCORE_KEY).is_not_null())
+
+    # One row per residue with the index of the first of its ptm names.
+    residue_df = _explode_with_index(
+        with_ptms_df.select(
+            PEAKS_ROW_KEY,
+            pl.col(PEAKS_PEPTIDE_KEY).str.extract_all(
+                r'[^()](?:' + PEAKS_MOD_REGEX + ')*'
+            ).alias('residue'),
+        ),
+        'residue',
+        'position',
+    ).with_columns(
+        pl.col('residue').str.count_match(r'\(').alias('nMods'),
+        pl.col('position').eq(pl.col('position').max().over(PEAKS_ROW_KEY)).alias('isLast'),
+    ).with_columns(
+        (pl.col('nMods').cumsum().over(PEAKS_ROW_KEY) - pl.col('nMods')).alias('firstMod'),
+    )
+
+    # One row per ptm marker, named using the AScore column.
+    names_df = _explode_with_index(
+        with_ptms_df.select(PEAKS_ROW_KEY, _ascore_names_expr().alias('name')),
+        'name',
+        'modIdx',
+    )
+    mod_df = residue_df.filter(pl.col('nMods').gt(0)).with_columns(
+        pl.int_ranges(
+            pl.col('firstMod'), pl.col('firstMod') + pl.col('nMods'), dtype=pl.UInt32
+        ).alias('modIdx')
+    ).explode('modIdx').join(
+        names_df, how='left', on=[PEAKS_ROW_KEY, 'modIdx']
+    ).select(
+        PEAKS_ROW_KEY,
+        'position',
+        'modIdx',
+        pl.col('name').map_dict(var_mods, default=pl.lit('9')).alias('modId'),
+        (pl.col('position').eq(0) & pl.col('name').str.ends_with('(N-term)')).alias('isN'),
+        (pl.col('isLast') & pl.col('name').str.ends_with('(C-term)')).alias('isC'),
+    )
+
+    # Only the first terminal ptm is moved to the terminus, and only the first
+    # remaining ptm is kept for each residue.
+    residue_keys = [PEAKS_ROW_KEY, 'position']
+    mod_df = mod_df.with_columns(
+        (
+            pl.col('isN') & pl.col('modIdx').eq(
+                pl.col('modIdx').filter(pl.col('isN')).min().over(residue_keys)
+            )
+        ).alias('isN'),
+    ).with_columns(
+        (
+            pl.col('isC') & pl.col('isN').is_not() & pl.col('modIdx').eq(
+                pl.col('modIdx').filter(pl.col('isC') & pl.col('isN').is_not()).min().over(
+                    residue_keys
+                )
+            )
+        ).alias('isC'),
+    )
+    terminus_df = mod_df.group_by(PEAKS_ROW_KEY).agg(
+        pl.col('modId').filter(pl.col('isN')).first().alias('nTermId'),
+        pl.col('modId').filter(pl.col('isC')).first().alias('cTermId'),
+    )
+    residue_mod_df = mod_df.filter(pl.col('isN').is_not() & pl.col('isC').is_not()).group_by(
+        residue_keys
+    ).agg(pl.col('modId').sort_by('modIdx').first().alias('residueId'))
+
+    ptm_seq_df = residue_df.join(
+        residue_mod_df, how='left', on=residue_keys
+    ).group_by(PEAKS_ROW_KEY, maintain_order=True).agg(
+        pl.col('residueId').fill_null(pl.lit('0')).sort_by('position').str.concat('')
+    ).join(terminus_df, how='left', on=PEAKS_ROW_KEY).select(
+        PEAKS_ROW_KEY,
+        pl.concat_str([
+            pl.col('nTermId').fill_null(pl.lit('0')),
+            pl.lit('.'),
+            pl.col('residueId'),
+            pl.lit('.'),
+            pl.col('cTermId').fill_null(pl.lit('0')),
+        ]).alias(PTM_SEQ_KEY),
+    )
+
+    peaks_df = peaks_df.join(ptm_seq_df, how='left', on=PEAKS_ROW_KEY).sort(PEAKS_ROW_KEY)
+    return peaks_df.select(
+        pl.exclude([PEAKS_ROW_KEY, PTM_SEQ_KEY]),
+        pl.when(pl.col(PEAKS_ASCORE_KEY).is_not_null()).then(
+            pl.col(PEAKS_PEPTIDE_KEY).str.replace_all(PEAKS_MOD_REGEX, '')
+        ).otherwise(pl.col(PEAKS_PEPTIDE_KEY)).alias(PEPTIDE_KEY),
+        pl.col(PTM_SEQ_KEY),
+    )
 
 def collect_peaks_var_mods(peaks_df):
     """ Helper function to collect all of the ptms present in PEAKS DB search results.
 
     Parameters
     ----------
-    peaks_df : pd.DataFrame
+    peaks_df : pl.DataFrame
         A DataFrame of PEAKS DB search results.
 
     Returns
@@ -191,39 +210,37 @@ def collect_peaks_var_mods(peaks_df):
     ptms_df : pd.DataFrame
         A small DataFrame listing the unique ptms found in the data.
     """
-    var_mod_df = deepcopy(peaks_df[[PEAKS_PTM_KEY, PEAKS_PEPTIDE_KEY]])
-    var_mod_df = var_mod_df.with_columns(
-        pl.col(PEAKS_PTM_KEY).apply(
-            lambda x: None if not isinstance(x, str) else [a.strip(' ') for a in x.split(';')],
-            skip_nulls=False,
-        ).alias('ptm_names')
-    )
-
-    var_mod_df = var_mod_df.with_columns(
-        pl.col(PEAKS_PEPTIDE_KEY).str.replace_all(r'[A-Za-z]', '').apply(
-            lambda x : [a.strip('(').strip(')') for a in x.split(')(')]
-        ).alias('peaks_ptm_weights')
-    )
-
-    var_mod_df = var_mod_df.filter(
+    var_mod_df = peaks_df.select(
+        pl.col(PEAKS_PTM_KEY).str.split(';').list.eval(
+            pl.element().str.strip_chars(' ')
+        ).alias('ptm_names'),
+        pl.col(PEAKS_PEPTIDE_KEY).str.extract_all(PEAKS_MOD_REGEX).list.eval(
+            pl.element().str.strip_chars('()')
+        ).alias('peaks_ptm_weights'),
+    ).with_row_count(PEAKS_ROW_KEY).filter(
         (pl.col('ptm_names').is_not_null()) & (pl.col('peaks_ptm_weights').is_not_null())
     )
 
-    if not var_mod_df.shape[0]:
+    # Pair the ptm names with the weights in the peptide by their position.
+    ptms = _explode_with_index(
+        var_mod_df.select(PEAKS_ROW_KEY, 'ptm_names'), 'ptm_names', 'ptmIdx',
+    ).join(
+        _explode_with_index(
+            var_mod_df.select(PEAKS_ROW_KEY, 'peaks_ptm_weights'), 'peaks_ptm_weights', 'ptmIdx',
+        ),
+        how='inner',
+        on=[PEAKS_ROW_KEY, 'ptmIdx'],
+    ).select(['ptm_names', 'peaks_ptm_weights']).drop_nulls().unique().sort(
+        ['ptm_names', 'peaks_ptm_weights']
+    ).rows()
+
+    if not ptms:
         return pd.DataFrame({
             PTM_NAME_KEY: [],
             PTM_WEIGHT_KEY: [],
             PTM_ID_KEY: [],
         })
 
-    var_mod_df = var_mod_df.with_columns(
-        pl.struct(['ptm_names', 'peaks_ptm_weights']).apply(
-            lambda x : ["~".join(y) for y in zip(x['ptm_names'], x['peaks_ptm_weights'])]
-        ).alias('combined_ptm_data')
-    )
-
-    ptms = [x.split('~') for x in var_mod_df['combined_ptm_data'].explode().unique()]
-
     ptm_names = [name for name, _ in ptms]
 
     ptm_weights = [KNOWN_PTM_WEIGHTS.get(name, float(weight)) for name, weight in ptms]
@@ -237,7 +254,7 @@ def collect_peaks_var_mods(peaks_df):
     ptms_df[PTM_ID_KEY] = ptms_df[PTM_NAME_KEY].apply(
         lambda x : ID_NUMBERS.get(x, 9)
     )
-    ptms_df = ptms_df.sort_values(by=PTM_ID_KEY).reset_index(drop=True)
+    ptms_df = ptms_df.sort_values(by=PTM_ID_KEY, kind='stable').reset_index(drop=True)
     ptms_df[PTM_IS_VAR_KEY] = True
 
     return ptms_df
@@ -252,7 +269,7 @@ def read_single_peaks_data(df_loc):
 
     Returns
     -------
-    hits_df : pd.DataFrame
+    hits_df : pl.DataFrame
         A DataFrame of all search results properly formatted for inSPIRE.
     mods_dfs : pd.DataFrame
         A small DataFrame detailing the ptms found in the data.
@@ -264,11 +281,7 @@ def read_single_peaks_data(df_loc):
     var_mod_dict = dict(zip(var_mods[PTM_NAME_KEY].tolist(), var_mods[PTM_ID_KEY].tolist()))
 
     if var_mod_dict:
-        peaks_df = peaks_df.with_columns(
-            pl.struct([PEAKS_PEPTIDE_KEY, PEAKS_ASCORE_KEY]).apply(
-                lambda x: separate_peaks_ptms(x, var_mod_dict)
-            ).alias('results')
-        ).unnest('results')
+        peaks_df = separate_peaks_ptms(peaks_df, var_mod_dict)
         peaks_df = peaks_df.drop(PEAKS_PEPTIDE_KEY)
     else:
         peaks_df = peaks_df.rename(
@@ -290,9 +303,7 @@ def read_single_peaks_data(df_loc):
 
     # Filter for Prosit and add feature columns not present.
     peaks_df = peaks_df.with_columns(
-        pl.col(PEAKS_CHIMERA_KEY).apply(
-            lambda x : 1 if x == 'Yes' else 0
-        ).alias('fromChimera'),
+        pl.col(PEAKS_CHIMERA_KEY).eq('Yes').fill_null(False).cast(pl.Int64).alias('fromChimera'),
         pl.col(ACCESSION_KEY).fill_null(
             pl.lit('unknown'),
         ).alias(ACCESSION_KEY),
@@ -303,13 +314,13 @@ def read_single_peaks_data(df_loc):
         (pl.col(PEAKS_MASS_KEY)/pl.col(SEQ_LEN_KEY)).alias('avgResidueMass'),
         pl.lit(0).alias(DELTA_SCORE_KEY),
         pl.lit(0).alias('missedCleavages'),
-        pl.col(PEAKS_SOURCE_KEY).apply(remove_source_suffixes).alias(SOURCE_KEY),
-        pl.col(PEAKS_SCAN_KEY).apply(
-            lambda x : x if isinstance(x, int) else int(x.split(':')[-1])
+        pl.col(PEAKS_SOURCE_KEY).str.replace(r'\.(mzML|raw|mgf)$', '').alias(SOURCE_KEY),
+        pl.col(PEAKS_SCAN_KEY).cast(pl.Utf8).str.extract(r'([^:]*)$').cast(
+            pl.Int64
         ).alias(SCAN_KEY),
-        pl.col(ACCESSION_KEY).apply(
-            lambda x : -1 if isinstance(x, str) and ('DECOY' in x or 'rev' in x) else 1
-        ).alias(LABEL_KEY),
+        pl.when(
+            pl.col(ACCESSION_KEY).str.contains('DECOY|rev')
+        ).then(-1).otherwise(1).cast(pl.Int64).alias(LABEL_KEY),
     )
 
     for col, dtype in peaks_df.schema.items():
@@ -332,7 +343,6 @@ def read_single_peaks_data(df_loc):
 
     return peaks_df, var_mods
 
-
 def read_peaks_data(peaks_data):
     """ Function to read in PEAKS DB search results from one or more files.
 
@@ -1,19 +1,136 @@
 """ Generic functions for reading in any search results.
 """
+import hashlib
+from io import StringIO
+import json
 import multiprocessing
 import os
 
 import pandas as pd
 import polars as pl
+import pyarrow.parquet as pq
 
+from inspire import __version__
 from inspire.accession import process_accession_groups
+from inspire.constants import ENDC_TEXT, OKCYAN_TEXT
 from inspire.input.mascot import read_mascot_data
 from inspire.input.maxquant import read_mq_data
 from inspire.input.msfragger import read_ms_fragger_data
 from inspire.input.peaks import read_peaks_data
-from inspire.utils import add_fixed_modifications
+from inspire.profiling import profile_function
+from inspire.utils import add_fixed_modifications, add_ptm_code, fingerprint_file
 
-def generic_read_df(config, save_dfs=True, for_calibration=False):
+SEARCH_CACHE_FILE = 'formatted_search.parquet'
+CACHE_KEY_METADATA = b'inspire.cacheKey'
+CACHE_MODS_METADATA = b'inspire.modsDf'
+# Increased whenever the columns of the formatted search results change.
+SEARCH_CACHE_VERSION = 2
+
+def get_search_cache_key(config, reduce_results):
+    """ Function to get the key identifying formatted search results, which changes
+        whenever the search results or the config used to format them change.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object for the experiment.
+    reduce_results : bool
+        Flag indicating whether the results are reduced to the best hit per scan.
+
+    Returns
+    -------
+    cache_key : str
+        The hex digest of the cache key.
+    """
+    search_results = config.search_results
+    if not isinstance(search_results, list):
+        search_results = [search_results]
+
+    key_data = {
+        'inspireVersion': __version__,
+        'cacheVersion': SEARCH_CACHE_VERSION,
+        'searchResults': [fingerprint_file(search_file) for search_file in search_results],
+        'searchEngine': config.search_engine,
+        'reduceResults': reduce_results,
+        'fixedModifications': config.fixed_modifications,
+        'scanTitleFormat': config.scan_title_format,
+        'sourceFiles': config.source_files,
+        'sourceFileName': config.source_filename,
+        'useAccessionStratum': config.use_accession_stratum,
+    }
+    if config.use_accession_stratum:
+        key_data.update({
+            'accessionFormat': config.accession_format,
+            'accessionHierarchy': config.accession_hierarchy,
+            'accessionFlags': config.accession_flags,
+            'proteome': (
+                None if config.proteome is None else fingerprint_file(config.proteome)
+            ),
+        })
+
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, default=str).encode('UTF-8')
+    ).hexdigest()
+
+def read_search_cache(cache_loc, cache_key):
+    """ Function to read formatted search results from the cache if they were
+        written with the same cache key. Only the Parquet footer is read to
+        validate the cache, the search results are scanned lazily.
+
+    Parameters
+    ----------
+    cache_loc : str
+        The location of the cache file.
+    cache_key : str
+        The expected cache key.
+
+    Returns
+    -------
+    search_lf : pl.LazyFrame or None
+        The formatted search results, or None if there is no valid cache.
+    mods_df : pd.DataFrame or None
+        A small DataFrame detailing the PTMs found.
+    """
+    if not os.path.exists(cache_loc):
+        return None, None
+
+    metadata = pq.read_schema(cache_loc).metadata or {}
+    if metadata.get(CACHE_KEY_METADATA) != cache_key.encode('UTF-8'):
+        return None, None
+
+    mods_df = pd.read_json(
+        StringIO(metadata[CACHE_MODS_METADATA].decode('UTF-8')), orient='table'
+    )
+    return pl.scan_parquet(cache_loc), mods_df
+
+def write_search_cache(search_df, mods_df, cache_loc, cache_key):
+    """ Function to write formatted search results to a Parquet cache, with the cache
+        key and modifications stored in the schema metadata.
+
+    Parameters
+    ----------
+    search_df : pl.DataFrame
+        The formatted search results.
+    mods_df : pd.DataFrame
+        A small DataFrame detailing the PTMs found.
+    cache_loc : str
+        The location of the cache file.
+    cache_key : str
+        The cache key of the search results.
+    """
+    search_table = search_df.to_arrow()
+    search_table = search_table.replace_schema_metadata({
+        **(search_table.schema.metadata or {}),
+        CACHE_KEY_METADATA: cache_key.encode('UTF-8'),
+        CACHE_MODS_METADATA: mods_df.to_json(orient='table', index=False).encode('UTF-8'),
+    })
+
+    # Written to a temporary file first so that an interrupted write is never reused.
+    pq.write_table(search_table, f'{cache_loc}.tmp')
+    os.replace(f'{cache_loc}.tmp', cache_loc)
+
+@profile_function
+def generic_read_df(config, save_dfs=True, for_calibration=False, columns=None):
     """ Function to read in search results from any search engine.
 
     Parameters
@@ -22,9 +139,11 @@ def generic_read_df(config, save_dfs=True, for_calibration=False):
         The Config object for the experiment.
     save_dfs : bool
         Flag indicating whether the formatted dataframes should be saved to disk.
-    overwrite_reduce : bool
+    for_calibration : bool
         Flag indicating whether to force reduction of Mascot dataframe to best hit
         (for CE calibration pipeline).
+    columns : list of str or None
+        The columns to be read, if None all columns are read.
 
     Returns
     -------
@@ -40,48 +159,57 @@ def generic_read_df(config, save_dfs=True, for_calibration=False):
 
     n_cores = min(config.n_cores, multiprocessing.cpu_count())
 
-    if os.path.exists(f'{config.output_folder}/formated_df.csv') and config.reuse_input:
-        search_df = pl.read_csv(f'{config.output_folder}/formated_df.csv')
-        mods_df = pd.read_csv(f'{config.output_folder}/formated_mods.csv')
+    cache_loc = f'{config.output_folder}/{SEARCH_CACHE_FILE}'
+    if config.reuse_input:
+        cache_key = get_search_cache_key(config, reduce_results)
+        search_lf, mods_df = read_search_cache(cache_loc, cache_key)
+        if search_lf is not None:
+            print(OKCYAN_TEXT + '\tReusing formatted search results.' + ENDC_TEXT)
+            if columns is not None:
+                search_lf = search_lf.select(columns)
+            return search_lf.collect(), mods_df
+
+    if config.search_engine == 'mascot':
+        search_df, mods_df = read_mascot_data(
+            config.search_results,
+            config.scan_title_format,
+            config.source_files,
+            reduce_results,
+            config.source_filename,
+            with_accession=config.use_accession_stratum,
+            n_cores=n_cores,
+        )
+    elif config.search_engine == 'maxquant':
+        search_df, mods_df = read_mq_data(config.search_results)
+    elif config.search_engine == 'peaks':
+        search_df, mods_df = read_peaks_data(config.search_results)
+    elif config.search_engine == 'msfragger':
+        search_df, mods_df = read_ms_fragger_data(
+            config.search_results,
+            config.fixed_modifications,
+            n_cores,
+            reduce_results,
+        )
     else:
-        if config.search_engine == 'mascot':
-            search_df, mods_df = read_mascot_data(
-                config.search_results,
-                config.scan_title_format,
-                config.source_files,
-                reduce_results,
-                config.source_filename,
-                with_accession=config.use_accession_stratum,
-            )
-            search_df = pl.from_pandas(search_df)
-        elif config.search_engine == 'maxquant':
-            search_df, mods_df = read_mq_data(config.search_results)
-        elif config.search_engine == 'peaks':
-            search_df, mods_df = read_peaks_data(config.search_results)
-        elif config.search_engine == 'msfragger':
-            search_df, mods_df = read_ms_fragger_data(
-                config.search_results,
-                config.fixed_modifications,
-                n_cores,
-                reduce_results,
-            )
-        else:
-            raise ValueError(f'Unknown Search Engine: {config.search_engine}')
-
-        if config.use_accession_stratum:
-            search_df = process_accession_groups(search_df, config)
-        if (
-            config.fixed_modifications is not None and
-            config.search_engine != 'msfragger'
-        ):
-            search_df, mods_df = add_fixed_modifications(
-                search_df,
-                mods_df,
-                config.fixed_modifications
-            )
-
-        if save_dfs and config.reuse_input:
-            search_df.write_csv(f'{config.output_folder}/formated_df.csv')
-            mods_df.to_csv(f'{config.output_folder}/formated_mods.csv', index=False)
+        raise ValueError(f'Unknown Search Engine: {config.search_engine}')
+
+    if config.use_accession_stratum:
+        search_df = process_accession_groups(search_df, config)
+    if (
+        config.fixed_modifications is not None and
+        config.search_engine != 'msfragger'
+    ):
+        search_df, mods_df = add_fixed_modifications(
+            search_df,
+            mods_df,
+            config.fixed_modifications
+        )
+    search_df = add_ptm_code(search_df)
+
+    if save_dfs and config.reuse_input:
+        write_search_cache(search_df, mods_df, cache_loc, cache_key)
+
+    if columns is not None:
+        search_df = search_df.select(columns)
 
     return search_df, mods_df
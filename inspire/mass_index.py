@@ -0,0 +1,281 @@
+""" Index of the masses of all nonspliced peptides of a proteome for tolerance window
+    queries.
+"""
+import hashlib
+import json
+import os
+
+from Bio import SeqIO
+import numpy as np
+
+from inspire.constants import RESIDUE_WEIGHTS
+from inspire.utils import fingerprint_file, load_index_arrays, save_index_arrays
+
+# Increased whenever the arrays stored in the cached index change.
+INDEX_VERSION = 1
+INDEX_ARRAYS = ['sequence', 'masses', 'positions', 'lengths']
+MIN_PEPTIDE_LENGTH = 7
+MAX_PEPTIDE_LENGTH = 30
+MERGE_CHUNK_SIZE = 1 << 22
+PROTEIN_SEPARATOR = '\n'
+
+# Residue weights by ASCII code, residues without a known weight are NaN.
+RESIDUE_WEIGHT_TABLE = np.full(256, np.nan)
+for _residue, _weight in RESIDUE_WEIGHTS.items():
+    RESIDUE_WEIGHT_TABLE[ord(_residue)] = _weight
+
+def get_residue_mass(peptide):
+    """ Function to get the summed residue weights of a peptide, NaN if any residue
+        has no known weight.
+    """
+    return float(RESIDUE_WEIGHT_TABLE[
+        np.frombuffer(peptide.encode('ascii', errors='replace'), dtype=np.uint8)
+    ].sum())
+
+def get_tolerance_window(masses, tolerance, units):
+    """ Function to get the lower and upper bound of the mass windows around masses.
+
+    Parameters
+    ----------
+    masses : np.array or float
+        The masses queried.
+    tolerance : float
+        The tolerance of the window either side of the mass.
+    units : str
+        Either Da or ppm.
+
+    Returns
+    -------
+    lower : np.array or float
+        The lowest mass within the windows.
+    upper : np.array or float
+        The highest mass within the windows.
+    """
+    if units == 'ppm':
+        tolerance = masses*tolerance*1e-6
+    return masses - tolerance, masses + tolerance
+
+def _protein_masses(sequence, start, end):
+    """ Function to generate the masses of all nonspliced peptides of a single protein
+        from prefix sums of its residue weights.
+    """
+    residue_weights = RESIDUE_WEIGHT_TABLE[sequence[start:end]]
+    unknown = np.isnan(residue_weights)
+    prefix_masses = np.zeros(end - start + 1)
+    np.cumsum(np.where(unknown, 0.0, residue_weights), out=prefix_masses[1:])
+    prefix_unknown = np.zeros(end - start + 1, dtype=np.int64)
+    np.cumsum(unknown, out=prefix_unknown[1:])
+
+    masses = []
+    positions = []
+    lengths = []
+    for pep_len in range(MIN_PEPTIDE_LENGTH, min(MAX_PEPTIDE_LENGTH, end - start) + 1):
+        # Peptides containing residues without a known weight are skipped.
+        known = (prefix_unknown[pep_len:] - prefix_unknown[:-pep_len]) == 0
+        masses.append((prefix_masses[pep_len:] - prefix_masses[:-pep_len])[known])
+        positions.append(start + np.flatnonzero(known))
+        lengths.append(np.full(known.sum(), pep_len, dtype=np.uint8))
+    return masses, positions, lengths
+
+def _sort_chunk(masses, positions, lengths, position_dtype):
+    """ Function to concatenate the peptides of consecutive proteins and sort them by mass.
+    """
+    masses = np.concatenate(masses)
+    order = np.argsort(masses, kind='stable')
+    return (
+        masses[order],
+        np.concatenate(positions)[order].astype(position_dtype),
+        np.concatenate(lengths)[order],
+    )
+
+def _sorted_chunks(proteome, sequence, chunk_size, position_dtype):
+    """ Function to generate the peptides of consecutive proteins in chunks of at least
+        chunk_size peptides, each sorted by mass.
+    """
+    chunk = ([], [], [])
+    n_peptides = 0
+    start = 0
+    for entry in proteome:
+        end = start + len(entry[1])
+        protein_arrays = _protein_masses(sequence, start, end)
+        for chunk_arrays, arrays in zip(chunk, protein_arrays):
+            chunk_arrays.extend(arrays)
+        n_peptides += sum(masses.shape[0] for masses in protein_arrays[0])
+        start = end + 1
+        if n_peptides >= chunk_size:
+            yield _sort_chunk(*chunk, position_dtype)
+            chunk = ([], [], [])
+            n_peptides = 0
+    if chunk[0]:
+        yield _sort_chunk(*chunk, position_dtype)
+
+def _merge_chunks(chunk_a, chunk_b):
+    """ Function to merge two chunks sorted by mass, keeping the peptides of chunk_a
+        first among equal masses so that the merge is stable.
+    """
+    n_merged = chunk_a[0].shape[0] + chunk_b[0].shape[0]
+    b_idx = np.searchsorted(chunk_a[0], chunk_b[0], side='right') + np.arange(
+        chunk_b[0].shape[0]
+    )
+    from_a = np.ones(n_merged, dtype=bool)
+    from_a[b_idx] = False
+
+    merged = []
+    for array_a, array_b in zip(chunk_a, chunk_b):
+        merged_array = np.empty(n_merged, dtype=array_a.dtype)
+        merged_array[from_a] = array_a
+        merged_array[b_idx] = array_b
+        merged.append(merged_array)
+    return tuple(merged)
+
+class PeptideMassIndex:
+    """ Sorted masses of every nonspliced peptide of MIN_PEPTIDE_LENGTH to
+        MAX_PEPTIDE_LENGTH residues in a proteome.
+
+    Parameters
+    ----------
+    sequence : np.array of np.uint8
+        The concatenated protein sequences, separated by PROTEIN_SEPARATOR.
+    masses : np.array of float
+        The sorted summed residue weights of each peptide.
+    positions : np.array of int
+        The start of each peptide in the concatenated sequence.
+    lengths : np.array of np.uint8
+        The length of each peptide.
+    """
+    def __init__(self, sequence, masses, positions, lengths):
+        self.sequence = sequence
+        self.masses = masses
+        self.positions = positions
+        self.lengths = lengths
+
+    @classmethod
+    def build(cls, proteome, chunk_size=MERGE_CHUNK_SIZE):
+        """ Function to build the index from a list of proteins.
+
+        Parameters
+        ----------
+        proteome : list of tuple
+            The proteins (position 0 is name and position 1 is sequence).
+        chunk_size : int (default=MERGE_CHUNK_SIZE)
+            The number of peptides sorted together before sorted chunks are merged.
+
+        Returns
+        -------
+        mass_index : PeptideMassIndex
+            The index of peptide masses.
+        """
+        sequence = np.frombuffer(
+            PROTEIN_SEPARATOR.join(
+                entry[1] for entry in proteome
+            ).encode('ascii', errors='replace'),
+            dtype=np.uint8,
+        )
+        position_dtype = np.uint32 if sequence.shape[0] < np.iinfo(np.uint32).max else np.int64
+
+        chunks = list(_sorted_chunks(proteome, sequence, chunk_size, position_dtype))
+        if not chunks:
+            return cls(
+                sequence,
+                np.zeros(0),
+                np.zeros(0, dtype=position_dtype),
+                np.zeros(0, dtype=np.uint8),
+            )
+
+        # Chunks are merged pairwise so that peptides are never all held unsorted.
+        while len(chunks) > 1:
+            chunks = [
+                _merge_chunks(*chunks[chunk_idx:chunk_idx+2])
+                if chunk_idx + 1 < len(chunks) else chunks[chunk_idx]
+                for chunk_idx in range(0, len(chunks), 2)
+            ]
+        return cls(sequence, *chunks[0])
+
+    @classmethod
+    def load(cls, index_loc, mmap_mode=None):
+        """ Function to load an index saved with PeptideMassIndex.save.
+
+        Parameters
+        ----------
+        index_loc : str
+            The folder where the index was saved.
+        mmap_mode : str or None (default=None)
+            If set, arrays are memory-mapped rather than read.
+        """
+        return cls(*load_index_arrays(index_loc, INDEX_ARRAYS, mmap_mode))
+
+    def save(self, index_loc):
+        """ Function to save the index to disk as a folder of arrays.
+        """
+        save_index_arrays(
+            index_loc, {array_name: getattr(self, array_name) for array_name in INDEX_ARRAYS}
+        )
+
+    def peptide(self, entry_idx):
+        """ Function to get the sequence of a peptide in the index.
+        """
+        position = int(self.positions[entry_idx])
+        return self.sequence[position:position+int(self.lengths[entry_idx])].tobytes().decode()
+
+    def find(self, mass, tolerance, units='Da'):
+        """ Function to find all peptides with a mass within tolerance of a query mass.
+
+        Parameters
+        ----------
+        mass : float
+            The summed residue weights of the query.
+        tolerance : float
+            The tolerance of the window either side of the mass.
+        units : str (default='Da')
+            Either Da or ppm.
+
+        Returns
+        -------
+        peptides : list of str
+            The unique peptides within the window, ordered by mass.
+        """
+        if np.isnan(mass):
+            return []
+        lower, upper = get_tolerance_window(mass, tolerance, units)
+        start_idx = np.searchsorted(self.masses, lower, side='left')
+        end_idx = np.searchsorted(self.masses, upper, side='right')
+        return list(dict.fromkeys(
+            self.peptide(entry_idx) for entry_idx in range(start_idx, end_idx)
+        ))
+
+def _read_proteome(proteome):
+    """ Function to read the proteome, keeping isoleucine so that competitor sequences
+        match the FASTA file.
+    """
+    return [(x.name, str(x.seq)) for x in SeqIO.parse(proteome, 'fasta')]
+
+def get_mass_index(proteome, cache_folder=None):
+    """ Function to get the peptide mass index of a proteome, optionally cached on disk
+        and memory-mapped.
+
+    Parameters
+    ----------
+    proteome : str
+        The location of the proteome FASTA file.
+    cache_folder : str or None (default=None)
+        The folder where the index is cached, if None the index is not cached.
+
+    Returns
+    -------
+    mass_index : PeptideMassIndex
+        The index of peptide masses.
+    """
+    if cache_folder is None:
+        return PeptideMassIndex.build(_read_proteome(proteome))
+
+    index_key = hashlib.sha256(
+        json.dumps({
+            'indexVersion': INDEX_VERSION,
+            'peptideLengths': [MIN_PEPTIDE_LENGTH, MAX_PEPTIDE_LENGTH],
+            'proteome': fingerprint_file(proteome),
+        }, sort_keys=True).encode('UTF-8')
+    ).hexdigest()
+    index_loc = f'{cache_folder}/massIndex_{index_key[:16]}'
+    if not os.path.exists(index_loc):
+        PeptideMassIndex.build(_read_proteome(proteome)).save(index_loc)
+    return PeptideMassIndex.load(index_loc, mmap_mode='r')
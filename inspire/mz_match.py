@@ -9,6 +9,7 @@ from inspire.constants import (
     RESIDUE_WEIGHTS,
     ION_OFFSET,
 )
+from inspire.utils import get_ptm_code
 
 def compute_potential_mws(sequence, modifications, reverse, ptm_id_weights):
     """ Function to compute the molecular weights of potential fragments
@@ -19,9 +20,9 @@ def compute_potential_mws(sequence, modifications, reverse, ptm_id_weights):
     ----------
     sequence : str
         The peptide sequence for which we require molecular weights.
-    modifications : str
+    modifications : str or tuple
         A string of the ptms for the sequence which will alter
-        the potential mzs.
+        the potential mzs, or its parsed PTM encoding.
     reverse : bool
         Whether we are getting fragment mzs in the forward direction
         (eg for b ions), or backward direction (eg. for y ions).
@@ -38,22 +39,13 @@ def compute_potential_mws(sequence, modifications, reverse, ptm_id_weights):
     n_fragments = sequence_length - 1
     mzs = np.empty(n_fragments)
 
-    if (
-        modifications and
-        isinstance(modifications, str) and
-        modifications != 'nan'
-        and modifications != 'None'
-    ):
-        ptms_list = modifications.split(".")
-        mods_list = [int(mod) for mod in ptms_list[1]]
-
+    ptm_code = get_ptm_code(modifications)
+    if ptm_code is not None:
         if reverse:
-            ptm_start = int(ptms_list[2])
-            ptm_end = int(ptms_list[0])
+            ptm_end, mods_list, ptm_start = ptm_code
             mods_list = mods_list[::-1]
         else:
-            ptm_start = int(ptms_list[0])
-            ptm_end = int(ptms_list[2])
+            ptm_start, mods_list, ptm_end = ptm_code
     else:
         mods_list = None
         ptm_start = 0
@@ -87,9 +79,9 @@ def get_ion_masses(sequence, ptm_id_weights, modifications=None):
     ----------
     sequence : str
         The peptide sequence for which we require molecular weights.
-    modifications : str
+    modifications : str or tuple
         A string of the ptms for the sequence which will alter
-        the potential mzs.
+        the potential mzs, or its parsed PTM encoding.
 
     Returns
     -------
@@ -97,6 +89,7 @@ def get_ion_masses(sequence, ptm_id_weights, modifications=None):
         A dictionary of all the mzs of all possible b and y ions
         that could be produced.
     """
+    modifications = get_ptm_code(modifications)
     sub_seq_mass, total_residue_mass = compute_potential_mws(
         sequence=sequence,
         modifications=modifications,
@@ -13,6 +13,7 @@ from inspire.constants import (
     PROTON,
 )
 from inspire.mz_match import get_ion_masses, compute_potential_mws
+from inspire.utils import get_ptm_code
 
 
 LOSS_NAMES = ['',  '*', '&#xb0;']
@@ -161,9 +162,9 @@ def generate_all_mzs(sequence, prec_charge, ptm_id_weights, modifications=None):
     ----------
     sequence : str
         The peptide sequence for which we require molecular weights.
-    modifications : str
+    modifications : str or tuple
         A string of the ptms for the sequence which will alter
-        the potential mzs.
+        the potential mzs, or its parsed PTM encoding.
 
     Returns
     -------
@@ -171,6 +172,7 @@ def generate_all_mzs(sequence, prec_charge, ptm_id_weights, modifications=None):
         A dictionary of all the mzs of all possible b and y ions
         that could be produced.
     """
+    modifications = get_ptm_code(modifications)
     sub_seq_mass, total_residue_mass = compute_potential_mws(
         sequence=sequence,
         modifications=modifications,
@@ -12,13 +12,16 @@ from inspire.constants import (
     MS2PIP_NAME_MAPPINGS,
     OKCYAN_TEXT,
     PEPTIDE_KEY,
+    PTM_CODE_KEYS,
     PTM_ID_KEY,
     PTM_NAME_KEY,
-    PTM_SEQ_KEY,
+    PTM_RESIDUES_KEY,
     SEQ_LEN_KEY,
 )
 from inspire.input.search_results import generic_read_df
-from inspire.utils import get_ox_flag
+from inspire.utils import add_ptm_code, get_ox_flag, get_ptm_code, get_row_ptm_code
+
+PROSIT_ROW_KEY = 'prositRow'
 
 def create_prosit_mod_seq(sequence, modifications, ox_marker):
     """ Function to add any required oxidation flags to the peptide sequence.
@@ -27,8 +30,8 @@ def create_prosit_mod_seq(sequence, modifications, ox_marker):
     ----------
     sequence : str
         The original unmodified sequence.
-    modifications : str or None
-        The ptms associated with this sequence.
+    modifications : str, tuple or None
+        The ptms associated with this sequence, or their parsed PTM encoding.
     ox_marker : int
         The ptm marker that indicates oxidation.
 
@@ -37,16 +40,11 @@ def create_prosit_mod_seq(sequence, modifications, ox_marker):
     mod_seq : str
         The sequence with modifications added.
     """
-    if (
-        modifications is None or
-        not modifications or
-        modifications == 'nan' or
-        not isinstance(modifications, str)
-    ):
+    ptm_code = get_ptm_code(modifications)
+    if ptm_code is None:
         return sequence
 
-    ptms_list = modifications.split(".")
-    mods_list = [int(mod) for mod in ptms_list[1]]
+    mods_list = ptm_code[1]
     if ox_marker in mods_list:
         mod_seq = ""
         previous_ind = 0
@@ -59,6 +57,64 @@ def create_prosit_mod_seq(sequence, modifications, ox_marker):
         return mod_seq
     return sequence
 
+def add_prosit_mod_seq(search_df, ox_marker):
+    """ Function to add the Prosit modified sequence to all PSMs, marking oxidised
+        residues from the compact PTM encoding.
+
+    Parameters
+    ----------
+    search_df : pl.DataFrame
+        A DataFrame of search results.
+    ox_marker : int
+        The ptm marker that indicates oxidation.
+
+    Returns
+    -------
+    search_df : pl.DataFrame
+        The input DataFrame with the modified_sequence column added.
+    """
+    if ox_marker < 0:
+        return search_df.with_columns(pl.col(PEPTIDE_KEY).alias('modified_sequence'))
+
+    search_df = add_ptm_code(search_df).with_row_count(PROSIT_ROW_KEY)
+    ox_df = search_df.filter(
+        pl.col(PTM_RESIDUES_KEY).list.contains(ox_marker).fill_null(False)
+    ).select(PROSIT_ROW_KEY, PEPTIDE_KEY, PTM_RESIDUES_KEY)
+
+    # Residue-wise marking requires one PTM ID per residue, anything else is left
+    # to the row-wise function.
+    is_aligned = (
+        pl.col(PTM_RESIDUES_KEY).list.lengths() == pl.col(PEPTIDE_KEY).str.n_chars()
+    )
+    unaligned_df = ox_df.filter(is_aligned.is_not()).select(
+        PROSIT_ROW_KEY,
+        pl.struct([PEPTIDE_KEY, PTM_RESIDUES_KEY]).apply(
+            lambda x : create_prosit_mod_seq(
+                x[PEPTIDE_KEY], (0, x[PTM_RESIDUES_KEY], 0), ox_marker,
+            ),
+            return_dtype=pl.Utf8,
+        ).alias('modified_sequence'),
+    )
+    ox_df = ox_df.filter(is_aligned).with_columns(
+        pl.col(PEPTIDE_KEY).str.extract_all('.')
+    ).explode([PEPTIDE_KEY, PTM_RESIDUES_KEY]).groupby(
+        PROSIT_ROW_KEY, maintain_order=True,
+    ).agg(
+        pl.when(pl.col(PTM_RESIDUES_KEY) == ox_marker).then(
+            pl.col(PEPTIDE_KEY) + '(ox)'
+        ).otherwise(
+            pl.col(PEPTIDE_KEY)
+        ).alias('modified_sequence')
+    ).with_columns(
+        pl.col('modified_sequence').list.join('')
+    )
+
+    return search_df.join(
+        pl.concat([ox_df, unaligned_df]), on=PROSIT_ROW_KEY, how='left',
+    ).with_columns(
+        pl.col('modified_sequence').fill_null(pl.col(PEPTIDE_KEY))
+    ).drop(PROSIT_ROW_KEY)
+
 def write_prosit_input_df(
         search_df,
         mods_df,
@@ -82,12 +138,7 @@ def write_prosit_input_df(
     """
     # Create modified sequence.
     ox_flag = get_ox_flag(mods_df)
-    search_df = search_df.with_columns(
-        pl.struct([PEPTIDE_KEY, PTM_SEQ_KEY]).apply(
-            lambda x : create_prosit_mod_seq(x[PEPTIDE_KEY], x[PTM_SEQ_KEY], ox_flag),
-            skip_nulls=False,
-        ).alias('modified_sequence')
-    )
+    search_df = add_prosit_mod_seq(search_df, ox_flag)
 
     # Write sequences in Prosit's input format.
     prosit_df = search_df.select('modified_sequence', CHARGE_KEY).rename(
@@ -164,8 +215,8 @@ def get_ms2pip_mods(ptm_seq, mod_id_mappings):
 
     Parameters
     ----------
-    ptm_seq : str or NaN
-        The PTM sequence formatted by inSPIRE.
+    ptm_seq : str, tuple or NaN
+        The PTM sequence formatted by inSPIRE, or its parsed PTM encoding.
     mod_id_mappings : dict
         A dictionary mapping PTM IDs to the weight of the PTM.
 
@@ -174,13 +225,14 @@ def get_ms2pip_mods(ptm_seq, mod_id_mappings):
     ms2pip_mods : str
         The PTMs observed formatted for MS2PIP input.
     """
-    if not isinstance(ptm_seq, str):
+    ptm_code = get_ptm_code(ptm_seq)
+    if ptm_code is None:
         return '-'
-    ptm_seq = ptm_seq.replace('.', '')
+    n_term, residue_mods, c_term = ptm_code
     mods = []
-    for idx, char in enumerate(ptm_seq):
-        if char != '0':
-            mods.append(f'{idx}|{mod_id_mappings[int(char)]}')
+    for idx, mod in enumerate([n_term, *residue_mods, c_term]):
+        if mod:
+            mods.append(f'{idx}|{mod_id_mappings[mod]}')
     if mods:
         return '|'.join(mods)
     return '-'
@@ -206,11 +258,12 @@ def write_ms2pip_input_df(target_df, mods_df, output_folder, output_name):
     )
     mod_id_mappings = dict(zip(mods_df[PTM_ID_KEY].tolist(), mods_df['ms2pipName'].tolist()))
 
-    target_df = target_df.with_row_count(name='spec_id')
+    target_df = add_ptm_code(target_df).with_row_count(name='spec_id')
     target_df = target_df.with_columns(
         pl.col('spec_id').apply(lambda x : f'peptide_{x}'),
-        pl.col(PTM_SEQ_KEY).apply(
-            lambda x : get_ms2pip_mods(x, mod_id_mappings)
+        pl.struct(PTM_CODE_KEYS).apply(
+            lambda x : get_ms2pip_mods(get_row_ptm_code(x), mod_id_mappings),
+            skip_nulls=False,
         ).alias('modifications'),
     )
 
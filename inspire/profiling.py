@@ -0,0 +1,362 @@
+""" Functions for profiling the time, memory and I/O used by each stage of the
+    inSPIRE pipeline and by its most expensive functions.
+"""
+from contextlib import contextmanager
+import cProfile
+import functools
+import glob
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows.
+    resource = None
+
+from inspire.constants import ENDC_TEXT, OKCYAN_TEXT
+
+# Set while profiling so that spawned worker processes also record their calls.
+PROFILE_DIR_ENV = 'INSPIRE_PROFILE_DIR'
+
+def _get_bytes_read():
+    """ Function to get the number of bytes read by the current process.
+
+    Returns
+    -------
+    bytes_read : int or None
+        The bytes read, or None if /proc is not available.
+    """
+    try:
+        with open('/proc/self/io', mode='r', encoding='UTF-8') as io_file:
+            for line in io_file:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _get_peak_rss(who='self'):
+    """ Function to get the peak resident set size in MB.
+
+    Parameters
+    ----------
+    who : str
+        Either self for the current process or children for all waited for
+        child processes.
+
+    Returns
+    -------
+    peak_rss : float or None
+        Peak RSS in MB, or None if unavailable.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN
+    ).ru_maxrss
+    # ru_maxrss is given in bytes on macOS but kilobytes on Linux.
+    if sys.platform == 'darwin':
+        usage /= 1024
+    return round(usage/1024, 2)
+
+def _count_rows(result):
+    """ Function to count the rows of a function's output where this is possible.
+    """
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    if hasattr(result, 'shape') and len(result.shape):
+        return int(result.shape[0])
+    if isinstance(result, dict) and result:
+        first_value = next(iter(result.values()))
+        if hasattr(first_value, 'shape') and len(first_value.shape):
+            return int(first_value.shape[0])
+    return None
+
+def profile_function(func):
+    """ Decorator to record the time, rows output, bytes read and peak memory of each
+        call to a function while the pipeline is being profiled. Records are written
+        to a file per process so that calls in worker processes are captured.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile_dir = os.environ.get(PROFILE_DIR_ENV)
+        if profile_dir is None:
+            return func(*args, **kwargs)
+
+        start_bytes = _get_bytes_read()
+        start_time = time.time()
+        start_counter = time.perf_counter()
+        start_cpu = time.process_time()
+        result = func(*args, **kwargs)
+        end_bytes = _get_bytes_read()
+
+        record = {
+            'function': func.__name__,
+            'pid': os.getpid(),
+            'start': start_time,
+            'seconds': time.perf_counter() - start_counter,
+            'cpuSeconds': time.process_time() - start_cpu,
+            'rows': _count_rows(result),
+            'bytesRead': (
+                None if start_bytes is None or end_bytes is None else end_bytes - start_bytes
+            ),
+            'peakRssMb': _get_peak_rss(),
+        }
+        with open(
+            f'{profile_dir}/calls_{os.getpid()}.jsonl', mode='a', encoding='UTF-8'
+        ) as record_file:
+            record_file.write(json.dumps(record) + '\n')
+
+        return result
+
+    return wrapper
+
+class PipelineProfiler:
+    """ Profiler recording the resources used by each stage of a pipeline run.
+        When disabled all methods do nothing.
+    """
+    def __init__(self, output_folder, enabled=False, dump_stats=False):
+        self.enabled = enabled
+        self.dump_stats = dump_stats
+        self.profile_dir = f'{output_folder}/profile'
+        self.stages = []
+        if enabled:
+            if not os.path.exists(self.profile_dir):
+                os.makedirs(self.profile_dir)
+            for call_file in glob.glob(f'{self.profile_dir}/calls_*.jsonl'):
+                os.remove(call_file)
+            os.environ[PROFILE_DIR_ENV] = self.profile_dir
+
+    @contextmanager
+    def stage(self, stage_name):
+        """ Context manager to profile a single pipeline stage.
+
+        Parameters
+        ----------
+        stage_name : str
+            The name of the stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stage_profile = cProfile.Profile() if self.dump_stats else None
+        start_bytes = _get_bytes_read()
+        start_time = time.time()
+        start_counter = time.perf_counter()
+        start_cpu = time.process_time()
+        if stage_profile is not None:
+            stage_profile.enable()
+        try:
+            yield
+        finally:
+            if stage_profile is not None:
+                stage_profile.disable()
+                stage_profile.dump_stats(f'{self.profile_dir}/{stage_name}.prof')
+            end_bytes = _get_bytes_read()
+            self.stages.append({
+                'stage': stage_name,
+                'start': start_time,
+                'end': time.time(),
+                'seconds': time.perf_counter() - start_counter,
+                'cpuSeconds': time.process_time() - start_cpu,
+                'bytesRead': (
+                    None if start_bytes is None or end_bytes is None
+                    else end_bytes - start_bytes
+                ),
+                'peakRssMb': _get_peak_rss(),
+                'childPeakRssMb': _get_peak_rss('children'),
+            })
+
+    def _read_function_records(self):
+        """ Function to read the call records written by all processes.
+        """
+        records = []
+        for call_file in sorted(glob.glob(f'{self.profile_dir}/calls_*.jsonl')):
+            with open(call_file, mode='r', encoding='UTF-8') as record_file:
+                records.extend(json.loads(line) for line in record_file if line.strip())
+        return records
+
+    def summarise(self):
+        """ Function to combine stage and function records into a single report.
+
+        Returns
+        -------
+        report : dict
+            The stage and function summaries.
+        """
+        function_records = self._read_function_records()
+        for record in function_records:
+            record['stage'] = None
+            for stage in self.stages:
+                if stage['start'] <= record['start'] <= stage['end']:
+                    record['stage'] = stage['stage']
+                    break
+
+        # The number of PSMs in the experiment is taken from reading the search results.
+        n_psms = max(
+            (
+                record['rows'] for record in function_records
+                if record['function'] == 'generic_read_df' and record['rows'] is not None
+            ),
+            default=None,
+        )
+
+        stage_summaries = []
+        for stage in self.stages:
+            stage_calls = [
+                record for record in function_records if record['stage'] == stage['stage']
+            ]
+            summary = {
+                key: stage[key] for key in (
+                    'stage', 'seconds', 'cpuSeconds', 'bytesRead', 'peakRssMb',
+                    'childPeakRssMb',
+                )
+            }
+            summary['workerBytesRead'] = sum(
+                record['bytesRead'] for record in stage_calls
+                if record['pid'] != os.getpid() and record['bytesRead'] is not None
+            )
+            summary['psmsPerSecond'] = (
+                None if n_psms is None or not stage['seconds']
+                else n_psms/stage['seconds']
+            )
+            stage_summaries.append(summary)
+
+        function_summaries = {}
+        for record in function_records:
+            key = (record['stage'], record['function'])
+            if key not in function_summaries:
+                function_summaries[key] = {
+                    'stage': record['stage'],
+                    'function': record['function'],
+                    'calls': 0,
+                    'seconds': 0.0,
+                    'cpuSeconds': 0.0,
+                    'rows': 0,
+                    'bytesRead': 0,
+                    'peakRssMb': 0.0,
+                    'processes': set(),
+                }
+            summary = function_summaries[key]
+            summary['calls'] += 1
+            summary['seconds'] += record['seconds']
+            summary['cpuSeconds'] += record['cpuSeconds']
+            summary['rows'] += record['rows'] or 0
+            summary['bytesRead'] += record['bytesRead'] or 0
+            summary['peakRssMb'] = max(summary['peakRssMb'], record['peakRssMb'] or 0.0)
+            summary['processes'].add(record['pid'])
+
+        for summary in function_summaries.values():
+            summary['processes'] = len(summary['processes'])
+            summary['rowsPerSecond'] = (
+                summary['rows']/summary['seconds'] if summary['seconds'] else None
+            )
+
+        return {
+            'nPsms': n_psms,
+            'stages': stage_summaries,
+            'functions': list(function_summaries.values()),
+        }
+
+    def write_report(self):
+        """ Function to write the profile as json and as a summary table to the
+            output folder and print the summary table.
+        """
+        if not self.enabled:
+            return
+
+        report = self.summarise()
+        with open(f'{self.profile_dir}/profile.json', mode='w', encoding='UTF-8') as json_file:
+            json.dump(report, json_file, indent=4)
+
+        summary_table = format_summary_table(report)
+        with open(
+            f'{self.profile_dir}/profile_summary.txt', mode='w', encoding='UTF-8'
+        ) as summary_file:
+            summary_file.write(summary_table)
+
+        print(OKCYAN_TEXT + summary_table + ENDC_TEXT)
+        del os.environ[PROFILE_DIR_ENV]
+
+def _format_value(value, decimals=2):
+    """ Function to format a possibly missing value for the summary table.
+    """
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.{decimals}f}'
+    return str(value)
+
+def _format_rows(header, rows):
+    """ Function to format rows as an aligned plain text table.
+    """
+    widths = [
+        max(len(str(entry)) for entry in column) for column in zip(header, *rows)
+    ]
+    lines = ['  '.join(str(entry).ljust(width) for entry, width in zip(header, widths))]
+    lines.append('  '.join('-'*width for width in widths))
+    for row in rows:
+        lines.append('  '.join(str(entry).ljust(width) for entry, width in zip(row, widths)))
+    return '\n'.join(lines)
+
+def format_summary_table(report):
+    """ Function to create plain text tables summarising a profile report.
+
+    Parameters
+    ----------
+    report : dict
+        The output of PipelineProfiler.summarise.
+
+    Returns
+    -------
+    summary_table : str
+        The stage and function tables.
+    """
+    stage_rows = [
+        [
+            stage['stage'],
+            _format_value(stage['seconds']),
+            _format_value(stage['cpuSeconds']),
+            _format_value(stage['peakRssMb']),
+            _format_value(stage['childPeakRssMb']),
+            _format_value(
+                None if stage['bytesRead'] is None
+                else (stage['bytesRead'] + stage['workerBytesRead'])/1e6
+            ),
+            _format_value(stage['psmsPerSecond'], 1),
+        ] for stage in report['stages']
+    ]
+    function_rows = [
+        [
+            function['stage'] or '-',
+            function['function'],
+            function['calls'],
+            function['processes'],
+            _format_value(function['seconds']),
+            _format_value(function['peakRssMb']),
+            _format_value(function['bytesRead']/1e6),
+            _format_value(function['rowsPerSecond'], 1),
+        ] for function in report['functions']
+    ]
+
+    return (
+        f'\ninSPIRE profile ({_format_value(report["nPsms"])} PSMs)\n\n' +
+        _format_rows(
+            [
+                'Stage', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Child Peak RSS (MB)',
+                'Read (MB)', 'PSMs/s',
+            ],
+            stage_rows,
+        ) + '\n\n' +
+        _format_rows(
+            [
+                'Stage', 'Function', 'Calls', 'Processes', 'Total (s)', 'Peak RSS (MB)',
+                'Read (MB)', 'Rows/s',
+            ],
+            function_rows,
+        ) + '\n'
+    )
@@ -20,6 +20,7 @@ from inspire.constants import (
     PROSIT_PRED_BATCH_SIZE,
     PROSIT_UNMOD_ALPHA_S,
 )
+from inspire.profiling import profile_function
 
 PROSIT_IONS = np.array(
     [
@@ -294,6 +295,7 @@ def sanitize(data):
     return data
 
 
+@profile_function
 def prosit_predict(data, d_model):
     """ Function to predict MS2 spectra or iRT using a Prosit model.
 
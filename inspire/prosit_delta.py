@@ -10,11 +10,11 @@ from inspire.constants import (
     ION_OFFSET,
     KNOWN_PTM_WEIGHTS,
     PEPTIDE_KEY,
-    PTM_SEQ_KEY,
     RESIDUE_WEIGHTS,
     SPECTRAL_ANGLE_KEY,
 )
 from inspire.mz_match import match_mz
+from inspire.utils import get_ptm_code, get_row_ptm_code
 
 DELTA_PRO_FEATURE_SET = (
     'spectralAngle',
@@ -73,29 +73,33 @@ DELTA_PRO_RESIDUE_WEIGHTS['C'] = 103.009185 + 57.021464
 DELTA_PRO_RESIDUE_WEIGHTS['m'] = DELTA_PRO_RESIDUE_WEIGHTS['M'] + KNOWN_PTM_WEIGHTS['Oxidation (M)']
 SIGNIFICANCE_THRESHOLD = -0.05
 
+def _is_oxidised(residue_mods, idx, ox_flag):
+    """ Helper function to check the PTM ID of a residue, returning False outside
+        of the sequence.
+    """
+    return 0 <= idx < len(residue_mods) and residue_mods[idx] == ox_flag
+
 def check_oxidation(pep_len, ptm_seq, idx, ox_flag):
     """ Helper function to check if resiude is oxidised.
     """
-    if not isinstance(ptm_seq, str) or ox_flag not in ptm_seq or idx < 0 or idx > pep_len:
+    ptm_code = get_ptm_code(ptm_seq)
+    if ptm_code is None or idx >= pep_len:
         return 0
-    if ptm_seq[idx+2] == ox_flag:
-        return 1
-    return 0
+    return int(_is_oxidised(ptm_code[1], idx, int(ox_flag)))
 
 def get_mass_diff(peptide, ptm_seq, idx, ox_flag):
     """ Function to find the difference between two residue masses.
     """
-    if not isinstance(ptm_seq, str):
-        return abs(
-            DELTA_PRO_RESIDUE_WEIGHTS[peptide[idx]] - DELTA_PRO_RESIDUE_WEIGHTS[peptide[idx-1]]
-        )
-
     c_wt = DELTA_PRO_RESIDUE_WEIGHTS[peptide[idx]]
     n_wt = DELTA_PRO_RESIDUE_WEIGHTS[peptide[idx-1]]
-    if ptm_seq[idx+2] == ox_flag:
-        c_wt += KNOWN_PTM_WEIGHTS['Oxidation (M)']
-    if ptm_seq[idx+1] == ox_flag:
-        n_wt += KNOWN_PTM_WEIGHTS['Oxidation (M)']
+
+    ptm_code = get_ptm_code(ptm_seq)
+    if ptm_code is not None:
+        ox_flag = int(ox_flag)
+        if _is_oxidised(ptm_code[1], idx, ox_flag):
+            c_wt += KNOWN_PTM_WEIGHTS['Oxidation (M)']
+        if _is_oxidised(ptm_code[1], idx-1, ox_flag):
+            n_wt += KNOWN_PTM_WEIGHTS['Oxidation (M)']
     return abs(c_wt - n_wt)
 
 def get_intes_at_loc(pep_len, matched_intensities, prosit_ions, loc, letter):
@@ -141,9 +145,9 @@ def compute_single_mz(sequence, modifications, ion_type, ion_idx, ptm_id_weights
     ----------
     sequence : str
         The peptide sequence for which we require molecular weights.
-    modifications : str
+    modifications : str or tuple
         A string of the ptms for the sequence which will alter
-        the potential mzs.
+        the potential mzs, or its parsed PTM encoding.
     reverse : bool
         Whether we are getting fragment mzs in the forward direction
         (eg for b ions), or backward direction (eg. for y ions).
@@ -156,20 +160,13 @@ def compute_single_mz(sequence, modifications, ion_type, ion_idx, ptm_id_weights
         An array of all the possible mzs that coule be observed in
         the MS2 spectrum of a sequence.
     """
-    if (
-        modifications and
-        isinstance(modifications, str) and
-        modifications != 'nan'
-        and modifications != 'None'
-    ):
-        ptms_list = modifications.split(".")
-        mods_list = [int(mod) for mod in ptms_list[1]]
-
+    ptm_code = get_ptm_code(modifications)
+    if ptm_code is not None:
         if ion_type == 'y':
-            ptm_start = int(ptms_list[2])
+            _, mods_list, ptm_start = ptm_code
             mods_list = mods_list[::-1]
         else:
-            ptm_start = int(ptms_list[0])
+            ptm_start, mods_list, _ = ptm_code
     else:
         mods_list = None
         ptm_start = 0.0
@@ -557,11 +554,12 @@ def get_deltas(
             ]
         )
 
+        ptm_code = get_row_ptm_code(df_row)
         input_feats[:, C_OX_INDEX] = np.array(
             [
                 check_oxidation(
                     pep_len,
-                    df_row[PTM_SEQ_KEY],
+                    ptm_code,
                     flip_idx,
                     ox_flag,
                 ) for flip_idx in flip_inds
@@ -571,7 +569,7 @@ def get_deltas(
             [
                 check_oxidation(
                     pep_len,
-                    df_row[PTM_SEQ_KEY],
+                    ptm_code,
                     flip_idx-1,
                     ox_flag,
                 ) for flip_idx in flip_inds
@@ -0,0 +1,366 @@
+""" Index of a proteome for fast lookup of the proteins and positions containing
+    a peptide sequence.
+"""
+from bisect import bisect_right
+import hashlib
+import json
+import multiprocessing as mp
+import os
+
+import numpy as np
+import polars as pl
+
+from inspire.constants import PEPTIDE_KEY
+from inspire.utils import (
+    fetch_proteome,
+    fingerprint_file,
+    load_index_arrays,
+    save_index_arrays,
+)
+
+# Increased whenever the arrays stored in the cached index change.
+INDEX_VERSION = 2
+INDEX_ARRAYS = ['names', 'descriptions', 'sequence', 'starts', 'kmers', 'positions']
+KMER_SIZE = 7
+# Residues are hashed to 5 bits, any collisions are removed on verification.
+KMER_BITS = 5
+PROTEIN_SEPARATOR = '\n'
+# Peptides are split into more batches than cores so that the pool balances the load.
+BATCHES_PER_CORE = 4
+# The minimum number of unique peptides remapped by each worker process.
+MIN_REMAP_BATCH_SIZE = 10_000
+
+# Indices attached by the current process, keyed by location.
+_ATTACHED_INDICES = {}
+
+class ProteomeIndex:
+    """ Sorted k-mer index over the I/L-collapsed sequences of a proteome.
+
+    Parameters
+    ----------
+    names : np.array of str
+        The names of the proteins.
+    descriptions : np.array of str
+        The descriptions of the proteins.
+    sequence : np.array of np.uint8
+        The concatenated protein sequences, separated by PROTEIN_SEPARATOR.
+    starts : np.array of int
+        The start position of each protein in the concatenated sequence.
+    kmers : np.array of int
+        The sorted codes of the k-mer starting at each position of the concatenated
+        sequence.
+    positions : np.array of int
+        The position of each sorted k-mer in the concatenated sequence.
+    """
+    def __init__(self, names, descriptions, sequence, starts, kmers, positions):
+        self.names = names
+        self.descriptions = descriptions
+        self.sequence = sequence
+        self.starts = starts
+        self.kmers = kmers
+        self.positions = positions
+        self._start_list = starts.tolist()
+        self._lengths = (np.diff(np.append(starts, sequence.shape[0] + 1)) - 1).tolist()
+
+    @classmethod
+    def build(cls, proteome):
+        """ Function to build the index from a list of proteins.
+
+        Parameters
+        ----------
+        proteome : list of tuple
+            The proteins (position 0 is name, position 1 is sequence and the optional
+            position 2 is description).
+
+        Returns
+        -------
+        proteome_index : ProteomeIndex
+            The index of the proteome.
+        """
+        names = np.array([entry[0] for entry in proteome], dtype=str)
+        descriptions = np.array(
+            [entry[2] if len(entry) > 2 else '' for entry in proteome], dtype=str,
+        )
+        sequence = np.frombuffer(
+            PROTEIN_SEPARATOR.join(
+                entry[1] for entry in proteome
+            ).replace('I', 'L').encode('ascii', errors='replace'),
+            dtype=np.uint8,
+        )
+        protein_lengths = np.array([len(entry[1]) for entry in proteome], dtype=np.int64)
+        starts = np.zeros(len(proteome), dtype=np.int64)
+        starts[1:] = np.cumsum(protein_lengths + 1)[:-1]
+
+        # Padded with empty codes so that every position starts a k-mer and queries
+        # shorter than KMER_SIZE can be answered as a range of k-mer codes.
+        n_kmers = sequence.shape[0]
+        codes = np.zeros(n_kmers + KMER_SIZE - 1, dtype=np.int64)
+        codes[:n_kmers] = sequence & 31
+        kmers = np.zeros(n_kmers, dtype=np.int64)
+        for offset in range(KMER_SIZE):
+            kmers = (kmers << KMER_BITS) | codes[offset:offset+n_kmers]
+
+        # Stable sorting keeps the positions of each k-mer in ascending order.
+        positions = np.argsort(kmers, kind='stable')
+        return cls(names, descriptions, sequence, starts, kmers[positions], positions)
+
+    @classmethod
+    def load(cls, index_loc, mmap_mode=None):
+        """ Function to load an index saved with ProteomeIndex.save.
+
+        Parameters
+        ----------
+        index_loc : str
+            The folder where the index was saved.
+        mmap_mode : str or None (default=None)
+            If set, arrays are memory-mapped rather than read, so that processes
+            loading the same index share a single copy through the page cache.
+        """
+        return cls(*load_index_arrays(index_loc, INDEX_ARRAYS, mmap_mode))
+
+    def save(self, index_loc):
+        """ Function to save the index to disk as a folder of arrays.
+        """
+        save_index_arrays(
+            index_loc, {array_name: getattr(self, array_name) for array_name in INDEX_ARRAYS}
+        )
+
+    def protein_name(self, protein_idx):
+        """ Function to get the name of a protein in the index.
+        """
+        return str(self.names[protein_idx])
+
+    def protein_description(self, protein_idx):
+        """ Function to get the description of a protein in the index.
+        """
+        return str(self.descriptions[protein_idx])
+
+    def _find_positions(self, query):
+        """ Function to find all positions of a query in the concatenated sequence.
+        """
+        kmer_code = 0
+        for residue in query[:KMER_SIZE]:
+            kmer_code = (kmer_code << KMER_BITS) | (residue & 31)
+        shift = KMER_BITS*max(KMER_SIZE - len(query), 0)
+        start_idx = np.searchsorted(self.kmers, kmer_code << shift, side='left')
+        end_idx = np.searchsorted(self.kmers, (kmer_code + 1) << shift, side='left')
+
+        query_len = len(query)
+        positions = [
+            position for position in self.positions[start_idx:end_idx].tolist()
+            if self.sequence[position:position+query_len].tobytes() == query
+        ]
+        if shift:
+            positions.sort()
+        return positions
+
+    def find(self, peptide, reverse=False):
+        """ Function to find all proteins and positions containing a peptide.
+
+        Parameters
+        ----------
+        peptide : str
+            The peptide sequence.
+        reverse : bool (default=False)
+            Flag indicating whether to search the reversed proteome. Reversed
+            proteins are not stored, the reversed peptide is searched instead.
+
+        Returns
+        -------
+        matches : list of tuple
+            The protein index and 0-indexed position of every match, ordered by
+            protein.
+        """
+        peptide = peptide.replace('I', 'L')
+        if not peptide:
+            return []
+
+        query = (peptide[::-1] if reverse else peptide).encode('ascii', errors='replace')
+        matches = []
+        for position in self._find_positions(query):
+            protein_idx = bisect_right(self._start_list, position) - 1
+            position -= self._start_list[protein_idx]
+            if reverse:
+                position = self._lengths[protein_idx] - position - len(peptide)
+            matches.append((protein_idx, position))
+        return matches
+
+    def contains(self, peptide, reverse=False):
+        """ Function to check whether any protein contains a peptide.
+        """
+        return bool(self.find(peptide, reverse=reverse))
+
+def get_proteome_index_loc(proteome, cache_folder):
+    """ Function to get the location of the cached index of a proteome, building the
+        index once per FASTA file.
+
+    Parameters
+    ----------
+    proteome : str
+        The location of the proteome FASTA file.
+    cache_folder : str
+        The folder where the index is cached.
+
+    Returns
+    -------
+    index_loc : str
+        The folder containing the index arrays.
+    """
+    index_key = hashlib.sha256(
+        json.dumps({
+            'indexVersion': INDEX_VERSION,
+            'kmerSize': KMER_SIZE,
+            'proteome': fingerprint_file(proteome),
+        }, sort_keys=True).encode('UTF-8')
+    ).hexdigest()
+    index_loc = f'{cache_folder}/proteomeIndex_{index_key[:16]}'
+    if not os.path.exists(index_loc):
+        ProteomeIndex.build(fetch_proteome(proteome)).save(index_loc)
+    return index_loc
+
+def get_proteome_index(proteome, cache_folder=None):
+    """ Function to get the index of a proteome, built once per FASTA file and cached.
+
+    Parameters
+    ----------
+    proteome : str
+        The location of the proteome FASTA file.
+    cache_folder : str or None (default=None)
+        The folder where the index is cached, if None the index is not cached.
+
+    Returns
+    -------
+    proteome_index : ProteomeIndex
+        The index of the proteome.
+    """
+    if cache_folder is None:
+        return ProteomeIndex.build(fetch_proteome(proteome))
+    return attach_proteome_index(get_proteome_index_loc(proteome, cache_folder))
+
+def attach_proteome_index(index_loc):
+    """ Function to attach to a cached proteome index without copying it, so that worker
+        processes share one copy of the proteome. Each index is attached once per process.
+
+    Parameters
+    ----------
+    index_loc : str
+        The folder containing the index arrays.
+
+    Returns
+    -------
+    proteome_index : ProteomeIndex
+        The memory-mapped index of the proteome.
+    """
+    if index_loc not in _ATTACHED_INDICES:
+        _ATTACHED_INDICES[index_loc] = ProteomeIndex.load(index_loc, mmap_mode='r')
+    return _ATTACHED_INDICES[index_loc]
+
+def get_batch_count(n_peptides, n_cores):
+    """ Function to get the number of peptide batches for remapping with n_cores.
+    """
+    if n_cores <= 1:
+        return 1
+    return max(min(n_cores*BATCHES_PER_CORE, n_peptides), 1)
+
+def parallel_remap(combined_df, n_cores, index_loc, out_column, trace_accession=True):
+    """ Function to remap peptides in a DataFrame to a proteome in parallel.
+
+    Parameters
+    ----------
+    combined_df : pl.DataFrame
+        DataFrame including peptides identified.
+    n_cores : int
+        The number of CPUs that should be used in parallel.
+    index_loc : str
+        The location of the cached proteome index (see get_proteome_index_loc), which
+        workers memory-map rather than receiving a copy of the proteome.
+    out_column : str
+        The name of the column
+    trace_accession : bool (default=True)
+        Flag indicating if full accession should be trace or just a boolean flag if
+        peptide is found in proteome.
+
+    Returns
+    -------
+    combined_df : pl.DataFrame
+        DataFrame including peptides identified with remapped accessions.
+    """
+    return parallel_multi_remap(
+        combined_df, n_cores, {out_column: index_loc}, trace_accession=trace_accession,
+    )
+
+def parallel_multi_remap(combined_df, n_cores, index_locs, trace_accession=True):
+    """ Function to remap peptides in a DataFrame to several proteomes in a single pass
+        over the unique peptides.
+
+    Parameters
+    ----------
+    combined_df : pl.DataFrame
+        DataFrame including peptides identified.
+    n_cores : int
+        The number of CPUs that should be used in parallel.
+    index_locs : dict
+        The location of the cached proteome index (see get_proteome_index_loc) for
+        each output column.
+    trace_accession : bool (default=True)
+        Flag indicating if full accession should be trace or just a boolean flag if
+        peptide is found in proteome.
+
+    Returns
+    -------
+    combined_df : pl.DataFrame
+        DataFrame including peptides identified with remapped accessions.
+    """
+    pep_df = combined_df.select(PEPTIDE_KEY).unique()
+    # Small remaps are not worth starting worker processes for.
+    n_batches = get_batch_count(pep_df.shape[0]//MIN_REMAP_BATCH_SIZE, n_cores)
+
+    if n_batches == 1:
+        remapped_pep_df = _sub_remap(pep_df, index_locs, trace_accession)
+    else:
+        # Peptides are dealt out in turn so that batch sizes differ by at most one.
+        pep_df_list = pep_df.with_row_count('batch').with_columns(
+            pl.col('batch') % n_batches
+        ).partition_by('batch', include_key=False)
+        func_args = [
+            [sub_pep_df, index_locs, trace_accession] for sub_pep_df in pep_df_list
+        ]
+        with mp.get_context('spawn').Pool(processes=min(n_cores, n_batches)) as pool:
+            pep_df_list = pool.starmap(_sub_remap, func_args)
+        remapped_pep_df = pl.concat(pep_df_list)
+
+    combined_df = combined_df.join(remapped_pep_df, how='inner', on=PEPTIDE_KEY)
+
+    return combined_df
+
+def _sub_remap(pep_df, index_locs, trace_accession):
+    peptides = pep_df[PEPTIDE_KEY].to_list()
+    remapped_columns = []
+    for out_column, index_loc in index_locs.items():
+        proteome_index = attach_proteome_index(index_loc)
+        remapped_columns.append(pl.Series(
+            out_column,
+            [
+                remap_to_proteome(peptide, proteome_index, trace_accession=trace_accession)
+                for peptide in peptides
+            ],
+            dtype=pl.Utf8 if trace_accession else pl.Boolean,
+        ))
+    return pep_df.with_columns(remapped_columns)
+
+def remap_to_proteome(
+        peptide,
+        proteome_index,
+        trace_accession=True
+    ):
+    """ Function to check for the presence of an identified peptide as either canonical
+        or spliced in the input proteome.
+    """
+    matches = proteome_index.find(peptide)
+    if not trace_accession:
+        return bool(matches)
+    if not matches:
+        return 'unknown'
+
+    protein_ids = list(dict.fromkeys(protein_idx for protein_idx, _ in matches))
+    return ' '.join(proteome_index.protein_name(protein_idx) for protein_idx in protein_ids)
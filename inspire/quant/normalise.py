@@ -5,7 +5,6 @@
         - source_clean : raw values with null replacement if the measurement is invalid.
         - source_norm : the final normalised value for that source file.
 """
-from math import log2
 import numpy as np
 import pandas as pd
 
@@ -42,28 +41,22 @@ def normalise_intensities(config):
         [PEPTIDE_KEY, ACCESSION_KEY] + [f'{source}_clean' for source in sources]
     ].to_csv(f'{config.output_folder}/quant/cleaned_quantification.csv', index=False)
 
-    # Select relevant columns.
-    quant_df = quant_df[
-        [PEPTIDE_KEY, ACCESSION_KEY, N_VALID_QUANT_KEY]
-        + [f'{source}_clean' for source in sources]
-        + [f'{source}_valid' for source in sources]
-    ]
-
-    for source in sources:
-        quant_df[f'{source}_clean'] = quant_df[f'{source}_clean'].apply(
-            lambda intensity : log2(intensity) if (
-                intensity is not None and intensity > 0
-            ) else None
-        )
+    # Select relevant columns and log transform the clean intensities.
+    quant_df = log_transform_intensities(
+        quant_df[
+            [PEPTIDE_KEY, ACCESSION_KEY, N_VALID_QUANT_KEY]
+            + [f'{source}_clean' for source in sources]
+            + [f'{source}_valid' for source in sources]
+        ],
+        sources,
+    )
 
     # Calculate average.
     quant_df[AVERAGE_QUANT_KEY] = quant_df[
         [f'{source}_clean' for source in sources]
     ].mean(axis=1, skipna=True, numeric_only=True)
 
-    global_median = quant_df[[f'{source}_clean' for source in sources]].median(axis=None)
-    for source in sources:
-        quant_df = equalize_medians(quant_df, source, global_median)
+    quant_df = equalize_medians(quant_df, sources)
 
     plot_distros(quant_df, config, sources)
 
@@ -77,6 +70,44 @@ def normalise_intensities(config):
     plot_quant_clustermap(config)
 
 
+def _get_source_matrix(quant_df, sources, suffix):
+    """ Function to get the values of a column type as a peptide by source matrix.
+    """
+    return quant_df[[f'{source}_{suffix}' for source in sources]].to_numpy(dtype=float)
+
+def _set_source_matrix(quant_df, sources, suffix, values):
+    """ Function to set the columns of a column type from a peptide by source matrix.
+    """
+    columns = [f'{source}_{suffix}' for source in sources]
+    return pd.concat([
+        quant_df.drop(columns=columns, errors='ignore'),
+        pd.DataFrame(values, columns=columns, index=quant_df.index),
+    ], axis=1)
+
+def get_valid_quantifications(quant_df, sources, config):
+    """ Function to find the quantifications which pass the Skyline idotp and
+        background ratio cut offs.
+
+    Parameters
+    ----------
+    quant_df : pd.DataFrame
+        DataFrame of quantified peptides.
+    sources : list of str
+        List of the raw files where the peptide was quantified.
+    config : inspire.config.Config
+        Config object for the whole experiment.
+
+    Returns
+    -------
+    valid_mask : np.array of bool
+        Peptide by source matrix flagging valid quantifications.
+    """
+    return (
+        (_get_source_matrix(quant_df, sources, 'idp') > config.skyline_idp_cut_off) &
+        (_get_source_matrix(quant_df, sources, 'ratio') > config.skyline_bg_ratio_cut_off)
+        # & (_get_source_matrix(quant_df, sources, 'identified') == 1)
+    )
+
 def count_valid_and_identified_quantifications(quant_df, sources, config):
     """ Function find the number of valid quantifications where peptide also
         identified in that file.
@@ -96,16 +127,9 @@ def count_valid_and_identified_quantifications(quant_df, sources, config):
         DataFrame of quantifications with flags indicating if they have valid quantification
         in each file.
     """
-    for source in sources:
-        quant_df[f'{source}_valid'] = quant_df.apply(
-            lambda df_row, src=source : (
-                (df_row[f'{src}_idp'] > config.skyline_idp_cut_off) &
-                (df_row[f'{src}_ratio'] > config.skyline_bg_ratio_cut_off)
-                # & (df_row[f'{src}_identified'] == 1)
-            ),
-            axis=1,
-        )
-    quant_df[N_VALID_QUANT_KEY] = quant_df[[f'{source}_valid' for source in sources]].sum(axis=1)
+    valid_mask = get_valid_quantifications(quant_df, sources, config)
+    quant_df = _set_source_matrix(quant_df, sources, 'valid', valid_mask)
+    quant_df[N_VALID_QUANT_KEY] = valid_mask.sum(axis=1)
 
     return quant_df
 
@@ -127,47 +151,62 @@ def clean_quantification_values(quant_df, sources, config):
         DataFrame of quantifications with quantifications including null replacement for
         invalid quantifications.
     """
-    for source in sources:
-        quant_df[f'{source}_clean'] = quant_df.apply(
-            lambda df_row, src=source : df_row[f'{src}_raw'] if (
-                (df_row[f'{src}_idp'] > config.skyline_idp_cut_off) &
-                (df_row[f'{src}_ratio'] > config.skyline_bg_ratio_cut_off)
-                # & (df_row[f'{src}_identified'] == 1)
-            ) else None,
-            axis=1,
-        )
-
-    return quant_df
-
+    return _set_source_matrix(
+        quant_df,
+        sources,
+        'clean',
+        np.where(
+            get_valid_quantifications(quant_df, sources, config),
+            _get_source_matrix(quant_df, sources, 'raw'),
+            np.nan,
+        ),
+    )
 
-def equalize_medians(quant_df, source, global_median):
-    """ Function to apply equalize medians for raw file normalisation of intensites
-        from a given raw file.
+def log_transform_intensities(quant_df, sources):
+    """ Function to log2 transform the clean intensities of every source, non-positive
+        intensities are set to null.
 
     Parameters
     ----------
     quant_df : pd.DataFrame
         DataFrame of quantified peptides.
-    source : list of str
-        The raw file with intensities to be normalised.
-    config : inspire.config.Config
-        Config object for the whole experiment.
+    sources : list of str
+        List of the raw files where the peptide was quantified.
 
     Returns
     -------
     quant_df : pd.DataFrame
-        DataFrame of quantifications, now including normalised intensities.
+        DataFrame of quantifications with log2 clean intensities.
     """
-    # Split between valid and invalid quantifications:
-    valid_quant_df = quant_df[quant_df[f'{source}_clean'].notna()]
-    invalid_quant_df = quant_df[quant_df[f'{source}_clean'].isna()]
+    intensities = _get_source_matrix(quant_df, sources, 'clean')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_intensities = np.where(intensities > 0, np.log2(intensities), np.nan)
 
-    valid_quant_df[f'{source}_norm'] = (
-        valid_quant_df[f'{source}_clean'] - valid_quant_df[f'{source}_clean'].median()
-    ) + global_median
+    return _set_source_matrix(quant_df, sources, 'clean', log_intensities)
 
-    # Fill with null for invalid samples and combine all entries
-    invalid_quant_df[f'{source}_norm'] = np.nan
-    quant_df = pd.concat([valid_quant_df, invalid_quant_df])
+def equalize_medians(quant_df, sources):
+    """ Function to apply equalize medians for raw file normalisation of intensites,
+        shifting the median of every raw file to the global median.
 
-    return quant_df
+    Parameters
+    ----------
+    quant_df : pd.DataFrame
+        DataFrame of quantified peptides.
+    sources : list of str
+        The raw files with intensities to be normalised.
+
+    Returns
+    -------
+    quant_df : pd.DataFrame
+        DataFrame of quantifications, now including normalised intensities.
+    """
+    clean_df = quant_df[[f'{source}_clean' for source in sources]]
+    global_median = clean_df.median(axis=None)
+    source_medians = clean_df.median(axis=0).to_numpy()
+
+    return _set_source_matrix(
+        quant_df,
+        sources,
+        'norm',
+        (clean_df.to_numpy(dtype=float) - source_medians) + global_median,
+    )
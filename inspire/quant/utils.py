@@ -2,6 +2,7 @@
 """
 from math import log2
 
+import numpy as np
 import pandas as pd
 from plotly.colors import n_colors
 import plotly.express as px
@@ -188,20 +189,15 @@ def plot_distros(quant_df, config, sources):
     sources : list of str
         List of the raw files.
     """
-    all_valids = []
-    for source in sources:
-        valid_quant_df = quant_df[
-            (quant_df[f'{source}_clean'].apply(lambda a : a is not None)) &
-            (quant_df[f'{source}_norm'].apply(lambda a : a is not None))
-        ]
-        valid_quant_df['File'] = source
-        all_valids.append(valid_quant_df[[
-            'File', f'{source}_clean', f'{source}_norm'
-        ]].rename(columns={
-            f'{source}_norm': 'Normalised Intensity',
-            f'{source}_clean': 'Raw Intensity'
-        }))
-    total_df = pd.concat(all_valids)
+    total_df = pd.DataFrame({
+        'File': np.repeat(sources, quant_df.shape[0]),
+        'Raw Intensity': quant_df[
+            [f'{source}_clean' for source in sources]
+        ].to_numpy().ravel(order='F'),
+        'Normalised Intensity': quant_df[
+            [f'{source}_norm' for source in sources]
+        ].to_numpy().ravel(order='F'),
+    })
 
     fig=go.Figure()
     fig.add_trace(go.Violin(
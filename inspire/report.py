@@ -1,11 +1,18 @@
 """ Functions for providing a report at the end of inSPIRE rescoring.
 """
+import hashlib
+import json
+import os
 import pickle
+
+import numpy as np
 import pandas as pd
 import polars as pl
 import yaml
 
+from inspire import __version__
 from inspire.constants import (
+    ACCESSION_STRATUM_KEY,
     CHARGE_KEY,
     DELTA_SCORE_KEY,
     ENDC_TEXT,
@@ -22,10 +29,7 @@ from inspire.constants import (
     PREFIX_KEYS,
     PSM_ID_KEY,
     SUFFIX_KEYS,
-    PRED_ACCESSION_KEY,
-    PRED_PEPTIDE_KEY,
     SEQ_LEN_KEY,
-    TRUE_PEPTIDE_KEY,
 )
 from inspire.figures import (
     create_binders_fig,
@@ -35,7 +39,8 @@ from inspire.figures import (
 )
 from inspire.html_template import create_html_report
 from inspire.input.mhcpan import read_mhcpan_output
-from inspire.rescore import apply_rescoring
+from inspire.rescore import apply_rescoring, read_rescore_output
+from inspire.utils import fingerprint_file
 
 NON_SPECTRAL_FEATURES = [
     ENGINE_SCORE_KEY,
@@ -47,6 +52,15 @@ NON_SPECTRAL_FEATURES = [
     'avgResidueMass',
 ]
 N_PR_STEPS = 200
+# The q-value cut offs reported in searchEngineFdrs.csv and the finer grid plotted.
+REPORT_Q_CUT_OFFS = [0.01*i for i in range(1, 11)]
+FDR_CURVE_Q_CUT_OFFS = np.linspace(0.0001, 0.1, 1000)
+# Feature distributions are plotted from densities on a fixed grid and a sample of outliers.
+DISTRIBUTION_GRID_SIZE = 256
+MAX_DISTRIBUTION_POINTS = 200
+DISTRIBUTION_SEED = 42
+# The non-spectral rescoring has fewer features so is given 1/3 of the cores.
+NON_SPECTRAL_CORE_DIVISOR = 3
 
 def combine_results(output_folder, mhc_pan_df, input_file):
     """ Function to add NetMHCpan predictions to inSPIRE PSMs.
@@ -97,16 +111,46 @@ def combine_results(output_folder, mhc_pan_df, input_file):
 
     return final_assignments_df
 
+def get_non_spectral_cache_key(
+        output_folder,
+        fdr,
+        rescore_method,
+        rescore_command,
+        proteome,
+        use_score_only,
+        rescore_engine,
+        rescore_model,
+    ):
+    """ Function to get the key identifying the non-spectral rescoring of the current
+        features and settings, so that it is not rerun when the report is regenerated.
+    """
+    return hashlib.sha256(
+        json.dumps({
+            'inspireVersion': __version__,
+            'features': fingerprint_file(f'{output_folder}/input_all_features.tab'),
+            'fdr': fdr,
+            'rescoreMethod': rescore_method,
+            'rescoreCommand': rescore_command,
+            'proteome': None if proteome is None else fingerprint_file(proteome),
+            'useScoreOnly': use_score_only,
+            'rescoreEngine': rescore_engine,
+            'rescoreModel': rescore_model,
+        }, sort_keys=True).encode('UTF-8')
+    ).hexdigest()
+
 def apply_non_spectral_percolator(
         output_folder,
         fdr,
         rescore_method,
         rescore_command,
         proteome,
-        use_score_only=False
+        use_score_only=False,
+        rescore_engine='external',
+        n_cores=1,
+        rescore_model='svm',
     ):
     """ Function to apply percolator without spectral features as a comparison with
-        full inSPIRE.
+        full inSPIRE. Results are reused if the features and settings are unchanged.
 
     Parameters
     ----------
@@ -120,52 +164,93 @@ def apply_non_spectral_percolator(
         Path to proteome file is protein inference to be performed.
     use_score_only : bool
         Flag indicating whether or not to use the engine score only.
+    rescore_engine : str (default='external')
+        Either external or inProcess, see inspire.rescore.apply_rescoring.
+    n_cores : int (default=1)
+        The number of cores used by mokapot or the in process engine.
+    rescore_model : str (default='svm')
+        The linear model used by the in process engine, either svm or lda.
 
     Returns
     -------
     non_spectral_psm_df : pd.DataFrame
         A DataFrame of results from Percolator trained without spectral features.
     """
-    all_features_df = pl.from_pandas(
-        pd.read_csv(f'{output_folder}/input_all_features.tab', sep='\t')
-    )
-    all_features_df = all_features_df.filter(
-        pl.col(IN_ACCESSION_KEY[rescore_method]).ne('deNovo')
-    )
-
     prefix_keys = PREFIX_KEYS[rescore_method]
     psm_id_key = PSM_ID_KEY[rescore_method]
+    input_loc = f'{output_folder}/non_spectral_perc_input.tab'
+    cache_key_loc = f'{output_folder}/non_spectral.{rescore_method}.cacheKey'
+    cache_key = get_non_spectral_cache_key(
+        output_folder,
+        fdr,
+        rescore_method,
+        rescore_command,
+        proteome,
+        use_score_only,
+        rescore_engine,
+        rescore_model,
+    )
 
-    if proteome is not None:
-        all_features_df = all_features_df.with_columns(
-            (pl.lit('-.') + pl.col(PEPTIDE_KEY) + pl.lit('.-')).alias(PEPTIDE_KEY)
-        )
+    if (
+        os.path.exists(cache_key_loc) and
+        os.path.exists(f'{output_folder}/non_spectral.{rescore_method}.psms.txt')
+    ):
+        with open(cache_key_loc, mode='r', encoding='UTF-8') as cache_key_file:
+            cached_key = cache_key_file.read().strip()
+    else:
+        cached_key = None
 
-    if use_score_only:
-        non_spectral_df = all_features_df.select(
-            prefix_keys +
-            [ENGINE_SCORE_KEY] +
-            SUFFIX_KEYS
+    if cached_key == cache_key:
+        print(
+            OKCYAN_TEXT + '\tReusing cached non-spectral rescoring.' + ENDC_TEXT
+        )
+        non_spectral_psm_df, _ = read_rescore_output(
+            output_folder, 'non_spectral', rescore_method
+        )
+        non_spectral_df = pl.read_csv(
+            input_loc, separator='\t', columns=[psm_id_key, ENGINE_SCORE_KEY],
         )
     else:
-        non_spectral_df = all_features_df.select(
-            prefix_keys + NON_SPECTRAL_FEATURES + SUFFIX_KEYS[rescore_method]
+        all_features_df = pl.from_pandas(
+            pd.read_csv(f'{output_folder}/input_all_features.tab', sep='\t')
+        )
+        all_features_df = all_features_df.filter(
+            pl.col(IN_ACCESSION_KEY[rescore_method]).ne('deNovo')
         )
 
-    non_spectral_df.write_csv(
-        f'{output_folder}/non_spectral_perc_input.tab',
-        separator='\t',
-    )
+        if proteome is not None:
+            all_features_df = all_features_df.with_columns(
+                (pl.lit('-.') + pl.col(PEPTIDE_KEY) + pl.lit('.-')).alias(PEPTIDE_KEY)
+            )
+
+        if use_score_only:
+            non_spectral_df = all_features_df.select(
+                prefix_keys +
+                [ENGINE_SCORE_KEY] +
+                SUFFIX_KEYS[rescore_method]
+            )
+        else:
+            non_spectral_df = all_features_df.select(
+                prefix_keys + NON_SPECTRAL_FEATURES + SUFFIX_KEYS[rescore_method]
+            )
+
+        non_spectral_df.write_csv(input_loc, separator='\t')
+
+        non_spectral_psm_df, _ = apply_rescoring(
+            output_folder,
+            'non_spectral_perc_input.tab',
+            fdr,
+            rescore_method,
+            'non_spectral',
+            rescore_command,
+            proteome,
+            rescore_engine=rescore_engine,
+            n_cores=n_cores,
+            rescore_model=rescore_model,
+        )
+        with open(cache_key_loc, mode='w', encoding='UTF-8') as cache_key_file:
+            cache_key_file.write(cache_key)
 
-    non_spectral_psm_df, _ = apply_rescoring(
-        output_folder,
-        'non_spectral_perc_input.tab',
-        fdr,
-        rescore_method,
-        'non_spectral',
-        rescore_command,
-        proteome,
-    )
     non_spectral_psm_df = non_spectral_psm_df.rename(
         {OUT_PSM_ID_KEY[rescore_method]: psm_id_key}
     )
@@ -178,52 +263,120 @@ def apply_non_spectral_percolator(
 
     return non_spectral_psm_df
 
-def get_stats_at_cut_off(assignment_df, binders_df, q_cut, q_val_key):
-    """ Function to calculate statistics on the PSMs above a given cut off.
+def get_rescoring_core_budget(n_cores):
+    """ Function to split the cores between final rescoring and the non-spectral
+        rescoring run alongside it.
+
+    Returns
+    -------
+    final_cores : int
+        The number of cores for final rescoring.
+    non_spectral_cores : int
+        The number of cores for the non-spectral rescoring.
+    """
+    non_spectral_cores = max(1, n_cores//NON_SPECTRAL_CORE_DIVISOR)
+    return max(1, n_cores - non_spectral_cores), non_spectral_cores
+
+def start_non_spectral_rescoring(config, executor, n_cores=None):
+    """ Function to submit the non-spectral rescoring used in the report to an executor
+        so that it runs alongside final rescoring.
 
     Parameters
     ----------
-    assignment_df : pd.DataFrame
+    config : inspire.config.Config
+        The settings for the whole pipeline.
+    executor : concurrent.futures.Executor
+        The executor running the rescoring.
+    n_cores : int or None (default=None)
+        The number of cores used, defaults to config.n_cores.
+
+    Returns
+    -------
+    non_spectral_future : concurrent.futures.Future
+        The future of the non-spectral PSMs, see apply_non_spectral_percolator.
+    """
+    return executor.submit(
+        apply_non_spectral_percolator,
+        *_get_non_spectral_args(config),
+        rescore_engine=config.rescore_engine,
+        n_cores=config.n_cores if n_cores is None else n_cores,
+        rescore_model=config.rescore_model,
+    )
+
+def _get_non_spectral_args(config):
+    """ Function to get the output folder, FDR, rescore method, rescore command and
+        proteome of the non-spectral rescoring.
+    """
+    if config.rescore_method == 'mokapot':
+        non_spectral_fdr = 0.05
+    else:
+        non_spectral_fdr = config.fdr
+
+    if config.infer_proteins:
+        proteome = config.proteome
+    else:
+        proteome = None
+
+    return (
+        config.output_folder,
+        non_spectral_fdr,
+        config.rescore_method,
+        config.rescore_command,
+        proteome,
+    )
+
+def get_stats_at_cut_offs(assignment_df, binders_df, q_cut_offs, q_val_key):
+    """ Function to calculate statistics on the PSMs above each of a grid of cut offs
+        from a single sort of the q-values.
+
+    Parameters
+    ----------
+    assignment_df : pl.DataFrame
         A DataFrame of PSM assignments.
     binders_df : pd.DataFrame
         A DataFrame of the predicted MHC binding of the PSMs.
-    q_cut : float
-        The q-value cut off to apply.
+    q_cut_offs : np.array of float
+        The q-value cut offs to apply.
     q_val_key : str
         The name of the column containing q-values.
 
     Returns
     -------
-    psm_count : int
-        The number of psms above the threshold.
-    binders_count : int
-        The number of predicted binders above the threshold.
-    pct_binders : float
+    psm_counts : np.array of int
+        The number of psms above each threshold.
+    binders_counts : np.array of int or None
+        The number of predicted binders above each threshold.
+    pct_binders : np.array of float or None
         The percentage of predicted binders among qualifying PSMs.
     """
-    psm_count = assignment_df.filter(pl.col(q_val_key).lt(q_cut)).shape[0]
-    if binders_df is not None:
-        binders_cut_df = binders_df[binders_df[q_val_key] <= q_cut]
-        binders_divisor = binders_cut_df.shape[0]
-        if binders_divisor > 0:
-            binders_count = binders_cut_df[
-                (binders_cut_df['BindLevel'] == '<=WB') | (binders_cut_df['BindLevel'] == '<=SB')
-            ].shape[0]
-            pct_binders = 100*binders_count/binders_divisor
-        else:
-            binders_count = 0
-            pct_binders = 0
-    else:
-        binders_count = None
-        pct_binders = None
-    return psm_count, binders_count, pct_binders
+    psm_counts = np.searchsorted(
+        np.sort(assignment_df[q_val_key].to_numpy()), q_cut_offs, side='left',
+    )
+    if binders_df is None:
+        return psm_counts, None, None
+
+    binder_q_values = binders_df[q_val_key].to_numpy()
+    order = np.argsort(binder_q_values, kind='stable')
+    is_binder = binders_df['BindLevel'].isin(['<=WB', '<=SB']).to_numpy()[order]
+    cumulative_binders = np.concatenate([[0], np.cumsum(is_binder)])
+
+    binders_divisors = np.searchsorted(binder_q_values[order], q_cut_offs, side='right')
+    binders_counts = cumulative_binders[binders_divisors]
+    pct_binders = np.divide(
+        100*binders_counts,
+        binders_divisors,
+        out=np.zeros(len(q_cut_offs)),
+        where=binders_divisors > 0,
+    )
+    return psm_counts, binders_counts, pct_binders
 
 def calculate_fdr_cut_offs(
         assignment_df,
         non_spectral_df,
         se_q_cut_key,
         binders_df=None,
-        ns_binders_df=None
+        ns_binders_df=None,
+        q_cut_offs=None,
     ):
     """ Function calculate statistics on PSMs at different false discovery rates.
 
@@ -239,40 +392,32 @@ def calculate_fdr_cut_offs(
         A DataFrame of NetMHCpan binders for inSPIRE assignments.
     ns_binders_df : pd.DataFrame or None
         A DataFrame of NetMHCpan binders for Percolator assignments without spectral features.
+    q_cut_offs : list of float or None (default=None)
+        The q-value cut offs, defaults to REPORT_Q_CUT_OFFS.
 
     Returns
     -------
     fdrs_df : pd.DataFrame
         A DataFrame of statistics on PSMs at various FDR thresholds.
     """
-    q_cut_offs = [0.01*i for i in range(1, 11)]
-    n_spire_psms = []
-    n_search_engine_psms = []
-    n_spire_binders = []
-    n_search_engine_binders = []
-    pct_spire_binders = []
-    pct_search_engine_binders = []
-
-    for q_cut in q_cut_offs:
-        car_stats = get_stats_at_cut_off(
-            assignment_df,
-            binders_df,
-            q_cut,
-            FINAL_Q_VALUE_KEY,
-        )
-        n_spire_psms.append(car_stats[0])
-        n_spire_binders.append(car_stats[1])
-        pct_spire_binders.append(car_stats[2])
-
-        se_stats = get_stats_at_cut_off(
-            non_spectral_df,
-            ns_binders_df,
-            q_cut,
-            se_q_cut_key,
-        )
-        n_search_engine_psms.append(se_stats[0])
-        n_search_engine_binders.append(se_stats[1])
-        pct_search_engine_binders.append(se_stats[2])
+    if q_cut_offs is None:
+        q_cut_offs = REPORT_Q_CUT_OFFS
+    q_cut_offs = np.asarray(q_cut_offs)
+
+    n_spire_psms, n_spire_binders, pct_spire_binders = get_stats_at_cut_offs(
+        assignment_df,
+        binders_df,
+        q_cut_offs,
+        FINAL_Q_VALUE_KEY,
+    )
+    (
+        n_search_engine_psms, n_search_engine_binders, pct_search_engine_binders
+    ) = get_stats_at_cut_offs(
+        non_spectral_df,
+        ns_binders_df,
+        q_cut_offs,
+        se_q_cut_key,
+    )
 
     return pd.DataFrame(
         {
@@ -286,64 +431,25 @@ def calculate_fdr_cut_offs(
         }
     )
 
-def _get_counts(all_df, score_cut_off, score_key, acc_grp):
-    """ Function to get the predicted and correct counts above a scoring threshold.
-
-    Parameters
-    ----------
-    all_df : pd.DataFrame
-        A DataFrame of all psms.
-    score_cut_off : float
-        A cut off on psms percolator score.
-    score_key : str
-        The column name of the percolator scores.
-    acc_grp : str
-        The accession group we are interested in.
-
-    Returns
-    -------
-    pred_count : int
-        The number of PSMs for the accession group above the threshold.
-    correct_count : int
-        The number of correct PSMs for the accession group above the threshold.
-    """
-    if acc_grp != 'discoverable':
-        filtered_df = all_df[
-            (all_df[score_key] >= score_cut_off) &
-            (all_df[PRED_ACCESSION_KEY] == acc_grp)
-        ]
-    else:
-        filtered_df = all_df[
-            all_df[score_key] >= score_cut_off
-        ]
-
-    pred_count = filtered_df.shape[0]
-
-    if score_key.startswith('prosit'):
-        pep_key = 'prositOverPeptide'
-    else:
-        pep_key = PRED_PEPTIDE_KEY
-
-    correct_count = filtered_df[filtered_df.apply(
-        lambda x : x[TRUE_PEPTIDE_KEY].replace('I', 'L') == x[pep_key].replace('I', 'L'),
-        axis=1
-    )].shape[0]
-
-    return pred_count, correct_count
-
-
-def generate_report(config):
+def generate_report(config, non_spectral_future=None):
     """ Function for creating a report at the end of ininspire execution.
 
     Parameters
     ----------
     config : inspire.config.Config
         The settings for the whole pipeline.
+    non_spectral_future : concurrent.futures.Future or None (default=None)
+        The non-spectral rescoring started by start_non_spectral_rescoring, if None
+        it is run (or read from the cache) here.
     """
     figures = {}
+    if config.rescore_strata:
+        figures['weights_strata'] = True
+
     figures['table'], most_pos_feats, most_neg_feats = create_weights_table(
         config.output_folder,
         config.rescore_method,
+        rescore_strata=config.rescore_strata,
     )
     figures['violin_fig'] = calculate_distributions(
         config,
@@ -351,23 +457,15 @@ def generate_report(config):
         most_neg_feats
     )
 
-    if config.rescore_method == 'mokapot':
-        non_spectral_fdr = 0.05
-    else:
-        non_spectral_fdr = config.fdr
-
-    if config.infer_proteins:
-        proteome = config.proteome
+    if non_spectral_future is None:
+        non_spectral_df = apply_non_spectral_percolator(
+            *_get_non_spectral_args(config),
+            rescore_engine=config.rescore_engine,
+            n_cores=config.n_cores,
+            rescore_model=config.rescore_model,
+        )
     else:
-        proteome = None
-
-    non_spectral_df = apply_non_spectral_percolator(
-        config.output_folder,
-        non_spectral_fdr,
-        config.rescore_method,
-        config.rescore_command,
-        proteome,
-    )
+        non_spectral_df = non_spectral_future.result()
 
     assignment_df = pl.read_csv(f'{config.output_folder}/finalPsmAssignments.csv')
 
@@ -381,25 +479,26 @@ def generate_report(config):
             f'non_spectral.{config.rescore_method}.psms.txt'
         )
         binders_df.to_csv(f'{config.output_folder}/binderfinalPsmAssignments.csv')
-
-        fdrs_df = calculate_fdr_cut_offs(
-            assignment_df,
-            non_spectral_df,
-            OUT_Q_KEY[config.rescore_method],
-            binders_df,
-            ns_binders_df
-        )
     else:
-        fdrs_df = calculate_fdr_cut_offs(
-            assignment_df,
-            non_spectral_df,
-            OUT_Q_KEY[config.rescore_method],
-        )
+        binders_df = None
+        ns_binders_df = None
+
+    # Both grids are counted in a single pass, the figures use the finer grid.
+    all_fdrs_df = calculate_fdr_cut_offs(
+        assignment_df,
+        non_spectral_df,
+        OUT_Q_KEY[config.rescore_method],
+        binders_df,
+        ns_binders_df,
+        q_cut_offs=np.concatenate([REPORT_Q_CUT_OFFS, FDR_CURVE_Q_CUT_OFFS]),
+    )
+    fdrs_df = all_fdrs_df.iloc[:len(REPORT_Q_CUT_OFFS)]
+    fdr_curve_df = all_fdrs_df.iloc[len(REPORT_Q_CUT_OFFS):].reset_index(drop=True)
 
     if config.use_binding_affinity:
-        figures['binders_fig'] = create_binders_fig(fdrs_df, config.search_engine)
+        figures['binders_fig'] = create_binders_fig(fdr_curve_df, config.search_engine)
 
-    figures['psms_fig'] = create_psms_fig(fdrs_df, config.output_folder)
+    figures['psms_fig'] = create_psms_fig(fdr_curve_df, config.output_folder)
     fdrs_df.to_csv(f'{config.output_folder}/searchEngineFdrs.csv')
     print(
         OKCYAN_TEXT +
@@ -413,30 +512,96 @@ def generate_report(config):
     )
 
 
+def _binned_kde(values):
+    """ Function to estimate the density of values on a grid, binning the values and
+        smoothing the counts with a Gaussian kernel (Silverman's bandwidth).
+    """
+    lower, upper = values.min(), values.max()
+    if lower == upper:
+        return np.array([lower]), np.array([1.0])
+
+    counts, edges = np.histogram(values, bins=DISTRIBUTION_GRID_SIZE, range=(lower, upper))
+    bin_width = edges[1] - edges[0]
+    bandwidth = max(1.06*values.std()*values.size**(-0.2), bin_width)
+    half_width = min(int(np.ceil(4*bandwidth/bin_width)), DISTRIBUTION_GRID_SIZE)
+    kernel = np.exp(-0.5*((np.arange(-half_width, half_width + 1)*bin_width)/bandwidth)**2)
+    density = np.convolve(counts, kernel, mode='full')[
+        half_width:half_width + DISTRIBUTION_GRID_SIZE
+    ]
+    return (edges[:-1] + edges[1:])/2, density/(density.sum()*bin_width)
+
+def summarise_distribution(values, rng):
+    """ Function to summarise the distribution of a feature for plotting, so that the
+        size of the figure does not depend on the number of PSMs.
+
+    Parameters
+    ----------
+    values : np.array of float
+        The feature values.
+    rng : np.random.Generator
+        The generator used to sample outliers.
+
+    Returns
+    -------
+    summary : dict or None
+        The grid and density of the values, their mean, and a sample of at most
+        MAX_DISTRIBUTION_POINTS outliers, None if there are no values.
+    """
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return None
+
+    grid, density = _binned_kde(values)
+    lower_quartile, upper_quartile = np.percentile(values, [25, 75])
+    whisker = 1.5*(upper_quartile - lower_quartile)
+    outliers = values[
+        (values < lower_quartile - whisker) | (values > upper_quartile + whisker)
+    ]
+    if outliers.size > MAX_DISTRIBUTION_POINTS:
+        outliers = rng.choice(outliers, MAX_DISTRIBUTION_POINTS, replace=False)
+
+    return {
+        'grid': grid,
+        'density': density,
+        'mean': float(values.mean()),
+        'points': outliers,
+    }
+
 def calculate_distributions(config, most_positive_features, most_negative_features):
-    """ Function to produce violin plots.
+    """ Function to produce violin plots from summaries of the distributions of the most
+        important features for accepted and rejected PSMs.
     """
     out_score_key = OUT_SCORE_KEY[config.rescore_method]
     psm_id_key = PSM_ID_KEY[config.rescore_method]
+    features = list(dict.fromkeys(most_positive_features + most_negative_features))
 
     out_filename = f'final.{config.rescore_method}.psms.txt'
-    input_df = pd.read_csv(f'{config.output_folder}/final_input.tab', sep='\t')
-    psms_df = pd.read_csv(f'{config.output_folder}/{out_filename}', sep='\t').rename(
-        columns={OUT_PSM_ID_KEY[config.rescore_method]: psm_id_key}
-    )
-
-    psms_df['Status'] = psms_df[out_score_key].apply(
-        lambda x : 'Accepted' if x >= 0 else 'Rejected'
-    )
-
-    combined_df = pd.merge(
-        input_df,
-        psms_df[[psm_id_key, 'Status', OUT_SCORE_KEY[config.rescore_method]]],
-        how='inner',
-        on=psm_id_key,
+    input_df = pl.read_csv(
+        f'{config.output_folder}/final_input.tab',
+        separator='\t',
+        columns=[psm_id_key] + features,
+        infer_schema_length=10_000,
     )
+    psms_df = pl.read_csv(
+        f'{config.output_folder}/{out_filename}',
+        separator='\t',
+        columns=[OUT_PSM_ID_KEY[config.rescore_method], out_score_key],
+    ).rename({OUT_PSM_ID_KEY[config.rescore_method]: psm_id_key})
+
+    combined_df = input_df.join(psms_df, how='inner', on=psm_id_key)
+
+    # Outliers are sampled separately for accepted and rejected PSMs.
+    rng = np.random.default_rng(DISTRIBUTION_SEED)
+    accepted = combined_df[out_score_key].to_numpy() >= 0
+    distributions = {}
+    for feature in features:
+        values = combined_df[feature].cast(pl.Float64).to_numpy()
+        distributions[feature] = {
+            'Accepted': summarise_distribution(values[accepted], rng),
+            'Rejected': summarise_distribution(values[~accepted], rng),
+        }
 
-    violin_plot = create_violin_fig(combined_df, most_positive_features, most_negative_features)
+    violin_plot = create_violin_fig(distributions, most_positive_features, most_negative_features)
 
     return violin_plot
 
@@ -495,7 +660,27 @@ def clean_percolator_weights(weights_path):
         for line in relevant_lines:
             file.write(line)
 
-def create_weights_table(output_folder, rescore_method, acc_idx=None):
+def _transpose_weights(weights_df):
+    """ Function to transpose the weights of each fold to one row per feature, sorted by
+        average weight with the bias term last.
+    """
+    transposed_df = weights_df.transpose()
+
+    weights_df_means = weights_df.mean()
+    weight_keys = [f'weightFold{i}' for i in range(1, 4)]
+    transposed_df.columns = weight_keys
+    transposed_df['feature'] = transposed_df.index
+    transposed_df['averageWeight'] = weights_df_means
+    transposed_df = transposed_df.sort_values(by='averageWeight', ascending=False)
+    m0_df = transposed_df[
+        (transposed_df.index == 'm0') | (transposed_df.index == 'intercept')
+    ]
+    transposed_df = transposed_df[
+        (transposed_df.index != 'm0') & (transposed_df.index != 'intercept')
+    ]
+    return pd.concat([transposed_df, m0_df])
+
+def create_weights_table(output_folder, rescore_method, acc_idx=None, rescore_strata=False):
     """ Function to create a Figure of weights table.
 
     Parameters
@@ -504,6 +689,9 @@ def create_weights_table(output_folder, rescore_method, acc_idx=None):
         The folder where all inspire output is written.
     rescore_method : str
         Indicator of whether mokapot or percolator is in use.
+    rescore_strata : bool (default=False)
+        Whether accession strata were rescored separately, in which case the weights of
+        every stratum are shown.
 
     Returns
     -------
@@ -514,8 +702,27 @@ def create_weights_table(output_folder, rescore_method, acc_idx=None):
     most_neg_feats : list of str
         A list of the most negatively weighted features.
     """
-    if rescore_method == 'mokapot':
-        weights_df = add_mokapot_weights(output_folder, rescore_method, acc_idx)
+    if rescore_strata:
+        strata_weights_df = pd.read_csv(
+            f'{output_folder}/final.{rescore_method}.strata.weights.csv'
+        )
+        strata_weights_df = strata_weights_df[
+            strata_weights_df['weightType'] == 'normalised'
+        ]
+        transposed_dfs = []
+        for stratum, weights_df in strata_weights_df.groupby(
+            ACCESSION_STRATUM_KEY, sort=False
+        ):
+            stratum_df = _transpose_weights(weights_df.drop(
+                [ACCESSION_STRATUM_KEY, 'fold', 'weightType'], axis=1,
+            ).dropna(axis=1, how='all').reset_index(drop=True))
+            stratum_df[ACCESSION_STRATUM_KEY] = stratum
+            transposed_dfs.append(stratum_df)
+        transposed_df = pd.concat(transposed_dfs)
+    elif rescore_method == 'mokapot':
+        transposed_df = _transpose_weights(
+            add_mokapot_weights(output_folder, rescore_method, acc_idx)
+        )
     else:
         if acc_idx is None:
             weights_path = f'{output_folder}/final.{rescore_method}.weights.csv'
@@ -523,36 +730,25 @@ def create_weights_table(output_folder, rescore_method, acc_idx=None):
             weights_path = f'{output_folder}/final_{acc_idx}.{rescore_method}.weights.csv'
         clean_percolator_weights(weights_path)
 
-        weights_df = pd.read_csv(
+        transposed_df = _transpose_weights(pd.read_csv(
             weights_path,
             skiprows=lambda x : x not in [0, 1, 4, 7],
             sep='\t',
-        )
-    transposed_df = weights_df.transpose()
-
-    weights_df_means = weights_df.mean()
-    weight_keys = [f'weightFold{i}' for i in range(1, 4)]
-    transposed_df.columns = weight_keys
-    transposed_df['feature'] = transposed_df.index
-    transposed_df['averageWeight'] = weights_df_means
-    transposed_df = transposed_df.sort_values(by='averageWeight', ascending=False)
-    m0_df = transposed_df[
-        (transposed_df.index == 'm0') | (transposed_df.index == 'intercept')
-    ]
-    transposed_df = transposed_df[
-        (transposed_df.index != 'm0') & (transposed_df.index != 'intercept')
-    ]
-    transposed_df = pd.concat([transposed_df, m0_df])
+        ))
 
+    # Features are ranked by their weight averaged over strata.
+    average_weights = transposed_df.groupby('feature', sort=False)['averageWeight'].mean()
     weights_and_feats = sorted([
-        (ave_wt, feat) for ave_wt, feat in zip(
-            transposed_df.averageWeight.tolist(),
-            transposed_df.feature.tolist()
-        ) if feat != 'm0' and feat != 'intercept' and '_' not in feat
+        (ave_wt, feat) for feat, ave_wt in average_weights.items()
+        if feat != 'm0' and feat != 'intercept' and '_' not in feat
     ])
     most_neg_feats = [x[1] for x in weights_and_feats[:3]]
     most_pos_feats = [x[1] for x in weights_and_feats[-3:]]
     most_pos_feats.reverse()
 
+    if rescore_strata:
+        transposed_df['feature'] = (
+            transposed_df[ACCESSION_STRATUM_KEY] + ': ' + transposed_df['feature']
+        )
     fig = create_weights_fig(transposed_df)
     return fig, most_pos_feats, most_neg_feats
@@ -1,9 +1,10 @@
 """ Functions for rescoring PSMs with an optimised feature set.
 """
+from concurrent.futures import ThreadPoolExecutor
+import os
 from pathlib import Path
 import subprocess
 
-import pandas as pd
 import polars as pl
 
 from inspire.constants import (
@@ -15,6 +16,7 @@ from inspire.constants import (
     FINAL_POSTEP_KEY,
     FINAL_Q_VALUE_KEY,
     FINAL_SCORE_KEY,
+    LABEL_KEY,
     OKCYAN_TEXT,
     OUT_ACCESSION_KEY,
     OUT_POSTEP_KEY,
@@ -22,14 +24,24 @@ from inspire.constants import (
     OUT_SCORE_KEY,
     PEPTIDE_KEY,
     PSM_ID_KEY,
+    PSM_ID_PATTERN,
     RT_KEY,
     SCAN_KEY,
     SOURCE_KEY,
     SPECTRAL_ANGLE_KEY,
+    WARNING_TEXT,
 )
 from inspire.input.mhcpan import read_mhcpan_output
-from inspire.utils import fetch_proteome, parallel_remap
+from inspire.profiling import profile_function
+from inspire.proteome_index import get_proteome_index_loc, parallel_multi_remap
+from inspire.rescore_engine import (
+    apply_in_process_rescoring,
+    apply_saved_model,
+    get_saved_model_files,
+    load_saved_weights,
+)
 
+@profile_function
 def apply_rescoring(
         output_folder,
         input_filename,
@@ -39,6 +51,11 @@ def apply_rescoring(
         rescore_command,
         proteome=None,
         decoy_prot_key='rev_',
+        rescore_engine='external',
+        n_cores=1,
+        rescore_model='svm',
+        rescore_mode='train',
+        model_folder=None,
     ):
     """ Function to apply percolator and return the PSMs matched.
 
@@ -54,12 +71,51 @@ def apply_rescoring(
         A specific filename for the output psms, defaults
     output_weights : bool
         Flag indicating whether or not to output the feature weights.
+    rescore_engine : str (default='external')
+        Either external to run the rescore_command or inProcess to rescore with
+        inspire.rescore_engine (no protein inference is applied in process).
+    n_cores : int (default=1)
+        The number of cores used by mokapot or the in process engine.
+    rescore_model : str (default='svm')
+        The linear model used by the in process engine, either svm or lda.
+    rescore_mode : str (default='train')
+        Either train to train new models or applyModel to score PSMs with the models
+        saved in model_folder by a previous rescoring.
+    model_folder : str or None (default=None)
+        The output folder of the rescoring which saved the models to apply.
 
     Returns
     -------
     results : pd.DataFrame
         The predictions from Percolator.
     """
+    if rescore_mode == 'applyModel':
+        psm_results_df, peptide_results_df = apply_saved_model(
+            output_folder,
+            input_filename,
+            fdr,
+            rescore_method,
+            output_prefix,
+            model_folder,
+        )
+        return _strip_flanking_residues(psm_results_df), _strip_flanking_residues(
+            peptide_results_df
+        )
+
+    if rescore_engine == 'inProcess':
+        psm_results_df, peptide_results_df = apply_in_process_rescoring(
+            output_folder,
+            input_filename,
+            fdr,
+            rescore_method,
+            output_prefix,
+            n_cores,
+            rescore_model,
+        )
+        return _strip_flanking_residues(psm_results_df), _strip_flanking_residues(
+            peptide_results_df
+        )
+
     psm_output_key = f'{output_folder}/{output_prefix}.{rescore_method}.psms.txt'
     pep_output_key = f'{output_folder}/{output_prefix}.{rescore_method}.peptides.txt'
     prot_out_key = f'{output_folder}/{output_prefix}.{rescore_method}.proteins.txt'
@@ -68,7 +124,8 @@ def apply_rescoring(
         clis = (
             f' --dest_dir {output_folder} --keep_decoys  ' +
             f' --train_fdr {fdr} ' +
-            f' --test_fdr {fdr} --file_root {output_prefix} --save_models '
+            f' --test_fdr {fdr} --file_root {output_prefix} --save_models ' +
+            f' --max_workers {n_cores} '
         )
         trailing_args = ''
     elif rescore_method == 'percolatorSeparate':
@@ -99,7 +156,12 @@ def apply_rescoring(
         f'"{rescore_command}" {clis} {output_folder}/{input_filename} {trailing_args}'
     )
 
-    with open(f'{output_folder}/rescore.log', 'w', encoding='UTF-8') as log_file:
+    # Rescoring jobs may run concurrently so only the final job writes to rescore.log.
+    if output_prefix == 'final':
+        log_loc = f'{output_folder}/rescore.log'
+    else:
+        log_loc = f'{output_folder}/{output_prefix}.rescore.log'
+    with open(log_loc, 'w', encoding='UTF-8') as log_file:
         subprocess.run(
             bash_command,
             check=True,
@@ -107,58 +169,93 @@ def apply_rescoring(
             stdout=log_file,
         )
 
-    psm_results_df = pl.read_csv(psm_output_key, separator='\t')
-    psm_results_df = psm_results_df.with_columns(
-        pl.col(PEPTIDE_KEY).apply(lambda x : x[2:-2])
-    )
+    return read_rescore_output(output_folder, output_prefix, rescore_method)
 
-    peptide_results_df = pl.read_csv(pep_output_key, separator='\t')
-    peptide_results_df = peptide_results_df.with_columns(
-        pl.col(PEPTIDE_KEY).apply(lambda x : x[2:-2])
-    )
+def read_rescore_output(output_folder, output_prefix, rescore_method):
+    """ Function to read the target PSMs and peptides written by a rescoring job.
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder in which all output for the pipeline is written.
+    output_prefix : str
+        The prefix of the rescoring output files.
+    rescore_method : str
+        The rescore method used.
+
+    Returns
+    -------
+    psm_results_df : pl.DataFrame
+        The rescored target PSMs.
+    peptide_results_df : pl.DataFrame
+        The rescored target peptides.
+    """
+    psm_results_df = _strip_flanking_residues(pl.read_csv(
+        f'{output_folder}/{output_prefix}.{rescore_method}.psms.txt', separator='\t',
+    ))
+    peptide_results_df = _strip_flanking_residues(pl.read_csv(
+        f'{output_folder}/{output_prefix}.{rescore_method}.peptides.txt', separator='\t',
+    ))
 
     return psm_results_df, peptide_results_df
 
-def _split_psm_ids(psm_id):
-    """ Function for splitting a PSM Id back into its source name, scan number
-        and peptide sequence.
+def _strip_flanking_residues(results_df):
+    """ Function to remove the flanking residues (e.g. -.PEPTIDE.-) from rescored peptides.
+    """
+    return results_df.with_columns(
+        pl.col(PEPTIDE_KEY).str.extract(r'^.{2}(.*).{2}$', 1)
+    )
 
-    Parameters
-    ----------
-    df_row : pd.Series
-        A row of the DataFrame to which the function is being applied.
+def _split_psm_ids(psm_id_key):
+    """ Function to get the expressions splitting a PSM Id back into its source name,
+        scan number and peptide sequence, the source name may itself contain underscores.
 
     Parameters
     ----------
-    df_row : pd.Series
-        The same row with source and scan added.
+    psm_id_key : str
+        The name of the column of PSM Ids.
+
+    Returns
+    -------
+    split_exprs : list of pl.Expr
+        Expressions for the modified sequence, scan and source columns.
     """
-    results = {}
-    source_scan_list = psm_id.split('_')
-    results['modifiedSequence'] = source_scan_list[-1]
-    results[SCAN_KEY] = int(source_scan_list[-2])
-    results[SOURCE_KEY] = '_'.join(source_scan_list[:-2])
-    return results
+    psm_ids = pl.col(psm_id_key)
+    return [
+        psm_ids.str.extract(PSM_ID_PATTERN, 3).alias('modifiedSequence'),
+        psm_ids.str.extract(PSM_ID_PATTERN, 2).cast(pl.Int64).alias(SCAN_KEY),
+        psm_ids.str.extract(PSM_ID_PATTERN, 1).alias(SOURCE_KEY),
+    ]
 
-def _regroup_accession(df_row, acc_cols):
-    """ Helper function to remove one hot encoding from Accession Stratum.
+def _regroup_accession(acc_cols):
+    """ Helper function to get the expression removing the one hot encoding of the
+        accession stratum.
 
     Parameters
     ----------
-    df_row : pd.Series
-        A row of the final results DataFrame.
     acc_cols : list of str
         All of the accession related columns.
 
     Returns
     -------
-    acc_stratum : str
-        The final accession stratum listed in the results.
+    acc_stratum : pl.Expr
+        The first accession stratum flagged, or unknown.
+    """
+    return pl.coalesce([
+        pl.when(pl.col(acc_col).eq(1)).then(pl.lit(acc_col.split('_')[1]))
+        for acc_col in acc_cols
+    ] + [pl.lit('unknown')])
+
+def _label_binding_level(level_col):
+    """ Helper function to get the expression naming the NetMHCpan binding level.
     """
-    for acc_col in acc_cols:
-        if df_row[acc_col] == 1:
-            return acc_col.split('_')[1]
-    return 'unknown'
+    return (
+        pl.when(pl.col(level_col).eq('<=SB')).then(pl.lit('Strong-Binder'))
+        .when(pl.col(level_col).eq('<=WB')).then(pl.lit('Weak-Binder'))
+        .when(pl.col(level_col).is_null()).then(pl.lit('Not predicted'))
+        .otherwise(pl.lit('Non-Binder'))
+        .alias(level_col)
+    )
 
 def _add_key_features(target_psms, config):
     """ Function to add spectral angle and engine score back to percolator
@@ -180,11 +277,7 @@ def _add_key_features(target_psms, config):
     psm_id_key = PSM_ID_KEY[config.rescore_method]
 
     input_key = f'{config.output_folder}/input_all_features.tab'
-    input_df = pl.from_pandas(pd.read_csv(
-        input_key,
-        sep='\t',
-    ))
-    input_df = input_df.unique(subset=[psm_id_key, PEPTIDE_KEY])
+    input_columns = pl.read_csv(input_key, separator='\t', n_rows=0).columns
 
     key_features = [
         SPECTRAL_ANGLE_KEY,
@@ -196,14 +289,26 @@ def _add_key_features(target_psms, config):
         ENGINE_SCORE_KEY,
         CHARGE_KEY,
     ]
+    if isinstance(config.collision_energy, list):
+        key_features.append('collisionEnergy')
+
+    acc_cols = []
     if config.use_accession_stratum:
         acc_cols = [
-            x for x in input_df.columns if x.startswith('accession') and x != 'accessionGroup'
+            x for x in input_columns if x.startswith('accession') and x != 'accessionGroup'
         ]
+
+    # Only the columns reported are read.
+    input_df = pl.read_csv(
+        input_key,
+        separator='\t',
+        columns=[psm_id_key, PEPTIDE_KEY] + key_features + acc_cols,
+        infer_schema_length=None,
+    ).unique(subset=[psm_id_key, PEPTIDE_KEY])
+
+    if config.use_accession_stratum:
         input_df = input_df.with_columns(
-            pl.struct(acc_cols).apply(
-                lambda x : _regroup_accession(x, acc_cols)
-            ).alias(ACCESSION_STRATUM_KEY)
+            _regroup_accession(acc_cols).alias(ACCESSION_STRATUM_KEY)
         )
 
         key_features.append(ACCESSION_STRATUM_KEY)
@@ -228,9 +333,6 @@ def _add_key_features(target_psms, config):
             how='left',
         )
 
-    if isinstance(config.collision_energy, list):
-        key_features.append('collisionEnergy')
-
     output_df = target_psms.join(
         input_df[[psm_id_key, PEPTIDE_KEY] + key_features],
         how='inner',
@@ -238,36 +340,264 @@ def _add_key_features(target_psms, config):
     )
 
     if config.use_binding_affinity is not None:
-        for col in mhc_pan_cols:
-            if col.endswith('Affinity') or col.endswith('%Rank_BA'):
-                output_df = output_df.with_columns(
-                    pl.col(col).fill_null(
-                        pl.lit(-1),
-                    ).alias(col),
-                )
-            else:
-                output_df = output_df.with_columns(
-                    pl.col(col).apply(
-                        lambda x : 'Strong-Binder' if x == '<=SB' else (
-                            'Weak-Binder' if x == '<=WB' else (
-                                'Not predicted' if x is None else
-                            'Non-Binder')
-                        ),
-                        skip_nulls=False,
-                    )
-                )
+        output_df = output_df.with_columns([
+            pl.col(col).fill_null(pl.lit(-1)).alias(col)
+            if col.endswith('Affinity') or col.endswith('%Rank_BA') else
+            _label_binding_level(col)
+            for col in mhc_pan_cols
+        ])
         key_features.extend(mhc_pan_cols)
 
     return output_df, key_features
 
-def final_rescoring(config):
+def get_strata(pin_df, accession_hierarchy):
+    """ Function to get the accession strata of the PSMs in a rescoring input.
+
+    Parameters
+    ----------
+    pin_df : pl.DataFrame
+        The rescoring input, with one hot encoded accession_<stratum> columns.
+    accession_hierarchy : list of str
+        The accession strata defined by the config.
+
+    Returns
+    -------
+    strata : list of tuple
+        The index (as in accession_hierarchy, unknown PSMs last), name and PSM count
+        of each stratum present, largest first.
+    acc_cols : list of str
+        The one hot encoded accession columns.
+    """
+    acc_cols = [col for col in pin_df.columns if col.startswith('accession_')]
+    stratum_counts = pin_df.select(
+        _regroup_accession(acc_cols).alias(ACCESSION_STRATUM_KEY)
+    )[ACCESSION_STRATUM_KEY].value_counts()
+
+    strata = []
+    for stratum, count in stratum_counts.rows():
+        if stratum in accession_hierarchy:
+            acc_idx = accession_hierarchy.index(stratum)
+        else:
+            acc_idx = len(accession_hierarchy)
+        strata.append((acc_idx, stratum, count))
+    return sorted(strata, key=lambda x : (-x[2], x[0])), acc_cols
+
+def get_largest_stratum(output_folder, rescore_method):
+    """ Function to get the largest separately rescored accession stratum.
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder where all inspire output is written.
+    rescore_method : str
+        The rescoring method used.
+
+    Returns
+    -------
+    acc_idx : int
+        The index of the largest stratum, as used in its output file names.
+    stratum : str
+        The name of the largest stratum.
+    """
+    strata_df = pl.read_csv(f'{output_folder}/final.{rescore_method}.strata.csv')
+    return strata_df['accessionIndex'][0], strata_df[ACCESSION_STRATUM_KEY][0]
+
+def get_strata_core_budget(n_cores, psm_counts):
+    """ Function to split the cores between separately rescored strata in proportion to
+        their size, with at least one core each and no more than n_cores in total unless
+        there are more strata than cores.
+
+    Parameters
+    ----------
+    n_cores : int
+        The number of cores available.
+    psm_counts : list of int
+        The number of PSMs in each stratum.
+
+    Returns
+    -------
+    strata_cores : list of int
+        The number of cores for each stratum.
+    """
+    # Every stratum gets one core, the rest are shared by largest remainder.
+    spare_cores = max(0, n_cores - len(psm_counts))
+    total_count = sum(psm_counts)
+    quotas = [spare_cores*psm_count/total_count for psm_count in psm_counts]
+    strata_cores = [1 + int(quota) for quota in quotas]
+    remainder_order = sorted(
+        range(len(quotas)), key=lambda idx : int(quotas[idx]) - quotas[idx]
+    )
+    for stratum_idx in remainder_order[:spare_cores - sum(int(quota) for quota in quotas)]:
+        strata_cores[stratum_idx] += 1
+    return strata_cores
+
+def merge_strata_weights(output_folder, output_prefix, rescore_method, strata):
+    """ Function to merge the model weights of separately rescored accession strata into
+        a single table with a stratum column.
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder where all inspire output is written.
+    output_prefix : str
+        The prefix of the merged output files, each stratum is written with the
+        prefix <output_prefix>_<stratum index>.
+    rescore_method : str
+        The rescoring method used.
+    strata : list of tuple
+        The index and name of each rescored stratum.
+    """
+    weights_dfs = []
+    for acc_idx, stratum in strata:
+        stratum_prefix = f'{output_prefix}_{acc_idx}'
+        if not all(
+            os.path.exists(model_loc) for model_loc in get_saved_model_files(
+                output_folder, rescore_method, stratum_prefix
+            )
+        ):
+            continue
+        for weight_type, normalised in (('normalised', True), ('raw', False)):
+            feature_names, weights, intercepts = load_saved_weights(
+                output_folder, rescore_method, stratum_prefix, normalised=normalised,
+            )
+            weights_dfs.append(pl.DataFrame(
+                weights, schema=feature_names,
+            ).with_columns(
+                pl.Series('m0', intercepts),
+            ).select(
+                pl.lit(stratum).alias(ACCESSION_STRATUM_KEY),
+                pl.arange(1, weights.shape[0] + 1).alias('fold'),
+                pl.lit(weight_type).alias('weightType'),
+                pl.all(),
+            ))
+
+    if weights_dfs:
+        pl.concat(weights_dfs, how='diagonal').write_csv(
+            f'{output_folder}/{output_prefix}.{rescore_method}.strata.weights.csv'
+        )
+
+def apply_stratified_rescoring(config, input_filename, output_prefix, proteome, n_cores):
+    """ Function to rescore each accession stratum separately, running the rescoring
+        of all strata concurrently and merging the results.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The config object used throughout the pipeline.
+    input_filename : str
+        The rescoring input file of PSM features.
+    output_prefix : str
+        The prefix of the merged output files, each stratum is written with the
+        prefix <output_prefix>_<stratum index>.
+    proteome : str or None
+        The proteome used for protein inference.
+    n_cores : int
+        The number of cores shared between strata.
+
+    Returns
+    -------
+    psm_results_df : pl.DataFrame
+        The rescored target PSMs of all strata, q-values are estimated per stratum.
+    peptide_results_df : pl.DataFrame
+        The rescored target peptides of all strata.
+    """
+    pin_df = pl.read_csv(
+        f'{config.output_folder}/{input_filename}', separator='\t', infer_schema_length=None,
+    )
+    strata, acc_cols = get_strata(pin_df, config.accession_hierarchy)
+    pin_df = pin_df.with_columns(
+        _regroup_accession(acc_cols).alias(ACCESSION_STRATUM_KEY)
+    ).drop(acc_cols)
+
+    # Strata without both targets and decoys have no FDR estimate.
+    rescore_strata = []
+    for acc_idx, stratum, psm_count in strata:
+        stratum_df = pin_df.filter(
+            pl.col(ACCESSION_STRATUM_KEY).eq(stratum)
+        ).drop(ACCESSION_STRATUM_KEY)
+        if stratum_df[LABEL_KEY].n_unique() < 2:
+            print(
+                WARNING_TEXT +
+                f'Warning. Accession stratum {stratum} lacks targets or decoys and is ' +
+                'not rescored.' +
+                ENDC_TEXT
+            )
+            continue
+        stratum_df.write_csv(
+            f'{config.output_folder}/{output_prefix}_{acc_idx}_input.tab', separator='\t',
+        )
+        rescore_strata.append((acc_idx, stratum, psm_count))
+    del pin_df
+
+    # Cores are shared in proportion to stratum size, so the largest stratum sets the runtime.
+    strata_cores = get_strata_core_budget(n_cores, [stratum[2] for stratum in rescore_strata])
+    with ThreadPoolExecutor(max_workers=max(1, min(n_cores, len(rescore_strata)))) as pool:
+        futures = [
+            pool.submit(
+                apply_rescoring,
+                config.output_folder,
+                f'{output_prefix}_{acc_idx}_input.tab',
+                config.fdr,
+                config.rescore_method,
+                f'{output_prefix}_{acc_idx}',
+                config.rescore_command,
+                proteome,
+                decoy_prot_key=config.decoy_protein_flag,
+                rescore_engine=config.rescore_engine,
+                n_cores=stratum_cores,
+                rescore_model=config.rescore_model,
+                rescore_mode=config.rescore_mode,
+                model_folder=config.rescore_model_folder,
+            ) for (acc_idx, _, _), stratum_cores in zip(rescore_strata, strata_cores)
+        ]
+        stratum_results = [future.result() for future in futures]
+
+    out_score_key = OUT_SCORE_KEY[config.rescore_method]
+    results_prefix = f'{config.output_folder}/{output_prefix}.{config.rescore_method}'
+    for results_type in ('psms', 'peptides', 'decoy.psms'):
+        stratum_locs = [
+            f'{config.output_folder}/{output_prefix}_{acc_idx}.{config.rescore_method}.' +
+            f'{results_type}.txt' for acc_idx, _, _ in rescore_strata
+        ]
+        if all(os.path.exists(stratum_loc) for stratum_loc in stratum_locs):
+            pl.concat([
+                pl.read_csv(stratum_loc, separator='\t') for stratum_loc in stratum_locs
+            ], how='diagonal').sort(out_score_key, descending=True).write_csv(
+                f'{results_prefix}.{results_type}.txt', separator='\t',
+            )
+
+    pl.DataFrame(
+        rescore_strata, schema=['accessionIndex', ACCESSION_STRATUM_KEY, 'nPsms'], orient='row',
+    ).write_csv(f'{results_prefix}.strata.csv')
+    merge_strata_weights(
+        config.output_folder,
+        output_prefix,
+        config.rescore_method,
+        [(acc_idx, stratum) for acc_idx, stratum, _ in rescore_strata],
+    )
+
+    return (
+        pl.concat([psm_df for psm_df, _ in stratum_results]).sort(
+            out_score_key, descending=True
+        ),
+        pl.concat([peptide_df for _, peptide_df in stratum_results]).sort(
+            out_score_key, descending=True
+        ),
+    )
+
+def final_rescoring(config, n_cores=None):
     """ Function to rescore PSMs using the final feature set.
 
     Parameters
     ----------
     config : inspire.config.Config
         The config object used throughout the pipeline.
+    n_cores : int or None (default=None)
+        The number of cores used for rescoring, defaults to config.n_cores.
     """
+    if n_cores is None:
+        n_cores = config.n_cores
+
     in_path = 'final_input.tab'
     output_prefix = 'final'
 
@@ -276,16 +606,26 @@ def final_rescoring(config):
     else:
         proteome = None
 
-    target_psms, target_peptides = apply_rescoring(
-        config.output_folder,
-        in_path,
-        config.fdr,
-        config.rescore_method,
-        output_prefix,
-        config.rescore_command,
-        proteome,
-        decoy_prot_key=config.decoy_protein_flag,
-    )
+    if config.rescore_strata:
+        target_psms, target_peptides = apply_stratified_rescoring(
+            config, in_path, output_prefix, proteome, n_cores,
+        )
+    else:
+        target_psms, target_peptides = apply_rescoring(
+            config.output_folder,
+            in_path,
+            config.fdr,
+            config.rescore_method,
+            output_prefix,
+            config.rescore_command,
+            proteome,
+            decoy_prot_key=config.decoy_protein_flag,
+            rescore_engine=config.rescore_engine,
+            n_cores=n_cores,
+            rescore_model=config.rescore_model,
+            rescore_mode=config.rescore_mode,
+            model_folder=config.rescore_model_folder,
+        )
 
     print(
         OKCYAN_TEXT + '\tRescoring complete.' + ENDC_TEXT
@@ -321,11 +661,7 @@ def apply_post_processing(target_psms, config):
 
     output_df, key_features = _add_key_features(target_psms, config)
 
-    output_df = output_df.with_columns(
-        pl.col(psm_id_key)
-        .apply(_split_psm_ids, skip_nulls=False)
-        .alias("results")
-    ).unnest("results")
+    output_df = output_df.with_columns(_split_psm_ids(psm_id_key))
 
     output_df = output_df.rename({
         out_score_key: FINAL_SCORE_KEY,
@@ -356,21 +692,17 @@ def apply_post_processing(target_psms, config):
 
 
         if config.proteome is not None:
-            target_proteome = fetch_proteome(config.proteome, with_desc=False)
-            output_df = parallel_remap(
-                output_df,
-                config.n_cores,
-                target_proteome,
-                'mapsToTarget',
-                trace_accession=False,
-            )
-
-            contams_proteome = fetch_proteome(contamns_path, with_desc=False)
-            output_df = parallel_remap(
+            output_df = parallel_multi_remap(
                 output_df,
                 config.n_cores,
-                contams_proteome,
-                'mapsToContaminant',
+                {
+                    'mapsToTarget': get_proteome_index_loc(
+                        config.proteome, config.output_folder
+                    ),
+                    'mapsToContaminant': get_proteome_index_loc(
+                        contamns_path, config.output_folder
+                    ),
+                },
                 trace_accession=False,
             )
         if config.proteome is not None:
@@ -0,0 +1,487 @@
+""" In process semi-supervised rescoring of PSMs, following the iterative target-decoy
+    approach of Percolator.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pickle
+import shutil
+
+import numpy as np
+import polars as pl
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.isotonic import IsotonicRegression
+from sklearn.svm import LinearSVC
+
+from inspire.constants import (
+    ENDC_TEXT,
+    LABEL_KEY,
+    OKCYAN_TEXT,
+    OUT_ACCESSION_KEY,
+    OUT_POSTEP_KEY,
+    OUT_PSM_ID_KEY,
+    OUT_Q_KEY,
+    OUT_SCORE_KEY,
+    PEPTIDE_KEY,
+    PERC_SCAN_ID,
+    PREFIX_KEYS,
+    PSM_ID_KEY,
+    SUFFIX_KEYS,
+    WARNING_TEXT,
+)
+
+N_FOLDS = 3
+N_ITERATIONS = 10
+# Grid of the SVM cost for targets and the ratio of the cost for decoys, as in Percolator.
+SVM_COSTS = [0.1, 1.0, 10.0]
+SVM_DECOY_COST_RATIOS = [1.0, 3.0, 10.0]
+# PSMs are assigned to cross validation folds by scan, as in Percolator.
+FOLD_SEED = 1
+
+def calculate_q_values(scores, labels):
+    """ Function to calculate target-decoy q-values, (decoys + 1)/targets, for every PSM.
+
+    Parameters
+    ----------
+    scores : np.array of float
+        The score of each PSM.
+    labels : np.array of int
+        The label of each PSM, 1 for targets and -1 for decoys.
+
+    Returns
+    -------
+    q_values : np.array of float
+        The q-value of each PSM in input order.
+    """
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    is_decoy = labels[order] != 1
+    fdrs = np.minimum(
+        (np.cumsum(is_decoy) + 1)/np.maximum(np.cumsum(~is_decoy), 1), 1.0,
+    )
+
+    # PSMs with tied scores are all accepted or rejected together.
+    tie_ends = np.searchsorted(-sorted_scores, -sorted_scores, side='right') - 1
+    sorted_q_values = np.minimum.accumulate(fdrs[::-1])[::-1][tie_ends]
+
+    q_values = np.empty_like(sorted_q_values)
+    q_values[order] = sorted_q_values
+    return q_values
+
+def calculate_peps(scores, labels):
+    """ Function to estimate the posterior error probability of each PSM from the ratio
+        of decoys to targets at its score, fitted by isotonic regression.
+
+    Parameters
+    ----------
+    scores : np.array of float
+        The score of each PSM.
+    labels : np.array of int
+        The label of each PSM, 1 for targets and -1 for decoys.
+
+    Returns
+    -------
+    peps : np.array of float
+        The posterior error probability of each PSM.
+    """
+    is_decoy = (labels != 1).astype(float)
+    if not is_decoy.any() or is_decoy.all():
+        return is_decoy
+
+    decoy_probs = IsotonicRegression(
+        increasing=False, y_min=0.0, y_max=1.0, out_of_bounds='clip',
+    ).fit(scores, is_decoy).predict(scores)
+    with np.errstate(divide='ignore'):
+        peps = decoy_probs/(1.0 - decoy_probs)
+    return np.minimum(peps, 1.0)
+
+def _get_initial_weights(features, labels, fdr):
+    """ Function to start training from the single feature, in either direction, which
+        identifies most targets at the FDR.
+    """
+    best_count, best_idx, best_sign = -1, 0, 1
+    for feature_idx in range(features.shape[1]):
+        for sign in (1, -1):
+            q_values = calculate_q_values(sign*features[:, feature_idx], labels)
+            target_count = np.sum(q_values[labels == 1] <= fdr)
+            if target_count > best_count:
+                best_count, best_idx, best_sign = target_count, feature_idx, sign
+
+    weights = np.zeros(features.shape[1])
+    weights[best_idx] = best_sign
+    return weights
+
+def _fit_model(features, labels, train_idx, fdr, model_type):
+    """ Function to fit a linear classifier, selecting the SVM costs which accept most
+        targets at the FDR.
+    """
+    if model_type == 'lda':
+        model = LinearDiscriminantAnalysis().fit(features[train_idx], labels[train_idx])
+        return model.coef_[0], float(model.intercept_[0])
+
+    best_count, best_model = -1, None
+    for cost in SVM_COSTS:
+        for decoy_cost_ratio in SVM_DECOY_COST_RATIOS:
+            model = LinearSVC(
+                C=cost, class_weight={1: 1.0, -1: decoy_cost_ratio}, dual=False,
+            ).fit(features[train_idx], labels[train_idx])
+            q_values = calculate_q_values(features @ model.coef_[0], labels)
+            target_count = np.sum(q_values[labels == 1] <= fdr)
+            if target_count > best_count:
+                best_count, best_model = target_count, model
+    return best_model.coef_[0], float(best_model.intercept_[0])
+
+def _train_fold(features, labels, fdr, model_type):
+    """ Function to train a linear model on a training fold, iteratively refitting with
+        all decoys and the targets accepted at the FDR by the previous model.
+
+    Returns
+    -------
+    weights : np.array of float
+        The feature weights.
+    intercept : float
+        The intercept of the model.
+    threshold : float
+        The score at the FDR cut off on the training fold.
+    scale : float
+        The distance from the median decoy score to the threshold.
+    """
+    weights = _get_initial_weights(features, labels, fdr)
+    intercept = 0.0
+    for _ in range(N_ITERATIONS):
+        q_values = calculate_q_values(features @ weights + intercept, labels)
+        train_idx = (labels != 1) | (q_values <= fdr)
+        if not np.any(labels[train_idx] == 1) or np.all(labels[train_idx] == 1):
+            break
+        weights, intercept = _fit_model(features, labels, train_idx, fdr, model_type)
+
+    # Scores are normalised so that the FDR cut off is 0 and the median decoy is -1.
+    scores = features @ weights + intercept
+    q_values = calculate_q_values(scores, labels)
+    accepted = (labels == 1) & (q_values <= fdr)
+    threshold = scores[accepted].min() if accepted.any() else scores.max()
+    scale = threshold - np.median(scores[labels != 1]) if np.any(labels != 1) else 1.0
+    if scale <= 0:
+        scale = 1.0
+    return weights, intercept, threshold, scale
+
+def rescore_psms(features, labels, scan_ids, fdr, n_cores, model_type='svm'):
+    """ Function to score PSMs with models trained by cross validation, each fold being
+        trained in a separate thread.
+
+    Parameters
+    ----------
+    features : np.array of float
+        The features of each PSM, shape (n PSMs, n features).
+    labels : np.array of int
+        The label of each PSM, 1 for targets and -1 for decoys.
+    scan_ids : np.array of int
+        The scan of each PSM, PSMs of the same scan are kept in the same fold.
+    fdr : float
+        The false discovery rate used to select training targets.
+    n_cores : int
+        The number of folds trained in parallel.
+    model_type : str (default='svm')
+        Either svm for a linear SVM or lda for linear discriminant analysis.
+
+    Returns
+    -------
+    scores : np.array of float
+        The score of each PSM from the model not trained on its fold.
+    fold_weights : list of tuple
+        The weights and intercept of each fold on normalised and on raw features.
+    """
+    means = features.mean(axis=0)
+    stds = features.std(axis=0)
+    stds[stds == 0] = 1.0
+    normed_features = (features - means)/stds
+
+    _, scan_idx = np.unique(scan_ids, return_inverse=True)
+    scan_folds = np.random.default_rng(FOLD_SEED).permutation(scan_idx.max() + 1) % N_FOLDS
+    folds = scan_folds[scan_idx]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(n_cores, N_FOLDS))) as pool:
+        fold_models = list(pool.map(
+            _train_fold,
+            [normed_features[folds != fold_idx] for fold_idx in range(N_FOLDS)],
+            [labels[folds != fold_idx] for fold_idx in range(N_FOLDS)],
+            [fdr]*N_FOLDS,
+            [model_type]*N_FOLDS,
+        ))
+
+    scores = np.zeros(features.shape[0])
+    fold_weights = []
+    for fold_idx, (weights, intercept, threshold, scale) in enumerate(fold_models):
+        test_idx = folds == fold_idx
+        scores[test_idx] = (normed_features[test_idx] @ weights + intercept - threshold)/scale
+        fold_weights.append((
+            np.append(weights, intercept),
+            np.append(weights/stds, intercept - np.sum(weights*means/stds)),
+        ))
+    return scores, fold_weights
+
+def _add_confidence(scored_df, rescore_method):
+    """ Function to add q-values and PEPs to scored PSMs or peptides.
+    """
+    scores = scored_df[OUT_SCORE_KEY[rescore_method]].to_numpy()
+    labels = scored_df[LABEL_KEY].to_numpy()
+    return scored_df.with_columns(
+        pl.Series(OUT_Q_KEY[rescore_method], calculate_q_values(scores, labels)),
+        pl.Series(OUT_POSTEP_KEY[rescore_method], calculate_peps(scores, labels)),
+    )
+
+def _format_results(scored_df, rescore_method):
+    """ Function to select the columns of Percolator output from scored PSMs.
+    """
+    return scored_df.select([
+        pl.col(PSM_ID_KEY[rescore_method]).alias(OUT_PSM_ID_KEY[rescore_method]),
+        OUT_SCORE_KEY[rescore_method],
+        OUT_Q_KEY[rescore_method],
+        OUT_POSTEP_KEY[rescore_method],
+        PEPTIDE_KEY,
+        pl.col(SUFFIX_KEYS[rescore_method][1]).alias(OUT_ACCESSION_KEY[rescore_method]),
+    ])
+
+def apply_in_process_rescoring(
+        output_folder,
+        input_filename,
+        fdr,
+        rescore_method,
+        output_prefix,
+        n_cores,
+        model_type='svm',
+    ):
+    """ Function to rescore PSMs in process, writing output files in the format of
+        Percolator.
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder in which all output for the pipeline is written.
+    input_filename : str
+        The Percolator input file of PSM features.
+    fdr : float
+        The false discovery rate used in training and to select PSMs.
+    rescore_method : str
+        Either percolator or percolatorSeparate, both apply target-decoy competition
+        per scan as Percolator does with --post-processing-tdc.
+    output_prefix : str
+        The prefix of all output files.
+    n_cores : int
+        The number of cross validation folds trained in parallel.
+    model_type : str (default='svm')
+        Either svm for a linear SVM or lda for linear discriminant analysis.
+
+    Returns
+    -------
+    psm_results_df : pl.DataFrame
+        The target PSMs with scores, q-values and PEPs.
+    peptide_results_df : pl.DataFrame
+        The best target PSM of each peptide with scores, q-values and PEPs.
+    """
+    id_keys = PREFIX_KEYS[rescore_method] + SUFFIX_KEYS[rescore_method]
+    pin_df = pl.read_csv(
+        f'{output_folder}/{input_filename}', separator='\t', infer_schema_length=10_000,
+    )
+    feature_names = [col for col in pin_df.columns if col not in id_keys]
+
+    scores, fold_weights = rescore_psms(
+        pin_df.select(feature_names).to_numpy().astype(np.float64),
+        pin_df[LABEL_KEY].to_numpy(),
+        pin_df[PERC_SCAN_ID].to_numpy(),
+        fdr,
+        n_cores,
+        model_type,
+    )
+    results_prefix = f'{output_folder}/{output_prefix}.{rescore_method}'
+    psm_results_df, peptide_results_df = _write_results(
+        pin_df.select(id_keys), scores, rescore_method, results_prefix,
+    )
+
+    # Percolator weights format, normalised then raw weights for each fold.
+    with open(f'{results_prefix}.weights.csv', mode='w', encoding='UTF-8') as weights_file:
+        for normed_weights, raw_weights in fold_weights:
+            weights_file.write('\t'.join(feature_names + ['m0']) + '\n')
+            weights_file.write('\t'.join(str(weight) for weight in normed_weights) + '\n')
+            weights_file.write('\t'.join(str(weight) for weight in raw_weights) + '\n')
+
+    return psm_results_df, peptide_results_df
+
+def _write_results(id_df, scores, rescore_method, results_prefix):
+    """ Function to apply target-decoy competition to scored PSMs, add q-values and PEPs,
+        and write target and decoy PSMs and peptides in the format of the rescore method.
+    """
+    score_key = OUT_SCORE_KEY[rescore_method]
+    scored_df = id_df.with_columns(
+        pl.Series(score_key, scores)
+    ).sort(score_key, descending=True)
+    # Both percolator methods are run with --post-processing-tdc, keeping the best PSM
+    # of each scan.
+    scored_df = scored_df.unique(subset=PERC_SCAN_ID, keep='first', maintain_order=True)
+
+    psm_df = _add_confidence(scored_df, rescore_method)
+    peptide_df = _add_confidence(
+        scored_df.unique(subset=PEPTIDE_KEY, keep='first', maintain_order=True),
+        rescore_method,
+    )
+
+    psm_results_df = _format_results(psm_df.filter(pl.col(LABEL_KEY).eq(1)), rescore_method)
+    peptide_results_df = _format_results(
+        peptide_df.filter(pl.col(LABEL_KEY).eq(1)), rescore_method
+    )
+    psm_results_df.write_csv(f'{results_prefix}.psms.txt', separator='\t')
+    peptide_results_df.write_csv(f'{results_prefix}.peptides.txt', separator='\t')
+    _format_results(psm_df.filter(pl.col(LABEL_KEY).ne(1)), rescore_method).write_csv(
+        f'{results_prefix}.decoy.psms.txt', separator='\t',
+    )
+    return psm_results_df, peptide_results_df
+
+def get_saved_model_files(model_folder, rescore_method, output_prefix):
+    """ Function to get the locations of the models saved by a previous rescoring, the
+        Percolator weights or the pickled mokapot model of each fold.
+    """
+    if rescore_method == 'mokapot':
+        return [
+            f'{model_folder}/{output_prefix}.mokapot.model_fold-{fold_idx}.pkl'
+            for fold_idx in range(1, N_FOLDS + 1)
+        ]
+    return [f'{model_folder}/{output_prefix}.{rescore_method}.weights.csv']
+
+def load_saved_weights(model_folder, rescore_method, output_prefix, normalised=False):
+    """ Function to load the feature weights of models saved by a previous rescoring.
+
+    Parameters
+    ----------
+    model_folder : str
+        The output folder of the rescoring which saved the models.
+    rescore_method : str
+        The rescore method used to train the models.
+    output_prefix : str
+        The prefix of the saved model files.
+    normalised : bool (default=False)
+        Whether to load the weights on standardised rather than unscaled features.
+
+    Returns
+    -------
+    feature_names : list of str
+        The features used by the models.
+    weights : np.array of float
+        The weights of each model, shape (n models, n features).
+    intercepts : np.array of float
+        The intercept of each model.
+    """
+    if rescore_method == 'mokapot':
+        weights = []
+        intercepts = []
+        for model_loc in get_saved_model_files(model_folder, rescore_method, output_prefix):
+            with open(model_loc, 'rb') as model_file:
+                model = pickle.load(model_file)
+            # mokapot models are trained on standardised features.
+            means = getattr(model.scaler, 'mean_', 0.0)
+            scales = getattr(model.scaler, 'scale_', 1.0)
+            coefs = model.estimator.coef_[0]
+            if normalised:
+                weights.append(coefs)
+                intercepts.append(model.estimator.intercept_[0])
+                continue
+            weights.append(coefs/scales)
+            intercepts.append(model.estimator.intercept_[0] - np.sum(coefs*means/scales))
+        return list(model.features), np.array(weights), np.array(intercepts)
+
+    with open(
+        get_saved_model_files(model_folder, rescore_method, output_prefix)[0],
+        mode='r',
+        encoding='UTF-8',
+    ) as weights_file:
+        lines = [line.rstrip('\n').split('\t') for line in weights_file if not line.startswith('#')]
+
+    # Each fold is written as a header, the normalised weights, and the raw weights.
+    feature_names = lines[0][:-1]
+    fold_weights = np.array(lines[1::3] if normalised else lines[2::3], dtype=np.float64)
+    return feature_names, fold_weights[:, :-1], fold_weights[:, -1]
+
+def apply_saved_model(
+        output_folder,
+        input_filename,
+        fdr,
+        rescore_method,
+        output_prefix,
+        model_folder,
+    ):
+    """ Function to score PSMs with models saved by a previous rescoring rather than
+        training, writing output files in the format of the rescore method.
+
+    Parameters
+    ----------
+    output_folder : str
+        The folder in which all output for the pipeline is written.
+    input_filename : str
+        The rescoring input file of PSM features.
+    fdr : float
+        The false discovery rate, only used to report the PSMs accepted.
+    rescore_method : str
+        The rescore method used to train the models.
+    output_prefix : str
+        The prefix of the saved model files and of all output files.
+    model_folder : str
+        The output folder of the rescoring which saved the models.
+
+    Returns
+    -------
+    psm_results_df : pl.DataFrame
+        The target PSMs with scores, q-values and PEPs.
+    peptide_results_df : pl.DataFrame
+        The best target PSM of each peptide with scores, q-values and PEPs.
+    """
+    feature_names, weights, intercepts = load_saved_weights(
+        model_folder, rescore_method, output_prefix
+    )
+    id_keys = PREFIX_KEYS[rescore_method] + SUFFIX_KEYS[rescore_method]
+    pin_df = pl.read_csv(
+        f'{output_folder}/{input_filename}', separator='\t', infer_schema_length=10_000,
+    )
+
+    input_features = [col for col in pin_df.columns if col not in id_keys]
+    missing_features = [feature for feature in feature_names if feature not in input_features]
+    if missing_features:
+        raise ValueError(
+            f'Features {missing_features} used by the models in {model_folder} are ' +
+            'missing from the rescoring input, the models must be retrained.'
+        )
+    extra_features = [feature for feature in input_features if feature not in feature_names]
+    if extra_features:
+        print(
+            WARNING_TEXT +
+            f'Warning. Features {extra_features} of the rescoring input are not used by ' +
+            'the saved models and are ignored.' +
+            ENDC_TEXT
+        )
+    elif input_features != feature_names:
+        print(
+            OKCYAN_TEXT +
+            '\tThe rescoring input features are reordered to match the saved models.' +
+            ENDC_TEXT
+        )
+
+    # The scores of all folds are averaged, as when a model is applied to new data.
+    scores = (
+        pin_df.select(feature_names).to_numpy().astype(np.float64) @ weights.T + intercepts
+    ).mean(axis=1)
+
+    results_prefix = f'{output_folder}/{output_prefix}.{rescore_method}'
+    psm_results_df, peptide_results_df = _write_results(
+        pin_df.select(id_keys), scores, rescore_method, results_prefix,
+    )
+
+    # Saved models are copied so that the report shows the weights applied.
+    for model_loc in get_saved_model_files(model_folder, rescore_method, output_prefix):
+        output_loc = f'{output_folder}/{os.path.basename(model_loc)}'
+        if not os.path.exists(output_loc) or not os.path.samefile(model_loc, output_loc):
+            shutil.copyfile(model_loc, output_loc)
+
+    n_accepted = psm_results_df.filter(pl.col(OUT_Q_KEY[rescore_method]) <= fdr).shape[0]
+    print(
+        OKCYAN_TEXT +
+        f'\tApplied saved models, {n_accepted} PSMs accepted at {fdr} FDR.' +
+        ENDC_TEXT
+    )
+    return psm_results_df, peptide_results_df
@@ -1,184 +1,209 @@
 """ Functions for calculating difference between predicted and detected
     retention times.
 """
-import os
-
-import pandas as pd
+import numpy as np
 import polars as pl
-from pyteomics import achrom
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import KFold
 
 from inspire.constants import (
     ACCESSION_STRATUM_KEY,
     LABEL_KEY,
     PEPTIDE_KEY,
     RT_KEY,
+    SOURCE_KEY,
     SPECTRAL_ANGLE_KEY,
 )
+from inspire.profiling import profile_function
+from inspire.rt_alignment import (
+    calibrate_retention_times,
+    get_rt_folds,
+    get_rt_scales,
+    predict_retention_times,
+    COEFFICIENT_KEY,
+    HIGH_CONFIDENCE_QUANTILE,
+    IRT_KEY,
+)
 
-def _add_achrom_rt_preds(train_df, test_df):
-    """ Function to fit and predict achrom's predictor.
+# The length correction parameters searched by achrom.get_RCs_vary_lcp at its
+# default accuracy over the range (-1.0, 1.0).
+ACHROM_LCP_GRID = np.arange(-1.0, 1.0, 0.2)
+UNSEEN_RESIDUE_FACTOR = 0.956
+
+def get_composition_matrix(peptides):
+    """ Function to count the residues of each unique peptide.
 
     Parameters
     ----------
-    train_df : pd.DataFrame
-        A DataFrame on which to fit the retention time predictor.
-    test_df : pd.DataFrame
-        A DataFrame on which to predict retention time.
+    peptides : np.array of str
+        The peptide of each PSM.
 
     Returns
     -------
-    test_df : pd.DataFrame
-        The input test_df with predRT as a new column.
+    residues : list of str
+        The residues present in the peptides.
+    counts : np.array of float
+        The number of each residue in each unique peptide.
+    log_lengths : np.array of float
+        The log of the length of each unique peptide.
+    peptide_idx : np.array of int
+        The index of each PSM's peptide in the unique peptides.
     """
-    retention_time_model = achrom.get_RCs_vary_lcp(
-        train_df[PEPTIDE_KEY],
-        train_df['retentionTime'],
-        lcp_range=(-1.0, 1.0),
-        term_aa=False,
-        rcond=None
-    )
+    unique_peptides, peptide_idx = np.unique(peptides, return_inverse=True)
+    lengths = np.array([len(peptide) for peptide in unique_peptides])
+    codes = np.frombuffer(''.join(unique_peptides).encode('ascii'), dtype=np.uint8)
+
+    residue_codes = np.unique(codes)
+    residue_idx = np.zeros(256, dtype=np.int64)
+    residue_idx[residue_codes] = np.arange(residue_codes.shape[0])
+
+    peptide_rows = np.repeat(np.arange(unique_peptides.shape[0]), lengths)
+    counts = np.bincount(
+        peptide_rows*residue_codes.shape[0] + residue_idx[codes],
+        minlength=unique_peptides.shape[0]*residue_codes.shape[0],
+    ).reshape(unique_peptides.shape[0], residue_codes.shape[0]).astype(float)
+
+    return [chr(code) for code in residue_codes], counts, np.log(lengths), peptide_idx
+
+def _add_achrom_rt_preds(residues, counts, log_lengths, train_idx, train_rts):
+    """ Function to fit achrom's additive retention time model, choosing the length
+        correction parameter from the grid searched by achrom.get_RCs_vary_lcp.
 
-    if 'C' not in retention_time_model['aa']:
-        retention_time_model['aa']['C'] = retention_time_model['aa']['P']*0.956
-    if 'W' not in retention_time_model['aa']:
-        retention_time_model['aa']['W'] = retention_time_model['aa']['P']*0.956
+    Parameters
+    ----------
+    residues : list of str
+        The residues present in the peptides.
+    counts : np.array of float
+        The number of each residue in each unique peptide.
+    log_lengths : np.array of float
+        The log of the length of each unique peptide.
+    train_idx : np.array of int
+        The unique peptide index of each training PSM.
+    train_rts : np.array of float
+        The retention time of each training PSM.
+
+    Returns
+    -------
+    pred_rts : np.array of float
+        The predicted retention time of each unique peptide.
+    """
+    train_counts = counts[train_idx]
+    seen = train_counts.any(axis=0)
+    train_counts = train_counts[:, seen]
+
+    grid_fits = []
+    for lcp in ACHROM_LCP_GRID:
+        design = np.column_stack([
+            train_counts*(1.0 + lcp*log_lengths[train_idx])[:, np.newaxis],
+            np.ones(train_idx.shape[0]),
+        ])
+        coefs = np.linalg.lstsq(design, train_rts, rcond=None)[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.nan_to_num(np.corrcoef(train_rts, design @ coefs)[0, 1], nan=-np.inf)
+        grid_fits.append((corr, lcp, coefs))
+
+    # The first of equally correlated fits is kept.
+    _, best_lcp, best_coefs = grid_fits[int(np.argmax([fit[0] for fit in grid_fits]))]
+
+    # As in achrom usage, residues unseen in training take a scaled proline coefficient.
+    residue_coefs = np.zeros(len(residues))
+    residue_coefs[seen] = best_coefs[:-1]
+    if 'P' in residues and seen[residues.index('P')]:
+        residue_coefs[~seen] = residue_coefs[residues.index('P')]*UNSEEN_RESIDUE_FACTOR
+
+    return (counts @ residue_coefs)*(1.0 + best_lcp*log_lengths) + best_coefs[-1]
+
+def _add_achrom_delta_rt(combined_df):
+    """ Function to calculate deltaRT with achrom's predictor when iRT predictions
+        are missing, each fold is predicted by a model fitted on the other folds.
 
-    pred_rts = test_df[PEPTIDE_KEY].apply(
-        lambda x :  achrom.calculate_RT(x, retention_time_model, raise_no_mod=False)
+    Parameters
+    ----------
+    combined_df : pl.DataFrame
+        A DataFrame of PSMs from a single scan file.
+
+    Returns
+    -------
+    combined_df : pl.DataFrame
+        The DataFrame updated with predRT and deltaRT columns.
+    """
+    residues, counts, log_lengths, peptide_idx = get_composition_matrix(
+        combined_df[PEPTIDE_KEY].to_numpy()
+    )
+    folds = get_rt_folds(combined_df.shape[0])
+    retention_times = combined_df[RT_KEY].to_numpy()
+    spectral_angles = combined_df[SPECTRAL_ANGLE_KEY].to_numpy()
+
+    train_mask = np.ones(combined_df.shape[0], dtype=bool)
+    if ACCESSION_STRATUM_KEY in combined_df.columns:
+        train_mask &= combined_df[ACCESSION_STRATUM_KEY].eq(0).to_numpy()
+    if LABEL_KEY in combined_df.columns:
+        train_mask &= combined_df[LABEL_KEY].eq(1).to_numpy()
+
+    pred_rts = np.zeros(combined_df.shape[0])
+    for fold in np.unique(folds):
+        train = train_mask & (folds != fold)
+        top_spec_angle_cut = pl.Series(spectral_angles[train]).quantile(
+            HIGH_CONFIDENCE_QUANTILE
+        )
+        train &= spectral_angles > top_spec_angle_cut
+        fold_pred_rts = _add_achrom_rt_preds(
+            residues, counts, log_lengths, peptide_idx[train], retention_times[train],
+        )
+        pred_rts[folds == fold] = fold_pred_rts[peptide_idx[folds == fold]]
+
+    return combined_df.with_columns(
+        pl.Series('predRT', pred_rts),
+        pl.Series('deltaRT', np.abs(pred_rts - retention_times)),
     )
-    return pred_rts
 
-def add_delta_irt(combined_df, config, scan_file):
+@profile_function
+def add_delta_irt(combined_df, config, scan_file, fits_df=None):
     """ Function to calculate difference between predicted and observed retention
         time for each PSM.
 
     Parameters
     ----------
-    combined_df : pd.DataFrame
+    combined_df : pl.DataFrame
         A DataFrame of PSMs.
+    config : inspire.config.Config
+        The Config object for the experiment.
+    scan_file : str
+        The name of the scan file the PSMs come from.
+    fits_df : pl.DataFrame or None (default=None)
+        The iRT calibrations of all scan files, if None the scan file is calibrated
+        on its own.
 
     Returns
     -------
-    combined_df : pd.DataFrame
-        The DataFrame updated with a deltaRT column.
+    combined_df : pl.DataFrame
+        The DataFrame updated with predRT and deltaRT columns.
     """
     if combined_df[RT_KEY].n_unique() <= 1:
-        combined_df['deltaRT'] = 0
-        return combined_df
-
-    kfold = KFold(n_splits=10, shuffle=True, random_state=42)
-    combined_df_list = []
-    coefficents = []
-    intercepts = []
-
-    if 'iRT' in combined_df.columns:
-        combined_df_irt_null_count = combined_df.filter(
-            pl.col('iRT').is_null()
-        ).shape[0]
-    else:
-        combined_df_irt_null_count = 1
+        return combined_df.with_columns(pl.lit(0.0).alias('deltaRT'))
+
+    if IRT_KEY not in combined_df.columns or combined_df[IRT_KEY].null_count():
+        return _add_achrom_delta_rt(combined_df)
 
+    rt_source = str(scan_file)
+    if fits_df is None:
+        fits_df = calibrate_retention_times(config, {rt_source: combined_df.lazy()})
+
+    irt_df = combined_df.select(pl.lit(rt_source).alias(SOURCE_KEY), pl.col(IRT_KEY))
     if config.rt_fit_loc is not None:
-        if os.path.exists(f'{config.rt_fit_loc}/rt_fit_{scan_file}.csv'):
-            rt_df = pd.read_csv(f'{config.rt_fit_loc}/rt_fit_{scan_file}.csv')
+        # Calibrations from another experiment are averaged over folds.
+        if rt_source not in fits_df[SOURCE_KEY].to_list():
+            fits_df = fits_df.filter(
+                pl.col(SOURCE_KEY).eq(fits_df[SOURCE_KEY].min())
+            ).with_columns(pl.lit(rt_source).alias(SOURCE_KEY))
         else:
-            rt_dfs = [x for x in os.listdir(config.rt_fit_loc) if x.startswith('rt_fit')]
-            rt_df = pd.read_csv(f'{config.rt_fit_loc}/{rt_dfs[0]}')
+            fits_df = fits_df.filter(pl.col(SOURCE_KEY).eq(rt_source))
+        rt_scale = get_rt_scales(fits_df)[COEFFICIENT_KEY][0]
+        pred_rts = predict_retention_times(irt_df, fits_df, cross_fit=False)
+    else:
+        rt_scale = 1.0
+        pred_rts = predict_retention_times(irt_df, fits_df)
 
-        coef = rt_df['coefficents'].mean()
-        intercept = rt_df['intercepts'].mean()
-        combined_df = combined_df.with_columns(
-            pl.col('iRT').apply(lambda x : (x*coef)+ intercept).alias('predRT')
-        )
-        combined_df = combined_df.with_columns(
-            (pl.col('predRT') - pl.col('retentionTime')).truediv(coef).abs().alias('deltaRT')
-        )
-        return combined_df
-
-    try:
-        for train, test in kfold.split(combined_df):
-            train_df = combined_df[train, :]
-            test_df = combined_df[test, :]
-
-            if ACCESSION_STRATUM_KEY in train_df.columns:
-                train_df = train_df.filter(
-                    pl.col(ACCESSION_STRATUM_KEY).eq(0)
-                )
-
-            if LABEL_KEY in train_df.columns:
-                train_df = train_df.filter(
-                    pl.col(LABEL_KEY).eq(1)
-                )
-
-            top_spec_angle_cut = train_df[SPECTRAL_ANGLE_KEY].quantile(0.9)
-            train_df = train_df.filter(
-                (pl.col(SPECTRAL_ANGLE_KEY) > top_spec_angle_cut)
-            )
-
-            if combined_df_irt_null_count > 0:
-                test_df['predRT'] = _add_achrom_rt_preds(train_df, test_df)
-            else:
-                reg = LinearRegression().fit(
-                    train_df.select('iRT').to_numpy(),
-                    train_df[RT_KEY].to_numpy(),
-                )
-                coefficents.append(reg.coef_[0])
-                intercepts.append(reg.intercept_)
-                pred_rt = pl.Series(
-                    reg.predict(test_df.select('iRT').to_numpy())
-                )
-                test_df = test_df.with_columns(
-                    pred_rt.alias('predRT')
-                )
-
-            test_df = test_df.with_columns(
-                (pl.col('predRT') - pl.col('retentionTime')).abs().alias('deltaRT')
-            )
-            combined_df_list.append(test_df)
-    except ValueError:
-        try:
-            # Simplest way to avoid errors on tiny files.
-            train_df = train_df.filter(pl.col(LABEL_KEY).eq(1))
-            reg = LinearRegression().fit(
-                train_df.select('iRT').to_numpy(),
-                train_df[RT_KEY].to_numpy(),
-            )
-            coefficents.append(reg.coef_[0])
-            intercepts.append(reg.intercept_)
-            pred_rt = pl.Series(
-                reg.predict(combined_df.select('iRT').to_numpy())
-            )
-            combined_df = combined_df.with_columns(
-                pred_rt.alias('predRT')
-            )
-            combined_df = combined_df.with_columns(
-                (pl.col('predRT') - pl.col('retentionTime')).abs().alias('deltaRT')
-            )
-        except ValueError:
-            reg = LinearRegression().fit(
-                combined_df.select('iRT').to_numpy(),
-                combined_df[RT_KEY].to_numpy(),
-            )
-            coefficents.append(reg.coef_[0])
-            intercepts.append(reg.intercept_)
-            pred_rt = pl.Series(
-                reg.predict(combined_df.select('iRT').to_numpy())
-            )
-            combined_df = combined_df.with_columns(
-                pred_rt.alias('predRT')
-            )
-            combined_df = combined_df.with_columns(
-                (pl.col('predRT') - pl.col('retentionTime')).abs().alias('deltaRT')
-            )
-
-
-    rt_df = pd.DataFrame({
-        'coefficents': coefficents,
-        'intercepts': intercepts,
-    })
-    if scan_file is not None:
-        rt_df.to_csv(f'{config.output_folder}/rt_fit_{scan_file}.csv', index=False)
-
-    return pl.concat(combined_df_list)
+    return combined_df.with_columns(
+        pred_rts.alias('predRT'),
+    ).with_columns(
+        (pl.col('predRT') - pl.col(RT_KEY)).truediv(rt_scale).abs().alias('deltaRT')
+    )
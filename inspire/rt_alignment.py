@@ -0,0 +1,407 @@
+""" Functions for calibrating predicted iRT to observed retention time across all
+    scan files of an experiment.
+"""
+import os
+
+import numpy as np
+import polars as pl
+from sklearn.model_selection import KFold
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+from inspire.constants import (
+    ACCESSION_STRATUM_KEY,
+    ENDC_TEXT,
+    LABEL_KEY,
+    OKCYAN_TEXT,
+    RT_KEY,
+    SOURCE_KEY,
+    SPECTRAL_ANGLE_KEY,
+    WARNING_TEXT,
+)
+from inspire.profiling import profile_function
+
+RT_CALIBRATION_FILE = 'rtCalibration.csv'
+RT_FIT_METHODS = ('linear', 'robust', 'lowess')
+
+IRT_KEY = 'iRT'
+FOLD_KEY = 'fold'
+SEGMENT_START_KEY = 'iRTStart'
+COEFFICIENT_KEY = 'coefficient'
+INTERCEPT_KEY = 'intercept'
+FIT_METHOD_KEY = 'fitMethod'
+CALIBRATION_COLUMNS = [
+    SOURCE_KEY, FOLD_KEY, SEGMENT_START_KEY, COEFFICIENT_KEY, INTERCEPT_KEY, FIT_METHOD_KEY,
+]
+
+N_RT_FOLDS = 10
+HIGH_CONFIDENCE_QUANTILE = 0.9
+
+# Huber weights for the robust fit.
+HUBER_EPSILON = 1.35
+ROBUST_ITERATIONS = 10
+
+# LOWESS fits are stored as piecewise linear segments between knots.
+LOWESS_FRACTION = 0.2
+LOWESS_KNOTS = 50
+
+_WEIGHT_KEY = 'rtFitWeight'
+_ROW_KEY = 'rtRowIndex'
+
+def get_rt_folds(n_rows):
+    """ Function to assign the PSMs of a scan file to cross fitting folds.
+
+    Parameters
+    ----------
+    n_rows : int
+        The number of PSMs in the scan file.
+
+    Returns
+    -------
+    folds : np.array of int
+        The fold of each PSM, each is predicted by the fit excluding its fold.
+    """
+    if n_rows < N_RT_FOLDS:
+        return np.arange(n_rows)
+
+    folds = np.empty(n_rows, dtype=np.int64)
+    kfold = KFold(n_splits=N_RT_FOLDS, shuffle=True, random_state=42)
+    for fold, (_, test_idx) in enumerate(kfold.split(np.arange(n_rows))):
+        folds[test_idx] = fold
+    return folds
+
+def _weighted_lines(train_df):
+    """ Function to fit a weighted least squares line of retention time against iRT
+        for every source.
+    """
+    weight = pl.col(_WEIGHT_KEY)
+    irt_mean = (weight*pl.col(IRT_KEY)).sum()/weight.sum()
+    rt_mean = (weight*pl.col(RT_KEY)).sum()/weight.sum()
+    coefficient = (
+        (weight*(pl.col(IRT_KEY) - irt_mean)*(pl.col(RT_KEY) - rt_mean)).sum() /
+        (weight*(pl.col(IRT_KEY) - irt_mean).pow(2)).sum()
+    )
+    return train_df.group_by(SOURCE_KEY).agg(
+        pl.lit(-np.inf).alias(SEGMENT_START_KEY),
+        coefficient.alias(COEFFICIENT_KEY),
+        (rt_mean - coefficient*irt_mean).alias(INTERCEPT_KEY),
+    )
+
+def _fit_lines(train_df, fit_method):
+    """ Function to fit a linear or Huber robust calibration for every source at once.
+    """
+    train_df = train_df.select(
+        SOURCE_KEY, IRT_KEY, RT_KEY, pl.lit(1.0).alias(_WEIGHT_KEY),
+    )
+    lines_df = _weighted_lines(train_df)
+    for _ in range(ROBUST_ITERATIONS if fit_method == 'robust' else 0):
+        residual = (
+            pl.col(RT_KEY) - pl.col(COEFFICIENT_KEY)*pl.col(IRT_KEY) - pl.col(INTERCEPT_KEY)
+        ).abs()
+        train_df = train_df.join(
+            lines_df, how='left', on=SOURCE_KEY,
+        ).with_columns(
+            residual.alias('residual'),
+        ).with_columns(
+            (HUBER_EPSILON*pl.col('residual').median().over(SOURCE_KEY)/0.6745).alias('scale'),
+        ).select(
+            SOURCE_KEY,
+            IRT_KEY,
+            RT_KEY,
+            pl.when((pl.col('residual') > pl.col('scale')) & (pl.col('scale') > 0))
+                .then(pl.col('scale')/pl.col('residual'))
+                .otherwise(1.0).alias(_WEIGHT_KEY),
+        )
+        lines_df = _weighted_lines(train_df)
+
+    return lines_df
+
+def _fit_lowess(train_df):
+    """ Function to fit a LOWESS calibration for every source, stored as the
+        segments between knots at quantiles of iRT.
+    """
+    segment_dfs = []
+    for source_df in train_df.partition_by(SOURCE_KEY):
+        irts = source_df[IRT_KEY].to_numpy()
+        knots = np.unique(np.quantile(irts, np.linspace(0, 1, LOWESS_KNOTS)))
+        if knots.shape[0] < 2:
+            continue
+        knot_rts = lowess(
+            source_df[RT_KEY].to_numpy(), irts, frac=LOWESS_FRACTION, xvals=knots,
+        )
+        finite = np.isfinite(knot_rts)
+        knots, knot_rts = knots[finite], knot_rts[finite]
+        if knots.shape[0] < 2:
+            continue
+
+        coefficients = np.diff(knot_rts)/np.diff(knots)
+        segment_dfs.append(pl.DataFrame({
+            SOURCE_KEY: source_df[SOURCE_KEY][0],
+            SEGMENT_START_KEY: np.append(-np.inf, knots[1:-1]),
+            COEFFICIENT_KEY: coefficients,
+            INTERCEPT_KEY: knot_rts[:-1] - coefficients*knots[:-1],
+        }))
+
+    if not segment_dfs:
+        return pl.DataFrame(schema={
+            SOURCE_KEY: pl.Utf8,
+            SEGMENT_START_KEY: pl.Float64,
+            COEFFICIENT_KEY: pl.Float64,
+            INTERCEPT_KEY: pl.Float64,
+        })
+    return pl.concat(segment_dfs)
+
+def fit_rt_calibrations(calibration_df, fit_method='linear'):
+    """ Function to fit the cross fitted iRT to retention time calibration of every
+        source. Each fold is fitted on the high confidence PSMs of the other folds.
+
+    Parameters
+    ----------
+    calibration_df : pl.DataFrame
+        The source, fold, iRT, retention time, spectral angle, and optionally label
+        and accession stratum of each PSM.
+    fit_method : str (default='linear')
+        The calibration model, linear, robust (Huber), or lowess.
+
+    Returns
+    -------
+    fits_df : pl.DataFrame
+        The calibration segments of each source and fold.
+    """
+    fit_dfs = []
+    for fold in calibration_df[FOLD_KEY].unique().sort().to_list():
+        train_df = calibration_df.filter(pl.col(FOLD_KEY).ne(fold))
+        if ACCESSION_STRATUM_KEY in train_df.columns:
+            train_df = train_df.filter(pl.col(ACCESSION_STRATUM_KEY).eq(0))
+        if LABEL_KEY in train_df.columns:
+            train_df = train_df.filter(pl.col(LABEL_KEY).eq(1))
+        train_df = train_df.filter(
+            pl.col(SPECTRAL_ANGLE_KEY) > pl.col(SPECTRAL_ANGLE_KEY).quantile(
+                HIGH_CONFIDENCE_QUANTILE
+            ).over(SOURCE_KEY)
+        )
+
+        if fit_method == 'lowess':
+            fold_df = _fit_lowess(train_df)
+        else:
+            fold_df = _fit_lines(train_df, fit_method)
+        fit_dfs.append(fold_df.with_columns(pl.lit(fold, dtype=pl.Int64).alias(FOLD_KEY)))
+
+    fits_df = pl.concat(fit_dfs).filter(
+        pl.col(COEFFICIENT_KEY).is_finite() & pl.col(INTERCEPT_KEY).is_finite()
+    )
+
+    # Folds with too few PSMs to fit use a line fitted to all targets of their source.
+    missing_df = calibration_df.select(SOURCE_KEY, FOLD_KEY).unique().join(
+        fits_df, how='anti', on=[SOURCE_KEY, FOLD_KEY]
+    )
+    if missing_df.shape[0]:
+        if LABEL_KEY in calibration_df.columns:
+            fallback_df = calibration_df.filter(pl.col(LABEL_KEY).eq(1))
+        else:
+            fallback_df = calibration_df
+        missing_df = missing_df.join(
+            _fit_lines(fallback_df, 'linear'), how='left', on=SOURCE_KEY,
+        ).with_columns(
+            pl.col(SEGMENT_START_KEY).fill_null(-np.inf),
+            pl.when(pl.col(COEFFICIENT_KEY).is_finite()).then(pl.col(COEFFICIENT_KEY))
+                .otherwise(1.0).alias(COEFFICIENT_KEY),
+            pl.when(pl.col(COEFFICIENT_KEY).is_finite()).then(pl.col(INTERCEPT_KEY))
+                .otherwise(0.0).alias(INTERCEPT_KEY),
+        )
+        fits_df = pl.concat([fits_df, missing_df.select(fits_df.columns)])
+
+    return fits_df.with_columns(pl.lit(fit_method).alias(FIT_METHOD_KEY)).select(
+        CALIBRATION_COLUMNS
+    ).sort(SOURCE_KEY, FOLD_KEY, SEGMENT_START_KEY)
+
+def predict_retention_times(irt_df, fits_df, cross_fit=True):
+    """ Function to predict retention time from iRT with the calibration of each source.
+
+    Parameters
+    ----------
+    irt_df : pl.DataFrame
+        DataFrame containing the source and iRT of each PSM.
+    fits_df : pl.DataFrame
+        The calibration segments of each source and fold.
+    cross_fit : bool (default=True)
+        Whether each PSM is predicted by the fit excluding its fold, otherwise
+        predictions are averaged over all folds.
+
+    Returns
+    -------
+    pred_rts : pl.Series
+        The predicted retention time of each PSM.
+    """
+    pred_df = irt_df.select(
+        pl.col(SOURCE_KEY), pl.col(IRT_KEY).cast(pl.Float64),
+    ).with_row_count(_ROW_KEY)
+    if cross_fit:
+        pred_df = pred_df.with_columns(
+            pl.Series(FOLD_KEY, get_rt_folds(pred_df.shape[0]))
+        )
+    else:
+        pred_df = pred_df.join(
+            fits_df.select(SOURCE_KEY, FOLD_KEY).unique(), how='left', on=SOURCE_KEY,
+        )
+
+    return pred_df.sort(IRT_KEY).join_asof(
+        fits_df.sort(SEGMENT_START_KEY),
+        left_on=IRT_KEY,
+        right_on=SEGMENT_START_KEY,
+        by=[SOURCE_KEY, FOLD_KEY],
+        strategy='backward',
+    ).group_by(_ROW_KEY).agg(
+        (pl.col(IRT_KEY)*pl.col(COEFFICIENT_KEY) + pl.col(INTERCEPT_KEY)).mean().alias('predRT')
+    ).sort(_ROW_KEY)['predRT']
+
+def get_rt_scales(fits_df):
+    """ Function to get the average slope of each source's calibration, used to
+        convert retention time differences to iRT units.
+
+    Parameters
+    ----------
+    fits_df : pl.DataFrame
+        The calibration segments of each source and fold.
+
+    Returns
+    -------
+    scales_df : pl.DataFrame
+        The slope of each source, non-positive slopes are replaced with 1.
+    """
+    return fits_df.group_by(SOURCE_KEY).agg(
+        pl.col(COEFFICIENT_KEY).mean()
+    ).with_columns(
+        pl.when(pl.col(COEFFICIENT_KEY) > 0).then(pl.col(COEFFICIENT_KEY))
+            .otherwise(1.0).alias(COEFFICIENT_KEY)
+    )
+
+def read_rt_calibration_file(file_loc):
+    """ Function to read a table of calibrations.
+    """
+    return pl.read_csv(
+        file_loc,
+        dtypes={
+            SOURCE_KEY: pl.Utf8,
+            FOLD_KEY: pl.Int64,
+            SEGMENT_START_KEY: pl.Float64,
+            COEFFICIENT_KEY: pl.Float64,
+            INTERCEPT_KEY: pl.Float64,
+            FIT_METHOD_KEY: pl.Utf8,
+        },
+    )
+
+def read_rt_calibrations(folder):
+    """ Function to read the calibrations written to a folder, including the per file
+        rt_fit csv files written by earlier versions of inSPIRE.
+
+    Parameters
+    ----------
+    folder : str
+        The folder containing the calibrations.
+
+    Returns
+    -------
+    fits_df : pl.DataFrame or None
+        The calibration segments of each source and fold, None if there are none.
+    """
+    if os.path.exists(f'{folder}/{RT_CALIBRATION_FILE}'):
+        return read_rt_calibration_file(f'{folder}/{RT_CALIBRATION_FILE}')
+
+    legacy_files = sorted(
+        file_name for file_name in os.listdir(folder)
+        if file_name.startswith('rt_fit_') and file_name.endswith('.csv')
+    )
+    if not legacy_files:
+        return None
+
+    legacy_dfs = []
+    for file_name in legacy_files:
+        legacy_df = pl.read_csv(f'{folder}/{file_name}')
+        legacy_dfs.append(pl.DataFrame({
+            SOURCE_KEY: file_name[len('rt_fit_'):-len('.csv')],
+            FOLD_KEY: np.arange(legacy_df.shape[0]),
+            SEGMENT_START_KEY: -np.inf,
+            COEFFICIENT_KEY: legacy_df['coefficents'].cast(pl.Float64),
+            INTERCEPT_KEY: (
+                legacy_df['intercepts'].cast(pl.Float64) if 'intercepts' in legacy_df.columns
+                else np.zeros(legacy_df.shape[0])
+            ),
+            FIT_METHOD_KEY: 'linear',
+        }))
+    return pl.concat(legacy_dfs)
+
+def write_rt_calibrations(fits_df, output_folder):
+    """ Function to write the calibrations of all sources to a single table.
+    """
+    fits_df.write_csv(f'{output_folder}/{RT_CALIBRATION_FILE}')
+
+def _can_calibrate(features_df):
+    """ Function to check if a scan file has iRT predictions for all PSMs and varying
+        retention times.
+    """
+    return (
+        IRT_KEY in features_df.columns and
+        features_df[IRT_KEY].null_count() == 0 and
+        features_df[RT_KEY].n_unique() > 1
+    )
+
+@profile_function
+def calibrate_retention_times(config, file_features):
+    """ Function to get the iRT calibrations of all scan files, fitted together in one
+        batch, reused from an earlier run, or read from rtFitLoc.
+
+    Parameters
+    ----------
+    config : inspire.config.Config
+        The Config object for the experiment.
+    file_features : dict
+        Mapping of each scan file name to a LazyFrame of its features.
+
+    Returns
+    -------
+    fits_df : pl.DataFrame or None
+        The calibration segments of each scan file and fold, None if no scan file
+        can be calibrated.
+    """
+    if config.rt_fit_loc is not None:
+        fits_df = read_rt_calibrations(config.rt_fit_loc)
+        if fits_df is None:
+            raise ValueError(
+                f'No retention time calibrations found in rtFitLoc {config.rt_fit_loc}.'
+            )
+        return fits_df
+
+    feature_cols = [IRT_KEY, RT_KEY, SPECTRAL_ANGLE_KEY, LABEL_KEY, ACCESSION_STRATUM_KEY]
+    calibration_dfs = []
+    for scan_file, features_lf in file_features.items():
+        features_df = features_lf.select(
+            [col for col in feature_cols if col in features_lf.columns]
+        ).collect()
+        if _can_calibrate(features_df):
+            calibration_dfs.append(features_df.with_columns(
+                pl.lit(scan_file).alias(SOURCE_KEY),
+                pl.Series(FOLD_KEY, get_rt_folds(features_df.shape[0])),
+            ))
+    if not calibration_dfs:
+        return None
+
+    if config.reuse_rt_fits:
+        fits_df = read_rt_calibrations(config.output_folder)
+        sources = {calibration_df[SOURCE_KEY][0] for calibration_df in calibration_dfs}
+        if (
+            fits_df is not None and
+            sources.issubset(set(fits_df[SOURCE_KEY].to_list())) and
+            FIT_METHOD_KEY in fits_df.columns and
+            set(fits_df[FIT_METHOD_KEY].to_list()) == {config.rt_fit_method}
+        ):
+            print(OKCYAN_TEXT + '\tReusing retention time calibrations.' + ENDC_TEXT)
+            return fits_df.filter(pl.col(SOURCE_KEY).is_in(list(sources)))
+        print(
+            WARNING_TEXT +
+            '\tNo matching retention time calibrations found, refitting.' +
+            ENDC_TEXT
+        )
+
+    return fit_rt_calibrations(
+        pl.concat(calibration_dfs, how='diagonal'), config.rt_fit_method,
+    )
@@ -1,6 +1,7 @@
 """ Main Script from which the whole program runs.
 """
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 import os
 import warnings
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3' # pylint: disable=wrong-import-position
@@ -13,6 +14,7 @@ from inspire.calibration import calibrate
 from inspire.config import Config
 from inspire.convert import convert_raw_to_mgf
 from inspire.constants import ENDC_TEXT, OKGREEN_TEXT
+from inspire.distributed import run_coordinator, run_worker
 from inspire.download import download_data, download_models, download_utils
 from inspire.epitope.extract_candidates import extract_epitope_candidates
 from inspire.execute_msfragger import execute_msfragger
@@ -23,6 +25,7 @@ from inspire.plot_spectra.plot_spectra import plot_spectra
 from inspire.predict_binding import predict_binding
 from inspire.predict_spectra import predict_spectra
 from inspire.prepare import prepare_for_spectral_prediction, prepare_for_mhcpan
+from inspire.profiling import PipelineProfiler
 from inspire.feature_creation import create_features
 from inspire.feature_selection import select_features
 from inspire.quant.execute import quantify_identifications
@@ -30,7 +33,11 @@ from inspire.quant.normalise import normalise_intensities
 from inspire.quant.de_analysis import de_analysis
 from inspire.quant.report_template import create_quant_report
 from inspire.rescore import final_rescoring
-from inspire.report import generate_report
+from inspire.report import (
+    generate_report,
+    get_rescoring_core_budget,
+    start_non_spectral_rescoring,
+)
 from inspire.utils import fetch_collision_energy
 from inspire.validate import validate_spliced
 import inspire
@@ -44,6 +51,8 @@ PIPELINE_OPTIONS = [
     'calibrate',
     'core',
     'convert',
+    'distributedCoordinator',
+    'distributedWorker',
     'downloadExample',
     'format',
     'fragger',
@@ -87,22 +96,52 @@ def get_arguments():
         help='What pipeline do you want to run?',
     )
 
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write the time, memory and I/O used by each stage to outputFolder/profile.',
+    )
+
+    parser.add_argument(
+        '--profile_dumps',
+        action='store_true',
+        help='Also write cProfile stats for each stage (implies --profile).',
+    )
+
     return parser.parse_args()
 
-def run_inspire(pipeline=None, config_file=None):
+def run_inspire(pipeline=None, config_file=None, profile=False, profile_dumps=False):
     """ Function to orchestrate running of the whole ininspire package.
+
+    Parameters
+    ----------
+    pipeline : str or None
+        The pipeline to run, read from the command line if None.
+    config_file : str or None
+        The config file to use, read from the command line if None.
+    profile : bool (default=False)
+        Whether to record the time, memory and I/O used by each stage.
+    profile_dumps : bool (default=False)
+        Whether to also write cProfile stats for each stage when profiling.
     """
     print(f'\n---> Running inSPIRE version {inspire.__version__} <---\n')
     if pipeline is None:
         args = get_arguments()
         config_file = args.config_file
         pipeline = args.pipeline
+        profile = args.profile or args.profile_dumps
+        profile_dumps = args.profile_dumps
 
+    # Nothing is profiled until the config gives the output folder.
+    profiler = PipelineProfiler(None)
     if pipeline == 'downloadExample':
         download_data()
     else:
         config = Config(config_file)
         config.validate()
+        profiler = PipelineProfiler(
+            config.output_folder, enabled=profile, dump_stats=profile_dumps,
+        )
         print(
             OKGREEN_TEXT +
             'Checking for required inSPIRE models...' +
@@ -114,16 +153,20 @@ def run_inspire(pipeline=None, config_file=None):
     if pipeline == 'calibrate' or (
         config.collision_energy is None and
         not os.path.exists(f'{config.output_folder}/collisionEnergyStats.csv')
-        and pipeline not in ('convert', 'fragger')
+        and pipeline not in ('convert', 'fragger', 'distributedWorker')
     ):
         print(
             OKGREEN_TEXT +
             'Running CE Calibration...' +
             ENDC_TEXT
         )
-        calibrate(config)
+        with profiler.stage('calibrate'):
+            calibrate(config)
 
-    if config.collision_energy is None and pipeline not in ('convert', 'fragger'):
+    # Workers take the calibrated collision energy from the coordinator.
+    if config.collision_energy is None and pipeline not in (
+        'convert', 'fragger', 'distributedWorker'
+    ):
         config.collision_energy = fetch_collision_energy(config.output_folder)
 
     if pipeline == 'convert':
@@ -132,7 +175,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Creating Formatted Spectral Prediction Input...' +
             ENDC_TEXT
         )
-        convert_raw_to_mgf(config)
+        with profiler.stage('convert'):
+            convert_raw_to_mgf(config)
 
     if pipeline == 'fragger':
         print(
@@ -140,7 +184,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Executing MSFragger with default inSPIRE settings...' +
             ENDC_TEXT
         )
-        execute_msfragger(config)
+        with profiler.stage('fragger'):
+            execute_msfragger(config)
 
     if pipeline == 'format':
         print(
@@ -148,7 +193,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Formatting search results for inSPIRE input...' +
             ENDC_TEXT
         )
-        _ = generic_read_df(config)
+        with profiler.stage('format'):
+            _ = generic_read_df(config)
 
     if pipeline in ('spectralPrepare', 'prepare', 'core'):
         print(
@@ -156,7 +202,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Creating Formatted Spectral Prediction Input...' +
             ENDC_TEXT
         )
-        prepare_for_spectral_prediction(config)
+        with profiler.stage('spectralPrepare'):
+            prepare_for_spectral_prediction(config)
 
     if pipeline in ('panPrepare', 'prepare', 'core'):
         if config.use_binding_affinity is not None:
@@ -165,7 +212,8 @@ def run_inspire(pipeline=None, config_file=None):
                 'Creating Formatted NetMHCpan Input...' +
                 ENDC_TEXT
             )
-        prepare_for_mhcpan(config)
+        with profiler.stage('panPrepare'):
+            prepare_for_mhcpan(config)
 
     if pipeline in ('predictSpectra', 'core'):
         print(
@@ -173,7 +221,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Predicting Spectra...' +
             ENDC_TEXT
         )
-        predict_spectra(config, 'core')
+        with profiler.stage('predictSpectra'):
+            predict_spectra(config, 'core')
 
     if pipeline in ('predictBinding', 'core'):
         if config.use_binding_affinity is not None:
@@ -182,7 +231,8 @@ def run_inspire(pipeline=None, config_file=None):
                 'Predicting NetMHCpan Binding Affinity...' +
                 ENDC_TEXT
             )
-            predict_binding(config)
+            with profiler.stage('predictBinding'):
+                predict_binding(config)
 
     if pipeline in ('featureGeneration', 'rescore', 'core'):
         print(
@@ -190,47 +240,96 @@ def run_inspire(pipeline=None, config_file=None):
             'Generating Features for Percolator Input...' +
             ENDC_TEXT
         )
-        create_features(config)
+        with profiler.stage('featureGeneration'):
+            create_features(config)
 
-    if pipeline in ('featureSelection', 'featureSelection+', 'rescore', 'core'):
+    if pipeline == 'distributedCoordinator':
         print(
             OKGREEN_TEXT +
-            'Optimising Feature Set...' +
+            'Coordinating Distributed Feature Generation...' +
             ENDC_TEXT
         )
-        select_features(config)
+        with profiler.stage('distributedCoordinator'):
+            run_coordinator(config)
 
-    if pipeline in ('finalRescoring', 'featureSelection+', 'rescore', 'core'):
+    if pipeline == 'distributedWorker':
         print(
             OKGREEN_TEXT +
-            'Running Finalised Rescoring...' +
+            'Generating Features as Distributed Worker...' +
             ENDC_TEXT
         )
-        final_rescoring(config)
+        with profiler.stage('distributedWorker'):
+            run_worker(config)
+
+    run_report = (
+        pipeline in ('featureSelection+', 'rescore', 'core', 'distributedCoordinator')
+        and not config.silent_execution
+    ) or pipeline == 'generateReport'
+
+    # The report's non-spectral rescoring only needs the features so runs alongside
+    # feature selection and final rescoring, sharing the cores.
+    with ThreadPoolExecutor(max_workers=1) as report_executor:
+        non_spectral_future = None
+        final_cores = config.n_cores
+        if run_report and pipeline in (
+            'featureSelection+', 'rescore', 'core', 'distributedCoordinator'
+        ):
+            final_cores, non_spectral_cores = get_rescoring_core_budget(config.n_cores)
+            non_spectral_future = start_non_spectral_rescoring(
+                config, report_executor, non_spectral_cores,
+            )
 
-    if (
-        pipeline in ('validate', 'featureSelection+', 'rescore', 'core', 'calibrate+core')
-        and config.accession_format == 'invitroSPI'
-    ):
-        print(
-            OKGREEN_TEXT +
-            'Validating spliced assignments...' +
-            ENDC_TEXT
-        )
-        validate_spliced(config)
+        if pipeline in (
+            'featureSelection', 'featureSelection+', 'rescore', 'core', 'distributedCoordinator'
+        ):
+            print(
+                OKGREEN_TEXT +
+                'Optimising Feature Set...' +
+                ENDC_TEXT
+            )
+            with profiler.stage('featureSelection'):
+                select_features(config)
 
-    if (
-        pipeline in ('featureSelection+', 'rescore', 'core') and not config.silent_execution
-    ) or pipeline == 'generateReport':
-        print(
-            OKGREEN_TEXT +
-            'Generating inSPIRE Performance Report...' +
-            ENDC_TEXT
-        )
-        generate_report(config)
+        if pipeline in (
+            'finalRescoring', 'featureSelection+', 'rescore', 'core', 'distributedCoordinator'
+        ):
+            print(
+                OKGREEN_TEXT +
+                'Running Finalised Rescoring...' +
+                ENDC_TEXT
+            )
+            with profiler.stage('finalRescoring'):
+                final_rescoring(config, final_cores)
+
+        if (
+            pipeline in (
+                'validate', 'featureSelection+', 'rescore', 'core', 'calibrate+core',
+                'distributedCoordinator',
+            )
+            and config.accession_format == 'invitroSPI'
+        ):
+            print(
+                OKGREEN_TEXT +
+                'Validating spliced assignments...' +
+                ENDC_TEXT
+            )
+            with profiler.stage('validateInvitroSPI'):
+                validate_spliced(config)
+
+        if run_report:
+            print(
+                OKGREEN_TEXT +
+                'Generating inSPIRE Performance Report...' +
+                ENDC_TEXT
+            )
+            with profiler.stage('generateReport'):
+                generate_report(config, non_spectral_future)
 
     if (
-        pipeline in ('validate', 'featureSelection+', 'rescore', 'core', 'calibrate+core')
+        pipeline in (
+            'validate', 'featureSelection+', 'rescore', 'core', 'calibrate+core',
+            'distributedCoordinator',
+        )
         and config.use_accession_stratum
     ):
         print(
@@ -238,7 +337,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Validating spliced assignments...' +
             ENDC_TEXT
         )
-        validate_spliced(config)
+        with profiler.stage('validateAccessionStrata'):
+            validate_spliced(config)
 
     if pipeline == 'spectralAngle':
         print(
@@ -246,7 +346,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Calculating Spectral Angles...' +
             ENDC_TEXT
         )
-        get_spectral_angle(config)
+        with profiler.stage('spectralAngle'):
+            get_spectral_angle(config)
 
     if pipeline == 'quantify':
         print(
@@ -254,10 +355,14 @@ def run_inspire(pipeline=None, config_file=None):
             'Running quantification via skyline docker...' +
             ENDC_TEXT
         )
-        quantify_identifications(config)
-        normalise_intensities(config)
-        de_analysis(config)
-        create_quant_report(config)
+        with profiler.stage('quantify'):
+            quantify_identifications(config)
+        with profiler.stage('normaliseIntensities'):
+            normalise_intensities(config)
+        with profiler.stage('deAnalysis'):
+            de_analysis(config)
+        with profiler.stage('quantReport'):
+            create_quant_report(config)
 
 
     if pipeline == 'extractCandidates':
@@ -266,7 +371,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Extracting Potential Epitope Candidates...' +
             ENDC_TEXT
         )
-        extract_epitope_candidates(config)
+        with profiler.stage('extractCandidates'):
+            extract_epitope_candidates(config)
 
     if pipeline == 'plotSpectra':
         print(
@@ -274,7 +380,8 @@ def run_inspire(pipeline=None, config_file=None):
             'Plotting Spectra...' +
             ENDC_TEXT
         )
-        plot_spectra(config)
+        with profiler.stage('plotSpectra'):
+            plot_spectra(config)
 
     if pipeline == 'plotIsobars':
         print(
@@ -282,7 +389,10 @@ def run_inspire(pipeline=None, config_file=None):
             'Plotting Isobars...' +
             ENDC_TEXT
         )
-        plot_isobars(config)
+        with profiler.stage('plotIsobars'):
+            plot_isobars(config)
+
+    profiler.write_report()
 
     print(
         OKGREEN_TEXT +
@@ -5,6 +5,7 @@
 from copy import deepcopy
 import gc
 from math import acos, pi
+import multiprocessing as mp
 from statistics import mean, variance
 
 import polars as pl
@@ -31,14 +32,15 @@ from inspire.constants import (
     PROSIT_SEQ_KEY,
     PROTON,
     PTM_ID_KEY,
-    PTM_SEQ_KEY,
+    PTM_CODE_KEYS,
     PTM_WEIGHT_KEY,
     SPEARMAN_KEY,
     SPECTRAL_ANGLE_KEY,
 )
 from inspire.mz_match import get_ion_masses, match_mz
+from inspire.profiling import profile_function
 from inspire.prosit_delta import get_deltas
-from inspire.utils import get_ox_flag
+from inspire.utils import add_ptm_code, get_ox_flag, get_row_ptm_code
 
 
 SPECTRAL_FEATURES = [
@@ -86,6 +88,19 @@ DELTA_FEATURES = [
 PROSIT_MAJOR_MINOR_CUT_OFF = 0.1
 SPECTRUM_MAJOR_MINOR_CUT_OFF = 0.1
 
+SCORING_KEYS = [
+    CHARGE_KEY,
+    INTENSITIES_KEY,
+    MZS_KEY,
+    PEPTIDE_KEY,
+    PROSIT_INTES_KEY,
+    PROSIT_IONS_KEY,
+    *PTM_CODE_KEYS,
+]
+SCORE_FEATURES = [SPECTRAL_ANGLE_KEY, SPEARMAN_KEY]
+# PSMs are split into more batches than cores so that the pool balances the load.
+SCORING_BATCHES_PER_CORE = 4
+
 def calculate_spectral_angle(true, predicted):
     """ Function to calculate the spectral angle between the true and predicted
         spectra.
@@ -338,7 +353,7 @@ def calculate_spectral_features(
     potential_ion_mzs, precursor_weight = get_ion_masses(
         sequence,
         ptm_id_weights,
-        df_row[PTM_SEQ_KEY]
+        get_row_ptm_code(df_row),
     )
 
     (
@@ -667,6 +682,7 @@ def fetch_mod_weight_dict(mods_df):
     return ptm_id_weights
 
 
+@profile_function
 def create_spectral_features(mods_df, config, task_id, model):
     """ Function to calculate spectral features between experimental and prosit predicted
         spectra.
@@ -686,9 +702,9 @@ def create_spectral_features(mods_df, config, task_id, model):
         The input DataFrame with features added to describe the match between experimental
         and prosit predicted spectra.
     """
-    spectral_df = pl.read_parquet(
+    spectral_df = add_ptm_code(pl.read_parquet(
         f'{config.output_folder}/temp_{task_id}_in.parquet'
-    )
+    ))
 
     ox_flag = get_ox_flag(mods_df)
 
@@ -704,7 +720,7 @@ def create_spectral_features(mods_df, config, task_id, model):
             PROSIT_INTES_KEY,
             PROSIT_IONS_KEY,
             PROSIT_SEQ_KEY,
-            PTM_SEQ_KEY,
+            *PTM_CODE_KEYS,
         ]).apply(
             lambda df_row : calculate_spectral_features(
                 df_row,
@@ -736,3 +752,68 @@ def create_spectral_features(mods_df, config, task_id, model):
     )
     del spectral_df
     gc.collect()
+
+def score_spectra(psm_df, ptm_id_weights, mz_accuracy, mz_units, n_cores):
+    """ Function to calculate the spectral angle and Spearman correlation between the
+        experimental and predicted spectrum of each PSM, scoring batches of PSMs
+        across a process pool.
+
+    Parameters
+    ----------
+    psm_df : pl.DataFrame
+        A DataFrame of PSMs with experimental spectra, predicted spectra, peptides
+        and PTMs.
+    ptm_id_weights : dict
+        A dict mapping ptm ids to the change in mass cause by it.
+    mz_accuracy : float
+        The m/z accuracy of the instrument which measured the spectra.
+    mz_units : str
+        Either Da or ppm.
+    n_cores : int
+        The number of CPUs that should be used in parallel.
+
+    Returns
+    -------
+    psm_df : pl.DataFrame
+        The input DataFrame with spectral angle and Spearman correlation added.
+    """
+    psm_df = add_ptm_code(psm_df)
+    psm_df = psm_df.drop([col for col in SCORE_FEATURES if col in psm_df.columns])
+    score_df = psm_df.select(SCORING_KEYS)
+
+    n_batches = min(n_cores*SCORING_BATCHES_PER_CORE, score_df.shape[0])
+    if n_cores <= 1 or n_batches <= 1:
+        scores_df = _score_batch(score_df, ptm_id_weights, mz_accuracy, mz_units)
+    else:
+        # Contiguous batches keep the scores in input order when concatenated.
+        batch_size = -(-score_df.shape[0]//n_batches)
+        func_args = [
+            [score_df.slice(offset, batch_size), ptm_id_weights, mz_accuracy, mz_units]
+            for offset in range(0, score_df.shape[0], batch_size)
+        ]
+        with mp.get_context('spawn').Pool(processes=min(n_cores, len(func_args))) as pool:
+            scores_df = pl.concat(pool.starmap(_score_batch, func_args))
+
+    return psm_df.hstack(scores_df)
+
+@profile_function
+def _score_batch(score_df, ptm_id_weights, mz_accuracy, mz_units):
+    """ Function to score a batch of PSMs in a single process.
+    """
+    scores = {score_feature: [] for score_feature in SCORE_FEATURES}
+    for df_row in score_df.iter_rows(named=True):
+        results = calculate_spectral_features(
+            df_row,
+            ptm_id_weights,
+            mz_accuracy,
+            mz_units,
+            None,
+            '1',
+            'ignore',
+            minimal_features=True,
+        )
+        for score_feature in SCORE_FEATURES:
+            scores[score_feature].append(results[score_feature])
+    return pl.DataFrame(
+        scores, schema={score_feature: pl.Float64 for score_feature in SCORE_FEATURES},
+    )
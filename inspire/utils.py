@@ -1,10 +1,13 @@
 """ Helpful functions used across the module.
 """
-import multiprocessing as mp
+import hashlib
+import os
 import pickle
 import re
+import shutil
 
 from Bio import SeqIO
+import numpy as np
 import pandas as pd
 import polars as pl
 
@@ -15,9 +18,12 @@ from inspire.constants import (
     KNOWN_PTM_LOC,
     KNOWN_PTM_WEIGHTS,
     PEPTIDE_KEY,
+    PTM_C_TERM_KEY,
     PTM_ID_KEY,
     PTM_IS_VAR_KEY,
+    PTM_N_TERM_KEY,
     PTM_NAME_KEY,
+    PTM_RESIDUES_KEY,
     PTM_SEQ_KEY,
     PTM_WEIGHT_KEY,
     SCAN_KEY,
@@ -27,6 +33,83 @@ from inspire.constants import (
 from inspire.input.mgf import process_mgf_file
 from inspire.input.mzml import process_mzml_file
 
+# Content is fingerprinted from evenly spaced blocks so that multi-GB input
+# files are not read in full just to validate a cache.
+FINGERPRINT_BLOCKS = 16
+FINGERPRINT_BLOCK_SIZE = 1 << 20
+
+def fingerprint_file(file_loc):
+    """ Function to fingerprint a file by its size, modification time and content.
+
+    Parameters
+    ----------
+    file_loc : str
+        The location of the file.
+
+    Returns
+    -------
+    fingerprint : dict
+        The path, size, modification time and content hash of the file.
+    """
+    file_stat = os.stat(file_loc)
+    content_hash = hashlib.sha256()
+    with open(file_loc, mode='rb') as input_file:
+        if file_stat.st_size <= FINGERPRINT_BLOCKS*FINGERPRINT_BLOCK_SIZE:
+            content_hash.update(input_file.read())
+        else:
+            block_step = (file_stat.st_size - FINGERPRINT_BLOCK_SIZE)//(FINGERPRINT_BLOCKS - 1)
+            for block_idx in range(FINGERPRINT_BLOCKS):
+                input_file.seek(block_idx*block_step)
+                content_hash.update(input_file.read(FINGERPRINT_BLOCK_SIZE))
+
+    return {
+        'path': os.path.abspath(file_loc),
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime_ns,
+        'content': content_hash.hexdigest(),
+    }
+
+def load_index_arrays(index_loc, array_names, mmap_mode=None):
+    """ Function to load the arrays of an index saved with save_index_arrays.
+
+    Parameters
+    ----------
+    index_loc : str
+        The folder where the index was saved.
+    array_names : list of str
+        The names of the arrays to load.
+    mmap_mode : str or None (default=None)
+        If set, arrays are memory-mapped rather than read, so that processes
+        loading the same index share a single copy through the page cache.
+
+    Returns
+    -------
+    arrays : list of np.array
+        The arrays in the order of array_names.
+    """
+    return [
+        np.load(f'{index_loc}/{array_name}.npy', mmap_mode=mmap_mode, allow_pickle=False)
+        for array_name in array_names
+    ]
+
+def save_index_arrays(index_loc, arrays):
+    """ Function to save the arrays of an index to disk as a folder of arrays.
+
+    Parameters
+    ----------
+    index_loc : str
+        The folder where the index is saved.
+    arrays : dict
+        The arrays of the index, keyed by name.
+    """
+    # Written to a temporary folder first so that an interrupted write is never reused.
+    if os.path.exists(f'{index_loc}.tmp'):
+        shutil.rmtree(f'{index_loc}.tmp')
+    os.makedirs(f'{index_loc}.tmp')
+    for array_name, array in arrays.items():
+        np.save(f'{index_loc}.tmp/{array_name}.npy', array)
+    os.replace(f'{index_loc}.tmp', index_loc)
+
 def fetch_proteome(proteome, with_desc=True):
     """ Function to read in proteome fasta file and return list of tuples containing:
         0. protein name
@@ -45,85 +128,6 @@ def fetch_proteome(proteome, with_desc=True):
         )
     ]
 
-def parallel_remap(combined_df, n_cores, proteome, out_column, trace_accession=True):
-    """ Function to remap peptides in a DataFrame to a proteome in parallel.
-
-    Parameters
-    ----------
-    combined_df : pl.DataFrame
-        DataFrame including peptides identified.
-    n_cores : int
-        The number of CPUs that should be used in parallel.
-    proteome : list of tuple
-        The liste of proteins (position 0 is name and position 1 is sequence).
-    out_column : str
-        The name of the column
-    trace_accession : bool (default=True)
-        Flag indicating if full accession should be trace or just a boolean flag if
-        peptide is found in proteome.
-
-    Returns
-    -------
-    combined_df : pl.DataFrame
-        DataFrame including peptides identified with remapped accessions.
-    """
-    pep_df = combined_df.select(PEPTIDE_KEY).unique()
-    batch_size = pep_df.shape[0]//n_cores
-    batch_values = []
-    for batch_idx in range(n_cores):
-        batch_values.extend([batch_idx]*batch_size)
-
-    if (additional_psms := pep_df.shape[0]%n_cores):
-        batch_values.extend([n_cores-1]*additional_psms)
-
-    pep_df = pep_df.with_columns(
-        pl.Series(name='batch', values=batch_values)
-    )
-    pep_df_list = pep_df.partition_by('batch')
-    func_args = []
-    for sub_pep_df in pep_df_list:
-        func_args.append([sub_pep_df, proteome, out_column, trace_accession])
-
-    with mp.get_context('spawn').Pool(processes=n_cores) as pool:
-        pep_df_list = pool.starmap(_sub_remap, func_args)
-    remapped_pep_df = pl.concat(pep_df_list)
-
-    combined_df = combined_df.join(remapped_pep_df, how='inner', on='peptide')
-
-    return combined_df
-
-def _sub_remap(pep_df, proteome, out_column, trace_accession):
-    pep_df = pep_df.with_columns(
-        pl.col('peptide').apply(
-            lambda x : remap_to_proteome(x, proteome, trace_accession=trace_accession)
-        ).alias(out_column)
-    )
-    return pep_df
-
-
-def remap_to_proteome(
-        peptide,
-        proteome,
-        trace_accession=True
-    ):
-    """ Function to check for the presence of an identified peptide as either canonical
-        or spliced in the input proteome.
-    """
-    il_peptide = peptide.replace('I', 'L')
-    accession_stratum = 'unknown'
-    for protein in proteome:
-        if il_peptide in protein[1]:
-            if not trace_accession:
-                return True
-            if accession_stratum == 'unknown':
-                accession_stratum = protein[0]
-            else:
-                accession_stratum += f' {protein[0]}'
-
-    if not trace_accession:
-        return False
-    return accession_stratum
-
 def get_mod_score(df_row):
     """ Helper function to compare different accession strata.
     """
@@ -180,6 +184,92 @@ def fetch_collision_energy(output_folder):
 
     return optimal_collision_energy
 
+def parse_ptm_seq(ptm_seq):
+    """ Function to parse a PTM sequence string into its compact integer encoding.
+
+    Parameters
+    ----------
+    ptm_seq : str or None
+        The PTM sequence of a peptide, e.g. 0.0102.0.
+
+    Returns
+    -------
+    ptm_code : tuple or None
+        The N-terminal PTM ID, a list of the PTM ID on each residue and the C-terminal
+        PTM ID, or None if the peptide is unmodified.
+    """
+    if not isinstance(ptm_seq, str) or not ptm_seq or ptm_seq in ('nan', 'None'):
+        return None
+
+    n_term, residues, c_term = ptm_seq.split('.')
+    return int(n_term), [int(mod) for mod in residues], int(c_term)
+
+def get_ptm_code(modifications):
+    """ Function to get the compact PTM encoding from either a PTM sequence string
+        or an already parsed encoding.
+    """
+    if isinstance(modifications, tuple):
+        return modifications
+    return parse_ptm_seq(modifications)
+
+def get_row_ptm_code(df_row):
+    """ Function to get the compact PTM encoding of a PSM, using the parsed columns
+        where these are available.
+    """
+    if PTM_RESIDUES_KEY in df_row:
+        if df_row[PTM_RESIDUES_KEY] is None:
+            return None
+        return df_row[PTM_N_TERM_KEY], df_row[PTM_RESIDUES_KEY], df_row[PTM_C_TERM_KEY]
+    return parse_ptm_seq(df_row[PTM_SEQ_KEY])
+
+def add_ptm_code(search_df):
+    """ Function to add the compact integer encoding of the PTM sequence so that it
+        is only parsed once per PSM.
+
+    Parameters
+    ----------
+    search_df : pl.DataFrame
+        A DataFrame of search results with the PTM sequence column.
+
+    Returns
+    -------
+    search_df : pl.DataFrame
+        The input DataFrame with N-terminal, per residue (uint8 list) and C-terminal
+        PTM ID columns added.
+    """
+    if PTM_RESIDUES_KEY in search_df.columns:
+        return search_df
+
+    ptm_parts = pl.col(PTM_SEQ_KEY).cast(pl.Utf8).str.split('.')
+    return search_df.with_columns(
+        ptm_parts.list.first().cast(pl.UInt8, strict=False).alias(PTM_N_TERM_KEY),
+        ptm_parts.list.get(1).str.extract_all(r'\d').list.eval(
+            pl.element().cast(pl.UInt8)
+        ).alias(PTM_RESIDUES_KEY),
+        ptm_parts.list.last().cast(pl.UInt8, strict=False).alias(PTM_C_TERM_KEY),
+    )
+
+def has_ptm_ids(ptm_ids):
+    """ Function to create an expression checking whether any of the given PTM IDs
+        are present on a PSM, using the compact PTM encoding.
+
+    Parameters
+    ----------
+    ptm_ids : list of int
+        The PTM IDs to check for.
+
+    Returns
+    -------
+    has_ptms : pl.Expr
+        Boolean expression, False for unmodified peptides.
+    """
+    ptm_ids = [int(ptm_id) for ptm_id in ptm_ids]
+    return (
+        pl.col(PTM_N_TERM_KEY).is_in(ptm_ids) |
+        pl.col(PTM_RESIDUES_KEY).list.eval(pl.element().is_in(ptm_ids)).list.any() |
+        pl.col(PTM_C_TERM_KEY).is_in(ptm_ids)
+    ).fill_null(False)
+
 def permute_ptms(peptide, ptm_seq, uniform_length=False):
     """ Function to generate all possible permutations on the PTMs of a peptide
         sequence due to adjacent amino acid swaps.
@@ -243,18 +333,6 @@ def permute_seq(peptide, uniform_length=False):
         permed_peps += [None]*(29-len(permed_peps))
     return permed_peps
 
-def check_bad_mods(ptm_str, bad_mods):
-    """ Function to check for the presence of ptms other than oxidation of methionine
-        or carbamidomehtylation of Cysteine.
-    """
-    if not isinstance(ptm_str, str):
-        return False
-
-    for mod_id in ptm_str:
-        if mod_id in bad_mods:
-            return True
-    return False
-
 def get_cam_flag(mods_df):
     """ Function to get the flag for oxidation of methionine from the PTMs DataFrame.
     Parameters
@@ -342,14 +420,16 @@ def modify_sequence_for_skyline(df_row, mod_weights):
     modified_sequence : str
         The modified sequence in the correct format for Skyline.
     """
-    if not isinstance(df_row[PTM_SEQ_KEY], str) or not df_row[PTM_SEQ_KEY]:
+    ptm_code = get_row_ptm_code(df_row)
+    if ptm_code is None:
         return df_row[PEPTIDE_KEY]
 
     modified_sequence = ''
+    residue_mods = ptm_code[1]
     for idx, entry in enumerate(df_row[PEPTIDE_KEY]):
-        mod = df_row[PTM_SEQ_KEY][idx+2]
-        if mod != '0':
-            mod_wt = mod_weights[int(mod)]
+        mod = residue_mods[idx]
+        if mod:
+            mod_wt = mod_weights[mod]
             if mod_wt > 0:
                 modified_sequence += f'{entry}[+{round(mod_wt, 1)}]'
             else:
@@ -409,15 +489,10 @@ def filter_for_prosit(search_df):
         The input DataFrame with sequences not suitable for Prosit input removed.
     """
     search_df = search_df.filter(
-        pl.col(PEPTIDE_KEY).is_not_null() & (pl.col(CHARGE_KEY).is_not_null())
-    )
-    search_df = search_df.filter(
-        pl.col(PEPTIDE_KEY).apply(
-            lambda x : isinstance(x, str) and 'U' not in x and len(x) > 6 and len(x) < 31,
-            skip_nulls=False,
-        )
-    )
-    search_df = search_df.filter(
+        pl.col(PEPTIDE_KEY).is_not_null() &
+        pl.col(CHARGE_KEY).is_not_null() &
+        pl.col(PEPTIDE_KEY).str.contains('U', literal=True).is_not() &
+        pl.col(PEPTIDE_KEY).str.n_chars().is_between(7, 30) &
         pl.col(CHARGE_KEY).lt(7)
     )
 
@@ -1,157 +1,83 @@
 """ Functions for validating spliced PSMs.
 """
+import functools
 import itertools
 import re
 
-from Bio import SeqIO
 import numpy as np
 import pandas as pd
-from scipy.stats import spearmanr
+import polars as pl
 
 from inspire.constants import (
     CHARGE_KEY,
+    INTENSITIES_KEY,
     KNOWN_PTM_WEIGHTS,
     MINIMAL_FEATURE_SET,
+    MZS_KEY,
+    PEPTIDE_KEY,
+    PROSIT_INTES_KEY,
     PROSIT_IONS_KEY,
-    PROTON,
-    RESIDUE_WEIGHTS,
+    PROSIT_SEQ_KEY,
+    PTM_SEQ_KEY,
     SCAN_KEY,
     SPEARMAN_KEY,
+    SPECTRAL_ANGLE_KEY,
     SOURCE_KEY,
 )
 from inspire.input.msp import msp_to_df
+from inspire.mass_index import get_mass_index, get_residue_mass
 from inspire.predict_spectra import predict_spectra
-from inspire.spectral_features import (
-    calculate_spectral_angle,
-    get_ion_masses,
-    get_matches,
+from inspire.rescore import get_largest_stratum
+from inspire.rt_alignment import (
+    get_rt_scales,
+    predict_retention_times,
+    read_rt_calibrations,
+    COEFFICIENT_KEY,
 )
+from inspire.spectral_features import score_spectra
 from inspire.utils import fetch_scan_data
 
 
 
-def get_sa(
-        df_row,
-        mz_accuracy,
-        mz_units,
-    ):
-    """ Function to extract the ion intensities from the true spectra which match
+def get_competitor_ptm_seq(modified_sequence):
+    """ Function to get the PTM sequence of a competitor from its Prosit modified
+        sequence, in which cysteine is always carbamidomethylated.
     """
-    sequence = df_row['pcpPeptide']
-    prosit_preds = df_row[PROSIT_IONS_KEY]
-    mod_seq = df_row['modified_sequence']
-
-
-    if '(ox)' not in mod_seq and 'C' not in mod_seq:
-        mods = None
-    else:
-        mods = '0.'
-        while mod_seq:
-            if len(mod_seq) > 1:
-                if mod_seq[1] == '(':
-                    mods += '1'
-                    mod_seq = mod_seq[5:]
-                    continue
-            if mod_seq[0] != 'C':
-                mods += '0'
-            else:
-                mods += '2'
-            mod_seq = mod_seq[1:]
-        mods += '.0'
-    potential_ion_mzs, precursor_weight = get_ion_masses(
-        sequence,
-        {
-            0: 0.0,
-            1: KNOWN_PTM_WEIGHTS['Oxidation (M)'],
-            2: KNOWN_PTM_WEIGHTS['Carbamidomethylation'],
-        },
-        modifications=mods
-    )
-
-    precursor_mz = (precursor_weight + (PROTON*df_row[CHARGE_KEY]))/df_row[CHARGE_KEY]
-
-    (
-        match_info, _, __,
-        ___, ____
-    ) = get_matches(
-        potential_ion_mzs,
-        prosit_preds,
-        df_row['mzs'],
-        precursor_mz,
-        df_row['intensities'],
-        mz_accuracy,
-        df_row['charge'],
-        mz_units,
-    )
-
-    matched_intensities = match_info['matched_intensities']
-    ordered_prosit_intes = match_info['ordered_prosit_intes']
-
-    matched_l2_norm = np.linalg.norm(matched_intensities, ord=2)
-
-    if matched_l2_norm:
-        normed_matched_intensities = matched_intensities/matched_l2_norm
-    else:
-        normed_matched_intensities = matched_intensities
-
-    df_row['spectralAngle'] = calculate_spectral_angle(
-        normed_matched_intensities,
-        ordered_prosit_intes,
-    )
-    spearman_total = spearmanr(normed_matched_intensities, ordered_prosit_intes)[0]
-
-    if not np.isnan(spearman_total):
-        df_row[SPEARMAN_KEY] = spearman_total
-    else:
-        df_row[SPEARMAN_KEY] = 0.0
-
-    return df_row
-
-
+    residue_mods = [
+        '1' if residue.endswith('(ox)') else '2' if residue == 'C' else '0'
+        for residue in re.findall(r'[A-Z](?:\(ox\))?', modified_sequence)
+    ]
+    return '0.' + ''.join(residue_mods) + '.0'
 
-def get_cleavage_peptides(proteome_loc):
-    """ Function to find all nonspliced peptides.
-    """
-    prot_sequences = list(SeqIO.parse(proteome_loc, 'fasta'))
-
-    weights = []
-    pcp_seqs = []
-    for protein in prot_sequences:
-        prot_seq = str(protein.seq)
-        for pep_len in range(7, 31):
-            for i in range(1 + len(prot_seq) - pep_len):
-                pep = prot_seq[i:i+pep_len]
-                pcp_seqs.append(pep)
-                weights.append(
-                    round(sum([RESIDUE_WEIGHTS[z] for z in pep]), 2)
-                )
-
-    return pd.DataFrame({
-        'pcpPeptide': pd.Series(pcp_seqs),
-        'mw': pd.Series(weights),
-    })
+@functools.lru_cache(maxsize=None)
+def get_oxidation_variants(pcp_pep, n_mod_ox):
+    """ Function to find all Prosit modified sequences of a nonspliced peptide with
+        n_mod_ox oxidised methionines.
 
-def get_mod_matched_seqs(mod_seq, pcp_pep):
-    """ Funciton to find all matched sequences including oxidation of methionine.
+    Parameters
+    ----------
+    pcp_pep : str
+        The nonspliced peptide sequence.
+    n_mod_ox : int
+        The number of oxidised methionines.
+
+    Returns
+    -------
+    modified_sequences : tuple of str
+        Every placement of the oxidations in the Prosit input encoding.
     """
-    n_mod_ox = mod_seq.count('[+16.0]')
-    if n_mod_ox == 0:
-        return [pcp_pep]
-    n_methionine = pcp_pep.count('M')
-    if n_methionine < n_mod_ox:
-        return []
-    methionine_pos = [
-        m.start() for m in re.finditer('M', pcp_pep)
-    ]
-    possible_oxidations = itertools.combinations(methionine_pos, n_mod_ox)
-
-    possible_mod_seqs = []
-    for possible_os in possible_oxidations:
-        mod_str = pcp_pep
-        for o_site in sorted(possible_os, reverse=True):
-            mod_str = mod_str[:o_site+1] + '[+16.0]' + mod_str[o_site+1:]
-        possible_mod_seqs.append(mod_str)
-    return possible_mod_seqs
+    methionine_pos = [idx for idx, residue in enumerate(pcp_pep) if residue == 'M']
+
+    modified_sequences = []
+    for ox_sites in itertools.combinations(methionine_pos, n_mod_ox):
+        segments = []
+        segment_start = 0
+        for ox_site in ox_sites:
+            segments.append(pcp_pep[segment_start:ox_site+1])
+            segment_start = ox_site + 1
+        segments.append(pcp_pep[segment_start:])
+        modified_sequences.append('(ox)'.join(segments))
+    return tuple(modified_sequences)
 
 def find_competitors(final_df, config):
     """ Function to find isobaric nonspliced competitors to spliced peptides.
@@ -160,41 +86,47 @@ def find_competitors(final_df, config):
         (final_df['accessionGroup'] == 'spliced')
     ]
 
-    final_df['mw'] = final_df['peptide'].apply(
-        lambda x : round(sum([RESIDUE_WEIGHTS[z] for z in x]), 2)
-    )
-
-    pcp_df = get_cleavage_peptides(config.proteome)
-    pcp_df = pcp_df.drop_duplicates()
-    pcp_df['label'] = 1
-
-    merged_df = pd.merge(
-        final_df[[
-            'source',
-            'scan',
-            'peptide',
-            'modifiedSequence',
-            'charge',
-            'retentionTime',
-            'proteins',
-            'mw'
-        ]],
-        pcp_df[['pcpPeptide', 'mw', 'label']],
-        how='inner',
-        on='mw'
+    mass_index = get_mass_index(
+        config.proteome, config.output_folder if config.cache_mass_index else None,
     )
+    final_df['mw'] = final_df['peptide'].apply(get_residue_mass)
+
+    # Competitors are all nonspliced peptides within the mass tolerance of the spliced peptide.
+    pcp_peptides = {
+        peptide_mass: mass_index.find(
+            peptide_mass, config.competitor_mass_tolerance, config.competitor_mass_units,
+        ) for peptide_mass in final_df['mw'].unique()
+    }
+    merged_df = final_df[[
+        'source',
+        'scan',
+        'peptide',
+        'modifiedSequence',
+        'charge',
+        'retentionTime',
+        'proteins',
+        'mw'
+    ]].copy()
+    merged_df['pcpPeptide'] = merged_df['mw'].map(pcp_peptides)
+    merged_df = merged_df.explode('pcpPeptide')
+    merged_df = merged_df[merged_df['pcpPeptide'].apply(lambda x : isinstance(x, str))]
+    merged_df['label'] = 1
     if merged_df.shape[0] == 0:
         return merged_df
-    merged_df['matched_pcps'] = merged_df.apply(
-        lambda x : get_mod_matched_seqs(x['modifiedSequence'], x['pcpPeptide']),
-        axis=1,
-    )
-    merged_df = merged_df.explode('matched_pcps')
-    merged_df = merged_df[merged_df['matched_pcps'].apply(lambda x : isinstance(x, str))]
+
+    # Oxidation variants are enumerated once per candidate and oxidation count.
+    merged_df['nOxidations'] = merged_df['modifiedSequence'].str.count(re.escape('[+16.0]'))
+    variant_df = merged_df[['pcpPeptide', 'nOxidations']].drop_duplicates()
+    variant_df['modified_sequence'] = [
+        get_oxidation_variants(pcp_pep, n_mod_ox) for pcp_pep, n_mod_ox in zip(
+            variant_df['pcpPeptide'], variant_df['nOxidations']
+        )
+    ]
+    variant_df = variant_df.explode('modified_sequence').dropna(subset=['modified_sequence'])
+    merged_df = pd.merge(
+        merged_df, variant_df, how='inner', on=['pcpPeptide', 'nOxidations'],
+    ).drop('nOxidations', axis=1)
     merged_df = merged_df.sort_values('peptide')
-    merged_df['modified_sequence'] = merged_df['matched_pcps'].apply(
-        lambda x : x.replace('[+16.0]', '(ox)').replace('[+57.0]', '')
-    )
 
     prosit_input_df = merged_df.rename(columns={'charge': 'precursor_charge'})
     prosit_input_df['collision_energy'] = config.collision_energy
@@ -222,22 +154,39 @@ def calculate_competitor_spectral_data(competitors_df, config):
     prosit_df = msp_to_df(
         f'{config.output_folder}/validationPredictions.msp', 'prosit', None
     )
-    prosit_df = prosit_df.drop_duplicates(subset=['modified_sequence', 'charge'])
-    competitors_df['modified_sequence'] = competitors_df['matched_pcps'].apply(
-        lambda x : x.replace('[+16.0]', '(ox)').replace('[+57.0]', '')
-    )
+    prosit_df = prosit_df.unique(subset=[PROSIT_SEQ_KEY, CHARGE_KEY]).to_pandas()
     competitors_df = pd.merge(
         competitors_df,
         prosit_df,
         how='inner',
-        on=['modified_sequence', CHARGE_KEY]
+        on=[PROSIT_SEQ_KEY, CHARGE_KEY]
     )
 
-    competitors_df['peptide'] = competitors_df['pcpPeptide']
-    competitors_df = competitors_df.apply(
-        lambda x : get_sa(x, config.mz_accuracy, config.mz_units),
-        axis=1
+    competitors_df[PEPTIDE_KEY] = competitors_df['pcpPeptide']
+    score_df = pl.from_pandas(competitors_df[[
+        CHARGE_KEY,
+        INTENSITIES_KEY,
+        MZS_KEY,
+        PEPTIDE_KEY,
+        PROSIT_INTES_KEY,
+        PROSIT_IONS_KEY,
+        PROSIT_SEQ_KEY,
+    ]]).with_columns(
+        pl.col(PROSIT_SEQ_KEY).apply(get_competitor_ptm_seq).alias(PTM_SEQ_KEY)
+    )
+    score_df = score_spectra(
+        score_df,
+        {
+            0: 0.0,
+            1: KNOWN_PTM_WEIGHTS['Oxidation (M)'],
+            2: KNOWN_PTM_WEIGHTS['Carbamidomethylation'],
+        },
+        config.mz_accuracy,
+        config.mz_units,
+        config.n_cores,
     )
+    competitors_df[SPECTRAL_ANGLE_KEY] = score_df[SPECTRAL_ANGLE_KEY].to_numpy()
+    competitors_df[SPEARMAN_KEY] = score_df[SPEARMAN_KEY].to_numpy()
     return competitors_df
 
 def validate_spliced(config):
@@ -263,46 +212,34 @@ def validate_spliced(config):
 
     competitors_df = calculate_competitor_spectral_data(competitors_df, config)
 
-    rt_ints = {}
-    rt_coefs = {}
-    for raw_file in competitors_df[SOURCE_KEY].unique().tolist():
-        rt_df = pd.read_csv(
-            f'{config.output_folder}/rt_fit_{raw_file}.csv'
-        )
-        rt_ints[raw_file] = rt_df['intercepts'].mean()
-
-        rt_coefs[raw_file] = rt_df['coefficents'].mean()
-
-    competitors_df['predRT'] = competitors_df.apply(
-        lambda x : rt_ints[x['source']] + (rt_coefs[x['source']]*x['iRT']),
-        axis=1,
-    )
-    competitors_df['base_deltaRT'] = competitors_df.apply(
-        lambda x : abs(
-            (x['retentionTime'] - x['predRT'])
-        ),
-        axis=1,
-    )
-    competitors_df['deltaRT'] = competitors_df.apply(
-        lambda x : abs(
-            abs(
-                x['base_deltaRT']/rt_coefs.get(x['source'], 1.0)
-            ) if rt_coefs.get(x['source'], 1.0) > 0 else x['base_deltaRT']
-        ),
-        axis=1
-    )
+    fits_df = read_rt_calibrations(config.output_folder)
+    rt_scales = dict(get_rt_scales(fits_df).select(SOURCE_KEY, COEFFICIENT_KEY).iter_rows())
+    competitors_df['predRT'] = predict_retention_times(
+        pl.from_pandas(competitors_df[[SOURCE_KEY, 'iRT']]), fits_df, cross_fit=False,
+    ).to_numpy()
+    competitors_df['base_deltaRT'] = (
+        competitors_df['retentionTime'] - competitors_df['predRT']
+    ).abs()
+    competitors_df['deltaRT'] = competitors_df['base_deltaRT']/competitors_df[
+        SOURCE_KEY
+    ].map(rt_scales).fillna(1.0)
 
     competitors_df['accession_spliced'] = 0
     competitors_df['accession_nonspliced'] = 1
     competitors_df.drop(
-        ['matched_pcps','intensities','mzs','prositIons','iRT'], axis=1,
+        ['intensities','mzs','prositIons','iRT'], axis=1,
     ).sort_values(by='spectralAngle', ascending=False).to_csv(
         f'{config.output_folder}/cleavageCompetitors.csv',
         index=False,
     )
 
+    weights_prefix = 'final'
+    if config.rescore_strata:
+        # Separately rescored strata have no shared model, the largest stratum's is used.
+        acc_idx, _ = get_largest_stratum(config.output_folder, 'percolatorSeparate')
+        weights_prefix = f'final_{acc_idx}'
     weights_df = pd.read_csv(
-        f'{config.output_folder}/final.percolatorSeparate.weights.csv',
+        f'{config.output_folder}/{weights_prefix}.percolatorSeparate.weights.csv',
         skiprows=lambda x : x not in [0, 2, 5, 8],
         sep='\t',
     )
@@ -343,21 +280,9 @@ def validate_spliced(config):
     final_df[final_df['pcpPeptide'].apply(lambda x : isinstance(x, str))].to_csv(
         f'{config.output_folder}/competitorPsp.csv'
     )
-    for raw_file in final_df[SOURCE_KEY].unique().tolist():
-        rt_df = pd.read_csv(
-            f'{config.output_folder}/rt_fit_{raw_file}.csv'
-        )
-        rt_ints[raw_file] = rt_df['intercepts'].mean()
-        rt_coefs[raw_file] = rt_df['coefficents'].mean()
-
-    final_df['deltaRT'] = final_df.apply(
-        lambda x : abs(
-            x['deltaRT']/rt_coefs.get(
-                x['source'], 1.0
-            ) if rt_coefs.get(x['source'], 1.0) > 0 else x['deltaRT']
-        ),
-        axis=1,
-    )
+    final_df['deltaRT'] = (
+        final_df['deltaRT']/final_df[SOURCE_KEY].map(rt_scales).fillna(1.0)
+    ).abs()
 
     final_df['accession_nonspliced'] = final_df['accessionGroup'].apply(
         lambda x : 1 if x == 'nonspliced' else 0
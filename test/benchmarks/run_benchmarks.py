@@ -0,0 +1,538 @@
+""" Benchmark harness for the inSPIRE hot paths using deterministic synthetic data.
+
+    Run from the repository root, e.g.:
+
+        python test/benchmarks/run_benchmarks.py --scale 10000
+        python test/benchmarks/run_benchmarks.py --scale 10000 --filter reader --repeat 5
+        python test/benchmarks/run_benchmarks.py --compare results/a.json results/b.json
+
+    Each run writes a json file named by git commit and scale to the results
+    folder so that throughput can be compared across commits.
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+# Allow running from a source checkout without installing inSPIRE.
+sys.path.insert(
+    1, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+# pylint: disable=wrong-import-position
+from synthetic import SyntheticExperiment
+
+from inspire.constants import (
+    CHARGE_KEY,
+    INTENSITIES_KEY,
+    LABEL_KEY,
+    MZS_KEY,
+    PEPTIDE_KEY,
+    PROSIT_INTES_KEY,
+    PROSIT_IONS_KEY,
+    PROSIT_SEQ_KEY,
+    PTM_SEQ_KEY,
+    RT_KEY,
+    SPECTRAL_ANGLE_KEY,
+)
+from inspire.feature_creation import combine_spectral_data
+from inspire.input.mascot import read_mascot_data
+from inspire.input.maxquant import read_mq_data
+from inspire.input.mgf import process_mgf_file
+from inspire.input.msp import msp_to_df
+from inspire.input.msfragger import read_ms_fragger_data
+from inspire.input.mzml import process_mzml_file
+from inspire.input.peaks import read_peaks_data
+from inspire.mz_match import get_ion_masses
+from inspire.prosit import get_precursor_charge_onehot, get_sequence_integer, sanitize
+from inspire.proteome_index import ProteomeIndex, remap_to_proteome
+from inspire.quant.normalise import (
+    clean_quantification_values,
+    count_valid_and_identified_quantifications,
+    equalize_medians,
+    log_transform_intensities,
+)
+from inspire.retention_time import add_delta_irt
+from inspire.spectral_features import (
+    calculate_spectral_features,
+    fetch_mod_weight_dict,
+    get_matches,
+    score_spectra,
+)
+from inspire.utils import fetch_proteome
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Number of raw files in the quantification normalisation benchmark.
+QUANT_SOURCES = 100
+# Process counts for the score_spectra scaling benchmarks.
+SCORING_CORES = sorted({1, 2, 4, 8} & set(range(1, (os.cpu_count() or 1) + 1)))
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """ Decorator registering a benchmark. The decorated function receives the
+        benchmark context and returns a function to time and the number of items
+        (PSMs, spectra, peptides) it processes.
+    """
+    def register(setup_func):
+        BENCHMARKS[name] = setup_func
+        return setup_func
+    return register
+
+class BenchmarkContext:
+    """ Synthetic data and shared intermediate results, created lazily. Search result
+        readers may use a separate, larger, experiment.
+    """
+    def __init__(self, experiment, data_folder, search_experiment=None, search_folder=None):
+        self.experiment = experiment
+        self.data_folder = data_folder
+        self.search_experiment = experiment if search_experiment is None else search_experiment
+        self.search_folder = data_folder if search_folder is None else search_folder
+        self.source = experiment.source_names[0]
+        self.mods_df = experiment.mods_df()
+        self.ptm_id_weights = fetch_mod_weight_dict(self.mods_df)
+        self._cache = {}
+
+    def cached(self, key, func):
+        """ Function to compute an intermediate result once.
+        """
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def prosit_df(self):
+        """ Predicted spectra read from the synthetic msp file.
+        """
+        return self.cached(
+            'prosit', lambda : msp_to_df(
+                f'{self.data_folder}/prositPredictions.msp', 'prosit', None,
+            )
+        )
+
+    def combined_df(self):
+        """ Search results of the first source combined with its spectra and predictions.
+        """
+        def _combine():
+            search_df = self.experiment.psm_table()
+            search_df = search_df.filter(pl.col('source').eq(self.source))
+            scan_df = process_mgf_file(
+                f'{self.data_folder}/{self.source}.mgf',
+                set(search_df['scan'].to_list()),
+                None,
+                None,
+            )
+            return combine_spectral_data(search_df, scan_df, self.prosit_df(), 1, 'prosit')
+        return self.cached('combined', _combine)
+
+@benchmark('reader_maxquant')
+def bench_read_mq_data(context):
+    """ Reading MaxQuant msms.txt.
+    """
+    return (
+        lambda : read_mq_data(f'{context.search_folder}/msms.txt'),
+        context.search_experiment.n_psms,
+    )
+
+@benchmark('reader_peaks')
+def bench_read_peaks_data(context):
+    """ Reading PEAKS DB search psm csv.
+    """
+    return (
+        lambda : read_peaks_data(f'{context.search_folder}/peaks_search.csv'),
+        context.search_experiment.n_psms,
+    )
+
+@benchmark('reader_mascot')
+def bench_read_mascot_data(context):
+    """ Reading Mascot csv exports.
+    """
+    return (
+        lambda : read_mascot_data(
+            f'{context.search_folder}/mascot_search.csv', None, None, False, None,
+        ),
+        context.search_experiment.n_psms,
+    )
+
+@benchmark('reader_msfragger')
+def bench_read_ms_fragger_data(context):
+    """ Reading MSFragger pepXML files, one worker per file.
+    """
+    pepxml_files = [
+        f'{context.search_folder}/{source}.pepXML'
+        for source in context.search_experiment.source_names
+    ]
+    return (
+        lambda : read_ms_fragger_data(pepxml_files, None, len(pepxml_files), False),
+        context.search_experiment.n_psms,
+    )
+
+@benchmark('msp_to_df')
+def bench_msp_to_df(context):
+    """ Reading Prosit predictions in msp format.
+    """
+    n_spectra = context.prosit_df().shape[0]
+    return (
+        lambda : msp_to_df(f'{context.data_folder}/prositPredictions.msp', 'prosit', None),
+        n_spectra,
+    )
+
+@benchmark('process_mgf_file')
+def bench_process_mgf_file(context):
+    """ Reading all spectra of one mgf file.
+    """
+    scans = set(range(1, context.experiment.n_psms + 1))
+    n_spectra = int((context.experiment.psm_sources == 0).sum())
+    return (
+        lambda : process_mgf_file(
+            f'{context.data_folder}/{context.source}.mgf', scans, None, None,
+            with_retention_time=True, with_ms1=True,
+        ),
+        n_spectra,
+    )
+
+@benchmark('process_mzml_file')
+def bench_process_mzml_file(context):
+    """ Reading all spectra of one mzML file.
+    """
+    n_spectra = int((context.experiment.psm_sources == 0).sum())
+    return (
+        lambda : process_mzml_file(
+            f'{context.data_folder}/{context.source}.mzML', None, with_retention_time=True,
+        ),
+        n_spectra,
+    )
+
+@benchmark('get_sequence_integer')
+def bench_get_sequence_integer(context):
+    """ Encoding modified sequences in the Prosit alphabet.
+    """
+    sequences = context.prosit_df()[PROSIT_SEQ_KEY].to_list()
+    return lambda : get_sequence_integer(sequences), len(sequences)
+
+@benchmark('sanitize')
+def bench_sanitize(context):
+    """ Cleaning raw Prosit intensity predictions.
+    """
+    prosit_df = context.prosit_df()
+    sequence_integer = get_sequence_integer(prosit_df[PROSIT_SEQ_KEY].to_list())
+    charge_onehot = get_precursor_charge_onehot(prosit_df[CHARGE_KEY].to_list())
+    intensities = np.random.default_rng(0).normal(
+        0.2, 0.3, (prosit_df.shape[0], 174)
+    ).astype(np.float32)
+
+    def _run():
+        return sanitize({
+            'sequence_integer': sequence_integer,
+            'precursor_charge_onehot': charge_onehot,
+            'intensities_pred': intensities.copy(),
+        })
+    return _run, prosit_df.shape[0]
+
+@benchmark('get_matches')
+def bench_get_matches(context):
+    """ Matching observed peaks to predicted fragment ions.
+    """
+    combined_df = context.combined_df()
+    match_args = []
+    for row in combined_df.iter_rows(named=True):
+        ion_masses, precursor_weight = get_ion_masses(
+            row[PEPTIDE_KEY], context.ptm_id_weights, row[PTM_SEQ_KEY],
+        )
+        match_args.append((
+            ion_masses,
+            dict(zip(row[PROSIT_IONS_KEY], row[PROSIT_INTES_KEY])),
+            np.array(row[MZS_KEY]),
+            precursor_weight,
+            row[INTENSITIES_KEY],
+            0.02,
+            row[CHARGE_KEY],
+            'Da',
+        ))
+
+    def _run():
+        for args in match_args:
+            get_matches(*args)
+    return _run, len(match_args)
+
+@benchmark('calculate_spectral_features')
+def bench_calculate_spectral_features(context):
+    """ The full spectral feature calculation per PSM (without Prosit-delta).
+    """
+    rows = list(context.combined_df().iter_rows(named=True))
+
+    def _run():
+        for row in rows:
+            calculate_spectral_features(
+                row, context.ptm_id_weights, 0.02, 'Da', None, '1', 'ignore',
+            )
+    return _run, len(rows)
+
+def register_score_spectra(n_cores):
+    """ Function to register a score_spectra benchmark using n_cores processes, so that
+        the speed up with cores can be read from the results.
+    """
+    @benchmark(f'score_spectra_{n_cores}_cores')
+    def bench_score_spectra(context):
+        """ Batch spectral angle scoring across a process pool.
+        """
+        score_df = context.combined_df()
+        return (
+            lambda : score_spectra(score_df, context.ptm_id_weights, 0.02, 'Da', n_cores),
+            score_df.shape[0],
+        )
+    return bench_score_spectra
+
+for _n_cores in SCORING_CORES:
+    register_score_spectra(_n_cores)
+
+@benchmark('add_delta_irt')
+def bench_add_delta_irt(context):
+    """ Retention time calibration and deltaRT calculation.
+    """
+    experiment = context.experiment
+    rt_df = experiment.psm_table().select([RT_KEY, LABEL_KEY]).with_columns(
+        pl.Series('iRT', experiment.irts[experiment.psm_peptide_idx]),
+        pl.Series(
+            SPECTRAL_ANGLE_KEY, np.random.default_rng(0).random(experiment.n_psms)
+        ),
+    )
+    config = SimpleNamespace(
+        rt_fit_loc=None,
+        output_folder=context.data_folder,
+        rt_fit_method='linear',
+        reuse_rt_fits=False,
+    )
+    return lambda : add_delta_irt(rt_df, config, None), rt_df.shape[0]
+
+@benchmark('add_delta_irt_achrom')
+def bench_add_delta_irt_achrom(context):
+    """ Retention time prediction with achrom's additive model when iRT is missing.
+    """
+    experiment = context.experiment
+    rt_df = experiment.psm_table().select([PEPTIDE_KEY, RT_KEY, LABEL_KEY]).with_columns(
+        pl.Series(
+            SPECTRAL_ANGLE_KEY, np.random.default_rng(0).random(experiment.n_psms)
+        ),
+    )
+    config = SimpleNamespace(
+        rt_fit_loc=None,
+        output_folder=context.data_folder,
+        rt_fit_method='linear',
+        reuse_rt_fits=False,
+    )
+    return lambda : add_delta_irt(rt_df, config, None), rt_df.shape[0]
+
+@benchmark('remap_to_proteome')
+def bench_remap_to_proteome(context):
+    """ Remapping peptides to the proteome.
+    """
+    proteome_index = ProteomeIndex.build(
+        fetch_proteome(f'{context.data_folder}/proteome.fasta', with_desc=False)
+    )
+    peptides = list(context.experiment.peptides)
+
+    def _run():
+        for peptide in peptides:
+            remap_to_proteome(peptide, proteome_index)
+    return _run, len(peptides)
+
+@benchmark('normalise_intensities')
+def bench_normalise_intensities(context):
+    """ Cleaning and median equalisation of a wide peptide by raw file quantification.
+    """
+    rng = np.random.default_rng(0)
+    peptides = list(context.experiment.peptides)
+    sources = [f'raw_{idx}' for idx in range(QUANT_SOURCES)]
+    quant_data = {'peptide': peptides, 'proteins': ['protein'] * len(peptides)}
+    for source in sources:
+        quant_data[f'{source}_raw'] = rng.lognormal(15, 2, len(peptides))
+        quant_data[f'{source}_idp'] = rng.random(len(peptides))
+        quant_data[f'{source}_ratio'] = rng.random(len(peptides))
+    quant_df = pd.DataFrame(quant_data)
+    config = SimpleNamespace(skyline_idp_cut_off=0.3, skyline_bg_ratio_cut_off=0.2)
+
+    def _run():
+        norm_df = count_valid_and_identified_quantifications(quant_df, sources, config)
+        norm_df = clean_quantification_values(norm_df, sources, config)
+        equalize_medians(log_transform_intensities(norm_df, sources), sources)
+    return _run, len(peptides)*len(sources)
+
+def get_commit():
+    """ Function to identify the checked out commit, flagging uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short=10', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(dirty)
+
+def run_benchmarks(scale, seed, repeat, name_filter, data_folder, search_scale=None):
+    """ Function to generate synthetic data and time each selected benchmark. If
+        search_scale is given the search result readers are run on a separate
+        experiment of that many PSMs.
+
+    Returns
+    -------
+    results : dict
+        The timings of each benchmark.
+    """
+    experiment = SyntheticExperiment(scale, seed=seed)
+    start_time = time.perf_counter()
+    experiment.write_all(data_folder)
+    print(f'Generated {scale} synthetic PSMs in {time.perf_counter() - start_time:.1f}s.')
+
+    search_experiment = None
+    search_folder = None
+    if search_scale is not None:
+        search_experiment = SyntheticExperiment(search_scale, seed=seed)
+        search_folder = f'{data_folder}/search'
+        start_time = time.perf_counter()
+        search_experiment.write_search_results(search_folder)
+        print(
+            f'Generated {search_scale} synthetic search results in ' +
+            f'{time.perf_counter() - start_time:.1f}s.'
+        )
+
+    context = BenchmarkContext(experiment, data_folder, search_experiment, search_folder)
+    results = {}
+    for name, setup_func in BENCHMARKS.items():
+        if name_filter is not None and name_filter not in name:
+            continue
+        try:
+            bench_func, n_items = setup_func(context)
+            timings = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                bench_func()
+                timings.append(time.perf_counter() - start_time)
+        except Exception as err: # pylint: disable=broad-except
+            results[name] = {'error': f'{type(err).__name__}: {err}'}
+            print(f'{name:<30} FAILED ({type(err).__name__}: {err})')
+            continue
+
+        best_time = min(timings)
+        results[name] = {
+            'items': n_items,
+            'timings': timings,
+            'min': best_time,
+            'median': float(np.median(timings)),
+            'itemsPerSecond': n_items/best_time if best_time else None,
+        }
+        print(
+            f'{name:<30} {best_time:>10.4f}s  {results[name]["itemsPerSecond"]:>14.1f} items/s'
+        )
+    return results
+
+def compare_results(baseline_file, current_file):
+    """ Function to print the speed up of one benchmark run over another.
+    """
+    with open(baseline_file, 'r', encoding='UTF-8') as in_file:
+        baseline = json.load(in_file)
+    with open(current_file, 'r', encoding='UTF-8') as in_file:
+        current = json.load(in_file)
+
+    if baseline['scale'] != current['scale']:
+        print(f'Warning: comparing scale {baseline["scale"]} with {current["scale"]}.')
+
+    print(f'{"benchmark":<30} {baseline["commit"]:>12} {current["commit"]:>12} {"speed up":>9}')
+    for name in sorted(set(baseline['results']) | set(current['results'])):
+        base_result = baseline['results'].get(name, {})
+        new_result = current['results'].get(name, {})
+        if 'min' not in base_result or 'min' not in new_result:
+            print(f'{name:<30} {"-":>12} {"-":>12} {"-":>9}')
+            continue
+        speed_up = base_result['min']/new_result['min']
+        print(
+            f'{name:<30} {base_result["min"]:>11.4f}s {new_result["min"]:>11.4f}s ' +
+            f'{speed_up:>8.2f}x'
+        )
+
+def get_arguments():
+    """ Function to collect command line arguments.
+    """
+    parser = ArgumentParser(description='Benchmark the inSPIRE hot paths on synthetic data.')
+    parser.add_argument('--scale', type=int, default=10_000, help='Number of PSMs.')
+    parser.add_argument(
+        '--search_scale', type=int,
+        help='Number of PSMs for the search result readers (default: scale).',
+    )
+    parser.add_argument('--seed', type=int, default=42, help='Seed for the data generator.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per benchmark.')
+    parser.add_argument('--filter', help='Only run benchmarks containing this string.')
+    parser.add_argument(
+        '--data_folder', help='Folder for the synthetic data (default: temporary folder).',
+    )
+    parser.add_argument(
+        '--results_folder', default=RESULTS_FOLDER, help='Folder to store result files.',
+    )
+    parser.add_argument(
+        '--compare', nargs='+', help='Result file(s) to compare against the current run.',
+    )
+    parser.add_argument(
+        '--list', action='store_true', help='List the available benchmarks and exit.',
+    )
+    return parser.parse_args()
+
+def main():
+    """ Function to run the benchmark suite from the command line.
+    """
+    args = get_arguments()
+    if args.list:
+        for name, setup_func in BENCHMARKS.items():
+            print(f'{name:<30} {setup_func.__doc__.strip()}')
+        return
+
+    if args.compare is not None and len(args.compare) == 2:
+        compare_results(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        data_folder = args.data_folder if args.data_folder is not None else temp_folder
+        results = run_benchmarks(
+            args.scale, args.seed, args.repeat, args.filter, data_folder, args.search_scale,
+        )
+
+    commit, dirty = get_commit()
+    run_data = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'scale': args.scale,
+        'searchScale': args.search_scale,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    if not os.path.exists(args.results_folder):
+        os.makedirs(args.results_folder)
+    suffix = '_dirty' if dirty else ''
+    results_file = f'{args.results_folder}/{commit}{suffix}_{args.scale}.json'
+    with open(results_file, 'w', encoding='UTF-8') as out_file:
+        json.dump(run_data, out_file, indent=4)
+    print(f'Results written to {results_file}')
+
+    if args.compare is not None:
+        compare_results(args.compare[0], results_file)
+
+if __name__ == '__main__':
+    main()
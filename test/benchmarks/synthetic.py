@@ -0,0 +1,552 @@
+""" Deterministic generator of synthetic immunopeptidomics data for benchmarking.
+    The same scale and seed always produce identical files, so timings can be
+    compared across commits.
+"""
+import base64
+import os
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from inspire.constants import (
+    ACCESSION_KEY,
+    CHARGE_KEY,
+    DELTA_SCORE_KEY,
+    ENGINE_SCORE_KEY,
+    LABEL_KEY,
+    MASS_DIFF_KEY,
+    PEPTIDE_KEY,
+    PROTON,
+    PTM_SEQ_KEY,
+    RESIDUE_WEIGHTS,
+    RT_KEY,
+    SCAN_KEY,
+    SEQ_LEN_KEY,
+    SOURCE_KEY,
+)
+
+# Cysteine is excluded as it is filtered by default when unmodified.
+AMINO_ACIDS = np.array(list('ADEFGHIKLMNPQRSTVWY'))
+OXIDATION_WEIGHT = 15.994915
+WATER_WEIGHT = 18.010565
+OXIDATION_ID = 1
+PROTEIN_LENGTH = 400
+
+class SyntheticExperiment:
+    """ A synthetic experiment of PSMs drawn from a random proteome, from which search
+        results, scans and Prosit style predictions can be written.
+    """
+    def __init__(
+            self,
+            n_psms,
+            n_sources=2,
+            seed=42,
+            decoy_fraction=0.2,
+            oxidation_fraction=0.1,
+            n_noise_peaks=10,
+        ):
+        self.n_psms = n_psms
+        self.n_sources = n_sources
+        self.n_noise_peaks = n_noise_peaks
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        n_proteins = max(10, n_psms//20)
+        residues = self.rng.choice(AMINO_ACIDS, size=(n_proteins, PROTEIN_LENGTH))
+        self.proteome = [
+            (f'SYNTH{idx:07d}', ''.join(protein)) for idx, protein in enumerate(residues)
+        ]
+
+        n_peptides = max(1, n_psms//2)
+        protein_idx = self.rng.integers(0, n_proteins, n_peptides)
+        lengths = self.rng.integers(8, 15, n_peptides)
+        starts = self.rng.integers(0, PROTEIN_LENGTH - 15, n_peptides)
+        is_decoy = self.rng.random(n_peptides) < decoy_fraction
+        peptides = []
+        for prot_idx, start, length, decoy in zip(protein_idx, starts, lengths, is_decoy):
+            peptide = self.proteome[prot_idx][1][start:start + length]
+            peptides.append(peptide[::-1] if decoy else peptide)
+        self.peptides = np.array(peptides, dtype=object)
+        self.accessions = np.array([
+            f'rev_{self.proteome[idx][0]}' if decoy else self.proteome[idx][0]
+            for idx, decoy in zip(protein_idx, is_decoy)
+        ], dtype=object)
+        self.is_decoy = is_decoy
+
+        # Oxidise the first methionine of a fraction of peptides.
+        ox_positions = np.array([peptide.find('M') for peptide in peptides])
+        ox_positions[self.rng.random(n_peptides) >= oxidation_fraction] = -1
+        self.ox_positions = ox_positions
+
+        # Retention time is a noisy linear function of hydrophobicity.
+        hydrophobicity = np.array([
+            sum(residue in 'AFILMVWY' for residue in peptide)/len(peptide)
+            for peptide in peptides
+        ])
+        self.irts = 100*hydrophobicity - 10 + self.rng.normal(0, 5, n_peptides)
+
+        self.psm_peptide_idx = self.rng.integers(0, n_peptides, n_psms)
+        self.psm_sources = self.rng.integers(0, n_sources, n_psms)
+        self.psm_scans = np.zeros(n_psms, dtype=int)
+        for source_idx in range(n_sources):
+            source_mask = self.psm_sources == source_idx
+            self.psm_scans[source_mask] = np.arange(1, source_mask.sum() + 1)
+        self.psm_charges = self.rng.integers(1, 4, n_psms)
+        self.psm_rts = (
+            self.irts[self.psm_peptide_idx]*0.4 + 30 + self.rng.normal(0, 1, n_psms)
+        )
+        psm_decoys = self.is_decoy[self.psm_peptide_idx]
+        self.psm_scores = np.where(
+            psm_decoys,
+            self.rng.gamma(2.0, 8.0, n_psms),
+            self.rng.gamma(4.0, 10.0, n_psms),
+        )
+        self.psm_mass_diffs = self.rng.normal(0, 2, n_psms)
+        self.psm_delta_scores = self.psm_scores*self.rng.random(n_psms)
+        self.psm_ms1_intensities = self.rng.lognormal(14, 1, n_psms)
+
+    @property
+    def source_names(self):
+        """ Names of the synthetic raw files.
+        """
+        return [f'synthetic_{idx}' for idx in range(self.n_sources)]
+
+    def _ptm_seq(self, peptide_idx):
+        """ Function to get the inSPIRE ptm_seq of a peptide.
+        """
+        ox_pos = self.ox_positions[peptide_idx]
+        if ox_pos < 0:
+            return None
+        n_res = len(self.peptides[peptide_idx])
+        return '0.' + '0'*ox_pos + str(OXIDATION_ID) + '0'*(n_res - ox_pos - 1) + '.0'
+
+    def _residue_masses(self, peptide_idx):
+        """ Function to get the masses of all residues of a peptide including oxidation.
+        """
+        masses = np.array([RESIDUE_WEIGHTS[res] for res in self.peptides[peptide_idx]])
+        if self.ox_positions[peptide_idx] >= 0:
+            masses[self.ox_positions[peptide_idx]] += OXIDATION_WEIGHT
+        return masses
+
+    def _fragment_mzs(self, peptide_idx):
+        """ Function to get the singly charged b and y ion m/z of a peptide.
+        """
+        masses = self._residue_masses(peptide_idx)
+        b_ions = np.cumsum(masses)[:-1] + PROTON
+        y_ions = np.cumsum(masses[::-1])[:-1] + WATER_WEIGHT + PROTON
+        return b_ions, y_ions
+
+    def psm_table(self):
+        """ Function to create the PSMs in the inSPIRE formatted search results layout.
+
+        Returns
+        -------
+        psm_df : pl.DataFrame
+            The synthetic PSMs.
+        """
+        peptides = self.peptides[self.psm_peptide_idx]
+        masses = np.array([
+            self._residue_masses(idx).sum() + WATER_WEIGHT for idx in range(len(self.peptides))
+        ])
+        lengths = np.array([len(peptide) for peptide in self.peptides])
+        return pl.DataFrame({
+            SOURCE_KEY: [self.source_names[idx] for idx in self.psm_sources],
+            SCAN_KEY: self.psm_scans,
+            PEPTIDE_KEY: list(peptides),
+            SEQ_LEN_KEY: lengths[self.psm_peptide_idx],
+            'missedCleavages': np.zeros(self.n_psms, dtype=int),
+            CHARGE_KEY: self.psm_charges,
+            MASS_DIFF_KEY: self.psm_mass_diffs,
+            RT_KEY: self.psm_rts,
+            ENGINE_SCORE_KEY: self.psm_scores,
+            DELTA_SCORE_KEY: self.psm_delta_scores,
+            'ms1Intensity': self.psm_ms1_intensities,
+            PTM_SEQ_KEY: [self._ptm_seq(idx) for idx in self.psm_peptide_idx],
+            ACCESSION_KEY: list(self.accessions[self.psm_peptide_idx]),
+            'fromChimera': np.zeros(self.n_psms, dtype=int),
+            'avgResidueMass': masses[self.psm_peptide_idx]/lengths[self.psm_peptide_idx],
+            LABEL_KEY: np.where(self.is_decoy[self.psm_peptide_idx], -1, 1),
+        })
+
+    def write_formatted_search(self, output_folder):
+        """ Function to write search results and modifications in inSPIRE format.
+        """
+        self.psm_table().write_csv(f'{output_folder}/formatted_search.csv')
+        self.mods_df().to_csv(f'{output_folder}/mods_df.csv', index=False)
+        return f'{output_folder}/formatted_search.csv'
+
+    @staticmethod
+    def mods_df():
+        """ Function to get the modifications DataFrame of the experiment.
+        """
+        return pd.DataFrame({
+            'Name': ['Oxidation (M)'],
+            'Delta': [OXIDATION_WEIGHT],
+            'Identifier': [OXIDATION_ID],
+            'isVar': [True],
+        })
+
+    def write_maxquant(self, output_folder):
+        """ Function to write the PSMs as a MaxQuant msms.txt file.
+        """
+        psm_df = self.psm_table()
+        mod_seqs = []
+        modifications = []
+        for idx in self.psm_peptide_idx:
+            peptide = self.peptides[idx]
+            ox_pos = self.ox_positions[idx]
+            if ox_pos < 0:
+                mod_seqs.append(f'_{peptide}_')
+                modifications.append('Unmodified')
+            else:
+                mod_seqs.append(f'_{peptide[:ox_pos + 1]}(Oxidation (M)){peptide[ox_pos + 1:]}_')
+                modifications.append('Oxidation (M)')
+
+        mq_df = pl.DataFrame({
+            'Raw file': psm_df[SOURCE_KEY],
+            'Scan number': psm_df[SCAN_KEY],
+            'Sequence': psm_df[PEPTIDE_KEY],
+            'Length': psm_df[SEQ_LEN_KEY],
+            'Missed cleavages': psm_df['missedCleavages'],
+            'Modifications': modifications,
+            'Modified sequence': mod_seqs,
+            'Proteins': psm_df[ACCESSION_KEY],
+            'Charge': psm_df[CHARGE_KEY],
+            'Mass': psm_df['avgResidueMass']*psm_df[SEQ_LEN_KEY],
+            'Simple mass error [ppm]': psm_df[MASS_DIFF_KEY],
+            'Retention time': psm_df[RT_KEY],
+            'Score': psm_df[ENGINE_SCORE_KEY],
+            'Delta score': psm_df[DELTA_SCORE_KEY],
+            'Reverse': ['+' if label == -1 else None for label in psm_df[LABEL_KEY]],
+        })
+        mq_df.write_csv(f'{output_folder}/msms.txt', separator='\t')
+        return f'{output_folder}/msms.txt'
+
+    def write_peaks(self, output_folder):
+        """ Function to write the PSMs as a PEAKS DB search psm csv file.
+        """
+        psm_df = self.psm_table()
+        peaks_peptides = []
+        ptms = []
+        ascores = []
+        for idx in self.psm_peptide_idx:
+            peptide = self.peptides[idx]
+            ox_pos = self.ox_positions[idx]
+            if ox_pos < 0:
+                peaks_peptides.append(peptide)
+                ptms.append(None)
+                ascores.append(None)
+            else:
+                peaks_peptides.append(
+                    f'{peptide[:ox_pos + 1]}(+15.99){peptide[ox_pos + 1:]}'
+                )
+                ptms.append('Oxidation (M)')
+                ascores.append(f'M{ox_pos + 1}:Oxidation (M):1000.00')
+
+        masses = psm_df['avgResidueMass']*psm_df[SEQ_LEN_KEY]
+        peaks_df = pl.DataFrame({
+            'Peptide': peaks_peptides,
+            '-10lgP': psm_df[ENGINE_SCORE_KEY],
+            'Mass': masses,
+            'Length': psm_df[SEQ_LEN_KEY],
+            'ppm': psm_df[MASS_DIFF_KEY],
+            'm/z': (masses + psm_df[CHARGE_KEY]*PROTON)/psm_df[CHARGE_KEY],
+            'Z': psm_df[CHARGE_KEY],
+            'RT': psm_df[RT_KEY],
+            'Scan': [f'F1:{scan}' for scan in psm_df[SCAN_KEY]],
+            'from Chimera': ['No']*self.n_psms,
+            'Source File': [f'{source}.raw' for source in psm_df[SOURCE_KEY]],
+            'Accession': [
+                acc.replace('rev_', 'DECOY_') for acc in psm_df[ACCESSION_KEY]
+            ],
+            'PTM': ptms,
+            'AScore': ascores,
+        })
+        peaks_df.write_csv(f'{output_folder}/peaks_search.csv')
+        return f'{output_folder}/peaks_search.csv'
+
+    def write_mascot(self, output_folder):
+        """ Function to write the PSMs as a Mascot csv export with a single source file.
+        """
+        psm_df = self.psm_table()
+        source = self.source_names[0]
+        out_file = f'{output_folder}/mascot_search.csv'
+        with open(out_file, 'w', encoding='UTF-8') as mascot_file:
+            mascot_file.write(
+                '\n"Header","--------------------------------------------------------"\n\n' +
+                'Search title,"inSPIRE Synthetic Data"\n' +
+                f'Peak list data path,"{source}.mgf"\n' +
+                f'Number of queries,{self.n_psms}\n\n' +
+                '"Variable modifications",' +
+                '"--------------------------------------------------------"\n\n' +
+                '"Identifier","Name","Delta","Neutral loss(es)"\n' +
+                f'{OXIDATION_ID},"Oxidation (M)",{OXIDATION_WEIGHT},0,63.998285\n\n' +
+                '"Search Parameters",' +
+                '"--------------------------------------------------------"\n\n' +
+                'Peptide Mass Tolerance,5\n\n' +
+                '"Protein hits","--------------------------------------------------------"\n\n' +
+                'prot_hit_num,prot_acc,prot_desc,pep_query,pep_rank,pep_exp_mr,pep_exp_z,' +
+                'pep_calc_mr,pep_miss,pep_score,pep_seq,pep_var_mod_pos,pep_scan_title\n'
+            )
+            for psm_idx, row in enumerate(psm_df.iter_rows(named=True)):
+                mass = row['avgResidueMass']*row[SEQ_LEN_KEY]
+                ptm_seq = row[PTM_SEQ_KEY] if row[PTM_SEQ_KEY] is not None else ''
+                description = (
+                    'Reversed sequence' if row[LABEL_KEY] == -1 else 'synthetic protein'
+                )
+                mascot_file.write(
+                    f'{psm_idx + 1},"{row[ACCESSION_KEY]}","{description}",{psm_idx + 1},1,' +
+                    f'{mass:.4f},{row[CHARGE_KEY]},{mass:.4f},0,' +
+                    f'{row[ENGINE_SCORE_KEY]:.2f},{row[PEPTIDE_KEY]},{ptm_seq},' +
+                    f'"{source}.{psm_idx + 1}.{psm_idx + 1}.{row[CHARGE_KEY]} ' +
+                    f'File:~{source}.raw~, NativeID:~controllerType=0 controllerNumber=1 ' +
+                    f'scan={row[SCAN_KEY]}~"\n'
+                )
+            mascot_file.write(
+                '\n"Queries","--------------------------------------------------------"\n\n' +
+                '"query_number","moverz","charge","intensity","StringTitle",' +
+                '"Scan number range","Retention time range","qualifiers"\n'
+            )
+        return out_file
+
+    def _pepxml_search_hit(self, peptide_idx, rank, score, mass_diff):
+        """ Function to create an MSFragger pepXML search_hit element for a peptide.
+        """
+        peptide = self.peptides[peptide_idx]
+        ox_pos = self.ox_positions[peptide_idx]
+        accession = self.accessions[peptide_idx]
+        if ox_pos < 0:
+            mod_info = ''
+        else:
+            mod_info = (
+                '<modification_info modified_peptide="' +
+                f'{peptide[:ox_pos + 1]}[147]{peptide[ox_pos + 1:]}">' +
+                f'<mod_aminoacid_mass mass="{RESIDUE_WEIGHTS["M"] + OXIDATION_WEIGHT:.4f}" ' +
+                f'position="{ox_pos + 1}"/></modification_info>'
+            )
+        mass = self._residue_masses(peptide_idx).sum() + WATER_WEIGHT
+        return (
+            f'<search_hit hit_rank="{rank}" peptide="{peptide}" peptide_prev_aa="K" ' +
+            f'peptide_next_aa="L" protein="{accession}" num_tot_proteins="1" ' +
+            f'calc_neutral_pep_mass="{mass:.4f}" massdiff="{mass_diff:.4f}" ' +
+            f'num_tol_term="0" num_missed_cleavages="0">{mod_info}' +
+            f'<search_score name="hyperscore" value="{score:.3f}"/>' +
+            '<search_score name="nextscore" value="0.0"/></search_hit>\n'
+        )
+
+    def write_msfragger(self, output_folder):
+        """ Function to write one MSFragger pepXML file per source, in which every
+            spectrum has a second ranked hit to a different peptide.
+        """
+        out_files = []
+        for source_idx, name in enumerate(self.source_names):
+            out_file = f'{output_folder}/{name}.pepXML'
+            with open(out_file, 'w', encoding='UTF-8') as pepxml_file:
+                pepxml_file.write(
+                    '<?xml version="1.0" encoding="UTF-8"?>\n' +
+                    '<msms_pipeline_analysis ' +
+                    'xmlns="http://regis-web.systemsbiology.net/pepXML">\n' +
+                    f'<msms_run_summary base_name="{name}" raw_data=".mzML">\n'
+                )
+                for psm_idx in np.where(self.psm_sources == source_idx)[0]:
+                    scan = self.psm_scans[psm_idx]
+                    charge = self.psm_charges[psm_idx]
+                    peptide_idx = self.psm_peptide_idx[psm_idx]
+                    score = self.psm_scores[psm_idx]
+                    pepxml_file.write(
+                        f'<spectrum_query spectrum="{name}.{scan:05d}.{scan:05d}.{charge}" ' +
+                        f'start_scan="{scan}" end_scan="{scan}" assumed_charge="{charge}" ' +
+                        f'retention_time_sec="{self.psm_rts[psm_idx]*60:.3f}" ' +
+                        f'index="{psm_idx + 1}"><search_result>\n' +
+                        self._pepxml_search_hit(
+                            peptide_idx, 1, score, self.psm_mass_diffs[psm_idx],
+                        ) +
+                        self._pepxml_search_hit(
+                            (peptide_idx + 1) % len(self.peptides),
+                            2,
+                            score - self.psm_delta_scores[psm_idx],
+                            0.0,
+                        ) +
+                        '</search_result></spectrum_query>\n'
+                    )
+                pepxml_file.write('</msms_run_summary>\n</msms_pipeline_analysis>\n')
+            out_files.append(out_file)
+        return out_files
+
+    def _spectrum(self, psm_idx):
+        """ Function to create a synthetic MS2 spectrum containing a random subset of
+            the PSM's fragment ions and random noise peaks.
+        """
+        # Seeded per PSM so spectra do not depend on which files are written.
+        rng = np.random.default_rng([self.seed, psm_idx])
+        b_ions, y_ions = self._fragment_mzs(self.psm_peptide_idx[psm_idx])
+        fragments = np.concatenate([b_ions, y_ions])
+        observed = fragments[rng.random(len(fragments)) < 0.7]
+        observed = observed + rng.normal(0, 0.003, len(observed))
+        noise = rng.uniform(100, fragments.max() + 100, self.n_noise_peaks)
+        mzs = np.sort(np.concatenate([observed, noise]))
+        intensities = rng.lognormal(8, 1.5, len(mzs))
+        return mzs, intensities
+
+    def write_mgf(self, output_folder):
+        """ Function to write one mgf file per source.
+        """
+        handles = {
+            source_idx: open(f'{output_folder}/{name}.mgf', 'w', encoding='UTF-8')
+            for source_idx, name in enumerate(self.source_names)
+        }
+        try:
+            for psm_idx in range(self.n_psms):
+                mzs, intensities = self._spectrum(psm_idx)
+                source_idx = self.psm_sources[psm_idx]
+                scan = self.psm_scans[psm_idx]
+                peaks = '\n'.join(f'{mz:.5f} {inte:.2f}' for mz, inte in zip(mzs, intensities))
+                handles[source_idx].write(
+                    'BEGIN IONS\n' +
+                    f'TITLE={self.source_names[source_idx]}.{scan}.{scan}.' +
+                    f'{self.psm_charges[psm_idx]}\n' +
+                    f'RTINSECONDS={self.psm_rts[psm_idx]*60:.3f}\n' +
+                    f'PEPMASS=500.0 {self.psm_ms1_intensities[psm_idx]:.1f}\n' +
+                    f'CHARGE={self.psm_charges[psm_idx]}+\n' +
+                    f'SCANS={scan}\n{peaks}\nEND IONS\n'
+                )
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+    def write_mzml(self, output_folder):
+        """ Function to write one minimal (non-indexed) mzML file per source.
+        """
+        for source_idx, name in enumerate(self.source_names):
+            psm_indices = np.where(self.psm_sources == source_idx)[0]
+            with open(f'{output_folder}/{name}.mzML', 'w', encoding='UTF-8') as mzml_file:
+                mzml_file.write(
+                    '<?xml version="1.0" encoding="utf-8"?>\n' +
+                    '<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0">\n' +
+                    '<cvList count="2">' +
+                    '<cv id="MS" fullName="Proteomics Standards Initiative Mass ' +
+                    'Spectrometry Ontology" URI="https://purl.obolibrary.org/obo/ms.obo"/>' +
+                    '<cv id="UO" fullName="Unit Ontology" ' +
+                    'URI="https://purl.obolibrary.org/obo/uo.obo"/></cvList>\n' +
+                    f'<run id="{name}"><spectrumList count="{len(psm_indices)}">\n'
+                )
+                for spec_idx, psm_idx in enumerate(psm_indices):
+                    mzs, intensities = self._spectrum(psm_idx)
+                    mzml_file.write(
+                        _format_mzml_spectrum(
+                            spec_idx,
+                            self.psm_scans[psm_idx],
+                            self.psm_charges[psm_idx],
+                            self.psm_rts[psm_idx],
+                            mzs,
+                            intensities,
+                        )
+                    )
+                mzml_file.write('</spectrumList></run>\n</mzML>\n')
+
+    def write_prosit_msp(self, output_folder, collision_energy=33):
+        """ Function to write Prosit style predictions for every peptide and charge
+            observed in the experiment.
+        """
+        pairs = np.unique(
+            np.stack([self.psm_peptide_idx, self.psm_charges], axis=1), axis=0,
+        )
+        out_file = f'{output_folder}/prositPredictions.msp'
+        with open(out_file, 'w', encoding='UTF-8') as msp_file:
+            for pair_idx, (peptide_idx, charge) in enumerate(pairs):
+                peptide = self.peptides[peptide_idx]
+                ox_pos = self.ox_positions[peptide_idx]
+                if ox_pos < 0:
+                    mods, mod_string = '0', ''
+                else:
+                    mods = f'1/{ox_pos + 1},M,Oxidation'
+                    mod_string = f'Oxidation@M{ox_pos + 2}'
+                ion_names = []
+                for frag_idx in range(1, len(peptide)):
+                    for frag_charge in range(1, min(charge, 3) + 1):
+                        suffix = '' if frag_charge == 1 else f'^{frag_charge}'
+                        ion_names.extend([f'y{frag_idx}{suffix}', f'b{frag_idx}{suffix}'])
+                intensities = np.random.default_rng(
+                    [self.seed, peptide_idx, charge]
+                ).random(len(ion_names))
+                intensities /= intensities.max()
+                peaks = ''.join(
+                    f'\n0.0\t{inte}\t"{ion}/0.0ppm"'
+                    for ion, inte in zip(ion_names, intensities)
+                )
+                if pair_idx:
+                    msp_file.write('\n')
+                msp_file.write(
+                    f'Name: {peptide}/{charge}\nMW: 0.0\n' +
+                    f'Comment: Parent=0.0 Collision_energy={float(collision_energy)} ' +
+                    f'Mods={mods} ModString={peptide}//{mod_string}/{charge} ' +
+                    f'iRT={self.irts[peptide_idx]}\nNum peaks: {len(ion_names)}{peaks}'
+                )
+        return out_file
+
+    def write_proteome(self, output_folder):
+        """ Function to write the synthetic proteome in fasta format.
+        """
+        out_file = f'{output_folder}/proteome.fasta'
+        with open(out_file, 'w', encoding='UTF-8') as fasta_file:
+            for name, sequence in self.proteome:
+                fasta_file.write(f'>{name}\n{sequence}\n')
+        return out_file
+
+    def write_search_results(self, output_folder):
+        """ Function to write the search results in every supported search engine format.
+        """
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+        self.write_formatted_search(output_folder)
+        self.write_maxquant(output_folder)
+        self.write_peaks(output_folder)
+        self.write_mascot(output_folder)
+        self.write_msfragger(output_folder)
+
+    def write_all(self, output_folder):
+        """ Function to write every synthetic input format to a folder.
+        """
+        self.write_search_results(output_folder)
+        self.write_mgf(output_folder)
+        self.write_mzml(output_folder)
+        self.write_prosit_msp(output_folder)
+        self.write_proteome(output_folder)
+
+def _encode_array(values):
+    """ Function to base64 encode a 64-bit float array for mzML.
+    """
+    return base64.b64encode(np.asarray(values, dtype='<f8').tobytes()).decode('ascii')
+
+def _format_mzml_spectrum(spec_idx, scan, charge, retention_time, mzs, intensities):
+    """ Function to format a single MS2 spectrum in mzML.
+    """
+    binary_arrays = ''
+    for accession, name, values in (
+            ('MS:1000514', 'm/z array', mzs),
+            ('MS:1000515', 'intensity array', intensities),
+        ):
+        encoded = _encode_array(values)
+        binary_arrays += (
+            f'<binaryDataArray encodedLength="{len(encoded)}">' +
+            '<cvParam cvRef="MS" accession="MS:1000523" name="64-bit float"/>' +
+            '<cvParam cvRef="MS" accession="MS:1000576" name="no compression"/>' +
+            f'<cvParam cvRef="MS" accession="{accession}" name="{name}"/>' +
+            f'<binary>{encoded}</binary></binaryDataArray>'
+        )
+    return (
+        f'<spectrum index="{spec_idx}" ' +
+        f'id="controllerType=0 controllerNumber=1 scan={scan}" ' +
+        f'defaultArrayLength="{len(mzs)}">' +
+        '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="2"/>' +
+        '<scanList count="1"><scan>' +
+        '<cvParam cvRef="MS" accession="MS:1000016" name="scan start time" ' +
+        f'value="{retention_time:.4f}" unitCvRef="UO" unitAccession="UO:0000031" ' +
+        'unitName="minute"/></scan></scanList>' +
+        '<precursorList count="1"><precursor><selectedIonList count="1"><selectedIon>' +
+        '<cvParam cvRef="MS" accession="MS:1000041" name="charge state" ' +
+        f'value="{charge}"/></selectedIon></selectedIonList></precursor></precursorList>' +
+        f'<binaryDataArrayList count="2">{binary_arrays}</binaryDataArrayList>' +
+        '</spectrum>\n'
+    )
@@ -3,7 +3,14 @@
 import os
 import unittest
 
-from inspire.input.mascot import MASCOT_PEP_QUERY_KEY, read_mascot_data
+import polars as pl
+
+from inspire.input.mascot import (
+    MASCOT_PEP_QUERY_KEY,
+    MASCOT_SCAN_TITLE_KEY,
+    read_mascot_data,
+    separate_scan_and_source,
+)
 
 
 EXPECTED_COLUMNS = {
@@ -67,5 +74,50 @@ class TestMascot(unittest.TestCase):
         self.assertEqual(mods_df['Identifier'].tolist(), [1, 2])
         self.assertEqual(EXPECTED_COLUMNS, set(search_df.columns))
 
+    def test_read_mascot_data_parallel(self):
+        """ Function to test that files read in parallel match sequential reading and
+            that fixed modifications are added.
+        """
+        search_df, _ = read_mascot_data(
+            [self.target_file_path, self.decoy_file_path], None, None, False, None,
+        )
+        parallel_search_df, _ = read_mascot_data(
+            [self.target_file_path, self.decoy_file_path], None, None, False, None,
+            n_cores=2,
+        )
+        self.assertTrue(search_df.frame_equal(parallel_search_df))
+
+        ptm_seqs = dict(search_df.select(['peptide', 'ptm_seq']).iter_rows())
+        self.assertEqual(ptm_seqs['KPALCQALLS'], '0.0000200000.0')
+        self.assertEqual(ptm_seqs['APRQPGLMA'], '0.000000010.0')
+        self.assertIsNone(ptm_seqs['PKRPPSAF'])
+        self.assertEqual(
+            sorted(search_df.filter(pl.col('peptide').eq('PKRPPSAF'))['scan'].to_list()),
+            [3048, 3062],
+        )
+        self.assertEqual(
+            set(search_df['source'].to_list()), {'PR487_Michele_20180611_B07_rep1'}
+        )
+
+    def test_separate_scan_and_source(self):
+        """ Function to test parsing of Mascot Distiller scan titles.
+        """
+        hits_df = pl.DataFrame({
+            MASCOT_SCAN_TITLE_KEY: [
+                'Cmpd 10, +MSn(450.2), 12.3 min, Scan 1021 (rt=12.31) from file [1]',
+                'Cmpd 11, +MSn(452.2), 12.4 min, Scan 1030 (rt=12.42) from file [0]',
+            ]
+        })
+        distiller_df = separate_scan_and_source(
+            hits_df, 'mascotDistiller', source_list=['sourceA', 'sourceB'],
+        )
+        self.assertEqual(distiller_df['scan'].to_list(), [1021, 1030])
+        self.assertEqual(distiller_df['source'].to_list(), ['sourceB', 'sourceA'])
+        self.assertEqual(distiller_df['retentionTime'].to_list(), [12.31, 12.42])
+
+        distiller_df = separate_scan_and_source(hits_df, 'distiller')
+        self.assertEqual(distiller_df['scan'].to_list(), [1021, 1030])
+        self.assertEqual(distiller_df['retentionTime'].to_list(), [12.31, 12.42])
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,6 +3,7 @@
 import os
 import unittest
 
+import polars as pl
 
 from inspire.input.maxquant import read_mq_data
 
@@ -43,6 +44,15 @@ class TestMaxQuant(unittest.TestCase):
         self.assertEqual(search_df.shape[0], 409)
         self.assertEqual(EXPECTED_COLUMNS, set(search_df.columns))
 
+    def test_read_mq_data_matches_reference(self):
+        """ Function to test that read_mq_data reproduces the reference formatted output.
+        """
+        search_df, _ = read_mq_data(self.search_file_path)
+        reference_df = pl.read_csv(
+            f'{os.getcwd()}/test/resources/max_quant_formatted.csv', dtypes=search_df.schema,
+        )
+        self.assertEqual(search_df.columns, reference_df.columns)
+        self.assertTrue(search_df.frame_equal(reference_df, null_equal=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+""" Test suite for the inSPIRE MSFragger input utilities.
+"""
+import os
+import shutil
+import unittest
+
+from inspire.input.msfragger import read_ms_fragger_data, read_single_ms_fragger_data
+
+OUTPUT_FOLDER = 'test/resources/output/msfragger_test'
+PEPXML_FILE = 'test/resources/msfragger_search.pepXML'
+
+EXPECTED_COLUMNS = [
+    'source',
+    'scan',
+    'peptide',
+    'Label',
+    'proteins',
+    'ptm_seq',
+    'sequenceLength',
+    'missedCleavages',
+    'charge',
+    'massDiff',
+    'retentionTime',
+    'engineScore',
+    'deltaScore',
+    'fromChimera',
+    'avgResidueMass',
+]
+
+class TestMsFragger(unittest.TestCase):
+    """ Testing suite for the inSPIRE MSFragger input utilities.
+    """
+    def setUp(self):
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_read_single_ms_fragger_data(self):
+        """ Function to test reading of a single pepXML file.
+        """
+        msf_df, mods_df = read_single_ms_fragger_data(PEPXML_FILE, None, 0)
+
+        self.assertEqual(msf_df.columns, EXPECTED_COLUMNS)
+        self.assertEqual(msf_df['scan'].to_list(), [10, 10, 11, 12])
+        self.assertEqual(
+            msf_df['peptide'].to_list(), ['AMLKPEPTK', 'GGGLPEPTC', 'NQSTYKLLL', 'NQSTYKLLLS'],
+        )
+        self.assertEqual(
+            msf_df['ptm_seq'].to_list(),
+            ['3.020000000.0', '0.000000001.0', '3.000000000.0', '0.5500000000.0'],
+        )
+        self.assertEqual(msf_df['proteins'].to_list(), ['rev_P1,P2', 'rev_P4', 'rev_P9', 'P9'])
+        self.assertEqual(msf_df['Label'].to_list(), [1, -1, -1, 1])
+        self.assertEqual(msf_df['deltaScore'].to_list(), [10.5, 0.0, 12.5, 14.5])
+        self.assertEqual(msf_df['massDiff'].to_list(), [0.0123, 0.3, 0.0, 1.5])
+        self.assertEqual(msf_df['source'].unique().to_list(), ['msfragger_search'])
+        self.assertEqual(
+            mods_df['Name'].to_list(),
+            [
+                'Acetyl (N-term)', 'Carbamidomethyl (C)', 'Deamidation (N)',
+                'Deamidation (Q)', 'Oxidation (M)',
+            ],
+        )
+
+    def test_source_with_quote(self):
+        """ Function to test that source names with quotes are replaced without
+            writing a temporary copy of the pepXML file.
+        """
+        with open(PEPXML_FILE, mode='r', encoding='UTF-8') as pepxml_file:
+            pepxml_data = pepxml_file.read().replace('msfragger_search', "pat's_run")
+        with open(
+            f"{OUTPUT_FOLDER}/pat's_run_calibrated.pepXML", mode='w', encoding='UTF-8'
+        ) as pepxml_file:
+            pepxml_file.write(pepxml_data)
+
+        msf_df, _ = read_single_ms_fragger_data(
+            f"{OUTPUT_FOLDER}/pat's_run_calibrated.pepXML", None, 3
+        )
+
+        self.assertEqual(msf_df['source'].unique().to_list(), ['temp_3'])
+        self.assertEqual(os.listdir(OUTPUT_FOLDER), ["pat's_run_calibrated.pepXML"])
+
+    def test_read_ms_fragger_data_parallel(self):
+        """ Function to test reading multiple pepXML files in parallel and reducing
+            to the top hit per scan.
+        """
+        with open(PEPXML_FILE, mode='r', encoding='UTF-8') as pepxml_file:
+            pepxml_data = pepxml_file.read().replace('msfragger_search', 'second_search')
+        with open(
+            f'{OUTPUT_FOLDER}/second_search.pepXML', mode='w', encoding='UTF-8'
+        ) as pepxml_file:
+            pepxml_file.write(pepxml_data)
+
+        msf_df, mods_df = read_ms_fragger_data(
+            [PEPXML_FILE, f'{OUTPUT_FOLDER}/second_search.pepXML'], None, 2, True,
+        )
+
+        self.assertEqual(msf_df.shape[0], 6)
+        self.assertEqual(
+            msf_df.sort(['source', 'scan'])['peptide'].to_list(),
+            ['AMLKPEPTK', 'NQSTYKLLL', 'NQSTYKLLLS']*2,
+        )
+        self.assertEqual(mods_df.shape[0], 5)
+
+if __name__ == '__main__':
+    unittest.main()
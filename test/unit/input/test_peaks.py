@@ -3,6 +3,8 @@
 import os
 import unittest
 
+import polars as pl
+
 from inspire.input.peaks import read_peaks_data
 
 EXPECTED_COLUMNS = {
@@ -42,6 +44,15 @@ class TeastPeaks(unittest.TestCase):
         self.assertEqual(search_df.shape[0], 426)
         self.assertEqual(EXPECTED_COLUMNS, set(search_df.columns))
 
+    def test_read_peaks_data_matches_reference(self):
+        """ Function to test that read_peaks_data reproduces the reference formatted output.
+        """
+        search_df, _ = read_peaks_data(self.search_file_path)
+        reference_df = pl.read_csv(
+            f'{os.getcwd()}/test/resources/peaks_formatted.csv', dtypes=search_df.schema,
+        )
+        self.assertEqual(search_df.columns, reference_df.columns)
+        self.assertTrue(search_df.frame_equal(reference_df, null_equal=True))
 
 if __name__ == '__main__':
     unittest.main()
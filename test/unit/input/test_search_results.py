@@ -1,10 +1,18 @@
 """ Test suite for the inSPIRE search_results input utilities.
 """
 import os
+import shutil
 import unittest
 
 from inspire.config import Config
-from inspire.input.search_results import generic_read_df
+from inspire.input.search_results import (
+    generic_read_df,
+    get_search_cache_key,
+    read_search_cache,
+    SEARCH_CACHE_FILE,
+)
+
+CACHE_FOLDER = 'test/resources/output/search_cache_test'
 
 EXPECTED_COLUMNS = {
     'source',
@@ -49,5 +57,46 @@ class TestSearchResults(unittest.TestCase):
         self.assertEqual(EXPECTED_COLUMNS, set(search_df.columns))
         self.assertEqual(search_df['ptm_seq'].iloc[408], '0.2222222.0')
 
+    def test_search_cache(self):
+        """ Function to test that formatted search results are cached with their
+            dtypes and the cache is invalidated when the input changes.
+        """
+        shutil.rmtree(CACHE_FOLDER, ignore_errors=True)
+        os.makedirs(CACHE_FOLDER)
+        shutil.copyfile(self.search_file_path, f'{CACHE_FOLDER}/msms.txt')
+        self.config.output_folder = CACHE_FOLDER
+        self.config.search_engine = 'maxquant'
+        self.config.search_results = [f'{CACHE_FOLDER}/msms.txt']
+        self.config.reuse_input = True
+
+        search_df, mods_df = generic_read_df(self.config)
+        self.assertTrue(os.path.exists(f'{CACHE_FOLDER}/{SEARCH_CACHE_FILE}'))
+
+        cache_key = get_search_cache_key(self.config, True)
+        cached_lf, cached_mods_df = read_search_cache(
+            f'{CACHE_FOLDER}/{SEARCH_CACHE_FILE}', cache_key
+        )
+        self.assertTrue(cached_lf.collect().frame_equal(search_df, null_equal=True))
+        self.assertTrue(cached_mods_df.equals(mods_df))
+
+        reused_df, _ = generic_read_df(self.config, columns=['source', 'scan', 'ptm_seq'])
+        self.assertEqual(reused_df.columns, ['source', 'scan', 'ptm_seq'])
+        self.assertEqual(reused_df.schema, search_df.select(reused_df.columns).schema)
+
+        # Changing the config or the search results changes the cache key.
+        self.config.fixed_modifications = ['Carbamidomethylation']
+        self.assertNotEqual(get_search_cache_key(self.config, True), cache_key)
+        self.config.fixed_modifications = None
+        self.assertNotEqual(get_search_cache_key(self.config, False), cache_key)
+        with open(f'{CACHE_FOLDER}/msms.txt', mode='a', encoding='UTF-8') as search_file:
+            search_file.write('\n')
+        new_key = get_search_cache_key(self.config, True)
+        self.assertNotEqual(new_key, cache_key)
+        self.assertEqual(
+            read_search_cache(f'{CACHE_FOLDER}/{SEARCH_CACHE_FILE}', new_key), (None, None)
+        )
+
+        shutil.rmtree(CACHE_FOLDER)
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,6 +7,7 @@ import numpy as np
 
 from inspire.config import Config
 from inspire.constants import (
+    ACCESSION_KEY,
     ACCESSION_STRATUM_KEY,
     PEPTIDE_KEY,
     LABEL_KEY,
@@ -14,13 +15,11 @@ from inspire.constants import (
 from inspire.accession import (
     validate_accession_stratum
 )
+from inspire.proteome_index import ProteomeIndex
 
 TEST_PROTEOME = [
     ('test', 'ACDEFGHLKMNPQR')
 ]
-TEST_PROTEOME_REVERSED = [
-    ('reversed_test', 'RQPNMKLHGFEDCA')
-]
 TEST_PEPTIDE_CANONICAL = 'FGHIK'
 TEST_PEPTIDE_SPLICED = 'DEFGKMNP'
 TEST_REVERSED_PEPTIDE_CANONICAL = 'GFED'
@@ -30,6 +29,7 @@ class TestAccession(unittest.TestCase):
     """
     def setUp(self):
         self.config = Config('test/resources/config.yml')
+        self.proteome_index = ProteomeIndex.build(TEST_PROTEOME)
 
     def test_validate_accession_stratum_canonical(self):
         """ Function to test the validate_accession_stratum function.
@@ -40,8 +40,7 @@ class TestAccession(unittest.TestCase):
                 ACCESSION_STRATUM_KEY: 2,
                 LABEL_KEY: 1,
             },
-            TEST_PROTEOME,
-            TEST_PROTEOME_REVERSED,
+            self.proteome_index,
             self.config
         )
         self.assertEqual(updated_df_row[ACCESSION_STRATUM_KEY], 0)
@@ -55,11 +54,11 @@ class TestAccession(unittest.TestCase):
                 ACCESSION_STRATUM_KEY: 2,
                 LABEL_KEY: -1,
             },
-            TEST_PROTEOME,
-            TEST_PROTEOME_REVERSED,
+            self.proteome_index,
             self.config
         )
         self.assertEqual(updated_df_row[ACCESSION_STRATUM_KEY], 0)
+        self.assertEqual(updated_df_row[ACCESSION_KEY], 'reversed_test')
 
     def test_validate_accession_stratum_spliced(self):
         """ Function to test the validate_accession_stratum function.
@@ -70,8 +69,7 @@ class TestAccession(unittest.TestCase):
                 ACCESSION_STRATUM_KEY: 1,
                 LABEL_KEY: 1,
             },
-            TEST_PROTEOME,
-            TEST_PROTEOME_REVERSED,
+            self.proteome_index,
             self.config
         )
         self.assertEqual(updated_df_row[ACCESSION_STRATUM_KEY], 1)
@@ -0,0 +1,162 @@
+""" Test suite for the inSPIRE distributed feature creation queue.
+"""
+import multiprocessing as mp
+import os
+import shutil
+import threading
+import unittest
+
+import numpy as np
+import polars as pl
+
+from inspire.config import Config
+from inspire.constants import BASIC_FEATURES, MINIMAL_FEATURE_SET
+from inspire.distributed import (
+    TASK_COMPLETE,
+    TASK_FAILED,
+    TaskQueue,
+    merge_feature_store,
+    process_queue,
+)
+
+QUEUE_FOLDER = 'test/resources/output/distributed_test'
+N_TASKS = 12
+N_WORKERS = 4
+N_PSMS = 500
+
+def _write_marker(file_idx, scan_file):
+    """ Task function which records that a task was processed.
+    """
+    with open(
+        f'{QUEUE_FOLDER}/done_{file_idx}_{os.getpid()}.txt', 'w', encoding='UTF-8'
+    ) as marker_file:
+        marker_file.write(scan_file)
+
+def _fail_odd_tasks(file_idx, scan_file):
+    """ Task function which fails for odd file indices.
+    """
+    if file_idx % 2:
+        raise ValueError(f'Cannot process {scan_file}')
+
+def _run_test_worker(worker_idx):
+    """ Worker process standing in for a separate host.
+    """
+    queue = TaskQueue(QUEUE_FOLDER)
+    return process_queue(
+        queue, _write_marker, worker_id=f'host{worker_idx}', poll_interval=0.1,
+    )
+
+class TestDistributed(unittest.TestCase):
+    """ Testing suite for the inSPIRE distributed feature creation queue.
+    """
+    def setUp(self):
+        if os.path.exists(QUEUE_FOLDER):
+            shutil.rmtree(QUEUE_FOLDER)
+        os.makedirs(QUEUE_FOLDER)
+        self.queue = TaskQueue(QUEUE_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(QUEUE_FOLDER)
+
+    def test_tasks_claimed_once_across_workers(self):
+        """ Function to test that several worker processes share the queue and
+            every task is processed exactly once.
+        """
+        self.queue.initialise(
+            [(idx, f'scanFile{idx}') for idx in range(N_TASKS)],
+            metadata={'maxScan': 100},
+        )
+        with mp.get_context('spawn').Pool(processes=N_WORKERS) as pool:
+            processed = pool.map(_run_test_worker, range(N_WORKERS))
+
+        all_processed = sorted(idx for worker_tasks in processed for idx in worker_tasks)
+        self.assertEqual(all_processed, list(range(N_TASKS)))
+
+        markers = [name for name in os.listdir(QUEUE_FOLDER) if name.startswith('done_')]
+        self.assertEqual(len(markers), N_TASKS)
+        self.assertEqual(self.queue.status_counts()[TASK_COMPLETE], N_TASKS)
+        self.assertTrue(self.queue.is_finished())
+        self.assertEqual(self.queue.get_metadata(), {'maxScan': 100})
+
+    def test_failed_and_expired_tasks(self):
+        """ Function to test that failures are recorded and expired leases reclaimed.
+        """
+        self.queue.initialise([(idx, f'scanFile{idx}') for idx in range(4)])
+        process_queue(self.queue, _fail_odd_tasks, worker_id='host0', poll_interval=0.1)
+
+        statuses = [task[2] for task in self.queue.get_tasks()]
+        self.assertEqual(statuses, [TASK_COMPLETE, TASK_FAILED, TASK_COMPLETE, TASK_FAILED])
+
+        self.queue.initialise([(0, 'scanFile0')])
+        self.assertEqual(self.queue.claim('deadHost'), (0, 'scanFile0'))
+        self.assertIsNone(self.queue.claim('host0'))
+
+        leased_queue = TaskQueue(QUEUE_FOLDER, lease_time=0.0)
+        self.assertEqual(leased_queue.claim('host0'), (0, 'scanFile0'))
+        self.assertFalse(leased_queue.complete(0, 'deadHost'))
+        self.assertTrue(leased_queue.complete(0, 'host0'))
+
+    def test_stale_queue_ignored(self):
+        """ Function to test that workers wait for a new run rather than exiting on the
+            finished queue of an earlier run, and give up if none is queued.
+        """
+        self.queue.initialise([(0, 'scanFile0')])
+        process_queue(self.queue, _write_marker, worker_id='host0', poll_interval=0.1)
+        self.assertTrue(self.queue.is_finished())
+
+        with self.assertRaises(TimeoutError):
+            process_queue(
+                self.queue, _write_marker, worker_id='host0', poll_interval=0.1,
+                wait_timeout=0.5,
+            )
+
+        self.queue.reset()
+        self.assertFalse(self.queue.is_ready())
+        coordinator = threading.Timer(
+            0.3, self.queue.initialise, args=([(idx, f'scanFile{idx}') for idx in range(3)],)
+        )
+        coordinator.start()
+        processed = process_queue(
+            self.queue, _write_marker, worker_id='host1', poll_interval=0.1, wait_timeout=10,
+        )
+        coordinator.join()
+        self.assertEqual(processed, [0, 1, 2])
+
+    def test_merge_feature_store(self):
+        """ Function to test that staged features are calibrated across scan files in
+            one batch and merged into the percolator input in file index order.
+        """
+        config = Config('test/resources/config.yml')
+        config.distributed_folder = QUEUE_FOLDER
+        config.output_folder = QUEUE_FOLDER
+        config.minimal_features = True
+        os.makedirs(f'{QUEUE_FOLDER}/features')
+        rng = np.random.default_rng(42)
+        for file_idx, slope in ((2, 2.0), (0, 0.5)):
+            irts = rng.uniform(-20, 120, N_PSMS)
+            features_df = pl.DataFrame({
+                feature: rng.random(N_PSMS) for feature in BASIC_FEATURES + MINIMAL_FEATURE_SET
+            }).with_columns(
+                pl.Series('specID', [f'{file_idx}_{idx}' for idx in range(N_PSMS)]),
+                pl.Series('Label', np.where(rng.random(N_PSMS) < 0.8, 1, -1)),
+                pl.Series('scan', np.arange(N_PSMS) + 1),
+                pl.Series('tempIndex', np.arange(N_PSMS)),
+                pl.Series('iRT', irts),
+                pl.Series('retentionTime', slope*irts + 10 + rng.normal(0, 1, N_PSMS)),
+                pl.lit('PEPTIDEK').alias('peptide'),
+                pl.lit('protein').alias('proteins'),
+            )
+            features_df.write_parquet(f'{QUEUE_FOLDER}/features/features_{file_idx}.parquet')
+
+        merge_feature_store(config, ['raw_a', 'raw_b', 'raw_c'], N_PSMS)
+
+        fits_df = pl.read_csv(f'{QUEUE_FOLDER}/rtCalibration.csv')
+        self.assertEqual(sorted(fits_df['source'].unique().to_list()), ['raw_a', 'raw_c'])
+        merged_df = pl.read_csv(f'{QUEUE_FOLDER}/input_all_features.tab', separator='\t')
+        self.assertEqual(merged_df.shape[0], 2*N_PSMS)
+        self.assertEqual(merged_df['specID'][0], '0_0')
+        self.assertEqual(merged_df['scannr'][-1], 2*N_PSMS + N_PSMS)
+        self.assertLess(merged_df['deltaRT'].median(), 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+""" Test suite for the inSPIRE feature selection.
+"""
+import os
+import shutil
+from types import SimpleNamespace
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import polars as pl
+from sklearn.metrics import auc, precision_recall_curve
+
+from inspire.feature_selection import (
+    calculate_pr_auc,
+    create_test_metric,
+    get_best_feature_set,
+    select_features,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/feature_selection_test'
+N_PSMS = 3000
+
+class TestFeatureSelection(unittest.TestCase):
+    """ Testing suite for the inSPIRE feature selection.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        labels = np.where(rng.random(N_PSMS) < 0.5, 1, -1)
+        correct = (labels == 1) & (rng.random(N_PSMS) < 0.6)
+        self.fe_df = create_test_metric(pl.DataFrame({
+            'Label': labels,
+            'spectralAngle': rng.normal(0, 1, N_PSMS) + 2*correct,
+            'deltaScore': rng.normal(0, 1, N_PSMS),
+            'engineScore': rng.normal(0, 1, N_PSMS) + 2*correct,
+            'deltaRT': rng.normal(0, 1, N_PSMS) - 2*(labels == 1),
+            'sequenceLength': rng.normal(0, 1, N_PSMS) + (labels == 1),
+            'noise1': rng.normal(0, 1, N_PSMS),
+            'noise2': rng.normal(0, 1, N_PSMS),
+        }))
+
+    def test_calculate_pr_auc(self):
+        """ Function to test the vectorised PR-AUC against sklearn, including ties.
+        """
+        rng = np.random.default_rng(0)
+        for scores in (rng.normal(0, 1, 500), np.round(rng.normal(0, 1, 500), 1)):
+            labels = (rng.random(500) < 0.3 + 0.2*(scores > 0)).astype(int)
+            precision, recall, _ = precision_recall_curve(labels, scores)
+            self.assertAlmostEqual(calculate_pr_auc(labels, scores), auc(recall, precision))
+
+    def test_get_best_feature_set(self):
+        """ Function to test that exhaustive, greedy, and beam search select the
+            informative features.
+        """
+        self.assertEqual(set(self.fe_df['testMetric']), {-1, 0, 1})
+        feature_set = ['noise1', 'deltaRT', 'noise2', 'sequenceLength']
+        exhaustive_sets, exhaustive_aucs = get_best_feature_set(self.fe_df, feature_set)
+        self.assertEqual([len(x) for x in exhaustive_sets], [1, 2, 3, 4])
+        self.assertEqual(exhaustive_sets[0], ['deltaRT'])
+        self.assertEqual(sorted(exhaustive_sets[1]), ['deltaRT', 'sequenceLength'])
+
+        for search_method in ('greedy', 'beam'):
+            feature_sets, pr_aucs = get_best_feature_set(
+                self.fe_df, feature_set, search_method=search_method, n_cores=2,
+            )
+            self.assertEqual(feature_sets[:2], exhaustive_sets[:2])
+            self.assertTrue(np.all(np.array(pr_aucs) <= np.array(exhaustive_aucs) + 1e-12))
+
+    def test_select_features(self):
+        """ Function to test that the final input is written in batches with deltaRT
+            converted to iRT for each source and constant features dropped.
+        """
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+        fe_df = self.fe_df.drop('testMetric').with_columns(
+            pl.Series('specID', [
+                f'{["raw_a", "raw_b_2", "raw_c"][idx % 3]}_{idx}_PEPTIDEK'
+                for idx in range(N_PSMS)
+            ]),
+            pl.Series('scannr', np.arange(N_PSMS)),
+            pl.lit(0.5).alias('spearmanR'),
+            pl.lit('PEPTIDEK').alias('peptide'),
+            pl.lit('protein').alias('Proteins'),
+        )
+        fe_df = fe_df.select(['specID', 'Label', 'scannr'] + [
+            col for col in fe_df.columns if col not in ('specID', 'Label', 'scannr')
+        ])
+        fe_df.write_csv(f'{OUTPUT_FOLDER}/input_all_features.tab', separator='\t')
+        pl.DataFrame({'coefficents': [2.0, 6.0]}).write_csv(f'{OUTPUT_FOLDER}/rt_fit_raw_a.csv')
+        pl.DataFrame({'coefficents': [-1.0]}).write_csv(f'{OUTPUT_FOLDER}/rt_fit_raw_b_2.csv')
+        config = SimpleNamespace(
+            output_folder=OUTPUT_FOLDER,
+            use_irt_diff=True,
+            minimal_features=True,
+            delta_method='ignore',
+            use_binding_affinity=None,
+            use_accession_stratum=False,
+            exclude_features=[],
+            include_features=None,
+            rescore_method='percolator',
+            feature_search=None,
+            n_cores=1,
+        )
+
+        try:
+            with patch('inspire.feature_selection.PIN_BATCH_SIZE', 100):
+                select_features(config)
+            final_df = pl.read_csv(f'{OUTPUT_FOLDER}/final_input.tab', separator='\t')
+        finally:
+            shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+        self.assertEqual(final_df.columns, [
+            'specID', 'Label', 'scannr', 'spectralAngle', 'deltaRT', 'peptide', 'Proteins',
+        ])
+        self.assertEqual(final_df['specID'].to_list(), fe_df['specID'].to_list())
+        np.testing.assert_allclose(
+            final_df['deltaRT'].to_numpy(),
+            np.abs(fe_df['deltaRT'].to_numpy())/np.tile([4.0, 1.0, 1.0], N_PSMS//3),
+        )
+        self.assertEqual(final_df['peptide'].unique().to_list(), ['-.PEPTIDEK.-'])
+
+if __name__ == '__main__':
+    unittest.main()
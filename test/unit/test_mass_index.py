@@ -0,0 +1,102 @@
+""" Test suite for the inSPIRE peptide mass index.
+"""
+import os
+import random
+import shutil
+import unittest
+
+from inspire.constants import RESIDUE_WEIGHTS
+from inspire.mass_index import PeptideMassIndex, get_mass_index, get_residue_mass
+
+OUTPUT_FOLDER = 'test/resources/output/mass_index_test'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+def _brute_force_find(proteome, mass, tolerance, units):
+    """ Function to find all peptides within tolerance by enumerating every peptide.
+    """
+    if units == 'ppm':
+        tolerance = mass*tolerance*1e-6
+    peptides = set()
+    for _, sequence in proteome:
+        for pep_len in range(7, 31):
+            for idx in range(1 + len(sequence) - pep_len):
+                peptide = sequence[idx:idx+pep_len]
+                if any(residue not in RESIDUE_WEIGHTS for residue in peptide):
+                    continue
+                if abs(sum(RESIDUE_WEIGHTS[residue] for residue in peptide) - mass) <= tolerance:
+                    peptides.add(peptide)
+    return peptides
+
+class TestMassIndex(unittest.TestCase):
+    """ Testing suite for the inSPIRE peptide mass index.
+    """
+    def setUp(self):
+        random.seed(42)
+        self.proteome = [
+            (
+                f'protein{idx}',
+                ''.join(random.choice(AMINO_ACIDS) for _ in range(random.randint(3, 50))),
+            ) for idx in range(30)
+        ]
+        self.proteome.append(('unknown_residue', 'ACDEFGHXKLMNPQRSTVWY'))
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_find(self):
+        """ Function to test that tolerance window queries find the same peptides as
+            enumerating every peptide, skipping peptides with unknown residues.
+        """
+        mass_index = PeptideMassIndex.build(self.proteome)
+        queries = [
+            sequence[:random.randint(7, min(len(sequence), 30))]
+            for _, sequence in self.proteome[:15] if len(sequence) >= 7
+        ]
+        queries.append('HXKLMNPQR')
+        for query in queries:
+            for tolerance, units in ((0.01, 'Da'), (0.5, 'Da'), (20, 'ppm')):
+                self.assertEqual(
+                    set(mass_index.find(get_residue_mass(query), tolerance, units)),
+                    _brute_force_find(self.proteome, get_residue_mass(query), tolerance, units),
+                )
+        first_peptide = self.proteome[0][1][:7]
+        self.assertIn(first_peptide, mass_index.find(get_residue_mass(first_peptide), 0.001))
+        self.assertEqual(mass_index.find(get_residue_mass('HXKLMNPQR'), 0.01), [])
+
+    def test_get_mass_index(self):
+        """ Function to test that the index is cached on disk and reused.
+        """
+        with open(f'{OUTPUT_FOLDER}/proteome.fasta', mode='w', encoding='UTF-8') as fasta:
+            for name, sequence in self.proteome:
+                fasta.write(f'>{name}\n{sequence}\n')
+
+        mass_index = get_mass_index(f'{OUTPUT_FOLDER}/proteome.fasta')
+        cached_index = get_mass_index(f'{OUTPUT_FOLDER}/proteome.fasta', OUTPUT_FOLDER)
+        index_folders = [x for x in os.listdir(OUTPUT_FOLDER) if x.startswith('massIndex_')]
+        self.assertEqual(len(index_folders), 1)
+        self.assertEqual(cached_index.masses.tolist(), mass_index.masses.tolist())
+
+        peptide_mass = get_residue_mass(self.proteome[4][1][2:11])
+        reused_index = get_mass_index(f'{OUTPUT_FOLDER}/proteome.fasta', OUTPUT_FOLDER)
+        self.assertEqual(
+            reused_index.find(peptide_mass, 0.01), mass_index.find(peptide_mass, 0.01),
+        )
+
+    def test_chunked_build(self):
+        """ Function to test that building from merged sorted chunks matches sorting
+            every peptide at once.
+        """
+        mass_index = PeptideMassIndex.build(self.proteome)
+        for chunk_size in (1, 50, 200):
+            chunked_index = PeptideMassIndex.build(self.proteome, chunk_size=chunk_size)
+            for array_name in ('masses', 'positions', 'lengths'):
+                self.assertEqual(
+                    getattr(chunked_index, array_name).tolist(),
+                    getattr(mass_index, array_name).tolist(),
+                )
+        self.assertEqual(PeptideMassIndex.build([('short', 'PEPT')]).masses.shape[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
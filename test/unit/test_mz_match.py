@@ -13,6 +13,7 @@ from inspire.mz_match import (
 
 TEST_PEPTIDE = 'ACDEFGHIKMN'
 TEST_PTM_SEQ = '0.02000000010.0'
+TEST_PTM_CODE = (0, [0, 2, 0, 0, 0, 0, 0, 0, 0, 1, 0], 0)
 TEST_PTM_WEIGHTS = {
     0: 0.0,
     1: 15.994915,
@@ -97,6 +98,22 @@ class TestMzMatch(unittest.TestCase):
 
         self.assertAlmostEqual(total_mass, EXPECTED_PRECURSOR_MASS)
 
+    def test_get_ion_masses_ptm_code(self):
+        """ Function to test the get_ion_masses function with the parsed PTM encoding.
+        """
+        masses, total_mass = get_ion_masses(
+            TEST_PEPTIDE,
+            TEST_PTM_WEIGHTS,
+            TEST_PTM_CODE,
+        )
+        for returned_mw, expected_mw in zip(masses['b'].tolist(), EXPECTED_B_IONS):
+            self.assertAlmostEqual(returned_mw, expected_mw)
+
+        for returned_mw, expected_mw in zip(masses['y'].tolist(), EXPECTED_Y_IONS):
+            self.assertAlmostEqual(returned_mw, expected_mw)
+
+        self.assertAlmostEqual(total_mass, EXPECTED_PRECURSOR_MASS)
+
     def test_match_mz(self):
         """ Function to test the match_mz function.
         """
@@ -0,0 +1,71 @@
+""" Test suite for the inSPIRE pipeline profiler.
+"""
+import json
+import multiprocessing as mp
+import os
+import shutil
+import unittest
+
+import polars as pl
+
+from inspire.profiling import PROFILE_DIR_ENV, PipelineProfiler, profile_function
+
+OUTPUT_FOLDER = 'test/resources/output/profiling_test'
+
+@profile_function
+def _make_rows(n_rows):
+    """ Profiled function returning a DataFrame of n_rows.
+    """
+    return pl.DataFrame({'value': list(range(n_rows))})
+
+class TestProfiling(unittest.TestCase):
+    """ Testing suite for the inSPIRE pipeline profiler.
+    """
+    def setUp(self):
+        if os.path.exists(OUTPUT_FOLDER):
+            shutil.rmtree(OUTPUT_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+        os.environ.pop(PROFILE_DIR_ENV, None)
+
+    def test_disabled_profiler(self):
+        """ Function to test that nothing is recorded without profiling enabled.
+        """
+        profiler = PipelineProfiler(OUTPUT_FOLDER)
+        with profiler.stage('format'):
+            self.assertEqual(_make_rows(3).shape[0], 3)
+        profiler.write_report()
+        self.assertFalse(os.path.exists(OUTPUT_FOLDER))
+
+    def test_profile_report(self):
+        """ Function to test stage and function records, including those from workers.
+        """
+        profiler = PipelineProfiler(OUTPUT_FOLDER, enabled=True, dump_stats=True)
+        with profiler.stage('format'):
+            _make_rows(10)
+            _make_rows(5)
+        with profiler.stage('featureGeneration'):
+            with mp.get_context('spawn').Pool(processes=2) as pool:
+                pool.map(_make_rows, [4, 4, 4])
+
+        profiler.write_report()
+
+        with open(f'{OUTPUT_FOLDER}/profile/profile.json', mode='r', encoding='UTF-8') as file:
+            report = json.load(file)
+
+        self.assertEqual(
+            [stage['stage'] for stage in report['stages']], ['format', 'featureGeneration']
+        )
+        functions = {function['stage']: function for function in report['functions']}
+        self.assertEqual(functions['format']['calls'], 2)
+        self.assertEqual(functions['format']['rows'], 15)
+        self.assertEqual(functions['format']['processes'], 1)
+        self.assertEqual(functions['featureGeneration']['calls'], 3)
+        self.assertEqual(functions['featureGeneration']['rows'], 12)
+        self.assertTrue(os.path.exists(f'{OUTPUT_FOLDER}/profile/profile_summary.txt'))
+        self.assertTrue(os.path.exists(f'{OUTPUT_FOLDER}/profile/format.prof'))
+        self.assertNotIn(PROFILE_DIR_ENV, os.environ)
+
+if __name__ == '__main__':
+    unittest.main()
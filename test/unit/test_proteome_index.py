@@ -0,0 +1,140 @@
+""" Test suite for the inSPIRE proteome index.
+"""
+import os
+import random
+import shutil
+import unittest
+from unittest.mock import patch
+
+import polars as pl
+
+from inspire.proteome_index import (
+    ProteomeIndex,
+    get_proteome_index,
+    get_proteome_index_loc,
+    parallel_multi_remap,
+    parallel_remap,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/proteome_index_test'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+def _brute_force_find(proteome, peptide, reverse):
+    """ Function to find all matches of a peptide by scanning every protein.
+    """
+    peptide = peptide.replace('I', 'L')
+    matches = []
+    for protein_idx, (_, sequence) in enumerate(proteome):
+        sequence = sequence.replace('I', 'L')
+        if reverse:
+            sequence = sequence[::-1]
+        position = sequence.find(peptide)
+        while position != -1:
+            matches.append((protein_idx, position))
+            position = sequence.find(peptide, position + 1)
+    return matches
+
+class TestProteomeIndex(unittest.TestCase):
+    """ Testing suite for the inSPIRE proteome index.
+    """
+    def setUp(self):
+        random.seed(42)
+        self.proteome = [
+            (
+                f'protein{idx}',
+                ''.join(random.choice(AMINO_ACIDS) for _ in range(random.randint(1, 60))),
+            ) for idx in range(50)
+        ]
+        self.proteome.append(('duplicate', self.proteome[0][1]))
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_find(self):
+        """ Function to test that the index finds the same matches as a full scan,
+            including peptides shorter than the k-mer size and reversed proteins.
+        """
+        proteome_index = ProteomeIndex.build(self.proteome)
+        peptides = ['A', 'LK', 'WWWWWWWWW']
+        for _, sequence in self.proteome[:20]:
+            length = min(len(sequence), random.randint(2, 12))
+            start = random.randint(0, len(sequence) - length)
+            peptides.append(sequence[start:start+length])
+            peptides.append(sequence[-length:][::-1])
+
+        for peptide in peptides:
+            for reverse in (False, True):
+                self.assertEqual(
+                    sorted(proteome_index.find(peptide, reverse=reverse)),
+                    _brute_force_find(self.proteome, peptide, reverse),
+                )
+        self.assertTrue(proteome_index.contains(self.proteome[3][1][:8]))
+
+    def test_get_proteome_index(self):
+        """ Function to test that the index is cached on disk and reused.
+        """
+        with open(f'{OUTPUT_FOLDER}/proteome.fasta', mode='w', encoding='UTF-8') as fasta:
+            for name, sequence in self.proteome:
+                fasta.write(f'>{name}\n{sequence}\n')
+
+        proteome_index = get_proteome_index(f'{OUTPUT_FOLDER}/proteome.fasta', OUTPUT_FOLDER)
+        index_folders = [x for x in os.listdir(OUTPUT_FOLDER) if x.startswith('proteomeIndex_')]
+        self.assertEqual(len(index_folders), 1)
+
+        cached_index = get_proteome_index(f'{OUTPUT_FOLDER}/proteome.fasta', OUTPUT_FOLDER)
+        self.assertEqual(cached_index.names.tolist(), proteome_index.names.tolist())
+        self.assertEqual(cached_index.sequence.tobytes(), proteome_index.sequence.tobytes())
+        peptide = self.proteome[7][1][2:11]
+        self.assertEqual(cached_index.find(peptide), proteome_index.find(peptide))
+
+    def test_parallel_remap(self):
+        """ Function to test that remapping with workers sharing the cached index gives
+            the same accessions as remapping in a single process.
+        """
+        with open(f'{OUTPUT_FOLDER}/proteome.fasta', mode='w', encoding='UTF-8') as fasta:
+            for name, sequence in self.proteome:
+                fasta.write(f'>{name}\n{sequence}\n')
+        index_loc = get_proteome_index_loc(f'{OUTPUT_FOLDER}/proteome.fasta', OUTPUT_FOLDER)
+
+        peptides = [sequence[:6] for _, sequence in self.proteome[:10]] + ['WWWWWWWWW']
+        pep_df = pl.DataFrame({'peptide': peptides})
+        serial_df = parallel_remap(pep_df, 1, index_loc, 'proteins')
+        with patch('inspire.proteome_index.MIN_REMAP_BATCH_SIZE', 1):
+            parallel_df = parallel_remap(pep_df, 2, index_loc, 'proteins')
+
+        expected = {}
+        for peptide in peptides:
+            protein_ids = sorted({
+                protein_idx for protein_idx, _ in _brute_force_find(self.proteome, peptide, False)
+            })
+            expected[peptide] = (
+                ' '.join(self.proteome[idx][0] for idx in protein_ids) if protein_ids else 'unknown'
+            )
+        self.assertEqual(dict(serial_df.rows()), expected)
+        self.assertEqual(dict(parallel_df.rows()), expected)
+
+        with open(f'{OUTPUT_FOLDER}/contaminants.fasta', mode='w', encoding='UTF-8') as fasta:
+            fasta.write(f'>contaminant\n{self.proteome[3][1]}\n')
+        contaminant_loc = get_proteome_index_loc(
+            f'{OUTPUT_FOLDER}/contaminants.fasta', OUTPUT_FOLDER
+        )
+        multi_df = parallel_multi_remap(
+            pep_df,
+            1,
+            {'mapsToTarget': index_loc, 'mapsToContaminant': contaminant_loc},
+            trace_accession=False,
+        )
+        self.assertEqual(
+            dict(multi_df.select(['peptide', 'mapsToTarget']).rows()),
+            {peptide: accession != 'unknown' for peptide, accession in expected.items()},
+        )
+        self.assertEqual(
+            dict(multi_df.select(['peptide', 'mapsToContaminant']).rows()),
+            {peptide: self.proteome[3][1].replace('I', 'L').find(peptide.replace('I', 'L')) != -1
+             for peptide in peptides},
+        )
+
+if __name__ == '__main__':
+    unittest.main()
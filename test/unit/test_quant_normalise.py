@@ -0,0 +1,99 @@
+""" Test suite for the inSPIRE quantification normalisation.
+"""
+from math import log2
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from inspire.quant.normalise import (
+    clean_quantification_values,
+    count_valid_and_identified_quantifications,
+    equalize_medians,
+    log_transform_intensities,
+)
+
+N_PEPTIDES = 300
+SOURCES = [f'raw_{idx}' for idx in range(12)]
+
+def _row_wise_normalisation(quant_df, config):
+    """ Function to clean and normalise intensities one row and source at a time.
+    """
+    rows = []
+    for _, df_row in quant_df.iterrows():
+        row = {'peptide': df_row['peptide'], 'nValid': 0}
+        for source in SOURCES:
+            valid = (
+                (df_row[f'{source}_idp'] > config.skyline_idp_cut_off) &
+                (df_row[f'{source}_ratio'] > config.skyline_bg_ratio_cut_off)
+            )
+            row['nValid'] += int(valid)
+            row[f'{source}_valid'] = valid
+            row[f'{source}_clean'] = df_row[f'{source}_raw'] if valid else None
+            row[f'{source}_log'] = log2(row[f'{source}_clean']) if (
+                row[f'{source}_clean'] is not None and row[f'{source}_clean'] > 0
+            ) else None
+        rows.append(row)
+    row_df = pd.DataFrame(rows)
+
+    log_values = row_df[[f'{source}_log' for source in SOURCES]].to_numpy(dtype=float)
+    global_median = np.nanmedian(log_values)
+    for source in SOURCES:
+        row_df[f'{source}_norm'] = (
+            row_df[f'{source}_log'] - row_df[f'{source}_log'].median()
+        ) + global_median
+    return row_df
+
+class TestQuantNormalise(unittest.TestCase):
+    """ Testing suite for the inSPIRE quantification normalisation.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        quant_data = {
+            'peptide': [f'PEPT{idx}K' for idx in range(N_PEPTIDES)],
+            'proteins': ['protein'] * N_PEPTIDES,
+        }
+        for source in SOURCES:
+            raw_values = rng.lognormal(15, 2, N_PEPTIDES)
+            raw_values[rng.random(N_PEPTIDES) < 0.05] = 0.0
+            raw_values[rng.random(N_PEPTIDES) < 0.05] = np.nan
+            idp_values = rng.random(N_PEPTIDES)
+            idp_values[rng.random(N_PEPTIDES) < 0.05] = np.nan
+            quant_data[f'{source}_raw'] = raw_values
+            quant_data[f'{source}_idp'] = idp_values
+            quant_data[f'{source}_ratio'] = rng.random(N_PEPTIDES)
+        self.quant_df = pd.DataFrame(quant_data)
+        self.config = SimpleNamespace(skyline_idp_cut_off=0.3, skyline_bg_ratio_cut_off=0.2)
+
+    def test_normalisation(self):
+        """ Function to test that the whole matrix cleaning, counting and median
+            equalisation match processing each row and source separately.
+        """
+        quant_df = count_valid_and_identified_quantifications(
+            self.quant_df, SOURCES, self.config
+        )
+        quant_df = clean_quantification_values(quant_df, SOURCES, self.config)
+        clean_values = quant_df[[f'{source}_clean' for source in SOURCES]].to_numpy()
+        quant_df = equalize_medians(log_transform_intensities(quant_df, SOURCES), SOURCES)
+
+        row_df = _row_wise_normalisation(self.quant_df, self.config)
+        self.assertEqual(quant_df['peptide'].tolist(), row_df['peptide'].tolist())
+        self.assertEqual(quant_df['nValid'].tolist(), row_df['nValid'].tolist())
+        np.testing.assert_array_equal(
+            quant_df[[f'{source}_valid' for source in SOURCES]].to_numpy(),
+            row_df[[f'{source}_valid' for source in SOURCES]].to_numpy(dtype=bool),
+        )
+        np.testing.assert_array_equal(
+            clean_values,
+            row_df[[f'{source}_clean' for source in SOURCES]].to_numpy(dtype=float),
+        )
+        np.testing.assert_allclose(
+            quant_df[[f'{source}_norm' for source in SOURCES]].to_numpy(),
+            row_df[[f'{source}_norm' for source in SOURCES]].to_numpy(dtype=float),
+            rtol=1e-12,
+        )
+        self.assertTrue(np.all(np.isnan(quant_df['raw_0_norm'][self.quant_df['raw_0_raw'] == 0])))
+
+if __name__ == '__main__':
+    unittest.main()
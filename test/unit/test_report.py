@@ -0,0 +1,162 @@
+""" Test suite for the inSPIRE performance report.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from inspire.report import (
+    apply_non_spectral_percolator,
+    calculate_fdr_cut_offs,
+    get_rescoring_core_budget,
+    start_non_spectral_rescoring,
+    summarise_distribution,
+    DISTRIBUTION_GRID_SIZE,
+    MAX_DISTRIBUTION_POINTS,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/report_test'
+N_PSMS = 2000
+
+class TestReport(unittest.TestCase):
+    """ Testing suite for the inSPIRE performance report.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        labels = np.where(rng.random(N_PSMS) < 0.5, 1, -1)
+        correct = (labels == 1) & (rng.random(N_PSMS) < 0.6)
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+        pl.DataFrame({
+            'specID': [f'raw_{idx}_PEPTIDEK' for idx in range(N_PSMS)],
+            'Label': labels,
+            'scannr': np.arange(N_PSMS),
+            'engineScore': rng.normal(0, 1, N_PSMS) + 2*correct,
+            'charge': rng.integers(2, 4, N_PSMS),
+            'deltaScore': rng.normal(0, 1, N_PSMS) + correct,
+            'massDiff': rng.normal(0, 1, N_PSMS),
+            'sequenceLength': rng.integers(8, 13, N_PSMS),
+            'nVarMods': rng.integers(0, 2, N_PSMS),
+            'avgResidueMass': rng.normal(110, 5, N_PSMS),
+            'spectralAngle': rng.normal(0, 1, N_PSMS) + 3*correct,
+            'peptide': [f'PEPT{idx % 500}K' for idx in range(N_PSMS)],
+            'Proteins': ['protein'] * N_PSMS,
+        }).write_csv(f'{OUTPUT_FOLDER}/input_all_features.tab', separator='\t')
+        self.config = SimpleNamespace(
+            output_folder=OUTPUT_FOLDER,
+            fdr=0.01,
+            rescore_method='percolator',
+            rescore_command='percolator',
+            infer_proteins=False,
+            proteome=None,
+            rescore_engine='inProcess',
+            rescore_model='lda',
+            n_cores=1,
+        )
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_non_spectral_rescoring(self):
+        """ Function to test that the non-spectral rescoring runs in an executor and is
+            reused while the features are unchanged.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            non_spectral_df = start_non_spectral_rescoring(self.config, executor).result()
+        self.assertIn('engineScore', non_spectral_df.columns)
+        self.assertNotIn('spectralAngle', pl.read_csv(
+            f'{OUTPUT_FOLDER}/non_spectral_perc_input.tab', separator='\t',
+        ).columns)
+
+        psms_loc = f'{OUTPUT_FOLDER}/non_spectral.percolator.psms.txt'
+        psms_mtime = os.stat(psms_loc).st_mtime_ns
+        cached_df = apply_non_spectral_percolator(
+            OUTPUT_FOLDER, 0.01, 'percolator', 'percolator', None,
+            rescore_engine='inProcess', rescore_model='lda',
+        )
+        self.assertEqual(os.stat(psms_loc).st_mtime_ns, psms_mtime)
+        self.assertEqual(cached_df.rows(), non_spectral_df.rows())
+
+        apply_non_spectral_percolator(
+            OUTPUT_FOLDER, 0.05, 'percolator', 'percolator', None,
+            rescore_engine='inProcess', rescore_model='lda',
+        )
+        self.assertNotEqual(os.stat(psms_loc).st_mtime_ns, psms_mtime)
+
+    def test_get_rescoring_core_budget(self):
+        """ Function to test that the cores are shared between the rescoring jobs.
+        """
+        self.assertEqual(get_rescoring_core_budget(1), (1, 1))
+        self.assertEqual(get_rescoring_core_budget(4), (3, 1))
+        self.assertEqual(get_rescoring_core_budget(12), (8, 4))
+
+    def test_calculate_fdr_cut_offs(self):
+        """ Function to test the single pass FDR statistics against filtering at each
+            cut off, including q-values equal to a cut off.
+        """
+        rng = np.random.default_rng(0)
+        assignment_df = pl.DataFrame({'qValue': np.round(rng.random(500)*0.12, 2)})
+        non_spectral_df = pl.DataFrame({'q-value': np.round(rng.random(300)*0.12, 2)})
+        binders_df = pd.DataFrame({
+            'qValue': assignment_df['qValue'].to_numpy(),
+            'BindLevel': rng.choice(['<=SB', '<=WB', None], 500),
+        })
+        binders_df.loc[binders_df['qValue'] <= 0.01, 'qValue'] = 0.5
+        ns_binders_df = binders_df.rename(columns={'qValue': 'q-value'})
+
+        fdrs_df = calculate_fdr_cut_offs(
+            assignment_df, non_spectral_df, 'q-value', binders_df, ns_binders_df,
+        )
+        for _, fdr_row in fdrs_df.iterrows():
+            q_cut = fdr_row['FDR']
+            self.assertEqual(
+                fdr_row['nSpirePsms'], assignment_df.filter(pl.col('qValue').lt(q_cut)).shape[0]
+            )
+            self.assertEqual(
+                fdr_row['nSearchEnginePsms'],
+                non_spectral_df.filter(pl.col('q-value').lt(q_cut)).shape[0],
+            )
+            binders_cut_df = binders_df[binders_df['qValue'] <= q_cut]
+            binders_count = binders_cut_df['BindLevel'].isin(['<=WB', '<=SB']).sum()
+            self.assertEqual(fdr_row['nSpireBinders'], binders_count)
+            self.assertEqual(fdr_row['nSearchEngineBinders'], binders_count)
+            self.assertAlmostEqual(
+                fdr_row['SpirePercentageBinders'],
+                100*binders_count/binders_cut_df.shape[0] if binders_cut_df.shape[0] else 0,
+            )
+
+        fine_df = calculate_fdr_cut_offs(
+            assignment_df, non_spectral_df, 'q-value', q_cut_offs=np.linspace(0.0001, 0.1, 1000),
+        )
+        self.assertEqual(fine_df.shape[0], 1000)
+        self.assertTrue(np.all(np.diff(fine_df['nSpirePsms']) >= 0))
+        self.assertIsNone(fine_df['nSpireBinders'][0])
+
+    def test_summarise_distribution(self):
+        """ Function to test that distribution summaries have a bounded size and a
+            density which integrates to one.
+        """
+        rng = np.random.default_rng(0)
+        values = np.concatenate([rng.standard_cauchy(100_000), [np.nan, np.inf]])
+        summary = summarise_distribution(values, rng)
+        self.assertEqual(summary['grid'].shape[0], DISTRIBUTION_GRID_SIZE)
+        self.assertEqual(summary['points'].shape[0], MAX_DISTRIBUTION_POINTS)
+        self.assertAlmostEqual(
+            np.sum(summary['density'])*(summary['grid'][1] - summary['grid'][0]), 1.0,
+        )
+        self.assertAlmostEqual(summary['mean'], np.mean(values[np.isfinite(values)]))
+
+        normal_summary = summarise_distribution(rng.normal(0, 1, 100_000), rng)
+        self.assertAlmostEqual(
+            np.max(normal_summary['density']), 1/np.sqrt(2*np.pi), delta=0.02,
+        )
+        self.assertIsNone(summarise_distribution(np.array([np.nan]), rng))
+        self.assertEqual(summarise_distribution(np.ones(10), rng)['grid'].tolist(), [1.0])
+
+if __name__ == '__main__':
+    unittest.main()
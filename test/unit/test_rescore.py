@@ -0,0 +1,140 @@
+""" Test suite for the inSPIRE rescoring post-processing.
+"""
+import os
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import polars as pl
+
+from inspire.rescore import (
+    _label_binding_level,
+    _regroup_accession,
+    _split_psm_ids,
+    apply_stratified_rescoring,
+    get_largest_stratum,
+    get_strata_core_budget,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/rescore_test'
+
+class TestRescore(unittest.TestCase):
+    """ Testing suite for the inSPIRE rescoring post-processing.
+    """
+    def test_split_psm_ids(self):
+        """ Function to test that PSM Ids are split into source, scan and sequence when
+            the source contains underscores.
+        """
+        psm_df = pl.DataFrame({
+            'specID': ['sample_1_run_2_1024_PEPTM[15.9949]IDE', 'raw_7_PEPTIDEK'],
+        }).with_columns(_split_psm_ids('specID'))
+        self.assertEqual(psm_df['source'].to_list(), ['sample_1_run_2', 'raw'])
+        self.assertEqual(psm_df['scan'].to_list(), [1024, 7])
+        self.assertEqual(
+            psm_df['modifiedSequence'].to_list(), ['PEPTM[15.9949]IDE', 'PEPTIDEK']
+        )
+
+    def test_regroup_columns(self):
+        """ Function to test that one hot accession strata and NetMHCpan binding levels
+            are relabelled.
+        """
+        psm_df = pl.DataFrame({
+            'accession_canonical': [1, 0, 0, 1],
+            'accession_spliced': [0, 1, 0, 1],
+            'BindLevel': ['<=SB', '<=WB', None, ''],
+        }).with_columns([
+            _regroup_accession(['accession_canonical', 'accession_spliced']).alias('stratum'),
+            _label_binding_level('BindLevel'),
+        ])
+        self.assertEqual(
+            psm_df['stratum'].to_list(), ['canonical', 'spliced', 'unknown', 'canonical']
+        )
+        self.assertEqual(
+            psm_df['BindLevel'].to_list(),
+            ['Strong-Binder', 'Weak-Binder', 'Not predicted', 'Non-Binder'],
+        )
+
+    def test_apply_stratified_rescoring(self):
+        """ Function to test that each accession stratum is rescored separately and the
+            results are merged while the weights are kept per stratum.
+        """
+        os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        self.addCleanup(shutil.rmtree, OUTPUT_FOLDER, ignore_errors=True)
+        rng = np.random.default_rng(1)
+        n_psms = 3000
+        labels = np.where(rng.random(n_psms) < 0.5, 1, -1)
+        correct = (labels == 1) & (rng.random(n_psms) < 0.6)
+        strata = rng.choice([0, 1, 2], n_psms, p=[0.6, 0.35, 0.05])
+        pl.DataFrame({
+            'specID': [f'raw_{idx}_PEPTIDEK' for idx in range(n_psms)],
+            'Label': labels,
+            'scannr': np.arange(n_psms),
+            'spectralAngle': rng.normal(0, 1, n_psms) + 3*correct,
+            'deltaRT': rng.normal(0, 1, n_psms) - 1.5*correct,
+            'accession_nonspliced': (strata == 0).astype(int),
+            'accession_spliced': (strata == 1).astype(int),
+            'peptide': [f'-.PEPT{idx}K.-' for idx in range(n_psms)],
+            'Proteins': ['protein'] * n_psms,
+        }).write_csv(f'{OUTPUT_FOLDER}/final_input.tab', separator='\t')
+        config = SimpleNamespace(
+            output_folder=OUTPUT_FOLDER,
+            accession_hierarchy=['nonspliced', 'spliced'],
+            fdr=0.01,
+            rescore_method='percolator',
+            rescore_command='percolator',
+            decoy_protein_flag='rev_',
+            rescore_engine='inProcess',
+            rescore_model='lda',
+            rescore_mode='train',
+            rescore_model_folder=None,
+        )
+
+        psm_df, _ = apply_stratified_rescoring(config, 'final_input.tab', 'final', None, 2)
+        self.assertEqual(psm_df.shape[0], np.sum(labels == 1))
+        for acc_idx in range(3):
+            stratum_df = pl.read_csv(
+                f'{OUTPUT_FOLDER}/final_{acc_idx}.percolator.psms.txt', separator='\t',
+            )
+            self.assertEqual(stratum_df.shape[0], np.sum((labels == 1) & (strata == acc_idx)))
+            stratum_psm_df = psm_df.filter(pl.col('PSMId').is_in(stratum_df['PSMId']))
+            self.assertEqual(
+                stratum_psm_df['q-value'].sort().to_list(),
+                stratum_df['q-value'].sort().to_list(),
+            )
+
+        self.assertEqual(
+            pl.read_csv(f'{OUTPUT_FOLDER}/final.percolator.strata.csv')['accessionIndex'].to_list(),
+            [0, 1, 2],
+        )
+        self.assertEqual(get_largest_stratum(OUTPUT_FOLDER, 'percolator'), (0, 'nonspliced'))
+        self.assertFalse(os.path.exists(f'{OUTPUT_FOLDER}/final.percolator.weights.csv'))
+        for acc_idx in range(3):
+            weights_df = pl.read_csv(
+                f'{OUTPUT_FOLDER}/final_{acc_idx}.percolator.weights.csv', separator='\t',
+            )
+            self.assertEqual(weights_df.columns, ['spectralAngle', 'deltaRT', 'm0'])
+            self.assertEqual(weights_df.shape[0], 8)
+
+        strata_weights_df = pl.read_csv(f'{OUTPUT_FOLDER}/final.percolator.strata.weights.csv')
+        self.assertEqual(
+            strata_weights_df.columns,
+            ['accessionGroup', 'fold', 'weightType', 'spectralAngle', 'deltaRT', 'm0'],
+        )
+        self.assertEqual(strata_weights_df.shape[0], 18)
+        self.assertEqual(
+            strata_weights_df['accessionGroup'].unique(maintain_order=True).to_list(),
+            ['nonspliced', 'spliced', 'unknown'],
+        )
+
+    def test_strata_core_budget(self):
+        """ Function to test that cores are shared between strata by size without
+            exceeding the cores available.
+        """
+        self.assertEqual(get_strata_core_budget(8, [100, 10, 1]), [6, 1, 1])
+        self.assertEqual(get_strata_core_budget(10, [3, 3, 3]), [4, 3, 3])
+        self.assertEqual(get_strata_core_budget(2, [5, 5, 5]), [1, 1, 1])
+        self.assertEqual(sum(get_strata_core_budget(7, [50, 50])), 7)
+
+if __name__ == '__main__':
+    unittest.main()
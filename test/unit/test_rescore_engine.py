@@ -0,0 +1,221 @@
+""" Test suite for the inSPIRE in process rescoring engine.
+"""
+from contextlib import redirect_stdout
+import io
+import os
+import pickle
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import polars as pl
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import LinearSVC
+
+from inspire.rescore_engine import (
+    apply_in_process_rescoring,
+    apply_saved_model,
+    calculate_peps,
+    calculate_q_values,
+    load_saved_weights,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/rescore_engine_test'
+N_PSMS = 3000
+
+def _brute_force_q_values(scores, labels):
+    """ Function to calculate q-values by counting targets and decoys above each score.
+    """
+    fdrs = np.array([
+        min(1.0, (np.sum((scores >= score) & (labels != 1)) + 1)/max(
+            np.sum((scores >= score) & (labels == 1)), 1
+        )) for score in scores
+    ])
+    return np.array([fdrs[scores <= score].min() for score in scores])
+
+class TestRescoreEngine(unittest.TestCase):
+    """ Testing suite for the inSPIRE in process rescoring engine.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        labels = np.where(rng.random(N_PSMS) < 0.5, 1, -1)
+        correct = (labels == 1) & (rng.random(N_PSMS) < 0.6)
+        self.pin_df = pl.DataFrame({
+            'specID': [f'raw_{idx}_PEPTIDEK' for idx in range(N_PSMS)],
+            'Label': labels,
+            'scannr': np.arange(N_PSMS)//2,
+            'spectralAngle': rng.normal(0, 1, N_PSMS) + 3*correct,
+            'deltaRT': rng.normal(0, 1, N_PSMS) - 1.5*correct,
+            'noise': rng.normal(0, 1, N_PSMS),
+            'peptide': [f'-.PEPT{idx % 1000}K.-' for idx in range(N_PSMS)],
+            'Proteins': ['protein'] * N_PSMS,
+        })
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+        self.pin_df.write_csv(f'{OUTPUT_FOLDER}/final_input.tab', separator='\t')
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_calculate_q_values(self):
+        """ Function to test q-values against counting targets and decoys, including ties.
+        """
+        rng = np.random.default_rng(0)
+        scores = np.round(rng.normal(0, 1, 200), 1)
+        labels = np.where(rng.random(200) < 0.6, 1, -1)
+        np.testing.assert_allclose(
+            calculate_q_values(scores, labels), _brute_force_q_values(scores, labels),
+        )
+
+        peps = calculate_peps(scores, labels)
+        self.assertTrue(np.all((peps >= 0) & (peps <= 1)))
+        order = np.argsort(scores)
+        self.assertTrue(np.all(np.diff(peps[order]) <= 1e-12))
+
+    def test_apply_in_process_rescoring(self):
+        """ Function to test that rescoring combines features to accept more targets than
+            the best single feature and writes Percolator format output.
+        """
+        labels = self.pin_df['Label'].to_numpy()
+        single_feature_count = np.sum(
+            calculate_q_values(self.pin_df['spectralAngle'].to_numpy(), labels)[labels == 1]
+            <= 0.01
+        )
+
+        for model_type in ('svm', 'lda'):
+            psm_df, peptide_df = apply_in_process_rescoring(
+                OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolator', 'final', 1, model_type,
+            )
+            self.assertEqual(
+                psm_df.columns,
+                ['PSMId', 'score', 'q-value', 'posterior_error_prob', 'peptide', 'proteinIds'],
+            )
+            # Target-decoy competition keeps the best PSM of each scan.
+            decoy_df = pl.read_csv(
+                f'{OUTPUT_FOLDER}/final.percolator.decoy.psms.txt', separator='\t',
+            )
+            scans = pl.concat([psm_df['PSMId'], decoy_df['PSMId']]).str.extract(
+                r'raw_(\d+)_', 1
+            ).cast(pl.Int64)//2
+            self.assertEqual(scans.n_unique(), N_PSMS//2)
+            self.assertEqual(scans.shape[0], N_PSMS//2)
+            self.assertEqual(peptide_df['peptide'].n_unique(), peptide_df.shape[0])
+            self.assertGreater(
+                psm_df.filter(pl.col('q-value') <= 0.01).shape[0], single_feature_count,
+            )
+
+        weights_df = pl.read_csv(
+            f'{OUTPUT_FOLDER}/final.percolator.weights.csv', separator='\t',
+        )
+        self.assertEqual(weights_df.columns, ['spectralAngle', 'deltaRT', 'noise', 'm0'])
+        self.assertEqual(weights_df.shape[0], 8)
+
+        threaded_df, _ = apply_in_process_rescoring(
+            OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolatorSeparate', 'final', 3,
+        )
+        serial_df, _ = apply_in_process_rescoring(
+            OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolatorSeparate', 'final', 1,
+        )
+        self.assertEqual(threaded_df.rows(), serial_df.rows())
+        self.assertTrue(os.path.exists(f'{OUTPUT_FOLDER}/final.percolatorSeparate.decoy.psms.txt'))
+
+    def test_apply_saved_model(self):
+        """ Function to test that saved Percolator weights score new input without
+            retraining and that missing features are rejected.
+        """
+        train_df, _ = apply_in_process_rescoring(
+            OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolator', 'final', 1,
+        )
+        model_folder = f'{OUTPUT_FOLDER}/model'
+        os.makedirs(model_folder)
+        weights_loc = f'{OUTPUT_FOLDER}/final.percolator.weights.csv'
+        with open(weights_loc, mode='r', encoding='UTF-8') as weights_file:
+            weights_lines = weights_file.readlines()
+        with open(
+            f'{model_folder}/final.percolator.weights.csv', mode='w', encoding='UTF-8'
+        ) as weights_file:
+            weights_file.write('# first line contains normalized weights\n')
+            weights_file.writelines(weights_lines)
+
+        self.pin_df.with_columns(pl.lit(1.0).alias('newFeature')).write_csv(
+            f'{OUTPUT_FOLDER}/final_input.tab', separator='\t',
+        )
+        psm_df, _ = apply_saved_model(
+            OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolator', 'final', model_folder,
+        )
+        self.assertEqual(psm_df.columns, train_df.columns)
+        decoy_df = pl.read_csv(
+            f'{OUTPUT_FOLDER}/final.percolator.decoy.psms.txt', separator='\t',
+        )
+        self.assertEqual(psm_df.shape[0] + decoy_df.shape[0], N_PSMS//2)
+        self.assertGreater(
+            psm_df.filter(pl.col('q-value') <= 0.01).shape[0],
+            0.9*train_df.filter(pl.col('q-value') <= 0.01).shape[0],
+        )
+        self.assertTrue(os.path.exists(weights_loc))
+
+        self.pin_df.select(
+            'specID', 'Label', 'scannr', 'noise', 'deltaRT', 'spectralAngle', 'peptide',
+            'Proteins',
+        ).write_csv(f'{OUTPUT_FOLDER}/final_input.tab', separator='\t')
+        with redirect_stdout(io.StringIO()) as stdout:
+            reordered_df, _ = apply_saved_model(
+                OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolator', 'final', model_folder,
+            )
+        self.assertIn('reordered', stdout.getvalue())
+        self.assertNotIn('ignored', stdout.getvalue())
+        self.assertEqual(reordered_df['score'].to_list(), psm_df['score'].to_list())
+
+        self.pin_df.drop('deltaRT').write_csv(
+            f'{OUTPUT_FOLDER}/final_input.tab', separator='\t',
+        )
+        with self.assertRaises(ValueError):
+            apply_saved_model(
+                OUTPUT_FOLDER, 'final_input.tab', 0.01, 'percolator', 'final', model_folder,
+            )
+
+    def test_load_saved_mokapot_models(self):
+        """ Function to test that the weights of pickled mokapot models, trained on
+            standardised features, reproduce their scores on unscaled features.
+        """
+        features = ['spectralAngle', 'deltaRT', 'noise']
+        feature_values = self.pin_df.select(features).to_numpy()
+        labels = self.pin_df['Label'].to_numpy()
+        model_folder = f'{OUTPUT_FOLDER}/model'
+        os.makedirs(model_folder)
+        models = []
+        for fold_idx in range(1, 4):
+            fold_values = feature_values[fold_idx::3]
+            scaler = StandardScaler().fit(fold_values)
+            # Stands in for a mokapot model, which holds the same attributes.
+            models.append(SimpleNamespace(
+                estimator=LinearSVC(dual=False).fit(
+                    scaler.transform(fold_values), labels[fold_idx::3]
+                ),
+                scaler=scaler,
+                features=features,
+            ))
+            with open(
+                f'{model_folder}/final.mokapot.model_fold-{fold_idx}.pkl', 'wb'
+            ) as model_file:
+                pickle.dump(models[-1], model_file)
+
+        feature_names, weights, intercepts = load_saved_weights(
+            model_folder, 'mokapot', 'final'
+        )
+        self.assertEqual(feature_names, features)
+        for model, fold_weights, intercept in zip(models, weights, intercepts):
+            np.testing.assert_allclose(
+                feature_values @ fold_weights + intercept,
+                model.estimator.decision_function(model.scaler.transform(feature_values)),
+            )
+
+        _, normed_weights, normed_intercepts = load_saved_weights(
+            model_folder, 'mokapot', 'final', normalised=True
+        )
+        np.testing.assert_allclose(normed_weights[0], models[0].estimator.coef_[0])
+        np.testing.assert_allclose(normed_intercepts[0], models[0].estimator.intercept_[0])
+
+if __name__ == '__main__':
+    unittest.main()
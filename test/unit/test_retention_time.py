@@ -0,0 +1,120 @@
+""" Test suite for the inSPIRE retention time features.
+"""
+import os
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import polars as pl
+from pyteomics import achrom
+
+from inspire.retention_time import add_delta_irt, get_composition_matrix, _add_achrom_rt_preds
+from inspire.rt_alignment import calibrate_retention_times
+
+OUTPUT_FOLDER = 'test/resources/output/retention_time_test'
+AMINO_ACIDS = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
+N_PSMS = 2000
+
+class TestRetentionTime(unittest.TestCase):
+    """ Testing suite for the inSPIRE retention time features.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        residue_rts = dict(zip(AMINO_ACIDS, rng.normal(0, 5, AMINO_ACIDS.shape[0])))
+        peptides = np.array([
+            ''.join(rng.choice(AMINO_ACIDS, rng.integers(7, 16))) for _ in range(300)
+        ])
+        self.peptides = peptides[rng.integers(0, 300, N_PSMS)]
+        self.rts = np.array([
+            sum(residue_rts[residue] for residue in peptide)*(1 - 0.2*np.log(len(peptide)))
+            for peptide in self.peptides
+        ]) + 50 + rng.normal(0, 2, N_PSMS)
+        self.rng = rng
+
+    def test_add_achrom_rt_preds(self):
+        """ Function to test the vectorised additive model against achrom, including
+            residues missing from the training peptides.
+        """
+        train = np.array(['W' not in peptide for peptide in self.peptides])
+        rt_model = achrom.get_RCs_vary_lcp(
+            self.peptides[train], self.rts[train], lcp_range=(-1.0, 1.0), term_aa=False,
+        )
+        rt_model['aa']['W'] = rt_model['aa']['P']*0.956
+        achrom_rts = [achrom.calculate_RT(peptide, rt_model) for peptide in self.peptides]
+
+        residues, counts, log_lengths, peptide_idx = get_composition_matrix(self.peptides)
+        self.assertEqual(counts.shape, (np.unique(self.peptides).shape[0], 20))
+        self.assertEqual(counts[peptide_idx[0]].sum(), len(self.peptides[0]))
+        pred_rts = _add_achrom_rt_preds(
+            residues, counts, log_lengths, peptide_idx[train], self.rts[train],
+        )
+        np.testing.assert_allclose(pred_rts[peptide_idx], achrom_rts, atol=1e-8)
+
+    def test_add_delta_irt(self):
+        """ Function to test that deltaRT is calculated from achrom predictions when
+            iRT predictions are missing.
+        """
+        combined_df = pl.DataFrame({
+            'peptide': self.peptides,
+            'retentionTime': self.rts,
+            'Label': np.ones(N_PSMS, dtype=int),
+            'spectralAngle': self.rng.random(N_PSMS),
+        })
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+        try:
+            delta_df = add_delta_irt(
+                combined_df,
+                SimpleNamespace(
+                    rt_fit_loc=None,
+                    output_folder=OUTPUT_FOLDER,
+                    rt_fit_method='linear',
+                    reuse_rt_fits=False,
+                ),
+                None,
+            )
+        finally:
+            shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+        self.assertEqual(delta_df.columns, combined_df.columns + ['predRT', 'deltaRT'])
+        self.assertEqual(sorted(delta_df['retentionTime']), sorted(combined_df['retentionTime']))
+        self.assertLess(delta_df['deltaRT'].median(), 5)
+
+    def test_add_delta_irt_calibrated(self):
+        """ Function to test that deltaRT is calculated from the iRT calibration, both
+            fitted for the scan file alone and shared across scan files.
+        """
+        irts = self.rng.uniform(-20, 120, N_PSMS)
+        combined_df = pl.DataFrame({
+            'iRT': irts,
+            'retentionTime': 0.5*irts + 10 + self.rng.normal(0, 1, N_PSMS),
+            'Label': np.ones(N_PSMS, dtype=int),
+            'spectralAngle': self.rng.random(N_PSMS),
+        })
+        config = SimpleNamespace(
+            rt_fit_loc=None,
+            output_folder=OUTPUT_FOLDER,
+            rt_fit_method='linear',
+            reuse_rt_fits=False,
+        )
+        fits_df = calibrate_retention_times(
+            config,
+            {'raw_a': combined_df.lazy(), 'raw_b': combined_df.with_columns(
+                pl.col('retentionTime')*2
+            ).lazy()},
+        )
+
+        single_df = add_delta_irt(combined_df, config, 'raw_a')
+        shared_df = add_delta_irt(combined_df, config, 'raw_a', fits_df)
+        self.assertEqual(single_df.columns, combined_df.columns + ['predRT', 'deltaRT'])
+        self.assertEqual(
+            single_df['retentionTime'].to_list(), combined_df['retentionTime'].to_list(),
+        )
+        np.testing.assert_allclose(
+            shared_df['deltaRT'].to_numpy(), single_df['deltaRT'].to_numpy(), atol=1e-8,
+        )
+        self.assertLess(single_df['deltaRT'].median(), 1.5)
+
+if __name__ == '__main__':
+    unittest.main()
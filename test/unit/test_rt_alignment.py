@@ -0,0 +1,159 @@
+""" Test suite for the inSPIRE retention time calibration.
+"""
+import os
+import shutil
+from types import SimpleNamespace
+import unittest
+
+import numpy as np
+import polars as pl
+from sklearn.linear_model import LinearRegression
+
+from inspire.rt_alignment import (
+    calibrate_retention_times,
+    get_rt_folds,
+    get_rt_scales,
+    predict_retention_times,
+    read_rt_calibrations,
+    write_rt_calibrations,
+    HIGH_CONFIDENCE_QUANTILE,
+)
+
+OUTPUT_FOLDER = 'test/resources/output/rt_alignment_test'
+N_PSMS = 1000
+
+class TestRtAlignment(unittest.TestCase):
+    """ Testing suite for the inSPIRE retention time calibration.
+    """
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        features_dfs = {}
+        for source, (slope, intercept) in {'raw_a': (0.5, 10.0), 'raw_b': (2.0, -5.0)}.items():
+            irts = rng.uniform(-20, 120, N_PSMS)
+            features_dfs[source] = pl.DataFrame({
+                'iRT': irts,
+                'retentionTime': slope*irts + intercept + rng.normal(0, 1, N_PSMS),
+                'spectralAngle': rng.random(N_PSMS),
+                'Label': np.where(rng.random(N_PSMS) < 0.8, 1, -1),
+            })
+        self.features_dfs = features_dfs
+        self.config = SimpleNamespace(
+            rt_fit_loc=None,
+            output_folder=OUTPUT_FOLDER,
+            rt_fit_method='linear',
+            reuse_rt_fits=False,
+        )
+        if not os.path.exists(OUTPUT_FOLDER):
+            os.makedirs(OUTPUT_FOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(OUTPUT_FOLDER, ignore_errors=True)
+
+    def test_calibrate_retention_times(self):
+        """ Function to test that the batch calibration matches a per file linear fit of
+            each fold and that cross fitted predictions recover retention time.
+        """
+        fits_df = calibrate_retention_times(
+            self.config,
+            {source: features_df.lazy() for source, features_df in self.features_dfs.items()},
+        )
+        self.assertEqual(fits_df.shape[0], 20)
+
+        for source, features_df in self.features_dfs.items():
+            folds = get_rt_folds(N_PSMS)
+            for fold in range(10):
+                train_df = features_df.filter(
+                    (folds != fold) & (features_df['Label'].to_numpy() == 1)
+                )
+                train_df = train_df.filter(
+                    pl.col('spectralAngle') > train_df['spectralAngle'].quantile(
+                        HIGH_CONFIDENCE_QUANTILE
+                    )
+                )
+                model = LinearRegression().fit(
+                    train_df[['iRT']].to_numpy(), train_df['retentionTime'].to_numpy(),
+                )
+                fold_fit = fits_df.filter(
+                    pl.col('source').eq(source) & pl.col('fold').eq(fold)
+                )
+                self.assertAlmostEqual(fold_fit['coefficient'][0], model.coef_[0])
+                self.assertAlmostEqual(fold_fit['intercept'][0], model.intercept_)
+
+            pred_rts = predict_retention_times(
+                features_df.with_columns(pl.lit(source).alias('source')), fits_df,
+            )
+            self.assertLess(
+                (pred_rts - features_df['retentionTime']).abs().median(), 1.5,
+            )
+
+        scales_df = get_rt_scales(fits_df).sort('source')
+        np.testing.assert_allclose(scales_df['coefficient'].to_numpy(), [0.5, 2.0], atol=0.1)
+
+    def test_robust_and_lowess_fits(self):
+        """ Function to test that robust and lowess calibrations are resistant to
+            outliers and that the calibration table reads back unchanged.
+        """
+        outlier_dfs = {
+            source: features_df.with_columns(
+                pl.when(pl.arange(0, N_PSMS) % 50 == 0)
+                    .then(pl.col('retentionTime') + 200)
+                    .otherwise(pl.col('retentionTime')),
+                pl.when(pl.arange(0, N_PSMS) % 50 == 0).then(1.0)
+                    .otherwise(pl.col('spectralAngle')).alias('spectralAngle'),
+            ).lazy() for source, features_df in self.features_dfs.items()
+        }
+        for fit_method in ('robust', 'lowess'):
+            self.config.rt_fit_method = fit_method
+            fits_df = calibrate_retention_times(self.config, outlier_dfs)
+            self.assertEqual(set(fits_df['fitMethod']), {fit_method})
+            self.assertEqual(fits_df.select('source', 'fold').n_unique(), 20)
+            for source, features_df in self.features_dfs.items():
+                pred_rts = predict_retention_times(
+                    features_df.with_columns(pl.lit(source).alias('source')), fits_df,
+                )
+                self.assertLess(
+                    (pred_rts - features_df['retentionTime']).abs().median(), 2.0,
+                )
+
+            write_rt_calibrations(fits_df, OUTPUT_FOLDER)
+            self.assertEqual(read_rt_calibrations(OUTPUT_FOLDER).rows(), fits_df.rows())
+
+    def test_read_rt_calibrations(self):
+        """ Function to test that calibrations are reused when they match the fit method
+            and that the per file fits of earlier versions are read.
+        """
+        self.assertIsNone(read_rt_calibrations(OUTPUT_FOLDER))
+        pl.DataFrame({'coefficents': [2.0, 4.0], 'intercepts': [1.0, 3.0]}).write_csv(
+            f'{OUTPUT_FOLDER}/rt_fit_raw_a.csv'
+        )
+        legacy_df = read_rt_calibrations(OUTPUT_FOLDER)
+        self.assertEqual(legacy_df['source'].to_list(), ['raw_a', 'raw_a'])
+        np.testing.assert_allclose(
+            predict_retention_times(
+                pl.DataFrame({'source': ['raw_a'], 'iRT': [10.0]}), legacy_df, cross_fit=False,
+            ).to_numpy(),
+            [32.0],
+        )
+
+        file_features = {
+            source: features_df.lazy() for source, features_df in self.features_dfs.items()
+        }
+        fits_df = calibrate_retention_times(self.config, file_features)
+        write_rt_calibrations(fits_df.with_columns(pl.col('intercept') + 1), OUTPUT_FOLDER)
+        self.config.reuse_rt_fits = True
+        reused_df = calibrate_retention_times(self.config, file_features)
+        self.assertEqual(
+            reused_df['intercept'].to_list(), (fits_df['intercept'] + 1).to_list(),
+        )
+
+        self.config.rt_fit_method = 'robust'
+        refit_df = calibrate_retention_times(self.config, file_features)
+        self.assertEqual(set(refit_df['fitMethod']), {'robust'})
+
+        self.config.rt_fit_loc = f'{OUTPUT_FOLDER}/missing'
+        os.makedirs(self.config.rt_fit_loc)
+        with self.assertRaises(ValueError):
+            calibrate_retention_times(self.config, file_features)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,16 @@ import unittest
 
 
 import numpy as np
+import polars as pl
 
+from inspire.mz_match import get_ion_masses
 from inspire.spectral_features import (
     calculate_spectral_angle,
+    calculate_spectral_features,
     check_for_precursor_peak,
     get_coverage,
     get_mz_error_stats,
+    score_spectra,
 )
 
 TEST_PEPTIDE = 'ACDEFGHIKM(ox)N'
@@ -19,6 +23,35 @@ EXPERIMENT_INTES = [1, 0, 1]
 PRED_INTES = [0, 1, 1]
 MZ_ERRORS = [0.01, 0.0, -0.01]
 ION_LIST = ['y1', 'b1', 'b3']
+PTM_ID_WEIGHTS = {0: 0.0, 1: 15.994915}
+
+def _get_score_df():
+    """ Function to create PSMs whose spectra contain some of the predicted ions.
+    """
+    rng = np.random.default_rng(42)
+    rows = []
+    for peptide, ptm_seq in [
+        ('PEPTIDEK', '0.00000000.0'),
+        ('MAGKLLPEP', '0.100000000.0'),
+        ('SIINFEKL', '0.00000000.0'),
+        ('YLLPAIVHI', '0.000000000.0'),
+    ]*3:
+        ion_masses, _ = get_ion_masses(peptide, PTM_ID_WEIGHTS, ptm_seq)
+        ion_names = [f'{ion}{idx+1}' for ion in ('y', 'b') for idx in range(len(peptide) - 1)]
+        observed_mzs = sorted(
+            mass + 1.007276 for ion in ('y', 'b') for mass in ion_masses[ion]
+            if rng.random() > 0.3
+        )
+        rows.append({
+            'charge': 2,
+            'intensities': rng.random(len(observed_mzs)).tolist(),
+            'mzs': observed_mzs,
+            'peptide': peptide,
+            'prositIntes': rng.random(len(ion_names)).tolist(),
+            'prositIons': ion_names,
+            'ptm_seq': ptm_seq,
+        })
+    return pl.DataFrame(rows)
 
 class TestSpectralFeatures(unittest.TestCase):
     """ Testing suite for the inSPIRE spectral features utilities
@@ -73,3 +106,22 @@ class TestSpectralFeatures(unittest.TestCase):
         self.assertAlmostEqual(total_cov, 2/3)
         self.assertAlmostEqual(b_cov, 2/3)
         self.assertAlmostEqual(y_cov, 1/3)
+
+    def test_score_spectra(self):
+        """ Function to test that batch scoring in a single process and across a process
+            pool matches scoring each PSM in turn.
+        """
+        score_df = _get_score_df()
+        expected = [
+            calculate_spectral_features(
+                df_row, PTM_ID_WEIGHTS, 0.02, 'Da', None, '1', 'ignore', minimal_features=True,
+            ) for df_row in score_df.iter_rows(named=True)
+        ]
+        for n_cores in (1, 2):
+            scored_df = score_spectra(score_df, PTM_ID_WEIGHTS, 0.02, 'Da', n_cores)
+            self.assertEqual(scored_df['peptide'].to_list(), score_df['peptide'].to_list())
+            self.assertEqual(
+                scored_df['spectralAngle'].to_list(), [x['spectralAngle'] for x in expected],
+            )
+            self.assertEqual(scored_df['spearmanR'].to_list(), [x['spearmanR'] for x in expected])
+        self.assertTrue(min(scored_df['spectralAngle'].to_list()) > 0.0)
@@ -3,13 +3,17 @@
 import unittest
 
 import pandas as pd
+import polars as pl
 from inspire.constants import PEPTIDE_KEY, PTM_SEQ_KEY
 
 from inspire.utils import (
     add_fixed_modifications,
+    add_ptm_code,
     get_mokapot_weights,
     get_ox_flag,
+    has_ptm_ids,
     modify_sequence_for_skyline,
+    parse_ptm_seq,
     permute_ptms,
     permute_seq,
 )
@@ -47,6 +51,7 @@ EXPECTED_PERMUTED_PTMS = [
 	'0.02000000001.0',
 ]
 EXPECTED_MODIFIED_SEQUENCE = 'AC[+57.0]DEFGHIKM[+16.0]N'
+TEST_PTM_CODE = (0, [0, 2, 0, 0, 0, 0, 0, 0, 0, 1, 0], 0)
 class TestUtils(unittest.TestCase):
     """ Testing suite for the inSPIRE utils.
     """
@@ -111,6 +116,33 @@ class TestUtils(unittest.TestCase):
         )
         self.assertEqual(modified_sequence, EXPECTED_MODIFIED_SEQUENCE)
 
+    def test_parse_ptm_seq(self):
+        """ Function to test the parse_ptm_seq function.
+        """
+        self.assertEqual(parse_ptm_seq(TEST_PTM_SEQ), TEST_PTM_CODE)
+        self.assertEqual(parse_ptm_seq('3.0010.6'), (3, [0, 0, 1, 0], 6))
+        self.assertIsNone(parse_ptm_seq(None))
+        self.assertIsNone(parse_ptm_seq('nan'))
+
+    def test_add_ptm_code(self):
+        """ Function to test the add_ptm_code function and PTM ID checks.
+        """
+        search_df = add_ptm_code(pl.DataFrame({
+            PTM_SEQ_KEY: [TEST_PTM_SEQ, None, '3.0010.6'],
+        }))
+        self.assertEqual(search_df['ptmNTerm'].to_list(), [0, None, 3])
+        self.assertEqual(search_df['ptmResidues'].to_list(), [TEST_PTM_CODE[1], None, [0, 0, 1, 0]])
+        self.assertEqual(search_df['ptmCTerm'].to_list(), [0, None, 6])
+        self.assertEqual(search_df['ptmResidues'].dtype, pl.List(pl.UInt8))
+        self.assertEqual(
+            search_df.select(has_ptm_ids([2]).alias('hasPtm'))['hasPtm'].to_list(),
+            [True, False, False],
+        )
+        self.assertEqual(
+            search_df.select(has_ptm_ids([6]).alias('hasPtm'))['hasPtm'].to_list(),
+            [False, False, True],
+        )
+
     def test_add_fixed_modification(self):
         """ Function to test the get_mokapot_weights function.
         """
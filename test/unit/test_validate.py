@@ -0,0 +1,23 @@
+""" Test suite for the inSPIRE spliced peptide validation.
+"""
+import unittest
+
+from inspire.validate import get_oxidation_variants
+
+class TestValidate(unittest.TestCase):
+    """ Testing suite for the inSPIRE spliced peptide validation.
+    """
+    def test_get_oxidation_variants(self):
+        """ Function to test that every placement of methionine oxidation is generated
+            in the Prosit input encoding.
+        """
+        self.assertEqual(get_oxidation_variants('PEPTIDEK', 0), ('PEPTIDEK',))
+        self.assertEqual(get_oxidation_variants('PEPTIDEK', 1), ())
+        self.assertEqual(
+            get_oxidation_variants('MAMKM', 2),
+            ('M(ox)AM(ox)KM', 'M(ox)AMKM(ox)', 'MAM(ox)KM(ox)'),
+        )
+        self.assertEqual(get_oxidation_variants('AMK', 1), ('AM(ox)K',))
+
+if __name__ == '__main__':
+    unittest.main()